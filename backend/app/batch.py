@@ -0,0 +1,583 @@
+"""Bulk chat: ``/api/chat/batch`` and JSONL batch jobs.
+
+A batch is a list of items (a prompt string or a ``/api/chat`` body) merged over shared
+``defaults``. Items run concurrently inside the backend, without a round trip through
+the HTTP middleware per prompt, under two limits:
+
+- a lane per provider and credential (``BATCH_CONCURRENCY``, overridable per provider
+  with ``BATCH_CONCURRENCY_<ID>``). A 429/503, or a busy Ollama scheduler, pauses the
+  whole lane for ``Retry-After`` (or an exponential backoff) and the item is retried up
+  to ``BATCH_MAX_RETRIES`` times;
+- ``BATCH_MAX_INFLIGHT`` upstream calls in total.
+
+``/api/chat/batch`` streams one NDJSON result line per item as items complete. Jobs
+(``/api/chat/batch/jobs``) take JSONL input, run in the background and append results
+to ``<data>/batch/<job id>.jsonl``. With ``"native": true``, items for providers that
+declare the ``batching`` capability (OpenAI, Anthropic) are submitted to the provider's
+own asynchronous batch API instead; that is cheaper but can take hours.
+
+Job state is kept in SQLite at ``<data>/batch/jobs.sqlite3``, so any worker process can
+report or cancel a job that another one runs. The running process syncs progress and a
+heartbeat about once a second and acts on cancel requests at the same time. Item bodies
+(and the API keys in them) stay in memory only, so a job cannot resume after its process
+exits: it is reported as failed, and the results it wrote so far stay on disk.
+"""
+from __future__ import annotations
+
+import abc
+import asyncio
+import json
+import os
+import random
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+from typing import Any, AsyncIterator, Awaitable, Callable
+
+import httpx
+from fastapi import HTTPException
+
+from . import fastjson, providers, routing, storage
+from .cache import cacheable, credential_hash, response_cache
+from .health import health_monitor
+from .scheduler import BACKGROUND, SchedulerBusy, parse_priority
+from .upstream import upstreams
+
+
+BATCH_CONCURRENCY = int(os.getenv("BATCH_CONCURRENCY", "4"))
+BATCH_MAX_INFLIGHT = int(os.getenv("BATCH_MAX_INFLIGHT", "32"))
+BATCH_MAX_ITEMS = int(os.getenv("BATCH_MAX_ITEMS", "10000"))
+BATCH_MAX_RETRIES = int(os.getenv("BATCH_MAX_RETRIES", "3"))
+BATCH_POLL_SEC = float(os.getenv("BATCH_POLL_SEC", "30"))
+RETRY_STATUSES = (429, 503)
+MAX_BACKOFF = 60.0
+SYNC_SEC = 1.0       # progress, heartbeat and cancel checks of running jobs
+STALE_SEC = 60.0     # a running job without a heartbeat for this long lost its process
+
+TIMEOUT = httpx.Timeout(60.0)
+
+
+def concurrency_for(provider_id: str) -> int:
+    value = os.getenv(f"BATCH_CONCURRENCY_{provider_id.upper()}", "").strip()
+    return max(1, int(value)) if value else max(1, BATCH_CONCURRENCY)
+
+
+def parse_items(items: Any = None, jsonl: str | None = None) -> list[dict]:
+    """Normalize a list (or JSONL text) of prompts / chat bodies; each gets an ``id``."""
+    if jsonl is not None:
+        items = []
+        for n, line in enumerate(jsonl.splitlines(), 1):
+            if line.strip():
+                try:
+                    items.append(json.loads(line))
+                except ValueError:
+                    raise ValueError(f"Invalid JSON on line {n}")
+    if not isinstance(items, list) or not items:
+        raise ValueError("items must be a non-empty list")
+    if len(items) > BATCH_MAX_ITEMS:
+        raise ValueError(f"At most {BATCH_MAX_ITEMS} items per batch")
+    out = []
+    for i, item in enumerate(items):
+        if isinstance(item, str):
+            item = {"prompt": item}
+        if not isinstance(item, dict):
+            raise ValueError(f"Item {i} must be a string or an object")
+        out.append({**item, "id": str(item.get("id", i))})
+    return out
+
+
+def _result(index: int, body: dict, status: int, output: Any = None, raw: Any = None, error: dict | None = None,
+            provider: str | None = None, model: str | None = None, started: float | None = None, **extra) -> dict:
+    out = {"id": body.get("id", str(index)), "index": index, "status": status,
+           "provider": provider or (body.get("provider") or None), "model": model or (body.get("model") or None),
+           "output": output, "raw": raw, "error": error}
+    if started is not None:
+        out["ms"] = round((time.perf_counter() - started) * 1000, 1)
+    out.update(extra)
+    return out
+
+
+def _retry_after(r: httpx.Response, attempt: int) -> float:
+    try:
+        return min(MAX_BACKOFF, float(r.headers.get("retry-after", "")))
+    except ValueError:
+        return min(MAX_BACKOFF, 2 ** attempt + random.uniform(0, 1))
+
+
+class Lane:
+    """Concurrency limit plus a shared pause for one provider credential."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.sem = asyncio.Semaphore(limit)
+        self.paused_until = 0.0
+        self.throttled = 0
+
+    async def call(self, fn: Callable[[], Awaitable[tuple[httpx.Response, Any]]]) -> tuple[httpx.Response, Any]:
+        async with self.sem:
+            attempt = 0
+            while True:
+                wait = self.paused_until - time.monotonic()
+                if wait > 0:
+                    await asyncio.sleep(wait)
+                try:
+                    r, data = await fn()
+                except SchedulerBusy as e:
+                    # A full local queue is a 503 too: pause the lane and retry
+                    if attempt >= BATCH_MAX_RETRIES:
+                        raise
+                    attempt += 1
+                    self.throttled += 1
+                    self.paused_until = max(self.paused_until, time.monotonic() + e.retry_after)
+                    continue
+                if r.status_code not in RETRY_STATUSES or attempt >= BATCH_MAX_RETRIES:
+                    return r, data
+                attempt += 1
+                self.throttled += 1
+                self.paused_until = max(self.paused_until, time.monotonic() + _retry_after(r, attempt))
+
+
+# --- Native provider batch APIs ---
+
+class NativeBatch(abc.ABC):
+    """Submit, poll and collect one provider-side batch. ``items`` are (custom_id, request)."""
+
+    @abc.abstractmethod
+    async def submit(self, adapter: providers.ProviderAdapter, items: list[tuple[str, providers.ChatRequest]]) -> str:
+        """Create the batch; returns the provider's batch id."""
+
+    @abc.abstractmethod
+    async def poll(self, adapter, req: providers.ChatRequest, batch_id: str) -> tuple[bool, dict]:
+        """(finished, provider status payload)."""
+
+    @abc.abstractmethod
+    def results(self, adapter, req: providers.ChatRequest, info: dict) -> AsyncIterator[tuple[str, int, Any]]:
+        """Yield (custom_id, HTTP status, response body) for each finished item."""
+
+
+def _check(r: httpx.Response, what: str) -> Any:
+    data = providers.parse_body(r)
+    if not r.is_success:
+        raise RuntimeError(f"{what} failed (HTTP {r.status_code}): {json.dumps(data)[:300]}")
+    return data
+
+
+class OpenAIBatch(NativeBatch):
+    """OpenAI Batch API: upload a JSONL file, create a batch, download the output file."""
+
+    @staticmethod
+    def _base(adapter) -> str:
+        return adapter.url.rsplit("/chat/completions", 1)[0]
+
+    @staticmethod
+    def _auth(req: providers.ChatRequest) -> dict:
+        return {"Authorization": f"Bearer {req.api_key}"}
+
+    async def submit(self, adapter, items):
+        lines = []
+        for custom_id, req in items:
+            call = adapter.build(req)
+            lines.append(json.dumps({"custom_id": custom_id, "method": "POST", "url": "/v1/chat/completions", "body": call.payload}))
+        req = items[0][1]
+        r = await upstreams.post(f"{self._base(adapter)}/files", headers=self._auth(req), data={"purpose": "batch"},
+                                 files={"file": ("batch.jsonl", "\n".join(lines).encode("utf-8"), "application/jsonl")}, timeout=TIMEOUT)
+        file_id = _check(r, "Batch file upload")["id"]
+        r = await upstreams.post(f"{self._base(adapter)}/batches", headers=self._auth(req), timeout=TIMEOUT,
+                                 json={"input_file_id": file_id, "endpoint": "/v1/chat/completions", "completion_window": "24h"})
+        return _check(r, "Batch create")["id"]
+
+    async def poll(self, adapter, req, batch_id):
+        info = _check(await upstreams.get(f"{self._base(adapter)}/batches/{batch_id}", headers=self._auth(req),
+                                          timeout=TIMEOUT, coalesce=False), "Batch status")
+        return info.get("status") in ("completed", "failed", "expired", "cancelled"), info
+
+    async def results(self, adapter, req, info):
+        for file_id in (info.get("output_file_id"), info.get("error_file_id")):
+            if not file_id:
+                continue
+            r = await upstreams.get(f"{self._base(adapter)}/files/{file_id}/content", headers=self._auth(req), timeout=TIMEOUT)
+            if not r.is_success:
+                raise RuntimeError(f"Batch results download failed (HTTP {r.status_code})")
+            for line in r.text.splitlines():
+                if line.strip():
+                    row = json.loads(line)
+                    response = row.get("response") or {}
+                    yield row.get("custom_id"), response.get("status_code") or 500, response.get("body") or row.get("error")
+
+
+class AnthropicBatch(NativeBatch):
+    """Anthropic Message Batches API."""
+
+    URL = "https://api.anthropic.com/v1/messages/batches"
+
+    @staticmethod
+    def _headers(req: providers.ChatRequest) -> dict:
+        return {"x-api-key": req.api_key, "anthropic-version": "2023-06-01"}
+
+    async def submit(self, adapter, items):
+        requests = [{"custom_id": custom_id, "params": adapter.build(req).payload} for custom_id, req in items]
+        r = await upstreams.post(self.URL, headers=self._headers(items[0][1]), json={"requests": requests}, timeout=TIMEOUT)
+        return _check(r, "Batch create")["id"]
+
+    async def poll(self, adapter, req, batch_id):
+        info = _check(await upstreams.get(f"{self.URL}/{batch_id}", headers=self._headers(req), timeout=TIMEOUT,
+                                          coalesce=False), "Batch status")
+        return info.get("processing_status") == "ended", info
+
+    async def results(self, adapter, req, info):
+        if not info.get("results_url"):
+            return
+        r = await upstreams.get(info["results_url"], headers=self._headers(req), timeout=TIMEOUT)
+        if not r.is_success:
+            raise RuntimeError(f"Batch results download failed (HTTP {r.status_code})")
+        for line in r.text.splitlines():
+            if line.strip():
+                row = json.loads(line)
+                result = row.get("result") or {}
+                if result.get("type") == "succeeded":
+                    yield row.get("custom_id"), 200, result.get("message")
+                else:
+                    yield row.get("custom_id"), 500, result
+
+
+NATIVE_BATCH: dict[str, NativeBatch] = {"openai": OpenAIBatch(), "anthropic": AnthropicBatch()}
+
+
+@dataclass
+class BatchJob:
+    id: str
+    total: int
+    native: bool = False
+    status: str = "queued"   # queued | running | completed | failed | cancelled
+    done: int = 0
+    failed: int = 0
+    created: float = field(default_factory=time.time)
+    finished: float | None = None
+    error: str | None = None
+    native_batches: list = field(default_factory=list)
+    output_path: str = ""
+    task: asyncio.Task | None = field(default=None, repr=False)
+
+    def describe(self) -> dict:
+        return {"id": self.id, "status": self.status, "total": self.total, "done": self.done, "failed": self.failed,
+                "native": self.native, "native_batches": self.native_batches, "created": self.created,
+                "finished": self.finished, "error": self.error}
+
+
+class BatchStore:
+    """Job rows shared by every worker process."""
+
+    COLUMNS = "id, total, native, status, done, failed, created, finished, error, native_batches, output_path, heartbeat"
+
+    def __init__(self, path: str | None = None):
+        self._path = path
+        self._conn = None
+        self._lock = threading.Lock()
+
+    @property
+    def conn(self):
+        if self._conn is None:
+            conn = storage.connect_sqlite(self._path or storage.data_path("batch", "jobs.sqlite3"))
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS batch_jobs ("
+                " id TEXT PRIMARY KEY, total INTEGER NOT NULL, native INTEGER NOT NULL, status TEXT NOT NULL,"
+                " done INTEGER NOT NULL DEFAULT 0, failed INTEGER NOT NULL DEFAULT 0, created REAL NOT NULL,"
+                " finished REAL, error TEXT, native_batches TEXT NOT NULL DEFAULT '[]', output_path TEXT NOT NULL,"
+                " heartbeat REAL, cancel INTEGER NOT NULL DEFAULT 0)"
+            )
+            self._conn = conn
+        return self._conn
+
+    def insert(self, job: BatchJob) -> None:
+        with self._lock:
+            self.conn.execute(
+                f"INSERT INTO batch_jobs ({self.COLUMNS}) VALUES ({', '.join('?' * 12)})",
+                (job.id, job.total, int(job.native), job.status, job.done, job.failed, job.created, job.finished,
+                 job.error, json.dumps(job.native_batches), job.output_path, time.time()),
+            )
+
+    def sync(self, job: BatchJob) -> bool:
+        """Write ``job``'s progress and a heartbeat; returns True when a cancel was requested."""
+        with self._lock:
+            self.conn.execute(
+                "UPDATE batch_jobs SET status = ?, done = ?, failed = ?, finished = ?, error = ?, native_batches = ?,"
+                " heartbeat = ? WHERE id = ?",
+                (job.status, job.done, job.failed, job.finished, job.error, json.dumps(job.native_batches),
+                 time.time(), job.id),
+            )
+            row = self.conn.execute("SELECT cancel FROM batch_jobs WHERE id = ?", (job.id,)).fetchone()
+        return bool(row and row[0])
+
+    def load(self, job_id: str, stale_sec: float = STALE_SEC) -> BatchJob | None:
+        with self._lock:
+            row = self.conn.execute(f"SELECT {self.COLUMNS} FROM batch_jobs WHERE id = ?", (job_id,)).fetchone()
+            if row is None:
+                return None
+            job = BatchJob(row[0], row[1], native=bool(row[2]), status=row[3], done=row[4], failed=row[5],
+                           created=row[6], finished=row[7], error=row[8], native_batches=json.loads(row[9]),
+                           output_path=row[10])
+            if job.status in ("queued", "running") and (row[11] or 0) < time.time() - stale_sec:
+                job.status, job.finished = "failed", time.time()
+                job.error = "Interrupted: the process running this job exited"
+                self.conn.execute("UPDATE batch_jobs SET status = ?, finished = ?, error = ? WHERE id = ?",
+                                  (job.status, job.finished, job.error, job.id))
+        return job
+
+    def request_cancel(self, job_id: str) -> None:
+        with self._lock:
+            self.conn.execute("UPDATE batch_jobs SET cancel = 1 WHERE id = ?", (job_id,))
+
+    def counts(self) -> dict[str, int]:
+        with self._lock:
+            return dict(self.conn.execute("SELECT status, COUNT(*) FROM batch_jobs GROUP BY status").fetchall())
+
+
+class BatchRunner:
+    def __init__(self, store: BatchStore | None = None):
+        self.lanes: dict[str, Lane] = {}
+        self.store = store or BatchStore()
+        self.jobs: dict[str, BatchJob] = {}   # jobs running in this process
+        self._inflight: asyncio.Semaphore | None = None
+        self.counters = {"items": 0, "succeeded": 0, "failed": 0, "cached": 0}
+
+    def lane(self, adapter: providers.ProviderAdapter, req: providers.ChatRequest) -> Lane:
+        key = f"{adapter.id}:{credential_hash(req.api_key or req.base or json.dumps(req.azure, sort_keys=True))}"
+        lane = self.lanes.get(key)
+        if lane is None:
+            lane = self.lanes[key] = Lane(concurrency_for(adapter.id))
+        return lane
+
+    @property
+    def inflight(self) -> asyncio.Semaphore:
+        if self._inflight is None:
+            self._inflight = asyncio.Semaphore(max(1, BATCH_MAX_INFLIGHT))
+        return self._inflight
+
+    @staticmethod
+    def resolve(body: dict) -> tuple[providers.ProviderAdapter, providers.ChatRequest]:
+        provider = (body.get('provider') or '').strip().lower()
+        req = providers.ChatRequest.from_body(body)
+        if not provider or not req.model or not req.prompt:
+            raise providers._bad_request("provider, model, and prompt are required")
+        adapter = providers.registry.resolve(provider)
+        if adapter is None:
+            raise HTTPException(status_code=400, detail={"error": {"message": f"Unsupported provider: {provider}", "code": "unsupported_provider"}})
+        adapter.validate(req)
+        providers.fit(adapter, req)
+        return adapter, req
+
+    async def execute(self, index: int, body: dict) -> dict:
+        """Run one item like /api/chat (cache included); errors become result lines, never exceptions."""
+        self.counters["items"] += 1
+        started = time.perf_counter()
+        result = await self._execute(index, body, started)
+        self.counters["succeeded" if 200 <= result["status"] < 300 else "failed"] += 1
+        return result
+
+    async def _execute(self, index: int, body: dict, started: float) -> dict:
+        try:
+            if body.get('group'):
+                return await self._execute_group(index, body, started)
+            adapter, req = self.resolve(body)
+        except HTTPException as e:
+            return _result(index, body, e.status_code, error=(e.detail or {}).get("error"), started=started)
+        health_monitor.use(adapter.id)
+        cache_mode = (body.get('cache') if isinstance(body.get('cache'), str) else '').strip().lower()
+        cached = await response_cache.lookup(adapter.id, req, cache_mode)
+        if cached.hit:
+            self.counters["cached"] += 1
+            return _result(index, body, 200, cached.value.get("output"), cached.value.get("raw"),
+                           provider=adapter.id, started=started, cache=cached.source)
+        try:
+            # Take the global slot inside the lane so a throttled provider does not hold slots
+            coalesce = cacheable(req, cache_mode)
+            r, data = await self.lane(adapter, req).call(
+                lambda: self._limited(providers.complete(adapter, req, TIMEOUT, self.priority(body), coalesce=coalesce)))
+        except SchedulerBusy as e:
+            return _result(index, body, 503, error={"message": str(e), "code": "ollama_busy"},
+                           provider=adapter.id, started=started)
+        except httpx.RequestError as e:
+            return _result(index, body, 502, error={"message": f"Upstream error: {str(e)}", "code": "chat_upstream"},
+                           provider=adapter.id, started=started)
+        output = adapter.extract_text(data)
+        if 200 <= r.status_code < 300 and isinstance(output, str) and output:
+            await response_cache.store(cached, {"output": output, "raw": data})
+        return _result(index, body, r.status_code, output, data, provider=adapter.id, started=started, cache=cached.source)
+
+    @staticmethod
+    def priority(body: dict) -> str:
+        # Batches queue behind interactive requests on local models unless told otherwise
+        return parse_priority(body.get('priority') or BACKGROUND)
+
+    async def _limited(self, call: Awaitable):
+        async with self.inflight:
+            return await call
+
+    async def _execute_group(self, index: int, body: dict, started: float) -> dict:
+        try:
+            group = routing.model_router.resolve(body['group'])
+        except (KeyError, ValueError):
+            return _result(index, body, 400, error={"message": f"Unknown model group: {body['group']}", "code": "unknown_group"})
+        try:
+            async with self.inflight:
+                routed = await routing.model_router.complete(group, body, TIMEOUT, priority=self.priority(body))
+        except routing.RouteError as e:
+            return _result(index, body, 502 if e.attempts else 400, error={"message": str(e), "code": "chat_upstream"}, started=started)
+        c = routed.candidate
+        r, data = routed.response
+        return _result(index, body, r.status_code, c.adapter.extract_text(data) if r.is_success else None, data,
+                       provider=c.adapter.id, model=c.member.model, started=started)
+
+    async def run(self, items: list[dict], defaults: dict | None = None) -> AsyncIterator[dict]:
+        """Yield one result per item, in completion order. Closing the iterator cancels the rest."""
+        defaults = defaults or {}
+        tasks = [asyncio.create_task(self.execute(i, {**defaults, **item})) for i, item in enumerate(items)]
+        try:
+            for next_done in asyncio.as_completed(tasks):
+                yield await next_done
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    # --- Jobs ---
+
+    async def submit(self, items: list[dict], defaults: dict | None = None, native: bool = False) -> BatchJob:
+        job = BatchJob(uuid.uuid4().hex[:16], len(items), native=native)
+        job.output_path = storage.data_path("batch", f"{job.id}.jsonl")
+        await asyncio.to_thread(self.store.insert, job)
+        self.jobs[job.id] = job
+        job.task = asyncio.create_task(self._run_job(job, items, defaults or {}))
+        return job
+
+    async def get(self, job_id: str) -> BatchJob | None:
+        job = self.jobs.get(job_id)
+        if job is not None:
+            return job
+        # Single process: a job that is not running here belonged to a previous run
+        return await asyncio.to_thread(self.store.load, job_id, STALE_SEC if storage.MULTI_PROCESS else -1.0)
+
+    async def cancel(self, job_id: str) -> BatchJob | None:
+        """Cancel a job; one running in another process stops within about ``SYNC_SEC``."""
+        job = self.jobs.get(job_id)
+        if job is not None:
+            if job.task is not None and not job.task.done():
+                job.task.cancel()
+            return job
+        job = await self.get(job_id)
+        if job is not None and job.status in ("queued", "running"):
+            await asyncio.to_thread(self.store.request_cancel, job_id)
+        return job
+
+    async def _sync(self, job: BatchJob) -> None:
+        while True:
+            await asyncio.sleep(SYNC_SEC)
+            try:
+                cancel = await asyncio.to_thread(self.store.sync, job)
+            except Exception:
+                continue  # a busy database only delays the next sync
+            if cancel and job.task is not None:
+                job.task.cancel()
+
+    async def _run_job(self, job: BatchJob, items: list[dict], defaults: dict) -> None:
+        job.status = "running"
+        sync = asyncio.create_task(self._sync(job))
+        try:
+            with open(job.output_path, "a", encoding="utf-8") as out:
+                def write(result: dict) -> None:
+                    job.done += 1
+                    if not 200 <= result["status"] < 300:
+                        job.failed += 1
+                    out.write(fastjson.dumps(result).decode("utf-8") + "\n")
+                    out.flush()
+
+                bodies = [{**defaults, **item} for item in items]
+                live, native = self._partition(bodies) if job.native else (list(range(len(bodies))), {})
+                tasks = [asyncio.create_task(self._run_live(live, bodies, write)),
+                         *(asyncio.create_task(self._run_native(job, group, bodies, write)) for group in native.values())]
+                try:
+                    await asyncio.gather(*tasks)
+                finally:
+                    # One part failing (or the job being cancelled) stops the rest before the file closes
+                    for task in tasks:
+                        task.cancel()
+                    await asyncio.gather(*tasks, return_exceptions=True)
+            job.status = "completed"
+        except asyncio.CancelledError:
+            job.status = "cancelled"
+        except Exception as e:
+            job.status, job.error = "failed", str(e)
+        finally:
+            job.finished = time.time()
+            sync.cancel()
+            try:
+                await asyncio.to_thread(self.store.sync, job)
+            finally:
+                self.jobs.pop(job.id, None)
+
+    async def _run_live(self, indexes: list[int], bodies: list[dict], write: Callable[[dict], None]) -> None:
+        if not indexes:
+            return
+        async for result in self.run([bodies[i] for i in indexes]):
+            result["index"] = indexes[result["index"]]
+            write(result)
+
+    def _partition(self, bodies: list[dict]) -> tuple[list[int], dict]:
+        """Split item indexes into live ones and native batches keyed by provider + credential."""
+        live, native = [], {}
+        for i, body in enumerate(bodies):
+            if body.get('group'):
+                live.append(i)
+                continue
+            try:
+                adapter, req = self.resolve(body)
+            except HTTPException:
+                live.append(i)
+                continue
+            handler = NATIVE_BATCH.get(adapter.id)
+            if handler is None or not adapter.capabilities.batching:
+                live.append(i)
+                continue
+            key = f"{adapter.id}:{credential_hash(req.api_key)}"
+            native.setdefault(key, (adapter, handler, []))[2].append((i, req))
+        return live, native
+
+    async def _run_native(self, job: BatchJob, group: tuple, bodies: list[dict], write: Callable[[dict], None]) -> None:
+        adapter, handler, entries = group
+        req = entries[0][1]
+        batch_id = await handler.submit(adapter, [(str(i), r) for i, r in entries])
+        record = {"provider": adapter.id, "id": batch_id, "items": len(entries), "status": "submitted"}
+        job.native_batches.append(record)
+        while True:
+            finished, info = await handler.poll(adapter, req, batch_id)
+            record["status"] = info.get("status") or info.get("processing_status")
+            if finished:
+                break
+            await asyncio.sleep(BATCH_POLL_SEC)
+        seen = set()
+        async for custom_id, status, data in handler.results(adapter, req, info):
+            try:
+                i = int(custom_id)
+            except (TypeError, ValueError):
+                continue
+            seen.add(i)
+            output = adapter.extract_text(data) if 200 <= status < 300 else None
+            write(_result(i, bodies[i], status, output, data, provider=adapter.id,
+                          error=None if output else {"message": "Batch item failed", "code": "batch_item"}))
+        for i, _ in entries:
+            if i not in seen:
+                write(_result(i, bodies[i], 502, provider=adapter.id,
+                              error={"message": f"No result in native batch ({record['status']})", "code": "batch_item"}))
+
+    def stats(self) -> dict:
+        counts = self.store.counts()
+        return {
+            **self.counters,
+            "lanes": {key: {"limit": lane.limit, "throttled": lane.throttled} for key, lane in self.lanes.items()},
+            "jobs": {status: counts.get(status, 0) for status in ("queued", "running", "completed", "failed", "cancelled")},
+            "running_here": len(self.jobs),
+        }
+
+
+batch_runner = BatchRunner()
@@ -0,0 +1,355 @@
+"""Response cache for chat completions.
+
+Lookups go memory LRU -> optional SQLite tier -> optional near-duplicate (embedding)
+match. Keys are a hash of the normalized request (provider, model, prompt, params and a
+hash of the credential, so responses are never shared across API keys).
+
+Only deterministic requests (``temperature: 0``) are cached by default: a sampled
+completion is expected to differ on every call, so "regenerate" must not replay it.
+Requests can opt in per call with ``cache: "on"``, or opt out with ``cache: "bypass"``
+(no lookup, no store). ``cache: "refresh"`` skips the lookup but stores the fresh
+response.
+"""
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import asdict, dataclass, field
+from typing import Any
+
+from . import fastjson, storage
+from .embeddings import Embedder, cosine, default_embedder
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - exercised only without numpy
+    np = None
+
+
+def _env_flag(name: str, default: str) -> bool:
+    return os.getenv(name, default).strip().lower() not in ("0", "false", "no", "off", "")
+
+
+CHAT_CACHE = _env_flag("CHAT_CACHE", "1")
+CHAT_CACHE_MAX_ENTRIES = int(os.getenv("CHAT_CACHE_MAX_ENTRIES", "512"))
+CHAT_CACHE_TTL = float(os.getenv("CHAT_CACHE_TTL", "3600"))
+# Workers only share cached responses through the SQLite tier
+CHAT_CACHE_PERSIST = _env_flag("CHAT_CACHE_PERSIST", "1" if storage.MULTI_PROCESS else "0")
+CHAT_CACHE_DB_TTL = float(os.getenv("CHAT_CACHE_DB_TTL", str(7 * 24 * 3600)))
+CHAT_CACHE_DB_MAX_MB = float(os.getenv("CHAT_CACHE_DB_MAX_MB", "64"))
+CHAT_CACHE_SEMANTIC = _env_flag("CHAT_CACHE_SEMANTIC", "0")
+CHAT_CACHE_SEMANTIC_THRESHOLD = float(os.getenv("CHAT_CACHE_SEMANTIC_THRESHOLD", "0.95"))
+CHAT_CACHE_SEMANTIC_MAX = int(os.getenv("CHAT_CACHE_SEMANTIC_MAX", "1024"))
+
+
+def stable_hash(obj: Any) -> str:
+    return hashlib.sha256(json.dumps(obj, sort_keys=True, separators=(',', ':'), default=str).encode("utf-8")).hexdigest()
+
+
+def cacheable(req, mode: str = "") -> bool:
+    """Whether a completion may be served from or stored in the cache."""
+    if mode == "bypass":
+        return False
+    return mode in ("on", "refresh") or req.temperature == 0
+
+
+def credential_hash(secret: str) -> str:
+    return hashlib.sha256(secret.encode("utf-8")).hexdigest()[:16] if secret else ""
+
+
+class LRUCache:
+    """Bounded in-memory LRU with a per-entry TTL."""
+
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._data: OrderedDict[str, tuple[float, Any]] = OrderedDict()
+
+    def get(self, key: str) -> Any | None:
+        item = self._data.get(key)
+        if item is None:
+            return None
+        expires, value = item
+        if expires < time.monotonic():
+            del self._data[key]
+            return None
+        self._data.move_to_end(key)
+        return value
+
+    def set(self, key: str, value: Any, ttl: float | None = None) -> None:
+        self._data[key] = (time.monotonic() + (self.ttl if ttl is None else ttl), value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        self._data.pop(key, None)
+
+    def clear(self) -> None:
+        self._data.clear()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+
+class SqliteTier:
+    """Persistent tier with TTL expiry and size-capped least-recently-used eviction."""
+
+    EVICT_EVERY = 32  # writes between eviction passes
+
+    def __init__(self, path: str, ttl: float, max_bytes: int):
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._conn = storage.connect_sqlite(path)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS responses ("
+            " key TEXT PRIMARY KEY, value BLOB NOT NULL, size INTEGER NOT NULL,"
+            " created REAL NOT NULL, accessed REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS responses_accessed ON responses(accessed)")
+
+    def get(self, key: str) -> Any | None:
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute("SELECT value, created FROM responses WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                return None
+            if row[1] + self.ttl < now:
+                self._conn.execute("DELETE FROM responses WHERE key = ?", (key,))
+                return None
+            self._conn.execute("UPDATE responses SET accessed = ? WHERE key = ?", (now, key))
+        return fastjson.loads(row[0])
+
+    def set(self, key: str, value: Any) -> None:
+        blob = fastjson.dumps(value)
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value, size, created, accessed) VALUES (?, ?, ?, ?, ?)",
+                (key, blob, len(blob), now, now),
+            )
+            self._writes += 1
+            if self._writes % self.EVICT_EVERY == 0:
+                self._evict(now)
+
+    def _evict(self, now: float) -> None:
+        self._conn.execute("DELETE FROM responses WHERE created < ?", (now - self.ttl,))
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        excess = total - self.max_bytes
+        freed = 0
+        doomed = []
+        for key, size in self._conn.execute("SELECT key, size FROM responses ORDER BY accessed ASC"):
+            doomed.append((key,))
+            freed += size
+            if freed >= excess:
+                break
+        self._conn.executemany("DELETE FROM responses WHERE key = ?", doomed)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM responses")
+
+    def stats(self) -> dict:
+        with self._lock:
+            count, size = self._conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM responses").fetchone()
+        return {"entries": count, "bytes": size}
+
+
+class SemanticIndex:
+    """Bounded set of (scope, embedding, key); matches only within the same scope.
+
+    Each scope's vectors are kept as one normalized NumPy matrix, rebuilt lazily after a
+    change, so a match is a single matrix-vector product. Without NumPy it falls back to
+    a Python scan. ``match`` is blocking; callers run it in a thread.
+    """
+
+    def __init__(self, threshold: float, max_entries: int):
+        self.threshold = threshold
+        self._entries: OrderedDict[str, tuple[str, list[float]]] = OrderedDict()
+        self._matrices: dict[str, tuple[list[str], Any]] = {}
+        self._lock = threading.Lock()
+        self.max_entries = max_entries
+
+    def add(self, key: str, scope: str, vector: list[float]) -> None:
+        with self._lock:
+            self._entries[key] = (scope, vector)
+            self._entries.move_to_end(key)
+            self._matrices.pop(scope, None)
+            while len(self._entries) > self.max_entries:
+                self._matrices.pop(self._entries.popitem(last=False)[1][0], None)
+
+    def _matrix(self, scope: str) -> tuple[list[str], Any]:
+        cached = self._matrices.get(scope)
+        if cached is None:
+            keys = [k for k, (entry_scope, _) in self._entries.items() if entry_scope == scope]
+            mat = np.asarray([self._entries[k][1] for k in keys], dtype=np.float32) if keys else None
+            if mat is not None:
+                norms = np.linalg.norm(mat, axis=1, keepdims=True)
+                norms[norms == 0] = 1.0
+                mat /= norms
+            cached = self._matrices[scope] = (keys, mat)
+        return cached
+
+    def match(self, scope: str, vector: list[float]) -> str | None:
+        with self._lock:
+            if np is None:
+                best_key, best = None, self.threshold
+                for key, (entry_scope, entry_vec) in self._entries.items():
+                    if entry_scope != scope:
+                        continue
+                    score = cosine(vector, entry_vec)
+                    if score >= best:
+                        best_key, best = key, score
+                return best_key
+            keys, mat = self._matrix(scope)
+        query = np.asarray(vector, dtype=np.float32)
+        norm = float(np.linalg.norm(query))
+        if mat is None or not norm or mat.shape[1] != query.shape[0]:
+            return None
+        scores = mat @ (query / norm)
+        i = int(np.argmax(scores))
+        return keys[i] if scores[i] >= self.threshold else None
+
+    def discard(self, key: str) -> None:
+        with self._lock:
+            entry = self._entries.pop(key, None)
+            if entry is not None:
+                self._matrices.pop(entry[0], None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._matrices.clear()
+
+
+@dataclass
+class Lookup:
+    key: str
+    scope: str
+    mode: str = ""
+    value: Any = None
+    source: str = "MISS"  # MISS | MEMORY | DISK | SEMANTIC | BYPASS
+    embedding: list[float] | None = field(default=None, repr=False)
+    prompt: str = field(default="", repr=False)
+
+    @property
+    def hit(self) -> bool:
+        return self.value is not None
+
+
+class ResponseCache:
+    def __init__(self, enabled: bool = CHAT_CACHE, persist: bool = CHAT_CACHE_PERSIST,
+                 semantic: bool = CHAT_CACHE_SEMANTIC, embedder: Embedder = default_embedder):
+        self.enabled = enabled
+        self.memory = LRUCache(CHAT_CACHE_MAX_ENTRIES, CHAT_CACHE_TTL)
+        self._persist = persist
+        self._disk: SqliteTier | None = None
+        self.semantic = SemanticIndex(CHAT_CACHE_SEMANTIC_THRESHOLD, CHAT_CACHE_SEMANTIC_MAX) if semantic else None
+        self.embedder = embedder
+        self.counters = {"hits_memory": 0, "hits_disk": 0, "hits_semantic": 0, "misses": 0, "bypass": 0, "stores": 0}
+
+    @property
+    def disk(self) -> SqliteTier | None:
+        if self._persist and self._disk is None:
+            self._disk = SqliteTier(storage.data_path("cache", "responses.sqlite3"),
+                                    CHAT_CACHE_DB_TTL, int(CHAT_CACHE_DB_MAX_MB * 1024 * 1024))
+        return self._disk
+
+    @staticmethod
+    def make_key(provider_id: str, req) -> tuple[str, str, str]:
+        """Return (key, scope, normalized prompt). The scope is everything except the prompt."""
+        fields = asdict(req)
+        prompt = (fields.pop("prompt", "") or "").replace("\r\n", "\n").strip()
+        fields["api_key"] = credential_hash(fields.get("api_key") or "")
+        azure = fields.get("azure") or {}
+        if azure.get("apiKey"):
+            fields["azure"] = {**azure, "apiKey": credential_hash(azure["apiKey"])}
+        scope = stable_hash({"provider": provider_id, **fields})
+        return stable_hash([scope, prompt]), scope, prompt
+
+    async def lookup(self, provider_id: str, req, mode: str = "") -> Lookup:
+        key, scope, prompt = self.make_key(provider_id, req)
+        found = Lookup(key=key, scope=scope, mode=mode, prompt=prompt)
+        if not self.enabled or not cacheable(req, mode):
+            found.mode, found.source = "bypass", "BYPASS"
+            self.counters["bypass"] += 1
+            return found
+        if mode == "refresh":
+            return found
+
+        value = self.memory.get(key)
+        if value is not None:
+            found.value, found.source = value, "MEMORY"
+            self.counters["hits_memory"] += 1
+            return found
+
+        disk = self.disk
+        if disk is not None:
+            value = await asyncio.to_thread(disk.get, key)
+            if value is not None:
+                self.memory.set(key, value)
+                found.value, found.source = value, "DISK"
+                self.counters["hits_disk"] += 1
+                return found
+
+        if self.semantic is not None and prompt:
+            try:
+                found.embedding = (await self.embedder.embed([prompt]))[0]
+            except Exception:
+                found.embedding = None
+            if found.embedding is not None:
+                near = await asyncio.to_thread(self.semantic.match, scope, found.embedding)
+                value = self.memory.get(near) if near else None
+                if value is None and near and disk is not None:
+                    value = await asyncio.to_thread(disk.get, near)
+                if value is not None:
+                    found.value, found.source = value, "SEMANTIC"
+                    self.counters["hits_semantic"] += 1
+                    return found
+                if near:
+                    self.semantic.discard(near)
+
+        self.counters["misses"] += 1
+        return found
+
+    async def store(self, lookup: Lookup, value: Any) -> None:
+        if not self.enabled or lookup.mode == "bypass":
+            return
+        self.memory.set(lookup.key, value)
+        disk = self.disk
+        if disk is not None:
+            await asyncio.to_thread(disk.set, lookup.key, value)
+        if self.semantic is not None and lookup.embedding is not None:
+            self.semantic.add(lookup.key, lookup.scope, lookup.embedding)
+        self.counters["stores"] += 1
+
+    def clear(self) -> None:
+        self.memory.clear()
+        if self.semantic is not None:
+            self.semantic.clear()
+        if self.disk is not None:
+            self.disk.clear()
+
+    def stats(self) -> dict:
+        hits = self.counters["hits_memory"] + self.counters["hits_disk"] + self.counters["hits_semantic"]
+        lookups = hits + self.counters["misses"]
+        return {
+            "enabled": self.enabled,
+            **self.counters,
+            "hit_ratio": round(hits / lookups, 4) if lookups else 0.0,
+            "memory_entries": len(self.memory),
+            "disk": self.disk.stats() if self.disk is not None else None,
+            "semantic": self.semantic is not None,
+        }
+
+
+response_cache = ResponseCache()
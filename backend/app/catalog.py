@@ -0,0 +1,145 @@
+"""Model catalogs for the model-list endpoints (Google AI, OpenRouter, Ollama tags).
+
+Each provider's list is cached per credential hash (API key, or base URL for Ollama).
+Entries are fresh for ``MODEL_CATALOG_TTL`` seconds. After that they are still served
+immediately while one background refresh fetches a new copy (stale-while-revalidate), up
+to ``MODEL_CATALOG_MAX_STALE`` seconds; older entries are refetched before responding.
+Upstream errors are never cached, and a failed background refresh keeps the stale copy.
+
+Every entry carries an ETag, so the renderer's repeat requests can be answered with 304.
+"""
+from __future__ import annotations
+
+import asyncio
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Any, Awaitable, Callable
+
+import httpx
+
+from . import fastjson
+from .cache import LRUCache, credential_hash, stable_hash
+from .singleflight import SingleFlight
+from .upstream import upstreams
+
+
+MODEL_CATALOG_TTL = float(os.getenv("MODEL_CATALOG_TTL", "300"))
+MODEL_CATALOG_MAX_STALE = float(os.getenv("MODEL_CATALOG_MAX_STALE", str(24 * 3600)))
+MODEL_CATALOG_MAX_ENTRIES = 256
+
+
+@dataclass
+class CatalogEntry:
+    status: int
+    body: dict                # what the endpoint returns by default
+    raw: Any = None           # full upstream payload, only returned with ?raw=1
+    fetched: float = field(default_factory=time.monotonic)
+    etag: str = ""
+    raw_etag: str = ""
+    _rendered: dict = field(default_factory=dict, repr=False, compare=False)
+
+    def __post_init__(self):
+        if not self.etag:
+            self.etag = 'W/"' + stable_hash([self.status, self.body])[:20] + '"'
+        if not self.raw_etag and self.raw is not None:
+            self.raw_etag = 'W/"' + stable_hash([self.status, self.raw])[:20] + '"'
+
+    @property
+    def age(self) -> float:
+        return time.monotonic() - self.fetched
+
+    @property
+    def cacheable(self) -> bool:
+        return self.status == 200
+
+    def render(self, include_raw: bool) -> bytes:
+        """Serialized response body, built once per fetch rather than once per request."""
+        if include_raw not in self._rendered:
+            self._rendered[include_raw] = fastjson.dumps({**self.body, "raw": self.raw} if include_raw else self.body)
+        return self._rendered[include_raw]
+
+
+async def fetch_google(api_key: str) -> CatalogEntry:
+    r = await upstreams.get(f"https://generativelanguage.googleapis.com/v1beta/models?key={api_key}", timeout=httpx.Timeout(20.0))
+    if not fastjson.is_json(r):
+        return CatalogEntry(r.status_code, {"raw": r.text})
+    data = fastjson.loads(r.content)
+    names = [m['name'] for m in (data.get('models') or []) if isinstance(m, dict) and m.get('name')] if isinstance(data, dict) else []
+    return CatalogEntry(r.status_code, {"models": names}, raw=data)
+
+
+async def fetch_openrouter(api_key: str) -> CatalogEntry:
+    headers = {"Authorization": f"Bearer {api_key}", "Accept": "application/json"}
+    r = await upstreams.get("https://openrouter.ai/api/v1/models", headers=headers, timeout=httpx.Timeout(20.0))
+    if not fastjson.is_json(r):
+        return CatalogEntry(r.status_code, {"raw": r.text})
+    data = fastjson.loads(r.content)
+    names = [m['id'] for m in (data.get('data') or []) if isinstance(m, dict) and m.get('id')] if isinstance(data, dict) else []
+    return CatalogEntry(r.status_code, {"models": names}, raw=data)
+
+
+async def fetch_ollama(base: str) -> CatalogEntry:
+    r = await upstreams.get(f"{base}/api/tags", timeout=httpx.Timeout(8.0))
+    # Ollama's tag list is small and the renderer reads it as-is
+    return CatalogEntry(r.status_code, fastjson.response_json(r))
+
+
+FETCHERS: dict[str, Callable[[str], Awaitable[CatalogEntry]]] = {
+    "google": fetch_google,
+    "openrouter": fetch_openrouter,
+    "ollama": fetch_ollama,
+}
+
+
+class ModelCatalog:
+    def __init__(self, ttl: float = MODEL_CATALOG_TTL, max_stale: float = MODEL_CATALOG_MAX_STALE):
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self.entries = LRUCache(MODEL_CATALOG_MAX_ENTRIES, ttl + max_stale)
+        self.flights = SingleFlight()
+        self._refreshing: dict[str, asyncio.Task] = {}
+        self.counters = {"fresh": 0, "stale": 0, "misses": 0, "refreshes": 0, "refresh_errors": 0}
+
+    async def get(self, provider: str, credential: str, force: bool = False) -> tuple[CatalogEntry, str]:
+        """Returns (entry, source) where source is FRESH, STALE or MISS."""
+        key = f"{provider}:{credential_hash(credential)}"
+        entry = None if force else self.entries.get(key)
+        if entry is not None and entry.age < self.ttl:
+            self.counters["fresh"] += 1
+            return entry, "FRESH"
+        if entry is not None:
+            self.counters["stale"] += 1
+            self._refresh_in_background(key, provider, credential)
+            return entry, "STALE"
+        self.counters["misses"] += 1
+        return await self.flights.do(key, lambda: self._fetch(key, provider, credential)), "MISS"
+
+    async def _fetch(self, key: str, provider: str, credential: str) -> CatalogEntry:
+        entry = await FETCHERS[provider](credential)
+        if entry.cacheable:
+            self.entries.set(key, entry)
+        return entry
+
+    def _refresh_in_background(self, key: str, provider: str, credential: str) -> None:
+        if key in self._refreshing:
+            return
+
+        async def refresh():
+            try:
+                self.counters["refreshes"] += 1
+                entry = await self.flights.do(key, lambda: self._fetch(key, provider, credential))
+                if not entry.cacheable:
+                    self.counters["refresh_errors"] += 1
+            except Exception:
+                self.counters["refresh_errors"] += 1
+            finally:
+                self._refreshing.pop(key, None)
+
+        self._refreshing[key] = asyncio.create_task(refresh())
+
+    def stats(self) -> dict:
+        return {**self.counters, "entries": len(self.entries), "ttl": self.ttl}
+
+
+model_catalog = ModelCatalog()
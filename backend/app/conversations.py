@@ -0,0 +1,333 @@
+"""Server-side conversations for /api/chat (``conversation_id``).
+
+Messages are appended to a log in SQLite (WAL) at ``<data>/conversations.sqlite3`` and
+never rewritten. Each turn, the provider context is the newest messages that fit the
+token budget, so the renderer only sends the new prompt. Each conversation keeps an
+in-memory window of its recent messages, and only messages appended since the last turn
+are read from disk, by this worker or any other. Building context never re-reads the
+whole history.
+
+Older turns that no longer fit are dropped from the context. With
+``CONVERSATION_SUMMARIZE`` the local mini model folds them into a running summary in the
+background. From the next turn on, that summary leads the context.
+
+Token counts are estimated (``tokens.approx_tokens``) once, when a message is stored;
+/api/chat still fits the final request with the model's own tokenizer.
+"""
+from __future__ import annotations
+
+import asyncio
+import os
+import re
+import threading
+import time
+import uuid
+from dataclasses import dataclass, field
+
+import httpx
+
+from . import fastjson, storage
+from .cache import LRUCache
+from .scheduler import BACKGROUND, MINI_KEEP_ALIVE, MINI_MODEL, OLLAMA_BASE, SchedulerBusy, keep_alive_value, ollama_scheduler
+from .tokens import MESSAGE_OVERHEAD_TOKENS, approx_tokens
+from .upstream import upstreams
+
+
+CONVERSATION_CONTEXT_TOKENS = int(os.getenv("CONVERSATION_CONTEXT_TOKENS", "8000"))
+CONVERSATION_RESERVE_TOKENS = int(os.getenv("CONVERSATION_RESERVE_TOKENS", "1024"))
+CONVERSATION_SUMMARIZE = os.getenv("CONVERSATION_SUMMARIZE", "1").strip().lower() not in ("0", "false", "no", "off")
+WINDOW_TOKENS = 32768          # most recent history kept in memory per conversation
+WINDOW_CONVERSATIONS = 256
+SUMMARY_INPUT_CHARS = 16000    # newest dropped text sent to the summarizer
+SUMMARY_RETRY_SEC = 60.0
+SUMMARY_HEADER = "Summary of the earlier conversation:"
+ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+
+
+def message_tokens(text: str) -> int:
+    return MESSAGE_OVERHEAD_TOKENS + approx_tokens(text or "")
+
+
+def context_budget(requested, max_context: int | None, prompt: str) -> int:
+    """Tokens of history to send: the requested budget, capped so prompt and reply still fit."""
+    budget = requested if isinstance(requested, int) and requested >= 0 else CONVERSATION_CONTEXT_TOKENS
+    budget = min(budget, WINDOW_TOKENS)
+    if max_context:
+        budget = min(budget, max_context - CONVERSATION_RESERVE_TOKENS - message_tokens(prompt))
+    return max(0, budget)
+
+
+@dataclass
+class Message:
+    seq: int
+    role: str
+    content: str
+    tokens: int
+    created: float
+
+    def describe(self) -> dict:
+        return {"seq": self.seq, "role": self.role, "content": self.content, "tokens": self.tokens, "created": self.created}
+
+
+@dataclass
+class Window:
+    last_seq: int
+    summary: str
+    summary_upto: int
+    messages: list[Message] = field(default_factory=list)  # oldest first, ends at last_seq
+
+    def trim(self) -> None:
+        total = 0
+        for i in range(len(self.messages) - 1, -1, -1):
+            total += self.messages[i].tokens
+            if total > WINDOW_TOKENS:
+                del self.messages[:i + 1]
+                return
+
+
+@dataclass
+class Context:
+    history: list[dict]
+    tokens: int = 0
+    dropped: int = 0        # stored messages left out of the history
+    summarized: bool = False
+
+    def describe(self, conversation_id: str) -> dict:
+        return {"id": conversation_id, "context_messages": len(self.history), "context_tokens": self.tokens,
+                "dropped": self.dropped, "summarized": self.summarized}
+
+
+class ConversationStore:
+    def __init__(self, path: str | None = None):
+        self._path = path
+        self._conn = None
+        self._lock = threading.Lock()
+        self.windows = LRUCache(WINDOW_CONVERSATIONS, 3600.0)
+        self._summarizing: dict[str, asyncio.Task] = {}
+        self._summary_failed = LRUCache(WINDOW_CONVERSATIONS, SUMMARY_RETRY_SEC)   # recent failures, skipped until they expire
+        self.counters = {"appended": 0, "window_hits": 0, "window_reads": 0, "summaries": 0, "summary_errors": 0}
+
+    @property
+    def conn(self):
+        if self._conn is None:
+            conn = storage.connect_sqlite(self._path or storage.data_path("conversations.sqlite3"))
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS conversations ("
+                " id TEXT PRIMARY KEY, title TEXT NOT NULL DEFAULT '', created REAL NOT NULL, updated REAL NOT NULL,"
+                " last_seq INTEGER NOT NULL DEFAULT 0, summary TEXT NOT NULL DEFAULT '', summary_upto INTEGER NOT NULL DEFAULT 0)"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS messages ("
+                " conversation_id TEXT NOT NULL, seq INTEGER NOT NULL, role TEXT NOT NULL, content TEXT NOT NULL,"
+                " tokens INTEGER NOT NULL, created REAL NOT NULL, PRIMARY KEY (conversation_id, seq)) WITHOUT ROWID"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS conversations_updated ON conversations(updated)")
+            self._conn = conn
+        return self._conn
+
+    # --- conversations ---
+
+    @staticmethod
+    def _describe(row) -> dict:
+        return {"id": row[0], "title": row[1], "created": row[2], "updated": row[3], "messages": row[4],
+                "summarized_upto": row[5]}
+
+    def create(self, conversation_id: str | None = None, title: str = "") -> dict:
+        conversation_id = conversation_id or f"conv_{uuid.uuid4().hex[:16]}"
+        now = time.time()
+        with self._lock:
+            self.conn.execute("INSERT OR IGNORE INTO conversations (id, title, created, updated) VALUES (?, ?, ?, ?)",
+                              (conversation_id, title, now, now))
+        return self.get(conversation_id)
+
+    def get(self, conversation_id: str) -> dict | None:
+        with self._lock:
+            row = self.conn.execute("SELECT id, title, created, updated, last_seq, summary_upto FROM conversations WHERE id = ?",
+                                    (conversation_id,)).fetchone()
+        return self._describe(row) if row else None
+
+    def recent(self, limit: int = 50) -> list[dict]:
+        with self._lock:
+            rows = self.conn.execute("SELECT id, title, created, updated, last_seq, summary_upto FROM conversations"
+                                     " ORDER BY updated DESC LIMIT ?", (max(1, limit),)).fetchall()
+        return [self._describe(r) for r in rows]
+
+    def messages(self, conversation_id: str, after: int = 0, limit: int = 500) -> list[dict]:
+        with self._lock:
+            rows = self.conn.execute("SELECT seq, role, content, tokens, created FROM messages"
+                                     " WHERE conversation_id = ? AND seq > ? ORDER BY seq LIMIT ?",
+                                     (conversation_id, after, max(1, limit))).fetchall()
+        return [Message(*r).describe() for r in rows]
+
+    def delete(self, conversation_id: str) -> bool:
+        self.windows.delete(conversation_id)
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                self.conn.execute("DELETE FROM messages WHERE conversation_id = ?", (conversation_id,))
+                deleted = self.conn.execute("DELETE FROM conversations WHERE id = ?", (conversation_id,)).rowcount
+                self.conn.execute("COMMIT")
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+        return bool(deleted)
+
+    def append(self, conversation_id: str, turns: list[tuple[str, str]]) -> list[Message]:
+        """Append messages in one transaction, creating the conversation if needed."""
+        now = time.time()
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                self.conn.execute("INSERT OR IGNORE INTO conversations (id, created, updated) VALUES (?, ?, ?)",
+                                  (conversation_id, now, now))
+                last_seq = self.conn.execute("SELECT last_seq FROM conversations WHERE id = ?", (conversation_id,)).fetchone()[0]
+                added = [Message(last_seq + i + 1, role, content, message_tokens(content), now) for i, (role, content) in enumerate(turns)]
+                self.conn.executemany("INSERT INTO messages (conversation_id, seq, role, content, tokens, created) VALUES (?, ?, ?, ?, ?, ?)",
+                                      [(conversation_id, m.seq, m.role, m.content, m.tokens, m.created) for m in added])
+                self.conn.execute("UPDATE conversations SET last_seq = ?, updated = ? WHERE id = ?",
+                                  (last_seq + len(added), now, conversation_id))
+                self.conn.execute("COMMIT")
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+        window = self.windows.get(conversation_id)
+        if window is not None and window.last_seq == last_seq:
+            window.messages.extend(added)
+            window.last_seq += len(added)
+            window.trim()
+        self.counters["appended"] += len(added)
+        return added
+
+    # --- context ---
+
+    def window(self, conversation_id: str) -> Window | None:
+        """Recent messages, reading only what was appended since the cached window."""
+        with self._lock:
+            row = self.conn.execute("SELECT last_seq, summary, summary_upto FROM conversations WHERE id = ?",
+                                    (conversation_id,)).fetchone()
+            if row is None:
+                self.windows.delete(conversation_id)
+                return None
+            last_seq, summary, summary_upto = row
+            window = self.windows.get(conversation_id)
+            if window is not None and window.last_seq == last_seq:
+                self.counters["window_hits"] += 1
+            elif window is not None and window.last_seq < last_seq:
+                rows = self.conn.execute("SELECT seq, role, content, tokens, created FROM messages"
+                                         " WHERE conversation_id = ? AND seq > ? ORDER BY seq", (conversation_id, window.last_seq))
+                window.messages.extend(Message(*r) for r in rows)
+                window.last_seq = last_seq
+                window.trim()
+                self.counters["window_reads"] += 1
+            else:
+                window = Window(last_seq, summary, summary_upto)
+                total = 0
+                for r in self.conn.execute("SELECT seq, role, content, tokens, created FROM messages"
+                                           " WHERE conversation_id = ? ORDER BY seq DESC", (conversation_id,)):
+                    total += r[3]
+                    if total > WINDOW_TOKENS:
+                        break
+                    window.messages.append(Message(*r))
+                window.messages.reverse()
+                self.counters["window_reads"] += 1
+            window.summary, window.summary_upto = summary, summary_upto
+            self.windows.set(conversation_id, window)
+        return window
+
+    async def context(self, conversation_id: str, budget: int) -> Context:
+        """History for the next turn: the summary (if any) plus the newest turns within ``budget`` tokens."""
+        window = await asyncio.to_thread(self.window, conversation_id)
+        if window is None or not window.last_seq:
+            return Context([])
+        summary_tokens = message_tokens(window.summary) if window.summary else 0
+        kept: list[Message] = []
+        total = summary_tokens
+        for m in reversed(window.messages):
+            if m.seq <= window.summary_upto or total + m.tokens > budget:
+                break
+            kept.append(m)
+            total += m.tokens
+        kept.reverse()
+        while kept and kept[0].role != "user":
+            total -= kept.pop(0).tokens  # providers expect the history to open with a user turn
+        first_seq = kept[0].seq if kept else window.last_seq + 1
+        if first_seq - 1 > window.summary_upto:
+            self._schedule_summary(conversation_id, first_seq - 1)
+
+        history = [{"role": m.role, "content": m.content} for m in kept]
+        if window.summary:
+            preface = f"{SUMMARY_HEADER}\n{window.summary}"
+            if history:
+                history[0] = {"role": "user", "content": f"{preface}\n\n{history[0]['content']}"}
+            else:
+                history = [{"role": "user", "content": preface}, {"role": "assistant", "content": "Understood."}]
+        return Context(history, total if history else 0, first_seq - 1, bool(window.summary))
+
+    async def remember(self, conversation_id: str, prompt: str, reply: str) -> None:
+        await asyncio.to_thread(self.append, conversation_id, [("user", prompt), ("assistant", reply)])
+
+    # --- summaries ---
+
+    def _schedule_summary(self, conversation_id: str, upto: int) -> None:
+        if not CONVERSATION_SUMMARIZE or conversation_id in self._summarizing:
+            return
+        if self._summary_failed.get(conversation_id) is not None:
+            return
+        task = asyncio.create_task(self._summarize(conversation_id, upto))
+        self._summarizing[conversation_id] = task
+        task.add_done_callback(lambda _: self._summarizing.pop(conversation_id, None))
+
+    def _dropped_text(self, conversation_id: str, upto: int) -> tuple[str, int] | None:
+        with self._lock:
+            row = self.conn.execute("SELECT summary, summary_upto FROM conversations WHERE id = ?", (conversation_id,)).fetchone()
+            if row is None or row[1] >= upto:
+                return None
+            rows = self.conn.execute("SELECT role, content FROM messages WHERE conversation_id = ? AND seq > ? AND seq <= ? ORDER BY seq",
+                                     (conversation_id, row[1], upto)).fetchall()
+        transcript = "\n\n".join(f"{'User' if role == 'user' else 'Assistant'}: {content}" for role, content in rows)
+        return transcript[-SUMMARY_INPUT_CHARS:], row[0]
+
+    async def _summarize(self, conversation_id: str, upto: int) -> None:
+        found = await asyncio.to_thread(self._dropped_text, conversation_id, upto)
+        if found is None:
+            return
+        transcript, previous = found
+        prompt = ("Summarize the conversation below in one short paragraph (under 150 words). "
+                  "Keep names, facts, decisions and open questions.\n\n"
+                  + (f"Earlier summary:\n{previous}\n\n" if previous else "")
+                  + f"Conversation:\n{transcript}")
+        payload = {"model": MINI_MODEL, "prompt": prompt, "stream": False, "keep_alive": keep_alive_value(MINI_KEEP_ALIVE)}
+        try:
+            async with ollama_scheduler.slot(OLLAMA_BASE, MINI_MODEL, BACKGROUND):
+                r = await upstreams.post(f"{OLLAMA_BASE}/api/generate", json=payload, timeout=httpx.Timeout(120.0))
+            text = (fastjson.loads(r.content).get("response") or "").strip() if r.is_success else ""
+        except (httpx.RequestError, SchedulerBusy, ValueError, AttributeError):
+            text = ""
+        if not text:
+            self.counters["summary_errors"] += 1
+            self._summary_failed.set(conversation_id, True)
+            return
+        await asyncio.to_thread(self._save_summary, conversation_id, text, upto)
+        self.counters["summaries"] += 1
+
+    def _save_summary(self, conversation_id: str, summary: str, upto: int) -> None:
+        with self._lock:
+            self.conn.execute("UPDATE conversations SET summary = ?, summary_upto = ? WHERE id = ? AND summary_upto < ?",
+                              (summary, upto, conversation_id, upto))
+        window = self.windows.get(conversation_id)
+        if window is not None and window.summary_upto < upto:
+            window.summary, window.summary_upto = summary, upto
+
+    async def stop(self) -> None:
+        tasks = list(self._summarizing.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def stats(self) -> dict:
+        return {**self.counters, "windows": len(self.windows), "summarizing": len(self._summarizing),
+                "limits": {"context_tokens": CONVERSATION_CONTEXT_TOKENS, "reserve_tokens": CONVERSATION_RESERVE_TOKENS,
+                           "window_tokens": WINDOW_TOKENS, "summarize": CONVERSATION_SUMMARIZE}}
+
+
+conversation_store = ConversationStore()
@@ -0,0 +1,48 @@
+"""Text embedders. The default talks to a local Ollama embedding model."""
+from __future__ import annotations
+
+import os
+from typing import Protocol
+
+import httpx
+
+from .upstream import upstreams
+
+
+OLLAMA_BASE = os.getenv("OLLAMA_BASE", "http://127.0.0.1:11434").rstrip('/')
+EMBED_MODEL = os.getenv("EMBED_MODEL", "nomic-embed-text")
+
+
+class Embedder(Protocol):
+    model: str
+
+    async def embed(self, texts: list[str]) -> list[list[float]]: ...
+
+
+class OllamaEmbedder:
+    """Batch embeddings via Ollama's ``/api/embed`` endpoint."""
+
+    def __init__(self, base: str = OLLAMA_BASE, model: str = EMBED_MODEL, timeout: float = 60.0):
+        self.base = base.rstrip('/')
+        self.model = model
+        self.timeout = httpx.Timeout(timeout)
+
+    async def embed(self, texts: list[str]) -> list[list[float]]:
+        if not texts:
+            return []
+        r = await upstreams.post(f"{self.base}/api/embed", json={"model": self.model, "input": texts}, timeout=self.timeout, coalesce=True)
+        r.raise_for_status()
+        vectors = (r.json() or {}).get("embeddings") or []
+        if len(vectors) != len(texts):
+            raise ValueError(f"Embedder returned {len(vectors)} vectors for {len(texts)} inputs")
+        return vectors
+
+
+def cosine(a: list[float], b: list[float]) -> float:
+    dot = sum(x * y for x, y in zip(a, b))
+    na = sum(x * x for x in a) ** 0.5
+    nb = sum(y * y for y in b) ** 0.5
+    return dot / (na * nb) if na and nb else 0.0
+
+
+default_embedder = OllamaEmbedder()
@@ -0,0 +1,51 @@
+"""JSON parsing and serialization for responses and upstream bodies.
+
+Uses orjson when it is installed (`pip install orjson`). It parses and serializes several
+times faster than the stdlib and writes bytes directly, so no str-to-UTF-8 copy is needed.
+Without orjson the stdlib is used with the same compact output, so responses differ only
+in how non-ASCII text is escaped.
+"""
+from __future__ import annotations
+
+import importlib.util
+import json
+from typing import Any
+
+import httpx
+from starlette.responses import JSONResponse as _JSONResponse
+
+
+ORJSON = importlib.util.find_spec("orjson") is not None
+if ORJSON:
+    import orjson
+
+
+def loads(data: bytes | str) -> Any:
+    if ORJSON:
+        return orjson.loads(data)
+    return json.loads(data)
+
+
+def dumps(obj: Any) -> bytes:
+    if ORJSON:
+        try:
+            return orjson.dumps(obj, option=orjson.OPT_NON_STR_KEYS)
+        except TypeError:
+            pass  # integers beyond 64 bits and other types orjson rejects
+    return json.dumps(obj, ensure_ascii=False, allow_nan=False, separators=(",", ":")).encode("utf-8")
+
+
+def is_json(r: httpx.Response) -> bool:
+    return r.headers.get("content-type", "").startswith("application/json")
+
+
+def response_json(r: httpx.Response) -> Any:
+    """Parsed upstream body, or ``{"raw": text}`` when it is not JSON."""
+    return loads(r.content) if is_json(r) else {"raw": r.text}
+
+
+class JSONResponse(_JSONResponse):
+    """Drop-in for Starlette's JSONResponse that serializes with ``dumps``."""
+
+    def render(self, content: Any) -> bytes:
+        return dumps(content)
@@ -0,0 +1,270 @@
+"""Background health probing for providers and tool backends.
+
+Each target (Ollama, SearXNG, Brave, DuckDuckGo, cloud LLM APIs) is probed on its own
+schedule and keeps a bounded history of (time, ok, latency). ``/api/status`` serves the
+current snapshot without touching any upstream, and ``/api/status/stream`` pushes a new
+snapshot whenever a target changes state (plus a periodic heartbeat).
+
+Cloud LLM probes are unauthenticated reachability checks against the API origin (any
+response below 500 counts as up), so they cost no quota. Other modules can also feed
+passive observations from real traffic with ``record()``; routing reads ``state()`` and
+``latency()``.
+
+``HEALTH_PROBES`` selects targets by name or group (``ollama``, ``search``, ``llm``),
+``all``, or ``off``. The default, ``auto``, probes Ollama and configured backends
+(SearXNG, Brave with a key) from startup; cloud LLM APIs, DuckDuckGo and the public
+SearXNG fallback are only probed once real traffic has used them (see ``use()``), so an
+idle install makes no outbound calls to third parties.
+
+Ollama bases other than ``OLLAMA_BASE`` come from clients (``watch_ollama``). At most
+``HEALTH_MAX_WATCHED`` of them are probed at a time, the least recently used making room,
+and each is dropped once unused for ``HEALTH_WATCH_TTL`` seconds.
+"""
+from __future__ import annotations
+
+import asyncio
+import os
+import random
+import time
+from collections import deque
+from dataclasses import dataclass, field
+from urllib.parse import urlsplit
+
+import httpx
+
+from . import providers, websearch
+from .upstream import upstreams
+
+
+HEALTH_PROBES = os.getenv("HEALTH_PROBES", "auto").strip().lower()
+HEALTH_INTERVAL = float(os.getenv("HEALTH_INTERVAL", "30"))
+HEALTH_CLOUD_INTERVAL = float(os.getenv("HEALTH_CLOUD_INTERVAL", "120"))
+HEALTH_TIMEOUT = float(os.getenv("HEALTH_TIMEOUT", "5"))
+HEALTH_HISTORY = int(os.getenv("HEALTH_HISTORY", "120"))
+HEALTH_SLOW_MS = float(os.getenv("HEALTH_SLOW_MS", "2000"))
+HEALTH_MAX_WATCHED = max(0, int(os.getenv("HEALTH_MAX_WATCHED", "4")))
+HEALTH_WATCH_TTL = float(os.getenv("HEALTH_WATCH_TTL", "600"))
+HEARTBEAT_SEC = 30.0
+
+OLLAMA_BASE = os.getenv("OLLAMA_BASE", "http://127.0.0.1:11434").rstrip("/")
+
+
+@dataclass
+class Target:
+    name: str
+    group: str                 # llm | search
+    url: str
+    interval: float
+    expect_ok: bool = True     # True: needs a 2xx; False: any response below 500 is "up"
+    on_demand: bool = False    # under ``auto``, probed only after first use
+    transient: bool = False    # client-supplied; dropped after HEALTH_WATCH_TTL without use
+    last_used: float = 0.0
+    history: deque = field(default_factory=lambda: deque(maxlen=HEALTH_HISTORY))
+    error: str | None = None
+
+    def record(self, ok: bool, latency_ms: float, error: str | None = None) -> None:
+        self.history.append((time.time(), ok, round(latency_ms, 1)))
+        self.error = None if ok else (error or "unavailable")
+
+    @property
+    def state(self) -> str:
+        if not self.history:
+            return "unknown"
+        _, ok, ms = self.history[-1]
+        if not ok:
+            return "err"
+        recent = list(self.history)[-5:]
+        if ms > HEALTH_SLOW_MS or not all(r[1] for r in recent):
+            return "warn"
+        return "ok"
+
+    def latency(self, pct: float = 0.5) -> float | None:
+        samples = sorted(ms for _, ok, ms in self.history if ok)
+        if not samples:
+            return None
+        return samples[min(len(samples) - 1, int(pct * len(samples)))]
+
+    def snapshot(self, history: bool = False) -> dict:
+        checked = self.history[-1][0] if self.history else None
+        out = {
+            "group": self.group,
+            "url": self.url,
+            "state": self.state,
+            "latency_ms": self.history[-1][2] if self.history else None,
+            "p50_ms": self.latency(0.5),
+            "p95_ms": self.latency(0.95),
+            "availability": round(sum(1 for r in self.history if r[1]) / len(self.history), 4) if self.history else None,
+            "checked": checked,
+            "error": self.error,
+        }
+        if history:
+            out["history"] = list(self.history)
+        return out
+
+
+class HealthMonitor:
+    def __init__(self, selection: str = HEALTH_PROBES):
+        self.selection = {s.strip() for s in selection.split(",") if s.strip()}
+        self.targets: dict[str, Target] = {}
+        self._tasks: dict[str, asyncio.Task] = {}
+        self._subscribers: set[asyncio.Queue] = set()
+        self._running = False
+        self.used: set[str] = set()
+
+    def enabled(self, target: Target) -> bool:
+        if "off" in self.selection:
+            return False
+        if "all" in self.selection or target.name in self.selection or target.group in self.selection:
+            return True
+        return "auto" in self.selection and (not target.on_demand or target.name in self.used)
+
+    def _start(self, target: Target) -> None:
+        if self._running and target.name not in self._tasks and self.enabled(target):
+            self._tasks[target.name] = asyncio.create_task(self._loop(target))
+
+    def add(self, target: Target) -> Target:
+        existing = self.targets.get(target.name)
+        if existing is not None:
+            return existing
+        self.targets[target.name] = target
+        self._start(target)
+        return target
+
+    def remove(self, name: str) -> None:
+        self.targets.pop(name, None)
+        self.used.discard(name)
+        task = self._tasks.pop(name, None)
+        if task is not None and task is not asyncio.current_task():
+            task.cancel()
+        self._publish()
+
+    def use(self, name: str) -> None:
+        """Note that real traffic went to ``name``; under ``auto`` this starts its probes."""
+        target = self.targets.get(name)
+        if target is None:
+            return
+        target.last_used = time.monotonic()
+        if name not in self.used:
+            self.used.add(name)
+            self._start(target)
+
+    def watch_ollama(self, base: str) -> None:
+        """Track an Ollama base URL the renderer is using (seen on the proxy endpoints)."""
+        base = base.rstrip("/")
+        parts = urlsplit(base)
+        if parts.scheme not in ("http", "https") or not parts.netloc:
+            return
+        name = "ollama" if base == OLLAMA_BASE else f"ollama@{parts.netloc}"
+        if name not in self.targets:
+            if not HEALTH_MAX_WATCHED:
+                return
+            watched = sorted((t for t in self.targets.values() if t.transient), key=lambda t: t.last_used)
+            for old in watched[:max(0, len(watched) - HEALTH_MAX_WATCHED + 1)]:
+                self.remove(old.name)
+            self.add(Target(name, "llm", f"{base}/api/version", HEALTH_INTERVAL, transient=True))
+        self.use(name)
+
+    async def probe(self, target: Target) -> None:
+        started = time.perf_counter()
+        try:
+            r = await upstreams.get(target.url, timeout=httpx.Timeout(HEALTH_TIMEOUT))
+            ok = r.is_success if target.expect_ok else r.status_code < 500
+            error = None if ok else f"HTTP {r.status_code}"
+        except (httpx.RequestError, httpx.InvalidURL) as e:
+            ok, error = False, str(e) or type(e).__name__
+        self.record(target.name, ok, (time.perf_counter() - started) * 1000, error)
+
+    def record(self, name: str, ok: bool, latency_ms: float, error: str | None = None) -> None:
+        target = self.targets.get(name)
+        if target is None:
+            return
+        before = target.state
+        target.record(ok, latency_ms, error)
+        if target.state != before:
+            self._publish()
+
+    def state(self, name: str) -> str:
+        target = self.targets.get(name)
+        return target.state if target is not None else "unknown"
+
+    def latency(self, name: str, pct: float = 0.5) -> float | None:
+        target = self.targets.get(name)
+        return target.latency(pct) if target is not None else None
+
+    async def _loop(self, target: Target) -> None:
+        # Spread the first probes out so they don't all fire at startup
+        await asyncio.sleep(random.uniform(0, min(2.0, target.interval)))
+        while True:
+            if target.transient and time.monotonic() - target.last_used > HEALTH_WATCH_TTL:
+                self.remove(target.name)
+                return
+            await self.probe(target)
+            await asyncio.sleep(target.interval * random.uniform(0.9, 1.1))
+
+    async def start(self) -> None:
+        self._running = True
+        for target in self.targets.values():
+            self._start(target)
+
+    async def stop(self) -> None:
+        self._running = False
+        tasks, self._tasks = list(self._tasks.values()), {}
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+    def lights(self) -> dict:
+        llm = [t.state for t in self.targets.values() if t.group == "llm" and t.history]
+        # One reachable model provider is enough to chat
+        if not llm:
+            modelhub = "unknown"
+        elif "ok" in llm:
+            modelhub = "ok"
+        else:
+            modelhub = "warn" if "warn" in llm else "err"
+        return {"backend": "ok", "modelhub": modelhub}
+
+    def snapshot(self, history: bool = False) -> dict:
+        return {
+            "updated": time.time(),
+            "lights": self.lights(),
+            "services": {name: t.snapshot(history) for name, t in self.targets.items()},
+        }
+
+    def subscribe(self) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue(maxsize=1)
+        self._subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue) -> None:
+        self._subscribers.discard(queue)
+
+    def _publish(self) -> None:
+        for queue in self._subscribers:
+            if queue.full():  # subscribers only need the latest snapshot
+                queue.get_nowait()
+            queue.put_nowait(True)
+
+
+def default_targets(monitor: HealthMonitor) -> None:
+    monitor.add(Target("ollama", "llm", f"{OLLAMA_BASE}/api/version", HEALTH_INTERVAL))
+    if websearch.SEARXNG_URL:
+        monitor.add(Target("searxng", "search", f"{websearch.SEARXNG_URL}/", HEALTH_INTERVAL, expect_ok=False))
+    if websearch.SEARXNG_FALLBACK_URL:
+        # The built-in fallback is a public instance; one set in the environment is the operator's own
+        public = not os.getenv("SEARXNG_FALLBACK_URL", "").strip()
+        monitor.add(Target("searxng_fallback", "search", f"{websearch.SEARXNG_FALLBACK_URL}/", HEALTH_INTERVAL,
+                           expect_ok=False, on_demand=public))
+    if websearch.BRAVE_API_KEY:
+        monitor.add(Target("brave", "search", "https://api.search.brave.com/", HEALTH_CLOUD_INTERVAL, expect_ok=False))
+    monitor.add(Target("duckduckgo", "search", "https://api.duckduckgo.com/", HEALTH_CLOUD_INTERVAL,
+                       expect_ok=False, on_demand=True))
+    # Cloud keys come with each request, so a provider is only known to be in use once called
+    for adapter in providers.registry.adapters():
+        url = adapter.health_url
+        if url:
+            monitor.add(Target(adapter.id, "llm", url, HEALTH_CLOUD_INTERVAL, expect_ok=False, on_demand=True))
+
+
+health_monitor = HealthMonitor()
+default_targets(health_monitor)
@@ -0,0 +1,564 @@
+"""Background jobs for /api/automation/commands/run.
+
+Jobs are rows in SQLite at ``<data>/jobs.sqlite3``, so they survive restarts and every
+worker process sees the same queue. Each process runs ``JOB_CONCURRENCY`` workers. A
+worker claims the next runnable job in one write transaction:
+
+- ``interactive`` jobs go before ``background`` ones (the default), oldest first;
+- a client (by IP address) runs at most ``JOB_MAX_PER_CLIENT`` jobs at once and may
+  queue at most ``JOB_MAX_QUEUED`` jobs, so one client's bulk work cannot take every
+  worker;
+- a failed attempt is retried after an exponential backoff with jitter, up to the job's
+  ``max_attempts``.
+
+Credentials never reach the table: ``apiKey``, ``api_key``, ``Authorization`` and
+``credentials`` entries are stored as ``[redacted]`` and kept in the submitting process's
+memory only. A job that carried any is pinned to that process; if the process goes away
+first, the job fails with ``credentials_lost`` instead of running without them. Jobs are
+only visible to, and cancellable by, the client that submitted them.
+
+Cancelling a queued job takes effect at once. A running job is cancelled by the process
+that runs it, within about a second. Running jobs write a heartbeat; jobs whose process
+died are requeued once the heartbeat is ``JOB_STALE_SEC`` old (pinned jobs, which also
+send heartbeats while queued, fail instead).
+
+Every change sets the row's ``rev`` from a counter in its own one-row table, bumped in the
+same write transaction, so revs only grow (deleting old jobs never hands one out again)
+and commit in order. The SSE feeds read the rows changed since the last ``rev`` they
+sent, so they also see jobs run by other worker processes.
+
+Commands are ``async def handler(ctx: JobContext) -> result``. The built-in ``chat`` (one
+/api/chat body) and ``batch`` (a /api/chat/batch body) commands call models at background
+priority, so they queue behind interactive chat on local models. More commands can be
+registered under the ``zeek_ai.jobs`` entry-point group.
+"""
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import copy
+import os
+import random
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from importlib.metadata import entry_points
+from typing import Any, Awaitable, Callable
+
+from . import fastjson, storage
+from .batch import batch_runner, parse_items
+from .scheduler import BACKGROUND, INTERACTIVE
+
+
+JOB_CONCURRENCY = max(1, int(os.getenv("JOB_CONCURRENCY", "4")))
+JOB_MAX_PER_CLIENT = max(1, int(os.getenv("JOB_MAX_PER_CLIENT", str(max(1, JOB_CONCURRENCY // 2)))))
+JOB_MAX_QUEUED = int(os.getenv("JOB_MAX_QUEUED", "1000"))
+JOB_MAX_ATTEMPTS = max(1, int(os.getenv("JOB_MAX_ATTEMPTS", "3")))
+JOB_MAX_ATTEMPTS_LIMIT = max(JOB_MAX_ATTEMPTS, int(os.getenv("JOB_MAX_ATTEMPTS_LIMIT", "10")))   # most a request may ask for
+JOB_BACKOFF_SEC = float(os.getenv("JOB_BACKOFF_SEC", "2"))
+JOB_MAX_BACKOFF_SEC = float(os.getenv("JOB_MAX_BACKOFF_SEC", "300"))
+JOB_TIMEOUT_SEC = float(os.getenv("JOB_TIMEOUT_SEC", "3600"))
+JOB_RETENTION_DAYS = float(os.getenv("JOB_RETENTION_DAYS", "7"))
+JOB_POLL_SEC = float(os.getenv("JOB_POLL_SEC", "5"))      # idle workers also wake on every local submit
+JOB_HEARTBEAT_SEC = 10.0
+JOB_STALE_SEC = float(os.getenv("JOB_STALE_SEC", "60"))
+PROGRESS_INTERVAL_SEC = 0.5    # progress writes per job are throttled to this
+ENTRY_POINT_GROUP = "zeek_ai.jobs"
+
+QUEUED, RUNNING, SUCCEEDED, FAILED, CANCELLED = "QUEUED", "RUNNING", "SUCCEEDED", "FAILED", "CANCELLED"
+FINISHED = (SUCCEEDED, FAILED, CANCELLED)
+PRIORITY_RANK = {INTERACTIVE: 0, BACKGROUND: 1}
+PRIORITY_NAME = {rank: name for name, rank in PRIORITY_RANK.items()}
+
+COLUMNS = ("id, command, args, client, priority, state, attempts, max_attempts, run_at, created, started, finished,"
+           " progress, message, result, error, cancel, rev")
+SECRET_FIELDS = ("apikey", "api_key", "authorization")
+REDACTED = "[redacted]"
+CREDENTIALS_LOST = {"message": "The job's credentials were held by a worker process that stopped; submit it again",
+                    "code": "credentials_lost"}
+REV = "(SELECT rev FROM job_revs)"      # the rev taken by the current ``_write`` transaction
+
+
+def redact(value: Any, secrets: list, path: tuple = (), credentials: bool = False) -> Any:
+    """A copy of ``value`` with credentials replaced by REDACTED; the originals go to ``secrets`` as (path, value)."""
+    if isinstance(value, dict):
+        out = {}
+        for key, item in value.items():
+            if (isinstance(key, str) and key.lower() in SECRET_FIELDS) or (credentials and isinstance(item, str)):
+                secrets.append(((*path, key), item))
+                out[key] = REDACTED
+            else:
+                # "credentials" maps providers to a key string or to an object with one
+                out[key] = redact(item, secrets, (*path, key), key == "credentials")
+        return out
+    if isinstance(value, list):
+        return [redact(item, secrets, (*path, i)) for i, item in enumerate(value)]
+    return value
+
+
+def restore(value: Any, secrets: list) -> Any:
+    """Undo ``redact``."""
+    value = copy.deepcopy(value)
+    for path, secret in secrets:
+        target = value
+        for key in path[:-1]:
+            target = target[key]
+        target[path[-1]] = secret
+    return value
+
+
+class JobError(Exception):
+    """Raised by handlers; ``retry=False`` fails the job without further attempts."""
+
+    def __init__(self, message: str, code: str = "job_failed", retry: bool = True):
+        super().__init__(message)
+        self.code = code
+        self.retry = retry
+
+
+class JobLimit(Exception):
+    pass
+
+
+@dataclass
+class Command:
+    name: str
+    handler: Callable[["JobContext"], Awaitable[Any]]
+    description: str = ""
+    validate: Callable[[dict], Any] | None = None    # raises ValueError for bad args at submit time
+    prepare: Callable[[dict], dict] | None = None     # normalizes args before they are stored
+
+
+class JobContext:
+    """What a handler sees: its arguments, and a way to report progress."""
+
+    def __init__(self, engine: "JobEngine", job: dict):
+        self.engine = engine
+        self.id = job["id"]
+        self.args = restore(job["args"], engine.secrets.get(job["id"], []))
+        self.attempt = job["attempts"]
+        self._reported = 0.0
+
+    async def progress(self, fraction: float, message: str | None = None) -> None:
+        now = time.monotonic()
+        fraction = min(1.0, max(0.0, float(fraction)))
+        if fraction < 1.0 and now - self._reported < PROGRESS_INTERVAL_SEC:
+            return
+        self._reported = now
+        await asyncio.to_thread(self.engine.store_progress, self.id, fraction, message)
+        self.engine.publish()
+
+
+class JobEngine:
+    def __init__(self, path: str | None = None):
+        self._path = path
+        self._conn = None
+        self._lock = threading.Lock()
+        self.commands: dict[str, Command] = {}
+        self.owner = f"{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self._running: dict[str, asyncio.Task] = {}
+        self.secrets: dict[str, list] = {}     # job id -> redacted credentials, for jobs pinned to this process
+        self._tasks: list[asyncio.Task] = []
+        self._wake = asyncio.Event()
+        self._stopping = False
+        self._subscribers: set[asyncio.Queue] = set()
+        self.counters = {"submitted": 0, "started": 0, "succeeded": 0, "failed": 0, "retried": 0, "cancelled": 0,
+                         "requeued": 0, "rejected": 0, "credentials_lost": 0}
+
+    @property
+    def conn(self):
+        if self._conn is None:
+            conn = storage.connect_sqlite(self._path or storage.data_path("jobs.sqlite3"))
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS jobs ("
+                " id TEXT PRIMARY KEY, command TEXT NOT NULL, args TEXT NOT NULL, client TEXT NOT NULL,"
+                " priority INTEGER NOT NULL, state TEXT NOT NULL, attempts INTEGER NOT NULL DEFAULT 0,"
+                " max_attempts INTEGER NOT NULL, run_at REAL NOT NULL, created REAL NOT NULL, started REAL, finished REAL,"
+                " progress REAL NOT NULL DEFAULT 0, message TEXT, result TEXT, error TEXT, cancel INTEGER NOT NULL DEFAULT 0,"
+                " owner TEXT, pinned TEXT, heartbeat REAL, rev INTEGER NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_queue ON jobs(state, priority, run_at)")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_client ON jobs(client, state)")
+            conn.execute("CREATE INDEX IF NOT EXISTS jobs_rev ON jobs(rev)")
+            conn.execute("CREATE TABLE IF NOT EXISTS job_revs (id INTEGER PRIMARY KEY CHECK (id = 0), rev INTEGER NOT NULL)")
+            conn.execute("INSERT OR IGNORE INTO job_revs (id, rev) SELECT 0, COALESCE(MAX(rev), 0) FROM jobs")
+            self._conn = conn
+        return self._conn
+
+    @contextlib.contextmanager
+    def _write(self):
+        """One write transaction that takes the next rev (``REV`` in its statements)."""
+        with self._lock:
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                self.conn.execute("UPDATE job_revs SET rev = rev + 1")
+                yield self.conn
+                self.conn.execute("COMMIT")
+            except BaseException:
+                self.conn.execute("ROLLBACK")
+                raise
+
+    def current_rev(self) -> int:
+        with self._lock:
+            return self.conn.execute("SELECT rev FROM job_revs").fetchone()[0]
+
+    # --- commands ---
+
+    def register(self, name: str, handler: Callable[[JobContext], Awaitable[Any]], description: str = "",
+                 validate: Callable[[dict], Any] | None = None, prepare: Callable[[dict], dict] | None = None) -> None:
+        self.commands[name] = Command(name, handler, description, validate, prepare)
+
+    def describe_commands(self) -> list[dict]:
+        return [{"id": c.name, "description": c.description} for c in self.commands.values()]
+
+    # --- rows ---
+
+    @staticmethod
+    def _describe(row, full: bool = True) -> dict:
+        job = {"id": row[0], "command": row[1], "client": row[3], "priority": PRIORITY_NAME.get(row[4], BACKGROUND),
+               "status": row[5], "attempts": row[6], "max_attempts": row[7], "run_at": row[8], "created": row[9],
+               "started": row[10], "finished": row[11], "progress": row[12], "message": row[13],
+               "error": fastjson.loads(row[15]) if row[15] else None, "cancel_requested": bool(row[16]), "rev": row[17]}
+        if full:
+            job["args"] = fastjson.loads(row[2])
+            job["result"] = fastjson.loads(row[14]) if row[14] else None
+        return job
+
+    def get(self, job_id: str, client: str, full: bool = True) -> dict | None:
+        """The job, if ``client`` submitted it."""
+        with self._lock:
+            row = self.conn.execute(f"SELECT {COLUMNS} FROM jobs WHERE id = ? AND client = ?", (job_id, client)).fetchone()
+        return self._describe(row, full) if row else None
+
+    def recent(self, client: str, state: str | None = None, limit: int = 50) -> list[dict]:
+        where, params = ("AND state = ?", (state,)) if state else ("", ())
+        with self._lock:
+            rows = self.conn.execute(f"SELECT {COLUMNS} FROM jobs WHERE client = ? {where} ORDER BY created DESC LIMIT ?",
+                                     (client, *params, max(1, limit))).fetchall()
+        return [self._describe(r, full=False) for r in rows]
+
+    def changes(self, after_rev: int, client: str, job_id: str | None = None, limit: int = 200) -> list[dict]:
+        """The client's jobs changed since ``after_rev``, oldest change first (without args and result).
+
+        Rows written in one transaction share a rev; they are returned together even past ``limit``,
+        so a feed that continues from the last rev it saw misses none of them.
+        """
+        where, params = ("AND id = ?", (job_id,)) if job_id else ("", ())
+        with self._lock:
+            last = self.conn.execute(f"SELECT rev FROM jobs WHERE rev > ? AND client = ? {where} ORDER BY rev LIMIT 1 OFFSET ?",
+                                     (after_rev, client, *params, max(0, limit - 1))).fetchone()
+            until, bound = ("AND rev <= ?", (last[0],)) if last else ("", ())
+            rows = self.conn.execute(f"SELECT {COLUMNS} FROM jobs WHERE rev > ? {until} AND client = ? {where} ORDER BY rev",
+                                     (after_rev, *bound, client, *params)).fetchall()
+        return [self._describe(r, full=False) for r in rows]
+
+    def submit(self, command: str, args: dict, client: str, priority: str | None = BACKGROUND,
+               max_attempts: int = JOB_MAX_ATTEMPTS) -> dict:
+        """Queue a job; ValueError for bad args, an unknown priority or ``max_attempts`` out of range."""
+        cmd = self.commands.get(command)
+        if cmd is None:
+            raise KeyError(command)
+        # Unlike chat, a typo must not move bulk work ahead of interactive traffic
+        priority = str(priority or BACKGROUND).strip().lower()
+        if priority not in PRIORITY_RANK:
+            raise ValueError(f"priority must be one of {', '.join(PRIORITY_RANK)}")
+        if not isinstance(max_attempts, int) or isinstance(max_attempts, bool) or not 1 <= max_attempts <= JOB_MAX_ATTEMPTS_LIMIT:
+            raise ValueError(f"max_attempts must be an integer from 1 to {JOB_MAX_ATTEMPTS_LIMIT}")
+        if cmd.validate is not None:
+            cmd.validate(args)
+        if cmd.prepare is not None:
+            args = cmd.prepare(args)
+        secrets: list = []
+        args = redact(args, secrets)
+        job_id = f"job_{uuid.uuid4().hex[:16]}"
+        now = time.time()
+        pinned = self.owner if secrets else None
+        with self._write():
+            queued = self.conn.execute("SELECT COUNT(*) FROM jobs WHERE client = ? AND state IN (?, ?)",
+                                       (client, QUEUED, RUNNING)).fetchone()[0]
+            if queued >= JOB_MAX_QUEUED:
+                self.counters["rejected"] += 1
+                raise JobLimit(f"At most {JOB_MAX_QUEUED} unfinished jobs per client")
+            self.conn.execute(
+                "INSERT INTO jobs (id, command, args, client, priority, state, max_attempts, run_at, created, pinned,"
+                f" heartbeat, rev) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, {REV})",
+                (job_id, command, fastjson.dumps(args).decode(), client, PRIORITY_RANK[priority], QUEUED,
+                 max_attempts, now, now, pinned, now if pinned else None))
+            if secrets:
+                self.secrets[job_id] = secrets
+        self.counters["submitted"] += 1
+        return self.get(job_id, client)
+
+    def claim(self) -> dict | None:
+        """Mark the next runnable job RUNNING for this process and return it."""
+        now = time.time()
+        with self._write():
+            row = self.conn.execute(
+                "SELECT id, client FROM jobs WHERE state = ? AND run_at <= ? AND (pinned IS NULL OR pinned = ?)"
+                " AND client NOT IN (SELECT client FROM jobs WHERE state = ? GROUP BY client HAVING COUNT(*) >= ?)"
+                " ORDER BY priority, run_at LIMIT 1", (QUEUED, now, self.owner, RUNNING, JOB_MAX_PER_CLIENT)).fetchone()
+            if row is not None:
+                self.conn.execute(
+                    "UPDATE jobs SET state = ?, attempts = attempts + 1, started = ?, owner = ?, heartbeat = ?,"
+                    f" progress = 0, message = NULL, rev = {REV} WHERE id = ?",
+                    (RUNNING, now, self.owner, now, row[0]))
+        return self.get(row[0], row[1]) if row is not None else None
+
+    def store_progress(self, job_id: str, fraction: float, message: str | None) -> None:
+        with self._write():
+            self.conn.execute(f"UPDATE jobs SET progress = ?, message = COALESCE(?, message), rev = {REV}"
+                              " WHERE id = ? AND owner = ? AND state = ?", (fraction, message, job_id, self.owner, RUNNING))
+
+    def finish(self, job_id: str, state: str, result: Any = None, error: dict | None = None) -> None:
+        with self._write():
+            self.secrets.pop(job_id, None)
+            self.conn.execute(
+                f"UPDATE jobs SET state = ?, finished = ?, result = ?, error = ?, owner = NULL, rev = {REV}"
+                " WHERE id = ? AND owner = ?",
+                (state, time.time(), fastjson.dumps(result).decode() if result is not None else None,
+                 fastjson.dumps(error).decode() if error else None, job_id, self.owner))
+
+    def retry_later(self, job_id: str, delay: float, error: dict) -> None:
+        with self._write():
+            self.conn.execute(
+                f"UPDATE jobs SET state = ?, run_at = ?, error = ?, owner = NULL, rev = {REV} WHERE id = ? AND owner = ?",
+                (QUEUED, time.time() + delay, fastjson.dumps(error).decode(), job_id, self.owner))
+
+    def release(self, job_id: str) -> None:
+        """Put a job back untouched (this process is shutting down); the attempt does not count."""
+        with self._write():
+            self.conn.execute(f"UPDATE jobs SET state = ?, attempts = attempts - 1, owner = NULL, rev = {REV}"
+                              " WHERE id = ? AND owner = ? AND state = ?", (QUEUED, job_id, self.owner, RUNNING))
+
+    def request_cancel(self, job_id: str, client: str) -> dict | None:
+        with self._write():
+            if self.conn.execute(f"UPDATE jobs SET state = ?, finished = ?, cancel = 1, rev = {REV}"
+                                 " WHERE id = ? AND client = ? AND state = ?",
+                                 (CANCELLED, time.time(), job_id, client, QUEUED)).rowcount:
+                self.secrets.pop(job_id, None)
+            self.conn.execute(f"UPDATE jobs SET cancel = 1, rev = {REV} WHERE id = ? AND client = ? AND state = ? AND cancel = 0",
+                              (job_id, client, RUNNING))
+        return self.get(job_id, client)
+
+    def _cancel_requested(self) -> list[str]:
+        with self._lock:
+            return [r[0] for r in self.conn.execute("SELECT id FROM jobs WHERE owner = ? AND state = ? AND cancel = 1",
+                                                     (self.owner, RUNNING))]
+
+    def _heartbeat(self, job_ids: list[str]) -> None:
+        now = time.time()
+        with self._lock:
+            self.conn.executemany("UPDATE jobs SET heartbeat = ? WHERE id = ? AND owner = ?",
+                                  [(now, job_id, self.owner) for job_id in job_ids])
+            # Queued jobs pinned here, so other processes can tell this one is still alive
+            self.conn.execute("UPDATE jobs SET heartbeat = ? WHERE pinned = ? AND state IN (?, ?)",
+                              (now, self.owner, QUEUED, RUNNING))
+            live = {r[0] for r in self.conn.execute("SELECT id FROM jobs WHERE pinned = ? AND state IN (?, ?)",
+                                                     (self.owner, QUEUED, RUNNING))}
+            # Finished, cancelled by another process or deleted
+            for job_id in set(self.secrets) - live:
+                del self.secrets[job_id]
+
+    def recover(self, stale_sec: float = JOB_STALE_SEC) -> int:
+        """Requeue RUNNING jobs whose process stopped sending heartbeats; drop old finished jobs.
+
+        Jobs pinned to such a process lost their credentials with it and fail instead.
+        """
+        now = time.time()
+        with self._write():
+            stale = self.conn.execute(f"UPDATE jobs SET state = ?, owner = NULL, rev = {REV}"
+                                      " WHERE state = ? AND pinned IS NULL AND heartbeat < ?",
+                                      (QUEUED, RUNNING, now - stale_sec)).rowcount
+            lost = self.conn.execute(
+                f"UPDATE jobs SET state = ?, finished = ?, error = ?, owner = NULL, rev = {REV}"
+                " WHERE state IN (?, ?) AND pinned IS NOT NULL AND pinned != ? AND heartbeat < ?",
+                (FAILED, now, fastjson.dumps(CREDENTIALS_LOST).decode(), QUEUED, RUNNING, self.owner, now - stale_sec)).rowcount
+            self.conn.execute(f"DELETE FROM jobs WHERE state IN ({', '.join('?' * len(FINISHED))}) AND finished < ?",
+                              (*FINISHED, now - JOB_RETENTION_DAYS * 86400))
+        self.counters["requeued"] += stale
+        self.counters["credentials_lost"] += lost
+        return stale + lost
+
+    # --- workers ---
+
+    async def start(self) -> None:
+        if self._tasks:
+            return
+        self._stopping = False
+        # A single process owns every job, so whatever was RUNNING belonged to a previous run
+        if await asyncio.to_thread(self.recover, JOB_STALE_SEC if storage.MULTI_PROCESS else -1.0):
+            self.publish()
+        self._tasks = [asyncio.create_task(self._worker()) for _ in range(JOB_CONCURRENCY)]
+        self._tasks.append(asyncio.create_task(self._supervise()))
+
+    async def stop(self) -> None:
+        self._stopping = True
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def wake(self) -> None:
+        self._wake.set()
+
+    async def _worker(self) -> None:
+        while True:
+            try:
+                job = await asyncio.to_thread(self.claim)
+            except Exception:
+                job = None  # database busy or locked; try again after the poll interval
+            if job is None:
+                self._wake.clear()
+                try:
+                    await asyncio.wait_for(self._wake.wait(), timeout=JOB_POLL_SEC)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            await self._run(job)
+
+    async def _run(self, job: dict) -> None:
+        self.counters["started"] += 1
+        self.publish()
+        cmd = self.commands.get(job["command"])
+        task = asyncio.create_task(cmd.handler(JobContext(self, job))) if cmd else None
+        if task is not None:
+            self._running[job["id"]] = task
+        try:
+            if task is None:
+                raise JobError(f"Unknown command: {job['command']}", "unknown_command", retry=False)
+            result = await asyncio.wait_for(task, timeout=JOB_TIMEOUT_SEC)
+        except asyncio.CancelledError:
+            if self._stopping:
+                await asyncio.to_thread(self.release, job["id"])
+                raise
+            self.counters["cancelled"] += 1
+            await asyncio.to_thread(self.finish, job["id"], CANCELLED, error={"message": "Cancelled", "code": "cancelled"})
+        except Exception as e:
+            await self._failed(job, e)
+        else:
+            self.counters["succeeded"] += 1
+            await asyncio.to_thread(self.finish, job["id"], SUCCEEDED, result)
+        finally:
+            self._running.pop(job["id"], None)
+        self.publish()
+
+    async def _failed(self, job: dict, e: Exception) -> None:
+        if isinstance(e, asyncio.TimeoutError):
+            error = {"message": f"Timed out after {JOB_TIMEOUT_SEC:g}s", "code": "job_timeout"}
+        else:
+            error = {"message": str(e) or type(e).__name__, "code": getattr(e, "code", "job_failed")}
+        if getattr(e, "retry", True) and job["attempts"] < job["max_attempts"]:
+            delay = min(JOB_MAX_BACKOFF_SEC, JOB_BACKOFF_SEC * 2 ** (job["attempts"] - 1))
+            self.counters["retried"] += 1
+            await asyncio.to_thread(self.retry_later, job["id"], delay * random.uniform(0.5, 1.0), error)
+        else:
+            self.counters["failed"] += 1
+            await asyncio.to_thread(self.finish, job["id"], FAILED, error=error)
+
+    async def _supervise(self) -> None:
+        """Act on cancel requests, write heartbeats and requeue jobs of dead processes."""
+        beat = recovered = time.monotonic()
+        while True:
+            await asyncio.sleep(1.0)
+            try:
+                if self._running:
+                    for job_id in await asyncio.to_thread(self._cancel_requested):
+                        task = self._running.get(job_id)
+                        if task is not None:
+                            task.cancel()
+                if (self._running or self.secrets) and time.monotonic() - beat >= JOB_HEARTBEAT_SEC:
+                    beat = time.monotonic()
+                    await asyncio.to_thread(self._heartbeat, list(self._running))
+                if time.monotonic() - recovered >= JOB_STALE_SEC / 2:
+                    recovered = time.monotonic()
+                    if await asyncio.to_thread(self.recover):
+                        self.wake()
+                        self.publish()
+            except Exception:
+                pass  # database busy; next round
+
+    async def cancel(self, job_id: str, client: str) -> dict | None:
+        job = await asyncio.to_thread(self.request_cancel, job_id, client)
+        task = self._running.get(job_id) if job is not None else None
+        if task is not None:
+            task.cancel()
+        self.publish()
+        return job
+
+    # --- change feed ---
+
+    def subscribe(self) -> asyncio.Queue:
+        queue: asyncio.Queue = asyncio.Queue(maxsize=1)
+        self._subscribers.add(queue)
+        return queue
+
+    def unsubscribe(self, queue: asyncio.Queue) -> None:
+        self._subscribers.discard(queue)
+
+    def publish(self) -> None:
+        for queue in self._subscribers:
+            if not queue.full():  # subscribers re-read everything changed since their last rev
+                queue.put_nowait(True)
+
+    def stats(self) -> dict:
+        with self._lock:
+            states = dict(self.conn.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall())
+        return {**self.counters, "states": states, "running_here": len(self._running), "concurrency": JOB_CONCURRENCY,
+                "max_per_client": JOB_MAX_PER_CLIENT, "commands": sorted(self.commands)}
+
+
+# --- built-in commands ---
+
+def _validate_chat(args: dict) -> None:
+    if not (args.get("prompt") or args.get("messages")):
+        raise ValueError("chat needs a /api/chat body with a prompt")
+
+
+async def _run_chat(ctx: JobContext) -> dict:
+    result = await batch_runner.execute(0, {**ctx.args, "priority": BACKGROUND})
+    status = result["status"]
+    if not 200 <= status < 300:
+        message = (result.get("error") or {}).get("message") or f"Upstream returned {status}"
+        # Rate limits and upstream failures are worth another attempt; bad requests are not
+        raise JobError(message, "chat_failed", retry=status == 429 or status >= 500 or status == 0)
+    return result
+
+
+def _prepare_batch(args: dict) -> dict:
+    """JSONL ``input`` becomes ``items``, so credentials inside the lines can be redacted."""
+    if isinstance(args.get("input"), str):
+        return {**{k: v for k, v in args.items() if k != "input"}, "items": parse_items(jsonl=args["input"])}
+    return args
+
+
+def _batch_args(args: dict) -> tuple[list[dict], dict]:
+    defaults = {k: v for k, v in args.items() if k not in ("items", "input", "defaults")}
+    if isinstance(args.get("defaults"), dict):
+        defaults.update(args["defaults"])
+    if isinstance(args.get("input"), str):
+        return parse_items(jsonl=args["input"]), defaults
+    return parse_items(args.get("items")), defaults
+
+
+async def _run_batch(ctx: JobContext) -> dict:
+    items, defaults = _batch_args(ctx.args)
+    results = []
+    async for result in batch_runner.run([{**item, "priority": BACKGROUND} for item in items], defaults):
+        results.append(result)
+        await ctx.progress(len(results) / len(items), f"{len(results)}/{len(items)} items")
+    results.sort(key=lambda r: r["index"])
+    return {"items": len(items), "failed": sum(1 for r in results if not 200 <= r["status"] < 300), "results": results}
+
+
+def _load_plugins(engine: JobEngine) -> None:
+    for ep in entry_points(group=ENTRY_POINT_GROUP):
+        obj = ep.load()
+        engine.register(ep.name, obj, (obj.__doc__ or "").strip().split("\n", 1)[0])
+
+
+job_engine = JobEngine()
+job_engine.register("chat", _run_chat, "One /api/chat request", _validate_chat)
+job_engine.register("batch", _run_batch, "A /api/chat/batch request; progress counts finished items", _batch_args,
+                    _prepare_batch)
+_load_plugins(job_engine)
@@ -1,13 +1,68 @@
+import os
+import sys
+
+if not __package__:
+    # Electron spawns `python backend/app/main.py` (and worker processes re-run it as
+    # `__mp_main__`); make the sibling modules importable as the `app` package so the
+    # relative imports below resolve (PEP 366).
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    __package__ = "app"
+
+import asyncio
+import time
+from contextlib import asynccontextmanager
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi import Request, HTTPException, Depends
-from fastapi.responses import JSONResponse
+from fastapi import Request, HTTPException, Depends, WebSocket, WebSocketDisconnect
+from fastapi.responses import FileResponse, Response, StreamingResponse
 import httpx
-import time
-import os
-import uvicorn
 
-app = FastAPI(title="Zeek AI Backend", version="0.1.0")
+from .upstream import upstreams
+from . import fastjson
+from .fastjson import JSONResponse
+from . import metrics
+from . import providers
+from . import routing
+from .batch import batch_runner, parse_items
+from . import storage
+from . import streaming
+from . import uploads
+from .cache import cacheable, response_cache
+from .ratelimit import client_key, limiter, rate_limit, route_group
+from .rag import ingest as rag_ingest
+from .rag import search as rag_search_mod
+from . import websearch
+from .weather import WeatherError, weather_service
+from .catalog import model_catalog
+from .conversations import ID_PATTERN, context_budget, conversation_store
+from .health import HEARTBEAT_SEC, health_monitor
+from .scheduler import MINI_KEEP_ALIVE, MINI_MODEL, OLLAMA_BASE, SchedulerBusy, keep_alive_value, ollama_scheduler, parse_priority
+from .tokens import CHAT_MIN_OUTPUT_TOKENS, token_counter
+from .windows import context_windows
+from .stt import STT_LANGUAGE, STT_MAX_UPLOAD_MB, SttUnavailable, stt_engine
+from .tts import TTS_MAX_CHARS, TtsUnavailable, UnknownVoice, split_sentences, tts_engine, wav_header
+from .jobs import FINISHED, JOB_MAX_ATTEMPTS, JobLimit, job_engine
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Runs once per worker process; everything opened here is process-local
+    app.state.worker_pid = os.getpid()
+    await health_monitor.start()
+    await ollama_scheduler.start()
+    await job_engine.start()
+    yield
+    await job_engine.stop()
+    await conversation_store.stop()
+    await stt_engine.stop()
+    await tts_engine.stop()
+    await ollama_scheduler.stop()
+    await health_monitor.stop()
+    # Close pooled upstream connections cleanly on shutdown
+    await upstreams.aclose()
+
+
+app = FastAPI(title="Zeek AI Backend", version="0.1.0", lifespan=lifespan, default_response_class=JSONResponse)
 
 # If UI is served via nginx and proxies /api to this backend, CORS is not needed.
 # Leaving permissive CORS for local dev convenience if accessed directly.
@@ -20,29 +75,7 @@ app.add_middleware(
 )
 
 
-# --- Very simple in-memory rate limiter (60 req/min per client IP) ---
-RATE_LIMIT = 300
-WINDOW_SEC = 60
-_rl_counters: dict[str, list[float]] = {}
-
-
-def rate_limit(request: Request):
-    ip = request.client.host if request.client else "anonymous"
-    now = time.time()
-    window_start = now - WINDOW_SEC
-    bucket = _rl_counters.setdefault(ip, [])
-    # drop old timestamps
-    while bucket and bucket[0] < window_start:
-        bucket.pop(0)
-    if len(bucket) >= RATE_LIMIT:
-        raise HTTPException(status_code=429, detail={"error": {"message": "Rate limit exceeded", "code": "rate_limited"}})
-    bucket.append(now)
-
-
 LOCAL_API_TOKEN = os.getenv("LOCAL_API_TOKEN", "").strip()
-BRAVE_API_KEY = os.getenv("BRAVE_API_KEY", "").strip()
-SEARXNG_URL = os.getenv("SEARXNG_URL", "").strip().rstrip('/')
-SEARXNG_FALLBACK_URL = os.getenv("SEARXNG_FALLBACK_URL", "").strip().rstrip('/') or "https://searx.party"
 
 @app.middleware("http")
 async def local_token_guard(request: Request, call_next):
@@ -58,6 +91,49 @@ async def local_token_guard(request: Request, call_next):
     return await call_next(request)
 
 
+async def _accept_websocket(ws: WebSocket) -> bool:
+    """LOCAL_API_TOKEN and rate limits for WebSocket routes, which the HTTP middleware never sees.
+
+    Browsers cannot set headers on a WebSocket handshake, so the token may also be sent as `?token=`.
+    """
+    auth = ws.headers.get("authorization", "")
+    token = auth.split(" ")[-1] if auth else ws.query_params.get("token", "")
+    if LOCAL_API_TOKEN and token != LOCAL_API_TOKEN:
+        await ws.close(code=1008)
+        return False
+    if limiter.check(route_group(ws.url.path), client_key(ws)) > 0:
+        limiter.rejected += 1
+        await ws.close(code=1013)  # try again later
+        return False
+    await ws.accept()
+    return True
+
+
+# Outermost, so token-guard rejections and CORS preflights are counted too
+app.add_middleware(metrics.MetricsMiddleware)
+
+metrics.registry.callback("zeek_chat_cache_events_total", "Response cache lookups and stores.", ("event",),
+                          lambda: response_cache.counters, kind="counter")
+metrics.registry.callback("zeek_model_catalog_events_total", "Model catalog cache events.", ("event",),
+                          lambda: model_catalog.counters, kind="counter")
+metrics.registry.callback("zeek_weather_cache_events_total", "Geocode and weather cache events.", ("event",),
+                          lambda: weather_service.counters, kind="counter")
+metrics.registry.callback("zeek_upstream_coalesce_total", "Coalescable upstream calls and how many shared a flight.", ("event",),
+                          lambda: {k: v for k, v in upstreams.flights.stats().items() if k != "inflight"}, kind="counter")
+metrics.registry.callback("zeek_batch_items_total", "Batch items by outcome.", ("outcome",),
+                          lambda: batch_runner.counters, kind="counter")
+metrics.registry.callback("zeek_ollama_queue_depth", "Local generations waiting for an Ollama slot.", ("priority",),
+                          lambda: ollama_scheduler.stats()["queue_depth"])
+metrics.registry.callback("zeek_health_up", "1 when the last probe of a target succeeded.", ("target",),
+                          lambda: {name: int(t.state in ("ok", "warn")) for name, t in health_monitor.targets.items() if t.history})
+
+
+@app.get("/metrics", include_in_schema=False)
+def prometheus_metrics():
+    """Prometheus text exposition of this worker's counters and histograms."""
+    return Response(content=metrics.registry.render(), media_type=metrics.CONTENT_TYPE)
+
+
 @app.get("/health")
 def health(dep: None = Depends(rate_limit)):
     return {"status": "ok"}
@@ -67,6 +143,44 @@ def api_health(dep: None = Depends(rate_limit)):
     return {"status": "ok"}
 
 
+def _status_snapshot(history: bool = False) -> dict:
+    snap = health_monitor.snapshot(history)
+    try:
+        rag_ingest.rag_store.conn
+        rag = "ok"
+    except Exception:
+        rag = "err"
+    snap["lights"] = {**snap["lights"], "rag": rag}
+    return snap
+
+
+@app.get("/api/status")
+def api_status(history: bool = False, dep: None = Depends(rate_limit)):
+    """Latest background probe results; never calls upstream. `history=true` adds samples."""
+    return {"data": _status_snapshot(history)}
+
+
+@app.get("/api/status/stream")
+async def api_status_stream(request: Request, dep: None = Depends(rate_limit)):
+    """Server-Sent Events: a `status` snapshot on connect, on every state change and as a heartbeat."""
+    queue = health_monitor.subscribe()
+
+    async def events():
+        try:
+            while True:
+                yield streaming.sse_event({"type": "status", **_status_snapshot()})
+                try:
+                    await asyncio.wait_for(queue.get(), timeout=HEARTBEAT_SEC)
+                except asyncio.TimeoutError:
+                    pass
+                if await request.is_disconnected():
+                    break
+        finally:
+            health_monitor.unsubscribe(queue)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=streaming.SSE_HEADERS)
+
+
 @app.get("/api/model_hub/providers")
 def list_providers(dep: None = Depends(rate_limit)):
     return {
@@ -98,267 +212,457 @@ def list_providers(dep: None = Depends(rate_limit)):
 async def ollama_version(base: str, dep: None = Depends(rate_limit)):
     # strip trailing slash
     base = base.rstrip('/')
+    health_monitor.watch_ollama(base)
     url = f"{base}/api/version"
     timeout = httpx.Timeout(5.0)
-    async with httpx.AsyncClient(timeout=timeout) as client:
-        try:
-            r = await client.get(url)
-            return JSONResponse(status_code=r.status_code, content=r.json() if r.headers.get('content-type','').startswith('application/json') else {"raw": r.text})
-        except httpx.RequestError as e:
-            raise HTTPException(status_code=502, detail={"error": {"message": f"Upstream error: {str(e)}", "code": "ollama_upstream"}})
+    try:
+        r = await upstreams.get(url, timeout=timeout)
+        return JSONResponse(status_code=r.status_code, content=fastjson.response_json(r))
+    except httpx.RequestError as e:
+        raise HTTPException(status_code=502, detail={"error": {"message": f"Upstream error: {str(e)}", "code": "ollama_upstream"}})
 
 
 # --- Unified chat endpoint with provider registry ---
 @app.post("/api/chat")
 async def chat_unified(request: Request, dep: None = Depends(rate_limit)):
+    """Single completion. Pass `stream: true` to receive Server-Sent Events instead.
+
+    `raw: false` leaves the upstream payload out of the response; `passthrough: true`
+    relays the provider's own response body unchanged (no normalization, no cache).
+    """
+    body = await request.json()
+    return await _chat(body, stream=bool(body.get('stream')))
+
+
+@app.post("/api/chat/stream")
+async def chat_stream(request: Request, dep: None = Depends(rate_limit)):
+    """Streaming completion as Server-Sent Events (event schema in streaming.py)."""
     body = await request.json()
+    return await _chat(body, stream=True)
+
+
+async def _chat(body: dict, stream: bool = False):
+    if body.get('group'):
+        return await _chat_routed(body, stream)
     provider = (body.get('provider') or '').strip().lower()  # e.g., 'openai','anthropic','googleai','openrouter','ollama','mistral','groq','cohere','azure_openai'
-    model = (body.get('model') or '').strip()
-    prompt = (body.get('prompt') or '').strip()
-    if not provider or not model or not prompt:
+    req = providers.ChatRequest.from_body(body)
+    if not provider or not req.model or not req.prompt:
         raise HTTPException(status_code=400, detail={"error": {"message": "provider, model, and prompt are required", "code": "bad_request"}})
+    adapter = providers.registry.resolve(provider)
+    if adapter is None:
+        raise HTTPException(status_code=400, detail={"error": {"message": f"Unsupported provider: {provider}", "code": "unsupported_provider"}})
 
-    # common inputs
-    api_key = (body.get('apiKey') or '').strip()
-    base = (body.get('base') or '').strip().rstrip('/')
-    azure = body.get('azure') or {}
-
+    # Validate before the cache lookup so bad requests never read cached data
+    adapter.validate(req)
+    health_monitor.use(adapter.id)
     timeout = httpx.Timeout(60.0)
-    async with httpx.AsyncClient(timeout=timeout) as client:
+    priority = parse_priority(body.get('priority'))
+    conversation_id = _conversation_id(body)
+    window = await context_windows.get(adapter, req.model, req.base)
+    if conversation_id:
+        context = await conversation_store.context(
+            conversation_id, context_budget(body.get('context_tokens'), window, req.prompt))
+        req.history = [*context.history, *req.history]
+    # Trim or reject over-long prompts here rather than after an upstream round-trip
+    fitted = providers.fit(adapter, req)
+    if body.get('passthrough') is True:
         try:
-            # Ollama (local)
-            if provider.startswith('ollama'):
-                if not base:
-                    raise HTTPException(status_code=400, detail={"error": {"message": "Ollama base is required", "code": "bad_request"}})
-                url = f"{base}/api/generate"
-                payload = {"model": model, "prompt": prompt, "stream": False}
-                r = await client.post(url, json=payload)
-                data = r.json() if r.headers.get('content-type','').startswith('application/json') else {"raw": r.text}
-                out = (data.get('response') if isinstance(data, dict) else None) or data
-                return JSONResponse(status_code=r.status_code, content={"output": out, "raw": data})
-
-            # Google AI (Gemini)
-            if provider.startswith('google'):
-                if not api_key:
-                    raise HTTPException(status_code=400, detail={"error": {"message": "Google AI apiKey is required", "code": "bad_request"}})
-                # Normalize model (strip 'models/' prefix if present)
-                if model.startswith('models/'):
-                    model = model.split('/', 1)[1]
-                url = f"https://generativelanguage.googleapis.com/v1beta/models/{model}:generateContent?key={api_key}"
-                payload = {"contents": [{"parts": [{"text": prompt}]}]}
-                r = await client.post(url, json=payload, headers={"Content-Type": "application/json"})
-                data = r.json() if r.headers.get('content-type','').startswith('application/json') else {"raw": r.text}
-                text = None
-                try:
-                    text = data["candidates"][0]["content"]["parts"][0]["text"]
-                except Exception:
-                    text = None
-                return JSONResponse(status_code=r.status_code, content={"output": text, "raw": data})
-
-            # OpenRouter
-            if provider.startswith('openrouter'):
-                if not api_key:
-                    raise HTTPException(status_code=400, detail={"error": {"message": "OpenRouter apiKey is required", "code": "bad_request"}})
-                url = "https://openrouter.ai/api/v1/chat/completions"
-                payload = {"model": model, "messages": [{"role": "user", "content": prompt}]}
-                r = await client.post(url, json=payload, headers={"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"})
-                data = r.json() if r.headers.get('content-type','').startswith('application/json') else {"raw": r.text}
-                text = None
-                try:
-                    text = data["choices"][0]["message"]["content"]
-                except Exception:
-                    text = None
-                return JSONResponse(status_code=r.status_code, content={"output": text, "raw": data})
-
-            # OpenAI-compatible
-            if provider.startswith('openai'):
-                if not api_key:
-                    raise HTTPException(status_code=400, detail={"error": {"message": "OpenAI apiKey is required", "code": "bad_request"}})
-                url = "https://api.openai.com/v1/chat/completions"
-                payload = {"model": model, "messages": [{"role": "user", "content": prompt}]}
-                r = await client.post(url, json=payload, headers={"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"})
-                data = r.json() if r.headers.get('content-type','').startswith('application/json') else {"raw": r.text}
-                text = None
-                try:
-                    text = data["choices"][0]["message"]["content"]
-                except Exception:
-                    text = None
-                return JSONResponse(status_code=r.status_code, content={"output": text, "raw": data})
-
-            # Anthropic
-            if provider.startswith('anthropic'):
-                if not api_key:
-                    raise HTTPException(status_code=400, detail={"error": {"message": "Anthropic apiKey is required", "code": "bad_request"}})
-                url = "https://api.anthropic.com/v1/messages"
-                payload = {"model": model, "max_tokens": 1024, "messages": [{"role": "user", "content": prompt}]}
-                r = await client.post(url, json=payload, headers={"x-api-key": api_key, "anthropic-version": "2023-06-01", "Content-Type": "application/json"})
-                data = r.json() if r.headers.get('content-type','').startswith('application/json') else {"raw": r.text}
-                text = None
-                try:
-                    text = data["content"][0]["text"]
-                except Exception:
-                    text = None
-                return JSONResponse(status_code=r.status_code, content={"output": text, "raw": data})
-
-            # Mistral
-            if provider.startswith('mistral'):
-                if not api_key:
-                    raise HTTPException(status_code=400, detail={"error": {"message": "Mistral apiKey is required", "code": "bad_request"}})
-                url = "https://api.mistral.ai/v1/chat/completions"
-                payload = {"model": model, "messages": [{"role": "user", "content": prompt}]}
-                r = await client.post(url, json=payload, headers={"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"})
-                data = r.json() if r.headers.get('content-type','').startswith('application/json') else {"raw": r.text}
-                text = None
-                try:
-                    text = data["choices"][0]["message"]["content"]
-                except Exception:
-                    text = None
-                return JSONResponse(status_code=r.status_code, content={"output": text, "raw": data})
-
-            # Groq (OpenAI-compatible path)
-            if provider.startswith('groq'):
-                if not api_key:
-                    raise HTTPException(status_code=400, detail={"error": {"message": "Groq apiKey is required", "code": "bad_request"}})
-                url = "https://api.groq.com/openai/v1/chat/completions"
-                payload = {"model": model, "messages": [{"role": "user", "content": prompt}]}
-                r = await client.post(url, json=payload, headers={"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"})
-                data = r.json() if r.headers.get('content-type','').startswith('application/json') else {"raw": r.text}
-                text = None
-                try:
-                    text = data["choices"][0]["message"]["content"]
-                except Exception:
-                    text = None
-                return JSONResponse(status_code=r.status_code, content={"output": text, "raw": data})
-
-            # Cohere
-            if provider.startswith('cohere'):
-                if not api_key:
-                    raise HTTPException(status_code=400, detail={"error": {"message": "Cohere apiKey is required", "code": "bad_request"}})
-                url = "https://api.cohere.ai/v2/chat"
-                payload = {"model": model, "messages": [{"role": "user", "content": prompt}]}
-                r = await client.post(url, json=payload, headers={"Authorization": f"Bearer {api_key}", "Content-Type": "application/json"})
-                data = r.json() if r.headers.get('content-type','').startswith('application/json') else {"raw": r.text}
-                text = None
-                try:
-                    text = data["text"] if isinstance(data, dict) and "text" in data else (data.get("output") if isinstance(data, dict) else None)
-                except Exception:
-                    text = None
-                return JSONResponse(status_code=r.status_code, content={"output": text, "raw": data})
-
-            # Azure OpenAI
-            if provider.startswith('azure') or provider.startswith('azure_openai'):
-                # expects azure = { endpoint, apiKey, deployment, apiVersion }
-                az_ep = (azure.get('endpoint') if isinstance(azure, dict) else '') or ''
-                az_key = (azure.get('apiKey') if isinstance(azure, dict) else '') or api_key
-                az_dep = (azure.get('deployment') if isinstance(azure, dict) else '') or model
-                az_ver = (azure.get('apiVersion') if isinstance(azure, dict) else '') or '2025-03-01-preview'
-                if not az_ep or not az_key or not az_dep:
-                    raise HTTPException(status_code=400, detail={"error": {"message": "Azure endpoint, apiKey and deployment are required", "code": "bad_request"}})
-                url = f"{az_ep.rstrip('/')}/openai/deployments/{az_dep}/chat/completions?api-version={az_ver}"
-                payload = {"messages": [{"role": "user", "content": prompt}]}
-                r = await client.post(url, json=payload, headers={"api-key": az_key, "Content-Type": "application/json"})
-                data = r.json() if r.headers.get('content-type','').startswith('application/json') else {"raw": r.text}
-                text = None
-                try:
-                    text = data["choices"][0]["message"]["content"]
-                except Exception:
-                    text = None
-                return JSONResponse(status_code=r.status_code, content={"output": text, "raw": data})
-
-            raise HTTPException(status_code=400, detail={"error": {"message": f"Unsupported provider: {provider}", "code": "unsupported_provider"}})
+            return await providers.passthrough(adapter, req, timeout, stream, {"X-Cache": "BYPASS", **fitted.headers()}, priority)
+        except SchedulerBusy as e:
+            raise _ollama_busy(e)
         except httpx.RequestError as e:
             raise HTTPException(status_code=502, detail={"error": {"message": f"Upstream error: {str(e)}", "code": "chat_upstream"}})
+    include_raw = body.get('raw') is not False
+    cache_mode = (body.get('cache') if isinstance(body.get('cache'), str) else '').strip().lower()
+    cached = await response_cache.lookup(adapter.id, req, cache_mode)
+    extra_headers = {**fitted.headers(), **({"X-Conversation-Id": conversation_id} if conversation_id else {})}
+    if cached.hit:
+        headers = {"X-Cache": cached.source, **extra_headers}
+        await _remember(conversation_id, req.prompt, cached.value.get("output"))
+        if stream:
+            return streaming.replay_response(cached.value.get("output") or "", provider, req.model, headers)
+        content = _with_raw(cached.value, include_raw)
+        if conversation_id:
+            content = {**content, "conversation": context.describe(conversation_id)}
+        return JSONResponse(status_code=200, content=content, headers=headers)
+
+    try:
+        if stream:
+            async def store_stream(text: str, done: dict):
+                await response_cache.store(cached, {"output": text, "raw": {"streamed": True, **done}})
+                await _remember(conversation_id, req.prompt, text)
+            return await providers.stream(adapter, req, provider, timeout, on_complete=store_stream,
+                                          response_headers={"X-Cache": cached.source, **extra_headers}, priority=priority)
+        r, data = await providers.complete(adapter, req, timeout, priority, coalesce=cacheable(req, cache_mode))
+        content = {"output": adapter.extract_text(data), "raw": data}
+        if 200 <= r.status_code < 300 and isinstance(content["output"], str) and content["output"]:
+            await response_cache.store(cached, content)
+            await _remember(conversation_id, req.prompt, content["output"])
+        # A new dict: the cache keeps `content` as stored
+        content = {**_with_raw(content, include_raw), "usage": providers.usage(adapter, data)}
+        if conversation_id:
+            content["conversation"] = context.describe(conversation_id)
+        return JSONResponse(status_code=r.status_code, content=content, headers={"X-Cache": cached.source, **extra_headers})
+    except SchedulerBusy as e:
+        raise _ollama_busy(e)
+    except httpx.RequestError as e:
+        raise HTTPException(status_code=502, detail={"error": {"message": f"Upstream error: {str(e)}", "code": "chat_upstream"}})
+
+
+def _ollama_busy(e: SchedulerBusy) -> HTTPException:
+    """The local scheduler had no slot in time: a retryable 503, not an upstream failure."""
+    return HTTPException(status_code=503, detail={"error": {"message": str(e), "code": "ollama_busy"}},
+                         headers={"Retry-After": str(e.retry_after)})
+
+
+def _conversation_id(body: dict) -> str | None:
+    """Validated `conversation_id`, or None for a stateless request."""
+    conversation_id = body.get('conversation_id')
+    if conversation_id is None or conversation_id == '':
+        return None
+    if not isinstance(conversation_id, str) or not ID_PATTERN.match(conversation_id):
+        raise HTTPException(status_code=400, detail={"error": {"message": "conversation_id must be 1-64 letters, digits, '-' or '_'", "code": "bad_request"}})
+    if body.get('passthrough') is True:
+        raise HTTPException(status_code=400, detail={"error": {"message": "passthrough replies cannot be added to a conversation", "code": "bad_request"}})
+    return conversation_id
+
+
+async def _remember(conversation_id: str | None, prompt: str, reply) -> None:
+    if conversation_id and isinstance(reply, str) and reply:
+        await conversation_store.remember(conversation_id, prompt, reply)
+
+
+def _with_raw(content: dict, include_raw: bool) -> dict:
+    return content if include_raw else {k: v for k, v in content.items() if k != "raw"}
+
+
+def _route_headers(routed: routing.Routed, source: str) -> dict:
+    headers = {"X-Cache": source, "X-Route-Attempts": str(len(routed.attempts))}
+    if routed.candidate is not None:
+        headers["X-Provider"] = routed.candidate.adapter.id
+        headers["X-Model"] = routed.candidate.member.model
+    return headers
+
+
+async def _chat_routed(body: dict, stream: bool = False):
+    """/api/chat with a model group: latency-aware member choice, failover and hedging."""
+    shared_req = providers.ChatRequest.from_body(body)  # also validates `messages`
+    prompt = shared_req.prompt
+    if not prompt:
+        raise HTTPException(status_code=400, detail={"error": {"message": "group and prompt are required", "code": "bad_request"}})
+    try:
+        group = routing.model_router.resolve(body['group'])
+    except KeyError:
+        raise HTTPException(status_code=400, detail={"error": {"message": f"Unknown model group: {body['group']}", "code": "unknown_group"}})
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail={"error": {"message": str(e), "code": "bad_request"}})
+    cache_mode = (body.get('cache') if isinstance(body.get('cache'), str) else '').strip().lower()
+    timeout = httpx.Timeout(60.0)
+    hedge_ms = body.get('hedge_ms')
+    priority = parse_priority(body.get('priority'))
+    include_raw = body.get('raw') is not False
+    conversation_id = _conversation_id(body)
+    history = None
+    conversation_headers = {"X-Conversation-Id": conversation_id} if conversation_id else {}
+    if conversation_id:
+        # One history for every member, sized for the smallest context window in the group
+        members = [(m, providers.registry.resolve(m.provider)) for m in group.members]
+        reqs = [(a, providers.ChatRequest.from_body({**routing.model_router.credentials(body, m, a), "model": m.model}))
+                for m, a in members if a]
+        windows = await asyncio.gather(*(context_windows.get(a, r.model, r.base) for a, r in reqs))
+        context = await conversation_store.context(
+            conversation_id, context_budget(body.get('context_tokens'), min(filter(None, windows), default=None), prompt))
+        history = context.history
+
+    # Answers are cached per member; a hit for the currently preferred member is served as-is
+    candidates = routing.model_router.candidates(group, body, stream=stream, history=history)
+    if candidates:
+        best = candidates[0]
+        cached = await response_cache.lookup(best.adapter.id, best.req, cache_mode)
+        if cached.hit:
+            headers = {"X-Cache": cached.source, "X-Provider": best.adapter.id, "X-Model": best.member.model, **conversation_headers}
+            await _remember(conversation_id, prompt, cached.value.get("output"))
+            if stream:
+                return streaming.replay_response(cached.value.get("output") or "", best.member.provider, best.member.model, headers)
+            content = {**_with_raw(cached.value, include_raw), "provider": best.adapter.id, "model": best.member.model}
+            if conversation_id:
+                content["conversation"] = context.describe(conversation_id)
+            return JSONResponse(status_code=200, content=content, headers=headers)
+    store_mode = "refresh" if cacheable(shared_req, cache_mode) else "bypass"
+
+    try:
+        if stream:
+            def store_stream(c: routing.Candidate):
+                async def store(text: str, done: dict):
+                    lookup = await response_cache.lookup(c.adapter.id, c.req, store_mode)
+                    await response_cache.store(lookup, {"output": text, "raw": {"streamed": True, **done}})
+                    await _remember(conversation_id, prompt, text)
+                return store
+            source = "BYPASS" if store_mode == "bypass" else "MISS"
+            routed = await routing.model_router.stream(group, body, timeout, store_stream,
+                                                       lambda c: {"X-Cache": source, "X-Provider": c.adapter.id, "X-Model": c.member.model,
+                                                                  **conversation_headers},
+                                                       priority=priority, history=history)
+            return routed.response
+        routed = await routing.model_router.complete(group, body, timeout,
+                                                     float(hedge_ms) if isinstance(hedge_ms, (int, float)) else None, priority, history)
+    except routing.RouteError as e:
+        status = 502 if e.attempts else 400
+        raise HTTPException(status_code=status, detail={"error": {"message": str(e), "code": "chat_upstream" if e.attempts else "bad_request",
+                                                                  "attempts": [a.describe() for a in e.attempts]}})
+    c = routed.candidate
+    r, data = routed.response
+    content = {"output": c.adapter.extract_text(data) if r.is_success else None, "raw": data,
+               "provider": c.adapter.id, "model": c.member.model,
+               "route": {"group": group.name, "attempts": [a.describe() for a in routed.attempts]}}
+    if routed.ok:
+        lookup = await response_cache.lookup(c.adapter.id, c.req, store_mode)
+        await response_cache.store(lookup, {"output": content["output"], "raw": data})
+        await _remember(conversation_id, prompt, content["output"])
+    content = {**_with_raw(content, include_raw), "usage": providers.usage(c.adapter, data)}
+    if conversation_id:
+        content["conversation"] = context.describe(conversation_id)
+    return JSONResponse(status_code=r.status_code, content=content,
+                        headers={**_route_headers(routed, "BYPASS" if store_mode == "bypass" else "MISS"), **conversation_headers})
+
+
+@app.get("/api/chat/groups")
+def chat_groups(dep: None = Depends(rate_limit)):
+    """Configured model groups and the router's per-member latency/error stats."""
+    return {"data": routing.model_router.describe()}
+
+
+BATCH_FIELDS = ("items", "input", "defaults", "stream", "native")
+
+
+def _batch_request(body: dict) -> tuple[list[dict], dict]:
+    """Items plus shared defaults: top-level chat fields, overridden by an explicit `defaults` object."""
+    defaults = {k: v for k, v in body.items() if k not in BATCH_FIELDS}
+    if isinstance(body.get('defaults'), dict):
+        defaults.update(body['defaults'])
+    try:
+        if isinstance(body.get('input'), str):
+            return parse_items(jsonl=body['input']), defaults
+        return parse_items(body.get('items')), defaults
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail={"error": {"message": str(e), "code": "bad_request"}})
+
+
+@app.post("/api/chat/batch")
+async def chat_batch(request: Request, dep: None = Depends(rate_limit)):
+    """Many completions in one request; results stream back as NDJSON lines as they complete.
+
+    Send `stream: false` to get `{"data": [...]}` in input order instead.
+    """
+    body = await request.json()
+    items, defaults = _batch_request(body)
+    if body.get('stream', True) is False:
+        results = [r async for r in batch_runner.run(items, defaults)]
+        return {"data": sorted(results, key=lambda r: r["index"])}
+
+    async def lines():
+        async for result in batch_runner.run(items, defaults):
+            yield fastjson.dumps(result) + b"\n"
+    return StreamingResponse(lines(), media_type="application/x-ndjson", headers={"Cache-Control": "no-cache"})
+
+
+@app.post("/api/chat/batch/jobs", status_code=202)
+async def chat_batch_job_create(request: Request, dep: None = Depends(rate_limit)):
+    """Background batch job from `items` or JSONL `input`; `native: true` uses provider batch APIs where available."""
+    body = await request.json()
+    items, defaults = _batch_request(body)
+    job = await batch_runner.submit(items, defaults, native=bool(body.get('native')))
+    return {"data": job.describe()}
+
+
+async def _batch_job(job_id: str):
+    job = await batch_runner.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail={"error": {"message": "Batch job not found", "code": "not_found"}})
+    return job
+
+
+@app.get("/api/chat/batch/jobs/{job_id}")
+async def chat_batch_job(job_id: str, dep: None = Depends(rate_limit)):
+    return {"data": (await _batch_job(job_id)).describe()}
+
+
+@app.get("/api/chat/batch/jobs/{job_id}/results")
+async def chat_batch_job_results(job_id: str, dep: None = Depends(rate_limit)):
+    """Results written so far, one JSON line per item in completion order."""
+    job = await _batch_job(job_id)
+    if not os.path.exists(job.output_path):
+        return Response(content=b"", media_type="application/x-ndjson")
+    return FileResponse(job.output_path, media_type="application/x-ndjson", filename=f"{job.id}.jsonl")
+
+
+@app.delete("/api/chat/batch/jobs/{job_id}")
+async def chat_batch_job_cancel(job_id: str, dep: None = Depends(rate_limit)):
+    await _batch_job(job_id)
+    job = await batch_runner.cancel(job_id)
+    return {"data": job.describe()}
+
+
+@app.get("/api/chat/batch/stats")
+def chat_batch_stats(dep: None = Depends(rate_limit)):
+    return {"data": batch_runner.stats()}
+
+
+# --- Conversations (server-side history for /api/chat `conversation_id`) ---
+@app.post("/api/conversations", status_code=201)
+async def conversation_create(request: Request, dep: None = Depends(rate_limit)):
+    body = await request.json() if await request.body() else {}
+    conversation_id = body.get('id') or None
+    if conversation_id is not None and not (isinstance(conversation_id, str) and ID_PATTERN.match(conversation_id)):
+        raise HTTPException(status_code=400, detail={"error": {"message": "id must be 1-64 letters, digits, '-' or '_'", "code": "bad_request"}})
+    title = body.get('title') if isinstance(body.get('title'), str) else ''
+    return {"data": await asyncio.to_thread(conversation_store.create, conversation_id, title)}
+
+
+@app.get("/api/conversations")
+def conversation_list(limit: int = 50, dep: None = Depends(rate_limit)):
+    """Most recently updated conversations first."""
+    return {"data": conversation_store.recent(limit)}
+
+
+@app.get("/api/conversations/stats")
+def conversation_stats(dep: None = Depends(rate_limit)):
+    return {"data": conversation_store.stats()}
+
+
+@app.get("/api/conversations/{conversation_id}")
+def conversation_get(conversation_id: str, after: int = 0, limit: int = 500, dep: None = Depends(rate_limit)):
+    """Conversation metadata and its messages; `?after=<seq>` returns only newer ones."""
+    meta = conversation_store.get(conversation_id)
+    if meta is None:
+        raise HTTPException(status_code=404, detail={"error": {"message": "Conversation not found", "code": "not_found"}})
+    return {"data": {**meta, "items": conversation_store.messages(conversation_id, after, limit)}}
+
+
+@app.delete("/api/conversations/{conversation_id}")
+def conversation_delete(conversation_id: str, dep: None = Depends(rate_limit)):
+    if not conversation_store.delete(conversation_id):
+        raise HTTPException(status_code=404, detail={"error": {"message": "Conversation not found", "code": "not_found"}})
+    return {"data": {"id": conversation_id, "status": "DELETED"}}
+
+
+# --- Token counting ---
+@app.post("/api/tokens/count")
+async def tokens_count(request: Request, dep: None = Depends(rate_limit)):
+    """Tokens of a chat request (`provider`, `model`, `prompt`/`system`/`messages`) or of a plain `text`.
+
+    Counted locally with the model's tokenizer, or estimated when none is available.
+    `exact: true` asks the provider's own counting endpoint instead (Anthropic, Google AI).
+    """
+    body = await request.json()
+    provider = (body.get('provider') or '').strip().lower()
+    adapter = providers.registry.resolve(provider) if provider else None
+    if provider and adapter is None:
+        raise HTTPException(status_code=400, detail={"error": {"message": f"Unsupported provider: {provider}", "code": "unsupported_provider"}})
+    text = body.get('text') if isinstance(body.get('text'), str) else None
+    req = providers.ChatRequest.from_body(body)
+    if text is None and not req.prompt:
+        raise HTTPException(status_code=400, detail={"error": {"message": "prompt, messages or text is required", "code": "bad_request"}})
+    provider_id = adapter.id if adapter else ""
+    tok = await token_counter.prepare(provider_id, req.model)
+    method = tok.name if tok else "estimate"
+    if text is not None:
+        tokens = token_counter.count(text, provider_id, tok)
+    else:
+        tokens, _ = token_counter.count_request(provider_id, req, tok)
+
+    if body.get('exact') is True:
+        call = adapter.count_call(req) if adapter is not None and text is None else None
+        if call is None:
+            raise HTTPException(status_code=400, detail={"error": {"message": "exact counts need a chat request for a provider with a token counting endpoint", "code": "bad_request"}})
+        adapter.validate(req)
+        try:
+            r = await upstreams.post(call.url, json=call.payload, headers=call.headers, timeout=httpx.Timeout(15.0))
+        except httpx.RequestError as e:
+            raise HTTPException(status_code=502, detail={"error": {"message": f"Upstream error: {str(e)}", "code": "tokens_upstream"}})
+        data = fastjson.response_json(r)
+        counted = adapter.count_of(data) if r.is_success else None
+        if not isinstance(counted, int):
+            raise HTTPException(status_code=r.status_code if r.status_code >= 400 else 502,
+                                detail={"error": {"message": "Token count failed", "code": "tokens_upstream", "raw": data}})
+        tokens, method = counted, "provider"
+
+    window = await context_windows.get(adapter, req.model, req.base) if adapter else None
+    result = {"tokens": tokens, "method": method, "provider": provider_id or None, "model": req.model or None, "context_window": window}
+    if window:
+        result["remaining"] = max(0, window - tokens)
+        result["fits"] = tokens + min(req.max_tokens or CHAT_MIN_OUTPUT_TOKENS, CHAT_MIN_OUTPUT_TOKENS) <= window
+    return {"data": result}
+
+
+@app.get("/api/tokens/stats")
+def tokens_stats(dep: None = Depends(rate_limit)):
+    return {"data": {**token_counter.stats(), "windows": context_windows.stats()}}
+
+
+@app.get("/api/upstream/stats")
+async def upstream_stats(dep: None = Depends(rate_limit)):
+    """Pooled upstream origins and request-coalescing counters."""
+    return {"data": upstreams.stats()}
+
+
+@app.get("/api/cache/stats")
+def cache_stats(dep: None = Depends(rate_limit)):
+    return {"data": response_cache.stats()}
+
+
+@app.delete("/api/cache")
+def cache_clear(dep: None = Depends(rate_limit)):
+    response_cache.clear()
+    return {"data": {"status": "CLEARED"}}
+
+
+@app.get("/api/chat/providers")
+def chat_providers(dep: None = Depends(rate_limit)):
+    """Registered provider adapters and their declared capabilities."""
+    return {"data": providers.registry.describe()}
+
 
 # --- Google AI proxy (Gemini) ---
 @app.post("/api/googleai/generate")
 async def google_ai_generate(request: Request, dep: None = Depends(rate_limit)):
     body = await request.json()
-    api_key = (body.get('apiKey') or '').strip()
-    model = (body.get('model') or '').strip()
-    prompt = (body.get('prompt') or '').strip()
-    if not api_key or not model or not prompt:
+    req = providers.ChatRequest.from_body(body)
+    if not req.api_key or not req.model or not req.prompt:
         raise HTTPException(status_code=400, detail={"error": {"message": "apiKey, model, and prompt are required", "code": "bad_request"}})
-    # Normalize model (strip 'models/' prefix if present)
-    if model.startswith('models/'):
-        model = model.split('/', 1)[1]
-    url = f"https://generativelanguage.googleapis.com/v1beta/models/{model}:generateContent?key={api_key}"
-    payload = {"contents": [{"parts": [{"text": prompt}]}]}
+    adapter = providers.registry.get("google")
     timeout = httpx.Timeout(60.0)
-    async with httpx.AsyncClient(timeout=timeout) as client:
-        try:
-            r = await client.post(url, json=payload, headers={"Content-Type": "application/json"})
-            if r.headers.get('content-type','').startswith('application/json'):
-                data = r.json()
-                text = None
-                try:
-                    text = data["candidates"][0]["content"]["parts"][0]["text"]
-                except Exception:
-                    text = None
-                return JSONResponse(status_code=r.status_code, content={"output": text, "raw": data})
-            else:
-                return JSONResponse(status_code=r.status_code, content={"raw": r.text})
-        except httpx.RequestError as e:
-            raise HTTPException(status_code=502, detail={"error": {"message": f"Upstream error: {str(e)}", "code": "googleai_upstream"}})
+    try:
+        r, data = await providers.complete(adapter, req, timeout)
+        if r.headers.get('content-type','').startswith('application/json'):
+            return JSONResponse(status_code=r.status_code, content={"output": adapter.extract_text(data), "raw": data})
+        else:
+            return JSONResponse(status_code=r.status_code, content={"raw": r.text})
+    except httpx.RequestError as e:
+        raise HTTPException(status_code=502, detail={"error": {"message": f"Upstream error: {str(e)}", "code": "googleai_upstream"}})
 
 @app.get("/api/googleai/models")
-async def google_ai_models(apiKey: str, dep: None = Depends(rate_limit)):
-    url = f"https://generativelanguage.googleapis.com/v1beta/models?key={apiKey}"
-    timeout = httpx.Timeout(20.0)
-    async with httpx.AsyncClient(timeout=timeout) as client:
-        try:
-            r = await client.get(url)
-            if r.headers.get('content-type','').startswith('application/json'):
-                data = r.json()
-                names = []
-                try:
-                    for m in (data.get('models') or []):
-                        if isinstance(m, dict) and m.get('name'):
-                            names.append(m['name'])
-                except Exception:
-                    names = []
-                return JSONResponse(status_code=r.status_code, content={"models": names, "raw": data})
-            else:
-                return JSONResponse(status_code=r.status_code, content={"raw": r.text})
-        except httpx.RequestError as e:
-            raise HTTPException(status_code=502, detail={"error": {"message": f"Upstream error: {str(e)}", "code": "googleai_upstream"}})
+async def google_ai_models(request: Request, apiKey: str, raw: bool = False, refresh: bool = False, dep: None = Depends(rate_limit)):
+    return await _catalog_response(request, "google", apiKey, raw, refresh, "googleai_upstream")
 
 
 # --- OpenRouter proxy ---
 @app.post("/api/openrouter/generate")
 async def openrouter_generate(request: Request, dep: None = Depends(rate_limit)):
     body = await request.json()
-    api_key = (body.get('apiKey') or '').strip()
-    model = (body.get('model') or '').strip()
-    prompt = (body.get('prompt') or '').strip()
-    if not api_key or not model or not prompt:
+    req = providers.ChatRequest.from_body(body)
+    if not req.api_key or not req.model or not req.prompt:
         raise HTTPException(status_code=400, detail={"error": {"message": "apiKey, model, and prompt are required", "code": "bad_request"}})
-    url = "https://openrouter.ai/api/v1/chat/completions"
-    payload = {
-        "model": model,
-        "messages": [
-            {"role": "user", "content": prompt}
-        ]
-    }
-    headers = {
-        "Authorization": f"Bearer {api_key}",
-        "Content-Type": "application/json"
-    }
+    adapter = providers.registry.get("openrouter")
     timeout = httpx.Timeout(60.0)
-    async with httpx.AsyncClient(timeout=timeout) as client:
-        try:
-            r = await client.post(url, json=payload, headers=headers)
-            if r.headers.get('content-type','').startswith('application/json'):
-                data = r.json()
-                text = None
-                try:
-                    text = data["choices"][0]["message"]["content"]
-                except Exception:
-                    text = None
-                return JSONResponse(status_code=r.status_code, content={"output": text, "raw": data})
-            else:
-                return JSONResponse(status_code=r.status_code, content={"raw": r.text})
-        except httpx.RequestError as e:
-            raise HTTPException(status_code=502, detail={"error": {"message": f"Upstream error: {str(e)}", "code": "openrouter_upstream"}})
+    try:
+        r, data = await providers.complete(adapter, req, timeout)
+        if r.headers.get('content-type','').startswith('application/json'):
+            return JSONResponse(status_code=r.status_code, content={"output": adapter.extract_text(data), "raw": data})
+        else:
+            return JSONResponse(status_code=r.status_code, content={"raw": r.text})
+    except httpx.RequestError as e:
+        raise HTTPException(status_code=502, detail={"error": {"message": f"Upstream error: {str(e)}", "code": "openrouter_upstream"}})
 
 
 # --- Tools: Live Weather (Open-Meteo) ---
@@ -369,244 +673,326 @@ async def tools_weather(request: Request, location: str | None = None, dep: None
     Docs: https://open-meteo.com/
     """
     timeout = httpx.Timeout(10.0)
-    async with httpx.AsyncClient(timeout=timeout) as client:
+    try:
+        place = (location or "").strip()
+        if place:
+            # Geocode (cached; Open-Meteo, then Nominatim)
+            lat, lon, place = await weather_service.geocode(place, timeout)
+            if lat is None or lon is None:
+                raise HTTPException(status_code=404, detail={"error": {"message": f"Location not found: {place}", "code": "location_not_found"}})
+        else:
+            # Default to a safe coordinate (Mocksville, NC approx.)
+            lat = 35.894
+            lon = -80.561
+            place = "Mocksville, NC"
+
         try:
-            lat = None
-            lon = None
-            place = (location or "").strip()
-            if place:
-                # Geocode location via Open-Meteo, then fall back to Nominatim (OSM) if needed
-                geo_url = "https://geocoding-api.open-meteo.com/v1/search"
-                gr = await client.get(geo_url, params={"name": place, "count": 1})
-                if gr.status_code == 200 and gr.headers.get("content-type", "").startswith("application/json"):
-                    g = gr.json()
-                    if g and g.get("results"):
-                        r0 = g["results"][0]
-                        lat = r0.get("latitude")
-                        lon = r0.get("longitude")
-                        if r0.get("name") and r0.get("country"):
-                            place = f"{r0['name']}, {r0['country']}"
-                
-                if lat is None or lon is None:
-                    # Fallback: Nominatim (OpenStreetMap) — public service, be kind and include UA
-                    try:
-                        nom_url = "https://nominatim.openstreetmap.org/search"
-                        nr = await client.get(nom_url, params={"q": place, "format": "json", "limit": 1}, headers={"User-Agent": "zeek-ai/0.1 (desktop)"})
-                        if nr.status_code == 200 and nr.headers.get("content-type", "").startswith("application/json"):
-                            nj = nr.json() or []
-                            if isinstance(nj, list) and nj:
-                                lat = float(nj[0].get("lat")) if nj[0].get("lat") else None
-                                lon = float(nj[0].get("lon")) if nj[0].get("lon") else None
-                                disp = nj[0].get("display_name")
-                                if disp:
-                                    place = disp
-                    except Exception:
-                        pass
-                if lat is None or lon is None:
-                    raise HTTPException(status_code=404, detail={"error": {"message": f"Location not found: {place}", "code": "location_not_found"}})
-            else:
-                # Default to a safe coordinate (Mocksville, NC approx.)
-                lat = 35.894
-                lon = -80.561
-                place = "Mocksville, NC"
-
-            wx_url = "https://api.open-meteo.com/v1/forecast"
-            wr = await client.get(wx_url, params={
-                "latitude": lat,
-                "longitude": lon,
-                "current_weather": True,
-                "temperature_unit": "fahrenheit"
-            })
-            if wr.status_code != 200:
-                raise HTTPException(status_code=wr.status_code, detail={"error": {"message": f"Weather fetch failed ({wr.status_code})", "code": "weather_error"}})
-            w = wr.json() or {}
-            cw = (w.get("current_weather") or {})
-            temp_f = cw.get("temperature")
-            wind = cw.get("windspeed")
-            code = cw.get("weathercode")
-            time_iso = cw.get("time")
-            # Minimal code -> description mapping (subset)
-            desc_map = {
-                0: "Clear",
-                1: "Mainly clear",
-                2: "Partly cloudy",
-                3: "Overcast",
-                45: "Fog",
-                48: "Depositing rime fog",
-                51: "Light drizzle",
-                61: "Light rain",
-                63: "Rain",
-                65: "Heavy rain",
-                71: "Snow",
-                80: "Rain showers",
-            }
-            desc = desc_map.get(code, "Conditions available")
-            msg = f"Current weather in {place}: {temp_f}°F, {desc}, wind {wind} mph. Time: {time_iso}."
-            return {"message": msg, "place": place, "current": cw}
-        except httpx.RequestError as e:
-            raise HTTPException(status_code=502, detail={"error": {"message": f"Upstream error: {str(e)}", "code": "weather_upstream"}})
+            cw = await weather_service.current(lat, lon, timeout)
+        except WeatherError as e:
+            raise HTTPException(status_code=e.status_code, detail={"error": {"message": str(e), "code": "weather_error"}})
+        temp_f = cw.get("temperature")
+        wind = cw.get("windspeed")
+        code = cw.get("weathercode")
+        time_iso = cw.get("time")
+        # Minimal code -> description mapping (subset)
+        desc_map = {
+            0: "Clear",
+            1: "Mainly clear",
+            2: "Partly cloudy",
+            3: "Overcast",
+            45: "Fog",
+            48: "Depositing rime fog",
+            51: "Light drizzle",
+            61: "Light rain",
+            63: "Rain",
+            65: "Heavy rain",
+            71: "Snow",
+            80: "Rain showers",
+        }
+        desc = desc_map.get(code, "Conditions available")
+        msg = f"Current weather in {place}: {temp_f}°F, {desc}, wind {wind} mph. Time: {time_iso}."
+        return {"message": msg, "place": place, "current": cw}
+    except httpx.RequestError as e:
+        raise HTTPException(status_code=502, detail={"error": {"message": f"Upstream error: {str(e)}", "code": "weather_upstream"}})
 
 # --- Tools: Web Search (Brave -> DuckDuckGo fallback) ---
 @app.get("/api/tools/search")
-async def tools_search(q: str, max: int = 5, dep: None = Depends(rate_limit)):
+async def tools_search(q: str, max: int = 5, mode: str = "", dep: None = Depends(rate_limit)):
+    """Web search across the configured backends. `mode` overrides SEARCH_MODE
+    (hedge, race, merge or sequential).
+    """
     q = (q or "").strip()
     if not q:
         raise HTTPException(status_code=400, detail={"error": {"message": "q is required", "code": "bad_request"}})
     max = max if 1 <= max <= 10 else 5
-    timeout = httpx.Timeout(10.0)
-    async with httpx.AsyncClient(timeout=timeout) as client:
-        # Prefer SearXNG if configured (open-source, keyless). Try primary then fallback.
-        for base in [u for u in [SEARXNG_URL, SEARXNG_FALLBACK_URL] if u]:
-            try:
-                r = await client.get(
-                    f"{base}/search",
-                    params={
-                        "q": q,
-                        "format": "json",
-                        "language": "en",
-                        "safesearch": 1,
-                        "categories": "general",
-                    },
-                    headers={"Accept": "application/json"},
-                )
-                if r.status_code == 200 and r.headers.get("content-type", "").startswith("application/json"):
-                    data = r.json() or {}
-                    items = []
-                    for d in (data.get("results") or [])[:max]:
-                        items.append({
-                            "title": d.get("title") or d.get("url"),
-                            "url": d.get("url"),
-                            "snippet": d.get("content") or d.get("pretty_url") or ""
-                        })
-                    if items:
-                        return {"items": items}
-            except httpx.RequestError:
-                continue
-
-        # Try Brave next if API key is configured
-        if BRAVE_API_KEY:
-            try:
-                r = await client.get(
-                    "https://api.search.brave.com/res/v1/web/search",
-                    params={"q": q, "count": max},
-                    headers={"Accept": "application/json", "X-Subscription-Token": BRAVE_API_KEY},
-                )
-                if r.status_code == 200 and r.headers.get("content-type", "").startswith("application/json"):
-                    data = r.json()
-                    items = []
-                    for d in (data.get("web", {}).get("results", []) or [])[:max]:
-                        items.append({
-                            "title": d.get("title") or d.get("url"),
-                            "url": d.get("url"),
-                            "snippet": d.get("description") or ""
-                        })
-                    if items:
-                        return {"items": items}
-            except httpx.RequestError:
-                pass
-
-        # Fallback: DuckDuckGo Instant Answer API (limited but keyless)
-        try:
-            r = await client.get("https://api.duckduckgo.com/", params={"q": q, "format": "json", "no_redirect": 1, "no_html": 1})
-            if r.status_code != 200:
-                raise HTTPException(status_code=r.status_code, detail={"error": {"message": "Search failed", "code": "search_error"}})
-            j = r.json() or {}
-            items = []
-            # Abstract
-            if j.get("AbstractText") and j.get("AbstractURL"):
-                items.append({"title": j.get("Heading") or j.get("AbstractURL"), "url": j.get("AbstractURL"), "snippet": j.get("AbstractText")})
-            # Related topics
-            for rt in (j.get("RelatedTopics") or []):
-                if isinstance(rt, dict) and rt.get("Text") and rt.get("FirstURL"):
-                    items.append({"title": rt.get("Text")[:80], "url": rt.get("FirstURL"), "snippet": rt.get("Text")})
-                if len(items) >= max:
-                    break
-            return {"items": items[:max]}
-        except httpx.RequestError as e:
-            raise HTTPException(status_code=502, detail={"error": {"message": f"Search upstream error: {str(e)}", "code": "search_upstream"}})
+    outcome = await websearch.search_router.search(q, max, mode or websearch.SEARCH_MODE)
+    for name in (*outcome.backends, *outcome.errors):
+        health_monitor.use(name)
+    if not outcome.items and outcome.errors and len(outcome.errors) == len(websearch.search_router.backends):
+        message = "; ".join(f"{name}: {err}" for name, err in outcome.errors.items())
+        raise HTTPException(status_code=502, detail={"error": {"message": f"Search upstream error: {message}", "code": "search_upstream"}})
+    return {"items": outcome.items, "backends": outcome.backends}
+
+
+@app.get("/api/tools/search/backends")
+async def tools_search_backends(dep: None = Depends(rate_limit)):
+    """Latency/health per search backend, in current priority order."""
+    return {"data": websearch.search_router.stats()}
 
 @app.get("/api/openrouter/models")
-async def openrouter_models(apiKey: str, dep: None = Depends(rate_limit)):
-    url = "https://openrouter.ai/api/v1/models"
-    headers = {"Authorization": f"Bearer {apiKey}", "Accept": "application/json"}
-    timeout = httpx.Timeout(20.0)
-    async with httpx.AsyncClient(timeout=timeout) as client:
-        try:
-            r = await client.get(url, headers=headers)
-            if r.headers.get('content-type','').startswith('application/json'):
-                data = r.json()
-                names = []
-                try:
-                    for m in (data.get('data') or []):
-                        mid = m.get('id') if isinstance(m, dict) else None
-                        if mid: names.append(mid)
-                except Exception:
-                    names = []
-                return JSONResponse(status_code=r.status_code, content={"models": names, "raw": data})
-            else:
-                return JSONResponse(status_code=r.status_code, content={"raw": r.text})
-        except httpx.RequestError as e:
-            raise HTTPException(status_code=502, detail={"error": {"message": f"Upstream error: {str(e)}", "code": "openrouter_upstream"}})
+async def openrouter_models(request: Request, apiKey: str, raw: bool = False, refresh: bool = False, dep: None = Depends(rate_limit)):
+    return await _catalog_response(request, "openrouter", apiKey, raw, refresh, "openrouter_upstream")
 
 
 @app.post("/api/ollama/generate")
 async def ollama_generate(request: Request, dep: None = Depends(rate_limit)):
     body = await request.json()
-    base = (body.get('base') or '').rstrip('/')
-    model = body.get('model') or ''
-    prompt = body.get('prompt') or ''
-    if not base or not model or not prompt:
+    req = providers.ChatRequest(model=body.get('model') or '', prompt=body.get('prompt') or '', base=(body.get('base') or '').rstrip('/'))
+    if not req.base or not req.model or not req.prompt:
         raise HTTPException(status_code=400, detail={"error": {"message": "base, model, and prompt are required", "code": "bad_request"}})
-    url = f"{base}/api/generate"
-    payload = {"model": model, "prompt": prompt, "stream": False}
     timeout = httpx.Timeout(60.0)
-    async with httpx.AsyncClient(timeout=timeout) as client:
-        try:
-            r = await client.post(url, json=payload)
-            # Ollama returns { response: "...", ... }
-            return JSONResponse(status_code=r.status_code, content=r.json() if r.headers.get('content-type','').startswith('application/json') else {"raw": r.text})
-        except httpx.RequestError as e:
-            raise HTTPException(status_code=502, detail={"error": {"message": f"Upstream error: {str(e)}", "code": "ollama_upstream"}})
+    try:
+        # Ollama returns { response: "...", ... }; relay its bytes instead of re-encoding them
+        return await providers.passthrough(providers.registry.get("ollama"), req, timeout, priority=parse_priority(body.get('priority')))
+    except SchedulerBusy as e:
+        raise _ollama_busy(e)
+    except httpx.RequestError as e:
+        raise HTTPException(status_code=502, detail={"error": {"message": f"Upstream error: {str(e)}", "code": "ollama_upstream"}})
 
 @app.get("/api/ollama/tags")
-async def ollama_tags(base: str, dep: None = Depends(rate_limit)):
-    base = base.rstrip('/')
-    url = f"{base}/api/tags"
-    timeout = httpx.Timeout(8.0)
-    async with httpx.AsyncClient(timeout=timeout) as client:
-        try:
-            r = await client.get(url)
-            return JSONResponse(status_code=r.status_code, content=r.json() if r.headers.get('content-type','').startswith('application/json') else {"raw": r.text})
-        except httpx.RequestError as e:
-            raise HTTPException(status_code=502, detail={"error": {"message": f"Upstream error: {str(e)}", "code": "ollama_upstream"}})
+async def ollama_tags(request: Request, base: str, refresh: bool = False, dep: None = Depends(rate_limit)):
+    health_monitor.watch_ollama(base)
+    return await _catalog_response(request, "ollama", base.rstrip('/'), False, refresh, "ollama_upstream")
 
 
-# --- RAG stubs ---
+async def _catalog_response(request: Request, provider: str, credential: str, raw: bool, refresh: bool, error_code: str):
+    """Serve a cached model catalog; the full upstream payload only with `?raw=true`.
+    Responses carry an ETag and answer `If-None-Match` with 304.
+    """
+    try:
+        entry, source = await model_catalog.get(provider, credential, force=refresh)
+    except httpx.RequestError as e:
+        raise HTTPException(status_code=502, detail={"error": {"message": f"Upstream error: {str(e)}", "code": error_code}})
+    include_raw = raw and entry.raw is not None
+    etag = entry.raw_etag if include_raw else entry.etag
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache", "X-Cache": source}
+    if entry.cacheable and etag in [t.strip() for t in request.headers.get("if-none-match", "").split(",")]:
+        return Response(status_code=304, headers=headers)
+    return Response(status_code=entry.status, content=entry.render(include_raw), media_type="application/json", headers=headers)
+
+
+# --- RAG ingestion ---
 @app.post("/api/rag/sources/upload")
-async def rag_upload(dep: None = Depends(rate_limit)):
-    return {"data": {"source_id": "src_demo_1", "status": "UPLOADED"}}
+async def rag_upload(request: Request, filename: str = "", index: bool = False, dep: None = Depends(rate_limit)):
+    """Upload a document as multipart (`file` field) or as a raw body with `?filename=`.
+    The file is streamed to disk; pass `?index=true` to start indexing right away.
+    """
+    ctype = request.headers.get("content-type", "")
+    limit = int(rag_ingest.RAG_MAX_UPLOAD_MB * 1024 * 1024)
+    too_large = f"Upload exceeds {rag_ingest.RAG_MAX_UPLOAD_MB:g} MB"
+    try:
+        if ctype.startswith("multipart/form-data"):
+            upload = await uploads.file_part(request, limit, too_large)
+            if upload is None:
+                raise HTTPException(status_code=400, detail={"error": {"message": "multipart field 'file' is required", "code": "bad_request"}})
+            data = await rag_ingest.save_upload(rag_ingest.rag_store, filename or upload.filename, upload.chunks)
+        else:
+            if not filename:
+                raise HTTPException(status_code=400, detail={"error": {"message": "filename is required for raw uploads", "code": "bad_request"}})
+            data = await rag_ingest.save_upload(rag_ingest.rag_store, filename, uploads.capped(request.stream(), limit, too_large))
+    except uploads.UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail={"error": {"message": str(e), "code": "upload_too_large"}})
+    except uploads.BadUpload as e:
+        raise HTTPException(status_code=400, detail={"error": {"message": str(e), "code": "bad_request"}})
+    if index:
+        data = {**data, **rag_ingest.indexer.start(data["source_id"])}
+    return {"data": data}
 
 
 @app.post("/api/rag/sources/index")
-async def rag_index(dep: None = Depends(rate_limit)):
-    return {"data": {"source_id": "src_demo_1", "status": "INDEXING"}}
+async def rag_index(request: Request, dep: None = Depends(rate_limit)):
+    """Start background indexing for one source (`source_id`) or every source not yet indexed."""
+    body = await request.json() if await request.body() else {}
+    source_id = (body.get("source_id") or "").strip() if isinstance(body, dict) else ""
+    force = bool(body.get("force")) if isinstance(body, dict) else False
+    if source_id:
+        status = rag_ingest.indexer.start(source_id, force=force)
+        if status is None:
+            raise HTTPException(status_code=404, detail={"error": {"message": f"Unknown source: {source_id}", "code": "not_found"}})
+        return {"data": status}
+    started = [rag_ingest.indexer.start(row["source_id"], force=force) for row in rag_ingest.rag_store.list_sources()]
+    return {"data": {"sources": started}}
+
+
+@app.get("/api/rag/sources/index")
+async def rag_index_status(source_id: str = "", dep: None = Depends(rate_limit)):
+    """Indexing job status for one source, or for all sources."""
+    if source_id:
+        status = rag_ingest.public_status(rag_ingest.rag_store.get_source(source_id))
+        if status is None:
+            raise HTTPException(status_code=404, detail={"error": {"message": f"Unknown source: {source_id}", "code": "not_found"}})
+        return {"data": status}
+    return {"data": {"sources": [rag_ingest.public_status(r) for r in rag_ingest.rag_store.list_sources()]}}
 
 
 @app.get("/api/rag/search")
-async def rag_search(q: str = "", dep: None = Depends(rate_limit)):
-    return {"data": {"query": q, "results": []}}
+async def rag_search(q: str = "", k: int = rag_search_mod.RAG_SEARCH_K, source_id: str = "", mode: str = "hybrid", dep: None = Depends(rate_limit)):
+    """Hybrid (vector + BM25) top-k over indexed chunks. `source_id` may be comma-separated;
+    `mode` is hybrid, vector or keyword.
+    """
+    if mode not in rag_search_mod.MODES:
+        raise HTTPException(status_code=400, detail={"error": {"message": f"mode must be one of {', '.join(rag_search_mod.MODES)}", "code": "bad_request"}})
+    sources = [s.strip() for s in source_id.split(",") if s.strip()] or None
+    return {"data": await rag_search_mod.searcher.search(q, k=k, source_ids=sources, mode=mode)}
 
 
-# --- STT stub ---
-@app.post("/api/stt/transcribe")
-async def stt_transcribe(dep: None = Depends(rate_limit)):
-    return {"data": {"transcript": "This is a stubbed transcript."}}
+@app.get("/api/rag/stats")
+async def rag_stats(dep: None = Depends(rate_limit)):
+    return {"data": rag_search_mod.searcher.stats()}
+
 
+# --- Speech-to-text ---
+def _stt_unavailable(e: SttUnavailable) -> HTTPException:
+    return HTTPException(status_code=503, detail={"error": {"message": str(e), "code": "stt_unavailable"}})
 
-# --- TTS stub ---
+
+@app.post("/api/stt/transcribe")
+async def stt_transcribe(request: Request, language: str = "", sample_rate: int = 16000, dep: None = Depends(rate_limit)):
+    """Transcribe one recording, sent as multipart (`file` field) or as the raw body.
+
+    Encoded audio (wav, mp3, ogg, webm, ...) is decoded by the engine. `audio/pcm` or
+    `audio/L16` bodies are 16-bit mono PCM at `?sample_rate=`.
+    """
+    ctype = request.headers.get("content-type", "").lower()
+    limit = int(STT_MAX_UPLOAD_MB * 1024 * 1024)
+    chunks = uploads.capped(request.stream(), limit, f"Audio exceeds {STT_MAX_UPLOAD_MB:g} MB")
+    data = bytearray()
+    try:
+        if ctype.startswith("multipart/form-data"):
+            upload = await uploads.file_part(request, limit, f"Audio exceeds {STT_MAX_UPLOAD_MB:g} MB")
+            if upload is None:
+                raise HTTPException(status_code=400, detail={"error": {"message": "multipart field 'file' is required", "code": "bad_request"}})
+            ctype, chunks = upload.content_type.lower(), upload.chunks
+        async for chunk in chunks:
+            data += chunk
+    except uploads.UploadTooLarge as e:
+        raise HTTPException(status_code=413, detail={"error": {"message": str(e), "code": "upload_too_large"}})
+    except uploads.BadUpload as e:
+        raise HTTPException(status_code=400, detail={"error": {"message": str(e), "code": "bad_request"}})
+    if not data:
+        raise HTTPException(status_code=400, detail={"error": {"message": "audio is required", "code": "bad_request"}})
+    try:
+        if ctype.startswith(("audio/pcm", "audio/l16")):
+            result = await stt_engine.transcribe_pcm(bytes(data), sample_rate, language or STT_LANGUAGE)
+        else:
+            result = await stt_engine.transcribe(bytes(data), language or STT_LANGUAGE)
+    except SttUnavailable as e:
+        raise _stt_unavailable(e)
+    except Exception as e:
+        raise HTTPException(status_code=422, detail={"error": {"message": str(e) or type(e).__name__, "code": "stt_failed"}})
+    return {"data": result}
+
+
+@app.websocket("/api/stt/stream")
+async def stt_stream(ws: WebSocket, language: str = "", sample_rate: int = 16000):
+    """Live transcription. Send binary frames of 16-bit mono PCM at `?sample_rate=` and
+    `{"type": "end"}` to flush. Receives `partial` and `final` events per utterance, then `done`.
+    """
+    if not await _accept_websocket(ws):
+        return
+    try:
+        session = stt_engine.session(ws.send_json, sample_rate, language or STT_LANGUAGE)
+    except SttUnavailable as e:
+        await ws.send_json({"type": "error", "error": {"message": str(e), "code": "stt_unavailable"}})
+        await ws.close(code=1011)
+        return
+    try:
+        await ws.send_json({"type": "ready", "sample_rate": sample_rate})
+        while True:
+            message = await ws.receive()
+            if message["type"] == "websocket.disconnect":
+                return
+            if message.get("bytes"):
+                await session.feed(message["bytes"])
+            elif message.get("text"):
+                try:
+                    control = fastjson.loads(message["text"])
+                except ValueError:
+                    control = {}
+                if isinstance(control, dict) and control.get("type") == "end":
+                    await session.finish()
+                    await ws.send_json({"type": "done"})
+                    await ws.close()
+                    return
+    except WebSocketDisconnect:
+        pass
+    finally:
+        session.close()
+
+
+@app.get("/api/stt/stats")
+def stt_stats(dep: None = Depends(rate_limit)):
+    return {"data": stt_engine.stats()}
+
+
+# --- Text-to-speech ---
 @app.post("/api/tts/synthesize")
-async def tts_synthesize(dep: None = Depends(rate_limit)):
-    return {"data": {"audio_url": "/static/tts/demo.wav"}}
+async def tts_synthesize(request: Request, dep: None = Depends(rate_limit)):
+    """Speak `text` with `voice` (default TTS_VOICE) at `speed` (0.5-2.0).
+
+    Streams `audio/wav`, or raw 16-bit mono PCM with `"format": "pcm"`, sentence by
+    sentence. The sample rate is in `X-Sample-Rate`.
+    """
+    body = await request.json()
+    text = body.get("text") if isinstance(body.get("text"), str) else ""
+    if not text.strip():
+        raise HTTPException(status_code=400, detail={"error": {"message": "text is required", "code": "bad_request"}})
+    if len(text) > TTS_MAX_CHARS:
+        raise HTTPException(status_code=413, detail={"error": {"message": f"text exceeds {TTS_MAX_CHARS} characters", "code": "text_too_long"}})
+    speed = body.get("speed", 1.0)
+    if isinstance(speed, bool) or not isinstance(speed, (int, float)) or not 0.5 <= speed <= 2.0:
+        raise HTTPException(status_code=400, detail={"error": {"message": "speed must be between 0.5 and 2.0", "code": "bad_request"}})
+    fmt = body.get("format") or "wav"
+    if fmt not in ("wav", "pcm"):
+        raise HTTPException(status_code=400, detail={"error": {"message": "format must be wav or pcm", "code": "bad_request"}})
+    try:
+        voice, path, rate = tts_engine.voice(body.get("voice") or "")
+    except TtsUnavailable as e:
+        raise HTTPException(status_code=503, detail={"error": {"message": str(e), "code": "tts_unavailable"}})
+    except UnknownVoice as e:
+        raise HTTPException(status_code=404, detail={"error": {"message": str(e), "code": "unknown_voice"}})
+
+    sentences = split_sentences(text)
+    audio = tts_engine.stream(sentences, voice, path, rate, float(speed))
+    # Synthesize the first sentence before answering, so failures still get a status code
+    try:
+        first = await anext(audio)
+    except Exception as e:
+        await audio.aclose()
+        raise HTTPException(status_code=500, detail={"error": {"message": str(e) or type(e).__name__, "code": "tts_failed"}})
+
+    async def chunks():
+        try:
+            if fmt == "wav":
+                yield wav_header(rate)
+            yield first
+            async for pcm in audio:
+                yield pcm
+        finally:
+            await audio.aclose()
+    media_type = "audio/wav" if fmt == "wav" else f"audio/L16;rate={rate};channels=1"
+    return StreamingResponse(chunks(), media_type=media_type,
+                             headers={"X-Sample-Rate": str(rate), "X-Voice": voice, "X-Sentences": str(len(sentences))})
+
+
+@app.get("/api/tts/voices")
+def tts_voices(dep: None = Depends(rate_limit)):
+    return {"data": tts_engine.voices()}
+
+
+@app.get("/api/tts/stats")
+async def tts_stats(dep: None = Depends(rate_limit)):
+    return {"data": await asyncio.to_thread(tts_engine.stats)}
 
 
 # --- Mini AI (Phi-3 Mini via Ollama) ---
@@ -625,39 +1011,173 @@ async def mini_generate(request: Request, dep: None = Depends(rate_limit)):
     if not prompt:
         raise HTTPException(status_code=400, detail={"error": {"message": "prompt is required", "code": "bad_request"}})
 
-    base = os.getenv("OLLAMA_BASE", "http://127.0.0.1:11434").rstrip('/')
-    model = os.getenv("MINI_MODEL", "phi3:mini")
+    base = OLLAMA_BASE
+    model = MINI_MODEL
     url = f"{base}/api/generate"
 
     # Compose text prompt; Ollama /api/generate does not accept roles, so prepend system
     composed = (f"SYSTEM:\n{system}\n\n" if system else "") + prompt
-    payload = {"model": model, "prompt": composed, "stream": False}
+    # Fit the prompt and reply into the model's window before queueing for a slot
+    req = providers.ChatRequest(model=model, prompt=composed, base=base,
+                                max_tokens=max_tokens if isinstance(max_tokens, int) and max_tokens > 0 else None)
+    ollama = providers.registry.get("ollama")
+    await context_windows.get(ollama, model, base)
+    fitted = providers.fit(ollama, req)
+    # Sampling settings only take effect under `options`
+    options = {}
     if isinstance(temperature, (int, float)):
-        payload["temperature"] = temperature
-    if isinstance(max_tokens, int):
-        payload["num_predict"] = max_tokens
-
+        options["temperature"] = temperature
+    if fitted.max_tokens:
+        options["num_predict"] = fitted.max_tokens
+    payload = {"model": model, "prompt": composed, "stream": False, "keep_alive": keep_alive_value(MINI_KEEP_ALIVE)}
+    if options:
+        payload["options"] = options
+
+    # The timeout covers generation only; waiting for a slot is bounded by OLLAMA_QUEUE_TIMEOUT
     timeout = httpx.Timeout(15.0)
-    async with httpx.AsyncClient(timeout=timeout) as client:
+    try:
+        async with ollama_scheduler.slot(base, model, parse_priority(body.get("priority"))):
+            r = await upstreams.post(url, json=payload, timeout=timeout, coalesce=options.get("temperature") == 0)
+        if r.status_code != 200:
+            raise HTTPException(status_code=r.status_code, detail={"error": {"message": "Ollama error", "code": "ollama_error", "raw": r.text}})
+        data = fastjson.response_json(r)
+        text = None
         try:
-            r = await client.post(url, json=payload)
-            if r.status_code != 200:
-                raise HTTPException(status_code=r.status_code, detail={"error": {"message": "Ollama error", "code": "ollama_error", "raw": r.text}})
-            data = r.json() if r.headers.get('content-type','').startswith('application/json') else {"raw": r.text}
+            text = data.get("response") if isinstance(data, dict) else None
+        except Exception:
             text = None
-            try:
-                text = data.get("response") if isinstance(data, dict) else None
-            except Exception:
-                text = None
-            return JSONResponse(status_code=200, content={"data": {"text": text}, "meta": {"model": model}})
-        except httpx.RequestError as e:
-            raise HTTPException(status_code=502, detail={"error": {"message": f"Upstream error: {str(e)}", "code": "mini_upstream"}})
+        return JSONResponse(status_code=200, content={"data": {"text": text}, "meta": {"model": model}})
+    except SchedulerBusy as e:
+        raise _ollama_busy(e)
+    except httpx.RequestError as e:
+        raise HTTPException(status_code=502, detail={"error": {"message": f"Upstream error: {str(e)}", "code": "mini_upstream"}})
+
+
+@app.get("/api/ollama/scheduler")
+def ollama_scheduler_stats(dep: None = Depends(rate_limit)):
+    """Local inference queue depth, wait times (ms) and running generations per model."""
+    return {"data": ollama_scheduler.stats()}
+
+
+# --- Automation ---
+JOB_STATES = ("QUEUED", "RUNNING", *FINISHED)
+
+
+def _job_not_found(job_id: str) -> HTTPException:
+    return HTTPException(status_code=404, detail={"error": {"message": f"Unknown job: {job_id}", "code": "not_found"}})
 
 
-# --- Automation stubs ---
 @app.post("/api/automation/commands/run")
-async def automation_run(dep: None = Depends(rate_limit)):
-    return {"data": {"status": "QUEUED", "job_id": "job_demo_1"}}
+async def automation_run(request: Request, dep: None = Depends(rate_limit)):
+    """Queue a command as a background job: `{"command": "batch", "args": {...}, "priority": "background"}`.
+
+    Returns at once; follow the job with `GET /api/automation/jobs/{id}` or its `/events` stream.
+    """
+    body = await request.json()
+    command, args = body.get('command'), body.get('args') or {}
+    if command not in job_engine.commands:
+        raise HTTPException(status_code=400, detail={"error": {"message": f"Unknown command: {command}", "code": "unknown_command"}})
+    if not isinstance(args, dict):
+        raise HTTPException(status_code=400, detail={"error": {"message": "args must be an object", "code": "bad_request"}})
+    try:
+        max_attempts = JOB_MAX_ATTEMPTS if body.get('max_attempts') is None else body['max_attempts']
+        job = await asyncio.to_thread(job_engine.submit, command, args, client_key(request),
+                                      body.get('priority'), max_attempts)
+    except (ValueError, TypeError) as e:
+        raise HTTPException(status_code=400, detail={"error": {"message": str(e), "code": "bad_request"}})
+    except JobLimit as e:
+        raise HTTPException(status_code=429, detail={"error": {"message": str(e), "code": "too_many_jobs"}})
+    job_engine.wake()
+    job_engine.publish()
+    return {"data": {**job, "job_id": job["id"]}}
+
+
+@app.get("/api/automation/commands")
+def automation_commands(dep: None = Depends(rate_limit)):
+    return {"data": job_engine.describe_commands()}
+
+
+@app.get("/api/automation/jobs")
+def automation_jobs(request: Request, state: str = "", limit: int = 50, dep: None = Depends(rate_limit)):
+    """The caller's most recent jobs first, without args and results; `state` filters by status."""
+    state = state.strip().upper()
+    if state and state not in JOB_STATES:
+        raise HTTPException(status_code=400, detail={"error": {"message": f"state must be one of {', '.join(JOB_STATES)}", "code": "bad_request"}})
+    return {"data": job_engine.recent(client_key(request), state or None, min(max(1, limit), 500))}
+
+
+@app.get("/api/automation/jobs/{job_id}")
+def automation_job(job_id: str, request: Request, dep: None = Depends(rate_limit)):
+    """The job with its args (credentials redacted) and result; only for the client that submitted it."""
+    job = job_engine.get(job_id, client_key(request))
+    if job is None:
+        raise _job_not_found(job_id)
+    return {"data": job}
+
+
+@app.delete("/api/automation/jobs/{job_id}")
+async def automation_job_cancel(job_id: str, request: Request, dep: None = Depends(rate_limit)):
+    """Cancel a job. Queued jobs stop at once; running ones shortly after (`cancel_requested`)."""
+    job = await job_engine.cancel(job_id, client_key(request))
+    if job is None:
+        raise _job_not_found(job_id)
+    return {"data": job}
+
+
+def _job_events(request: Request, job_id: str | None = None) -> StreamingResponse:
+    client = client_key(request)
+    queue = job_engine.subscribe()
+    # Other worker processes' changes are only seen by polling the table
+    poll = 1.0 if storage.MULTI_PROCESS else HEARTBEAT_SEC
+
+    async def events():
+        try:
+            rev = 0
+            if job_id is None:
+                # The feed starts with what is queued or running now, then follows changes
+                rev = await asyncio.to_thread(job_engine.current_rev)
+                current = await asyncio.to_thread(job_engine.recent, client, None, 500)
+                for job in reversed([j for j in current if j["status"] not in FINISHED]):
+                    yield streaming.sse_event({"type": "job", **job})
+            beat = time.monotonic()
+            while True:
+                for job in await asyncio.to_thread(job_engine.changes, rev, client, job_id):
+                    rev = job["rev"]
+                    yield streaming.sse_event({"type": "job", **job})
+                    if job_id is not None and job["status"] in FINISHED:
+                        return
+                try:
+                    await asyncio.wait_for(queue.get(), timeout=poll)
+                except asyncio.TimeoutError:
+                    pass
+                if await request.is_disconnected():
+                    break
+                if time.monotonic() - beat >= HEARTBEAT_SEC:
+                    beat = time.monotonic()
+                    yield b": keep-alive\n\n"
+        finally:
+            job_engine.unsubscribe(queue)
+
+    return StreamingResponse(events(), media_type="text/event-stream", headers=streaming.SSE_HEADERS)
+
+
+@app.get("/api/automation/jobs/{job_id}/events")
+async def automation_job_events(job_id: str, request: Request, dep: None = Depends(rate_limit)):
+    """Server-Sent Events: the job on connect and after every change; ends when the job finishes."""
+    if await asyncio.to_thread(job_engine.get, job_id, client_key(request), False) is None:
+        raise _job_not_found(job_id)
+    return _job_events(request, job_id)
+
+
+@app.get("/api/automation/events")
+async def automation_events(request: Request, dep: None = Depends(rate_limit)):
+    """Server-Sent Events for the caller's jobs: unfinished ones on connect, then every change."""
+    return _job_events(request)
+
+
+@app.get("/api/automation/stats")
+def automation_stats(dep: None = Depends(rate_limit)):
+    return {"data": job_engine.stats()}
 
 
 @app.get("/api/automation/experts")
@@ -674,7 +1194,6 @@ async def automation_scratchpad_fork(dep: None = Depends(rate_limit)):
 
 
 if __name__ == "__main__":
-    # Allow running as a local service for Electron mode
-    port = int(os.getenv("PORT", "8000"))
-    # Bind to loopback for desktop security
-    uvicorn.run("app.main:app", host="127.0.0.1", port=port, reload=False, workers=1)
+    # Allow running as a local service for Electron mode (see serve.py for worker options)
+    from .serve import main as serve_main
+    serve_main()
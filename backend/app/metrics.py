@@ -0,0 +1,229 @@
+"""Prometheus-style metrics for ``GET /metrics`` (text exposition format 0.0.4).
+
+Counters and histograms are plain dicts of floats/lists updated from the event loop, so
+recording is a dict lookup and an add: no locks and no objects beyond the label tuple.
+Histogram bucket counts are stored per bucket and only made cumulative when scraped.
+Values owned by other subsystems (cache hits, queue depth, ...) are read by callbacks at
+scrape time and cost nothing on the hot path.
+
+Label sets per metric are capped (``METRICS_MAX_SERIES``); further combinations are
+folded into ``other`` so user-supplied model names cannot grow memory without bound.
+Metrics are per process: with ``WORKERS`` > 1 each scrape sees the worker that served it.
+"""
+from __future__ import annotations
+
+import os
+import time
+from bisect import bisect_left
+from contextvars import ContextVar
+from typing import Callable, Iterable
+
+
+METRICS = os.getenv("METRICS", "1").strip().lower() not in ("0", "false", "no", "off")
+METRICS_MAX_SERIES = int(os.getenv("METRICS_MAX_SERIES", "500"))
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Seconds spent waiting on upstream calls during the current request (one float list per request)
+upstream_time: ContextVar[list | None] = ContextVar("upstream_time", default=None)
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: tuple[str, ...], values: tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(str(v))}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _num(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(int(value)) if float(value).is_integer() else repr(value)
+
+
+class Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values: dict = {}
+
+    def _key(self, key: tuple) -> tuple:
+        if key in self.values or len(self.values) < METRICS_MAX_SERIES:
+            return key
+        return ("other",) * len(self.labels)
+
+    def header(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, *labels, amount: float = 1.0) -> None:
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0.0) + amount
+
+    def render(self) -> list[str]:
+        return self.header() + [f"{self.name}{_labels(self.labels, k)} {_num(v)}" for k, v in self.values.items()]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, *labels) -> None:
+        self.values[self._key(labels)] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = (), buckets: tuple[float, ...] = LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = buckets
+
+    def observe(self, value: float, *labels) -> None:
+        key = self._key(labels)
+        series = self.values.get(key)
+        if series is None:
+            # [count per bucket..., +Inf bucket, sum]
+            series = self.values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    def render(self) -> list[str]:
+        lines = self.header()
+        for key, series in self.values.items():
+            total = 0
+            for bound, n in zip(self.buckets + (float("inf"),), series):
+                total += n
+                le = 'le="%s"' % _num(bound)
+                lines.append(f"{self.name}_bucket{_labels(self.labels, key, le)} {total}")
+            lines.append(f"{self.name}_sum{_labels(self.labels, key)} {_num(series[-1])}")
+            lines.append(f"{self.name}_count{_labels(self.labels, key)} {total}")
+        return lines
+
+
+class Callback(Metric):
+    """Series read at scrape time: ``fn`` returns {label value (or tuple): number}."""
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...], fn: Callable[[], dict], kind: str = "gauge"):
+        super().__init__(name, help, labels)
+        self.fn = fn
+        self.kind = kind
+
+    def render(self) -> list[str]:
+        try:
+            values = self.fn() or {}
+        except Exception:
+            return []
+        lines = self.header()
+        for key, value in values.items():
+            if isinstance(value, (int, float)) and not isinstance(value, bool):
+                lines.append(f"{self.name}{_labels(self.labels, key if isinstance(key, tuple) else (key,))} {_num(value)}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: dict[str, Metric] = {}
+
+    def register(self, metric: Metric) -> Metric:
+        self.metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, help: str, labels: Iterable[str] = ()) -> Counter:
+        return self.register(Counter(name, help, tuple(labels)))
+
+    def gauge(self, name: str, help: str, labels: Iterable[str] = ()) -> Gauge:
+        return self.register(Gauge(name, help, tuple(labels)))
+
+    def histogram(self, name: str, help: str, labels: Iterable[str] = (), buckets: tuple[float, ...] = LATENCY_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, help, tuple(labels), buckets))
+
+    def callback(self, name: str, help: str, labels: Iterable[str], fn: Callable[[], dict], kind: str = "gauge") -> Callback:
+        return self.register(Callback(name, help, tuple(labels), fn, kind))
+
+    def render(self) -> str:
+        lines: list[str] = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+registry = Registry()
+
+http_requests = registry.counter("zeek_http_requests_total", "HTTP requests by route and status.", ("method", "route", "status"))
+http_duration = registry.histogram("zeek_http_request_duration_seconds", "HTTP request latency until the response body is sent.", ("method", "route"))
+http_upstream_seconds = registry.counter("zeek_http_upstream_seconds_total", "Time requests spent waiting on upstream calls.", ("route",))
+http_local_seconds = registry.counter("zeek_http_local_seconds_total", "Time requests spent outside upstream calls.", ("route",))
+http_bytes_in = registry.counter("zeek_http_request_bytes_total", "Request body bytes (Content-Length).", ("route",))
+http_bytes_out = registry.counter("zeek_http_response_bytes_total", "Response body bytes sent.", ("route",))
+http_inflight = registry.gauge("zeek_http_inflight_requests", "Requests currently being served.")
+
+upstream_requests = registry.counter("zeek_upstream_responses_total", "Upstream responses by origin and status code.", ("origin", "status"))
+upstream_errors = registry.counter("zeek_upstream_errors_total", "Upstream calls that failed without a response.", ("origin", "error"))
+upstream_ttfb = registry.histogram("zeek_upstream_ttfb_seconds", "Time from sending an upstream request to its response headers.", ("origin",))
+
+chat_duration = registry.histogram("zeek_chat_duration_seconds", "Non-streaming completion latency per provider/model.", ("provider", "model"))
+chat_ttfb = registry.histogram("zeek_chat_ttfb_seconds", "Streaming completion time to upstream headers per provider/model.", ("provider", "model"))
+chat_responses = registry.counter("zeek_chat_responses_total", "Completions by provider and upstream status.", ("provider", "status"))
+chat_tokens = registry.counter("zeek_chat_tokens_total", "Completion tokens by provider and kind (input, output, cached, cache_write).", ("provider", "kind"))
+
+ollama_queue_wait = registry.histogram("zeek_ollama_queue_wait_seconds", "Time local generations waited for an Ollama slot.", ("priority",))
+
+ratelimit_rejected = registry.counter("zeek_ratelimit_rejected_total", "Requests rejected with 429 by the rate limiter.", ("group",))
+
+
+def add_upstream_time(seconds: float) -> None:
+    acc = upstream_time.get()
+    if acc is not None:
+        acc[0] += seconds
+
+
+class MetricsMiddleware:
+    """Pure ASGI middleware: per-route counts, latency, upstream/local split and bytes."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not METRICS:
+            return await self.app(scope, receive, send)
+        started = time.perf_counter()
+        acc = [0.0]
+        token = upstream_time.set(acc)
+        meta = [500, 0]  # status, bytes out
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                meta[0] = message["status"]
+            elif message["type"] == "http.response.body":
+                meta[1] += len(message.get("body", b""))
+            await send(message)
+
+        http_inflight.inc(amount=1)
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            http_inflight.inc(amount=-1)
+            upstream_time.reset(token)
+            elapsed = time.perf_counter() - started
+            route = getattr(scope.get("route"), "path", None) or "unmatched"
+            method = scope["method"]
+            http_requests.inc(method, route, meta[0])
+            http_duration.observe(elapsed, method, route)
+            http_upstream_seconds.inc(route, amount=min(acc[0], elapsed))
+            http_local_seconds.inc(route, amount=max(0.0, elapsed - acc[0]))
+            http_bytes_out.inc(route, amount=meta[1])
+            for name, value in scope.get("headers", ()):
+                if name == b"content-length":
+                    http_bytes_in.inc(route, amount=int(value or 0))
+                    break
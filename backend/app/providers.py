@@ -0,0 +1,699 @@
+"""Provider adapter registry for /api/chat and the per-provider proxy routes.
+
+Each adapter knows how to build the upstream request for one provider, how to pull the
+completion text out of its response, which stream parser understands its wire format,
+and which capabilities it supports. Adapters are looked up by provider id in O(1).
+
+Extra adapters can be plugged in without touching this file:
+
+- Python packages can expose adapters under the ``zeek_ai.providers`` entry-point group
+  (the entry point may load an adapter instance or an adapter class).
+- ``PROVIDERS_CONFIG`` may point to a JSON file describing additional providers:
+
+    [
+      {"id": "together", "style": "openai", "url": "https://api.together.xyz/v1/chat/completions",
+       "label": "Together", "capabilities": {"max_context": 32768}},
+      {"id": "custom", "class": "my_pkg.adapters:CustomAdapter"}
+    ]
+"""
+from __future__ import annotations
+
+import abc
+import contextlib
+import importlib
+import json
+import os
+import time
+from collections import OrderedDict
+from dataclasses import asdict, dataclass, field
+from importlib.metadata import entry_points
+from typing import Any
+from urllib.parse import urlsplit
+
+import httpx
+from fastapi import HTTPException
+from fastapi.responses import Response, StreamingResponse
+
+from . import fastjson, metrics, streaming
+from .scheduler import INTERACTIVE, ollama_scheduler
+from .tokens import CHAT_DEFAULT_MAX_TOKENS, TokenBudgetError, approx_tokens, token_counter
+from .upstream import upstreams
+from .windows import context_windows
+
+
+ENTRY_POINT_GROUP = "zeek_ai.providers"
+PROVIDERS_CONFIG = os.getenv("PROVIDERS_CONFIG", "").strip()
+# Anthropic prompt-cache breakpoints are added once the cached prefix is at least this long
+PROMPT_CACHE = os.getenv("PROMPT_CACHE", "1").strip().lower() not in ("0", "false", "no", "off")
+PROMPT_CACHE_MIN_TOKENS = int(os.getenv("PROMPT_CACHE_MIN_TOKENS", "1024"))
+PREFIX_CACHE_MAX = 256
+MESSAGE_ROLES = {"system": "system", "developer": "system", "user": "user", "assistant": "assistant", "model": "assistant"}
+
+
+@dataclass(frozen=True)
+class Capabilities:
+    streaming: bool = True
+    batching: bool = False
+    max_context: int | None = None   # shared by all of the provider's models; see windows.py
+    token_counting: bool = False
+    prompt_caching: bool = False   # reuses long shared prefixes (automatically or via cache markers)
+    stream_usage: bool = False     # accepts stream_options.include_usage
+
+
+@dataclass
+class ChatRequest:
+    model: str
+    prompt: str
+    api_key: str = ""
+    base: str = ""
+    azure: dict = field(default_factory=dict)
+    history: list[dict] = field(default_factory=list)  # earlier turns: [{"role": "user"|"assistant", "content"}]
+    system: str = ""
+    max_tokens: int | None = None  # reply limit; fit() lowers it to the room left in the context window
+    temperature: float | None = None  # None: the provider's default
+
+    @classmethod
+    def from_body(cls, body: dict) -> "ChatRequest":
+        """Accepts `prompt`, `system` and/or an OpenAI-style `messages` array.
+
+        System messages are appended to `system`. Without `prompt`, the last message must
+        be a user turn and becomes the prompt; the rest becomes the history.
+        """
+        azure = body.get('azure') or {}
+        system = body.get('system').strip() if isinstance(body.get('system'), str) else ''
+        prompt = (body.get('prompt') or '').strip()
+        max_tokens = body.get('max_tokens', body.get('max_completion_tokens'))
+        if max_tokens is not None and (isinstance(max_tokens, bool) or not isinstance(max_tokens, int) or max_tokens < 1):
+            raise _bad_request("max_tokens must be a positive integer")
+        temperature = body.get('temperature')
+        if temperature is not None and (isinstance(temperature, bool) or not isinstance(temperature, (int, float)) or not 0 <= temperature <= 2):
+            raise _bad_request("temperature must be a number from 0 to 2")
+        history: list[dict] = []
+        if body.get('messages') is not None:
+            systems, history = _parse_messages(body['messages'])
+            system = "\n\n".join(p for p in (system, *systems) if p)
+            if not prompt and history and history[-1]["role"] == "user":
+                prompt = history.pop()["content"].strip()
+        return cls(
+            model=(body.get('model') or '').strip(),
+            prompt=prompt,
+            api_key=(body.get('apiKey') or '').strip(),
+            base=(body.get('base') or '').strip().rstrip('/'),
+            azure=azure if isinstance(azure, dict) else {},
+            history=history,
+            system=system,
+            max_tokens=max_tokens,
+            temperature=temperature,
+        )
+
+    def messages(self, with_system: bool = False) -> list[dict]:
+        head = [{"role": "system", "content": self.system}] if with_system and self.system else []
+        return [*head, *self.history, {"role": "user", "content": self.prompt}]
+
+
+def _content_text(content: Any) -> str:
+    if isinstance(content, str):
+        return content
+    if isinstance(content, list):  # content parts: [{"type": "text", "text": ...}]
+        return "".join(p.get("text") or "" for p in content if isinstance(p, dict) and p.get("type", "text") == "text")
+    return ""
+
+
+def _parse_messages(messages: Any) -> tuple[list[str], list[dict]]:
+    if not isinstance(messages, list):
+        raise _bad_request("messages must be an array of {role, content}")
+    systems, turns = [], []
+    for m in messages:
+        role = MESSAGE_ROLES.get(str(m.get("role") or "").lower()) if isinstance(m, dict) else None
+        if role is None:
+            raise _bad_request("each message needs a role of system, user or assistant")
+        text = _content_text(m.get("content"))
+        if role == "system":
+            systems.append(text.strip())
+        else:
+            turns.append({"role": role, "content": text})
+    return systems, turns
+
+
+def _usage(input_tokens=None, output_tokens=None, cached_tokens=None, cache_write_tokens=None) -> dict:
+    return {"input_tokens": input_tokens, "output_tokens": output_tokens,
+            "cached_tokens": cached_tokens or 0, "cache_write_tokens": cache_write_tokens or 0}
+
+
+@dataclass
+class UpstreamCall:
+    url: str
+    payload: dict
+    headers: dict | None = None
+
+
+def _bad_request(message: str) -> HTTPException:
+    return HTTPException(status_code=400, detail={"error": {"message": message, "code": "bad_request"}})
+
+
+class ProviderAdapter(abc.ABC):
+    """Base adapter. Subclasses set the class attributes and implement ``build``/``extract_text``."""
+
+    id: str = ""
+    label: str = ""
+    aliases: tuple[str, ...] = ()
+    capabilities: Capabilities = Capabilities()
+    stream_parser: streaming.Parser = staticmethod(streaming.parse_openai)
+    health_url: str = ""  # unauthenticated reachability probe; empty for per-request hosts
+
+    def validate(self, req: ChatRequest) -> None:
+        if not req.api_key:
+            raise _bad_request(f"{self.label} apiKey is required")
+
+    @abc.abstractmethod
+    def build(self, req: ChatRequest, stream: bool = False) -> UpstreamCall:
+        """The upstream call for ``req``."""
+
+    @abc.abstractmethod
+    def extract_text(self, data: Any) -> str | None:
+        """The completion text of a full response."""
+
+    def count_call(self, req: ChatRequest) -> UpstreamCall | None:
+        """The provider's own token counting endpoint, when it has one."""
+        return None
+
+    def count_of(self, data: Any) -> int | None:
+        return None
+
+    def usage_of(self, data: Any) -> Any:
+        """The usage object of a full (non-streaming) response."""
+        return data.get("usage") if isinstance(data, dict) else None
+
+    def normalize_usage(self, usage: Any) -> dict | None:
+        """Provider usage -> {input_tokens, output_tokens, cached_tokens, cache_write_tokens}.
+
+        ``input_tokens`` counts the whole prompt, cached part included. The base form is
+        OpenAI's chat.completions usage.
+        """
+        if not isinstance(usage, dict):
+            return None
+        details = usage.get("prompt_tokens_details") or {}
+        return _usage(usage.get("prompt_tokens"), usage.get("completion_tokens"), details.get("cached_tokens"))
+
+    def describe(self) -> dict:
+        return {"id": self.id, "label": self.label, "aliases": list(self.aliases), "capabilities": asdict(self.capabilities)}
+
+
+class OpenAICompatibleAdapter(ProviderAdapter):
+    """Bearer-token chat.completions APIs (OpenAI, OpenRouter, Mistral, Groq, ...)."""
+
+    def __init__(self, id: str, label: str, url: str, capabilities: Capabilities | None = None, aliases: tuple[str, ...] = (),
+                 max_tokens_field: str = "max_tokens"):
+        self.id = id
+        self.max_tokens_field = max_tokens_field  # OpenAI's reasoning models only accept max_completion_tokens
+        self.label = label
+        self.url = url
+        if url:
+            parts = urlsplit(url)
+            self.health_url = f"{parts.scheme}://{parts.netloc}/"
+        self.aliases = aliases
+        if capabilities is not None:
+            self.capabilities = capabilities
+
+    def build(self, req: ChatRequest, stream: bool = False) -> UpstreamCall:
+        # Providers with automatic prompt caching match on the prefix, so the system prompt goes first
+        payload: dict = {"model": req.model, "messages": req.messages(with_system=True)}
+        if req.max_tokens:
+            payload[self.max_tokens_field] = req.max_tokens
+        if req.temperature is not None:
+            payload["temperature"] = req.temperature
+        if stream:
+            payload["stream"] = True
+            if self.capabilities.stream_usage:
+                payload["stream_options"] = {"include_usage": True}
+        headers = {"Authorization": f"Bearer {req.api_key}", "Content-Type": "application/json"}
+        return UpstreamCall(self.url, payload, headers)
+
+    def extract_text(self, data: Any) -> str | None:
+        try:
+            return data["choices"][0]["message"]["content"]
+        except Exception:
+            return None
+
+
+class AzureOpenAIAdapter(OpenAICompatibleAdapter):
+    def __init__(self):
+        super().__init__("azure", "Azure OpenAI", "", Capabilities(prompt_caching=True, stream_usage=True),
+                         aliases=("azure_openai",), max_tokens_field="max_completion_tokens")
+
+    @staticmethod
+    def _settings(req: ChatRequest) -> tuple[str, str, str, str]:
+        # expects azure = { endpoint, apiKey, deployment, apiVersion }
+        az = req.azure
+        return (
+            az.get('endpoint') or '',
+            az.get('apiKey') or req.api_key,
+            az.get('deployment') or req.model,
+            az.get('apiVersion') or '2025-03-01-preview',
+        )
+
+    def validate(self, req: ChatRequest) -> None:
+        az_ep, az_key, az_dep, _ = self._settings(req)
+        if not az_ep or not az_key or not az_dep:
+            raise _bad_request("Azure endpoint, apiKey and deployment are required")
+
+    def build(self, req: ChatRequest, stream: bool = False) -> UpstreamCall:
+        az_ep, az_key, az_dep, az_ver = self._settings(req)
+        url = f"{az_ep.rstrip('/')}/openai/deployments/{az_dep}/chat/completions?api-version={az_ver}"
+        payload: dict = {"messages": req.messages(with_system=True)}
+        if req.max_tokens:
+            payload[self.max_tokens_field] = req.max_tokens
+        if req.temperature is not None:
+            payload["temperature"] = req.temperature
+        if stream:
+            payload["stream"] = True
+            payload["stream_options"] = {"include_usage": True}
+        return UpstreamCall(url, payload, {"api-key": az_key, "Content-Type": "application/json"})
+
+
+class AnthropicAdapter(ProviderAdapter):
+    id = "anthropic"
+    label = "Anthropic"
+    capabilities = Capabilities(batching=True, max_context=200000, token_counting=True, prompt_caching=True)
+    stream_parser = staticmethod(streaming.parse_anthropic)
+    health_url = "https://api.anthropic.com/"
+    CACHE_CONTROL = {"type": "ephemeral"}
+
+    def build(self, req: ChatRequest, stream: bool = False) -> UpstreamCall:
+        # max_tokens is required here; fit() has already clamped it to the room left
+        payload: dict = {"model": req.model, "max_tokens": req.max_tokens or CHAT_DEFAULT_MAX_TOKENS, "messages": req.messages()}
+        if req.system:
+            payload["system"] = [{"type": "text", "text": req.system}]
+        if req.temperature is not None:
+            payload["temperature"] = min(req.temperature, 1.0)  # Anthropic's range is 0-1
+        if PROMPT_CACHE:
+            self._mark_cache(payload, req)
+        if stream:
+            payload["stream"] = True
+        return UpstreamCall("https://api.anthropic.com/v1/messages", payload, self._headers(req))
+
+    @staticmethod
+    def _headers(req: ChatRequest) -> dict:
+        return {"x-api-key": req.api_key, "anthropic-version": "2023-06-01", "Content-Type": "application/json"}
+
+    def count_call(self, req: ChatRequest) -> UpstreamCall | None:
+        payload: dict = {"model": req.model, "messages": req.messages()}
+        if req.system:
+            payload["system"] = req.system
+        return UpstreamCall("https://api.anthropic.com/v1/messages/count_tokens", payload, self._headers(req))
+
+    def count_of(self, data: Any) -> int | None:
+        return data.get("input_tokens") if isinstance(data, dict) else None
+
+    def _mark_cache(self, payload: dict, req: ChatRequest) -> None:
+        """Cache breakpoints after the system prompt and after the history, when long enough.
+
+        The system prompt is the same every turn. The history only grows, so the next turn
+        reads the prefix cached by this one.
+        """
+        prefix = approx_tokens(req.system)
+        if req.system and prefix >= PROMPT_CACHE_MIN_TOKENS:
+            payload["system"][-1]["cache_control"] = self.CACHE_CONTROL
+        if req.history:
+            prefix += sum(approx_tokens(m["content"]) for m in req.history)
+            if prefix >= PROMPT_CACHE_MIN_TOKENS:
+                i = len(req.history) - 1
+                last = payload["messages"][i]
+                payload["messages"][i] = {**last, "content": [{"type": "text", "text": last["content"], "cache_control": self.CACHE_CONTROL}]}
+
+    def extract_text(self, data: Any) -> str | None:
+        try:
+            return data["content"][0]["text"]
+        except Exception:
+            return None
+
+    def normalize_usage(self, usage: Any) -> dict | None:
+        if not isinstance(usage, dict):
+            return None
+        # input_tokens excludes cache reads and writes
+        read, write = usage.get("cache_read_input_tokens") or 0, usage.get("cache_creation_input_tokens") or 0
+        total = usage.get("input_tokens")
+        return _usage(total + read + write if isinstance(total, int) else None, usage.get("output_tokens"), read, write)
+
+
+class GeminiAdapter(ProviderAdapter):
+    id = "google"
+    label = "Google AI"
+    aliases = ("googleai", "gemini")
+    capabilities = Capabilities(token_counting=True, prompt_caching=True)
+    stream_parser = staticmethod(streaming.parse_gemini)
+    health_url = "https://generativelanguage.googleapis.com/"
+
+    @staticmethod
+    def _model(req: ChatRequest) -> str:
+        # Normalize model (strip 'models/' prefix if present)
+        return req.model.split('/', 1)[1] if req.model.startswith('models/') else req.model
+
+    def build(self, req: ChatRequest, stream: bool = False) -> UpstreamCall:
+        method = "streamGenerateContent?alt=sse&" if stream else "generateContent?"
+        url = f"https://generativelanguage.googleapis.com/v1beta/models/{self._model(req)}:{method}key={req.api_key}"
+        payload: dict = {"contents": [{"role": "model" if m["role"] == "assistant" else "user", "parts": [{"text": m["content"]}]}
+                                      for m in req.messages()]}
+        if req.system:
+            payload["systemInstruction"] = {"parts": [{"text": req.system}]}
+        config = {}
+        if req.max_tokens:
+            config["maxOutputTokens"] = req.max_tokens
+        if req.temperature is not None:
+            config["temperature"] = req.temperature
+        if config:
+            payload["generationConfig"] = config
+        return UpstreamCall(url, payload, {"Content-Type": "application/json"})
+
+    def count_call(self, req: ChatRequest) -> UpstreamCall | None:
+        model = self._model(req)
+        call = self.build(req)
+        payload = {"generateContentRequest": {"model": f"models/{model}", **call.payload}}
+        url = f"https://generativelanguage.googleapis.com/v1beta/models/{model}:countTokens?key={req.api_key}"
+        return UpstreamCall(url, payload, call.headers)
+
+    def count_of(self, data: Any) -> int | None:
+        return data.get("totalTokens") if isinstance(data, dict) else None
+
+    def extract_text(self, data: Any) -> str | None:
+        try:
+            return data["candidates"][0]["content"]["parts"][0]["text"]
+        except Exception:
+            return None
+
+    def usage_of(self, data: Any) -> Any:
+        return data.get("usageMetadata") if isinstance(data, dict) else None
+
+    def normalize_usage(self, usage: Any) -> dict | None:
+        if not isinstance(usage, dict):
+            return None
+        return _usage(usage.get("promptTokenCount"), usage.get("candidatesTokenCount"), usage.get("cachedContentTokenCount"))
+
+
+class CohereAdapter(ProviderAdapter):
+    id = "cohere"
+    label = "Cohere"
+    capabilities = Capabilities()
+    stream_parser = staticmethod(streaming.parse_cohere)
+    health_url = "https://api.cohere.ai/"
+
+    def build(self, req: ChatRequest, stream: bool = False) -> UpstreamCall:
+        payload: dict = {"model": req.model, "messages": req.messages(with_system=True)}
+        if req.max_tokens:
+            payload["max_tokens"] = req.max_tokens
+        if req.temperature is not None:
+            payload["temperature"] = min(req.temperature, 1.0)  # Cohere's range is 0-1
+        if stream:
+            payload["stream"] = True
+        headers = {"Authorization": f"Bearer {req.api_key}", "Content-Type": "application/json"}
+        return UpstreamCall("https://api.cohere.ai/v2/chat", payload, headers)
+
+    def extract_text(self, data: Any) -> str | None:
+        if not isinstance(data, dict):
+            return None
+        if "text" in data:
+            return data["text"]
+        try:
+            # v2 chat: { message: { content: [ { type: "text", text } ] } }
+            return data["message"]["content"][0]["text"]
+        except Exception:
+            return data.get("output")
+
+    def normalize_usage(self, usage: Any) -> dict | None:
+        if not isinstance(usage, dict):
+            return None
+        tokens = usage.get("tokens") or usage.get("billed_units") or {}
+        return _usage(tokens.get("input_tokens"), tokens.get("output_tokens"))
+
+
+class OllamaAdapter(ProviderAdapter):
+    id = "ollama"
+    label = "Ollama"
+    capabilities = Capabilities()
+    stream_parser = staticmethod(streaming.parse_ollama)
+
+    def validate(self, req: ChatRequest) -> None:
+        if not req.base:
+            raise _bad_request("Ollama base is required")
+
+    def build(self, req: ChatRequest, stream: bool = False) -> UpstreamCall:
+        prompt = req.prompt
+        if req.history:
+            # /api/generate takes a single prompt, so earlier turns become a transcript
+            turns = [f"{'User' if m['role'] == 'user' else 'Assistant'}: {m['content']}" for m in req.history]
+            prompt = "\n\n".join([*turns, f"User: {req.prompt}", "Assistant:"])
+        payload = {"model": req.model, "prompt": prompt, "stream": stream}
+        if req.system:
+            payload["system"] = req.system
+        options = {}
+        if req.max_tokens:
+            options["num_predict"] = req.max_tokens
+        if req.temperature is not None:
+            options["temperature"] = req.temperature
+        if options:
+            payload["options"] = options
+        return UpstreamCall(f"{req.base}/api/generate", payload)
+
+    def extract_text(self, data: Any) -> str | None:
+        return (data.get('response') if isinstance(data, dict) else None) or data
+
+    def usage_of(self, data: Any) -> Any:
+        return data
+
+    def normalize_usage(self, usage: Any) -> dict | None:
+        if not isinstance(usage, dict) or "eval_count" not in usage:
+            return None
+        return _usage(usage.get("prompt_eval_count"), usage.get("eval_count"))
+
+
+class ProviderRegistry:
+    def __init__(self) -> None:
+        self._adapters: dict[str, ProviderAdapter] = {}
+        self._index: dict[str, ProviderAdapter] = {}
+        # Prefix matches of client-sent names, kept apart from (and bounded unlike) the registered ids
+        self._prefixed: OrderedDict[str, ProviderAdapter] = OrderedDict()
+
+    def register(self, adapter: ProviderAdapter) -> None:
+        self._adapters[adapter.id] = adapter
+        for key in (adapter.id, *adapter.aliases):
+            self._index[key.lower()] = adapter
+        self._prefixed.clear()
+
+    def get(self, provider_id: str) -> ProviderAdapter | None:
+        return self._index.get((provider_id or '').strip().lower())
+
+    def resolve(self, provider: str) -> ProviderAdapter | None:
+        """Look up by id or alias; fall back to the longest registered prefix
+        (e.g. 'ollama-llama2' -> ollama, 'openai-compatible' -> openai), memoized in a bounded LRU.
+        """
+        key = (provider or '').strip().lower()
+        adapter = self._index.get(key)
+        if adapter is not None or not key:
+            return adapter
+        adapter = self._prefixed.get(key)
+        if adapter is not None:
+            self._prefixed.move_to_end(key)
+            return adapter
+        matches = [k for k in self._index if key.startswith(k)]
+        if matches:
+            adapter = self._prefixed[key] = self._index[max(matches, key=len)]
+            while len(self._prefixed) > PREFIX_CACHE_MAX:
+                self._prefixed.popitem(last=False)
+        return adapter
+
+    def adapters(self) -> list[ProviderAdapter]:
+        return list(self._adapters.values())
+
+    def describe(self) -> list[dict]:
+        return [a.describe() for a in self._adapters.values()]
+
+
+def _adapter_from_config(entry: dict) -> ProviderAdapter:
+    if entry.get("class"):
+        module_name, _, attr = entry["class"].partition(":")
+        obj = getattr(importlib.import_module(module_name), attr)
+        return obj() if isinstance(obj, type) else obj
+    if (entry.get("style") or "openai") != "openai":
+        raise ValueError(f"Unsupported provider style: {entry.get('style')}")
+    return OpenAICompatibleAdapter(
+        entry["id"],
+        entry.get("label") or entry["id"],
+        entry["url"],
+        Capabilities(**(entry.get("capabilities") or {})),
+        aliases=tuple(entry.get("aliases") or ()),
+    )
+
+
+def _load_plugins(registry: ProviderRegistry) -> None:
+    for ep in entry_points(group=ENTRY_POINT_GROUP):
+        obj = ep.load()
+        registry.register(obj() if isinstance(obj, type) else obj)
+    if PROVIDERS_CONFIG:
+        with open(PROVIDERS_CONFIG, "r", encoding="utf-8") as f:
+            for entry in json.load(f):
+                registry.register(_adapter_from_config(entry))
+
+
+registry = ProviderRegistry()
+for _adapter in (
+    OllamaAdapter(),
+    GeminiAdapter(),
+    OpenAICompatibleAdapter("openrouter", "OpenRouter", "https://openrouter.ai/api/v1/chat/completions",
+                            Capabilities(prompt_caching=True, stream_usage=True)),
+    OpenAICompatibleAdapter("openai", "OpenAI", "https://api.openai.com/v1/chat/completions",
+                            Capabilities(batching=True, token_counting=True, prompt_caching=True, stream_usage=True),
+                            max_tokens_field="max_completion_tokens"),
+    AnthropicAdapter(),
+    OpenAICompatibleAdapter("mistral", "Mistral", "https://api.mistral.ai/v1/chat/completions", Capabilities()),
+    OpenAICompatibleAdapter("groq", "Groq", "https://api.groq.com/openai/v1/chat/completions", Capabilities(stream_usage=True)),
+    CohereAdapter(),
+    AzureOpenAIAdapter(),
+):
+    registry.register(_adapter)
+_load_plugins(registry)
+
+
+def parse_body(r: httpx.Response) -> Any:
+    return fastjson.response_json(r)
+
+
+def record_usage(adapter: ProviderAdapter, usage: dict | None) -> dict | None:
+    if usage:
+        for kind in ("input", "output", "cached", "cache_write"):
+            if usage.get(f"{kind}_tokens"):
+                metrics.chat_tokens.inc(adapter.id, kind, amount=usage[f"{kind}_tokens"])
+    return usage
+
+
+def usage(adapter: ProviderAdapter, data: Any) -> dict | None:
+    """Normalized token usage of a full response (cached prompt tokens included)."""
+    return record_usage(adapter, adapter.normalize_usage(adapter.usage_of(data)))
+
+
+def _usage_parser(adapter: ProviderAdapter) -> streaming.Parser:
+    """The adapter's stream parser with the final usage normalized like ``usage``."""
+    async def parse(resp: httpx.Response):
+        async for event in adapter.stream_parser(resp):
+            if event["type"] == "done" and event.get("usage"):
+                event = {**event, "usage": record_usage(adapter, adapter.normalize_usage(event["usage"]))}
+            yield event
+    return parse
+
+
+def fit(adapter: ProviderAdapter, req: ChatRequest):
+    """Fit ``req`` into the model's context window (see tokens.TokenCounter.fit); 400 when it never can.
+
+    Unknown windows skip the check; await ``context_windows.get`` first to look up Ollama's.
+    """
+    try:
+        return token_counter.fit(adapter.id, context_windows.lookup(adapter, req.model, req.base), req)
+    except TokenBudgetError as e:
+        raise HTTPException(status_code=400, detail={"error": {
+            "message": str(e), "code": "context_length_exceeded",
+            "input_tokens": e.input_tokens, "context_window": e.window}})
+
+
+def local_slot(adapter: ProviderAdapter, req: ChatRequest, priority: str):
+    """Local Ollama generations are queued by the scheduler; cloud calls go straight out."""
+    if adapter.id == "ollama":
+        return ollama_scheduler.slot(req.base, req.model, priority)
+    return contextlib.nullcontext()
+
+
+async def complete(adapter: ProviderAdapter, req: ChatRequest, timeout: httpx.Timeout,
+                   priority: str = INTERACTIVE, coalesce: bool = False) -> tuple[httpx.Response, Any]:
+    """Validate, send and parse one non-streaming completion.
+
+    ``coalesce`` lets identical concurrent calls share one upstream response; pass it only
+    for cacheable requests (see ``cache.cacheable``), as one sampled reply is no stand-in
+    for another.
+    """
+    adapter.validate(req)
+    call = adapter.build(req)
+    async with local_slot(adapter, req, priority):
+        started = time.perf_counter()
+        r = await upstreams.post(call.url, json=call.payload, headers=call.headers, timeout=timeout, coalesce=coalesce)
+    metrics.chat_duration.observe(time.perf_counter() - started, adapter.id, req.model)
+    metrics.chat_responses.inc(adapter.id, r.status_code)
+    return r, parse_body(r)
+
+
+async def stream(adapter: ProviderAdapter, req: ChatRequest, provider: str, timeout: httpx.Timeout,
+                 on_complete: streaming.OnComplete | None = None, response_headers: dict | None = None,
+                 priority: str = INTERACTIVE):
+    adapter.validate(req)
+    call = adapter.build(req, stream=True)
+
+    async def open_stream():
+        started = time.perf_counter()
+        resp = await streaming.open_chat_stream(call.url, call.payload, call.headers, _usage_parser(adapter), provider, req.model,
+                                                timeout, on_complete=on_complete, response_headers=response_headers)
+        metrics.chat_ttfb.observe(time.perf_counter() - started, adapter.id, req.model)
+        metrics.chat_responses.inc(adapter.id, resp.status_code)
+        return resp
+
+    return await _holding_local_slot(adapter, req, priority, open_stream)
+
+
+async def passthrough(adapter: ProviderAdapter, req: ChatRequest, timeout: httpx.Timeout, stream: bool = False,
+                      response_headers: dict | None = None, priority: str = INTERACTIVE) -> Response:
+    """Relay the upstream response byte for byte: no parsing, no normalization, no cache.
+
+    The body is streamed to the client as it arrives, so large payloads are never held in
+    memory. Non-JSON error bodies (gateways, proxies) keep the usual ``{"raw": text}`` shape.
+    """
+    adapter.validate(req)
+    call = adapter.build(req, stream=stream)
+
+    async def open_relay():
+        started = time.perf_counter()
+        resp = await upstreams.open_stream("POST", call.url, json=call.payload, headers=call.headers, timeout=timeout)
+        metrics.chat_responses.inc(adapter.id, resp.status_code)
+        if stream:
+            metrics.chat_ttfb.observe(time.perf_counter() - started, adapter.id, req.model)
+        ctype = resp.headers.get("content-type", "")
+        if resp.status_code >= 400 and not ctype.startswith("application/json"):
+            try:
+                await resp.aread()
+            finally:
+                await resp.aclose()
+            return fastjson.JSONResponse(status_code=resp.status_code, content={"raw": resp.text})
+
+        async def relay():
+            try:
+                async for chunk in resp.aiter_bytes():
+                    yield chunk
+            finally:
+                await resp.aclose()
+                if not stream:
+                    metrics.chat_duration.observe(time.perf_counter() - started, adapter.id, req.model)
+        headers = {**(streaming.SSE_HEADERS if stream else {}), **(response_headers or {})}
+        return StreamingResponse(relay(), status_code=resp.status_code, media_type=ctype or None, headers=headers)
+
+    return await _holding_local_slot(adapter, req, priority, open_relay)
+
+
+async def _holding_local_slot(adapter: ProviderAdapter, req: ChatRequest, priority: str, open_response) -> Response:
+    """Open a response while holding the Ollama slot until its body is fully relayed."""
+    if adapter.id != "ollama":
+        return await open_response()
+    # Hold the slot until the relayed stream finishes (or the client goes away)
+    ticket = await ollama_scheduler.acquire(req.base, req.model, priority)
+    try:
+        resp = await open_response()
+    except BaseException:
+        ollama_scheduler.release(ticket)
+        raise
+    if not isinstance(resp, StreamingResponse):
+        ollama_scheduler.release(ticket)
+        return resp
+    body = resp.body_iterator
+
+    async def release_when_done():
+        try:
+            async for chunk in body:
+                yield chunk
+        finally:
+            ollama_scheduler.release(ticket)
+    resp.body_iterator = release_when_done()
+    return resp
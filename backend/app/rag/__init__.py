@@ -0,0 +1 @@
+"""Local retrieval-augmented generation: ingestion, chunking, embeddings and search."""
@@ -0,0 +1,115 @@
+"""Text extraction and overlapping, paragraph-aligned chunking."""
+from __future__ import annotations
+
+import hashlib
+import os
+import re
+import zlib
+from dataclasses import dataclass
+
+
+CHUNK_CHARS = int(os.getenv("RAG_CHUNK_CHARS", "1200"))
+CHUNK_OVERLAP = int(os.getenv("RAG_CHUNK_OVERLAP", "200"))
+
+# On average every ANCHOR_EVERY-th paragraph may end a chunk (see chunk_text)
+ANCHOR_EVERY = 3
+
+TEXT_EXTENSIONS = {".txt", ".md", ".markdown", ".rst", ".csv", ".json", ".log", ".html", ".htm"}
+
+
+@dataclass(frozen=True)
+class Chunk:
+    idx: int
+    text: str
+    start: int
+    end: int
+
+    @property
+    def hash(self) -> str:
+        return hashlib.sha256(self.text.encode("utf-8")).hexdigest()
+
+
+class UnsupportedDocument(Exception):
+    pass
+
+
+def extract_text(path: str) -> str:
+    """Return the plain text of a text/markdown/PDF file."""
+    ext = os.path.splitext(path)[1].lower()
+    if ext == ".pdf":
+        try:
+            from pypdf import PdfReader
+        except ImportError:
+            raise UnsupportedDocument("PDF support requires `pip install pypdf`")
+        reader = PdfReader(path)
+        return "\n\n".join((page.extract_text() or "") for page in reader.pages)
+    if ext in TEXT_EXTENSIONS or not ext:
+        with open(path, "r", encoding="utf-8", errors="replace") as f:
+            return f.read()
+    raise UnsupportedDocument(f"Unsupported file type: {ext}")
+
+
+_PARAGRAPH = re.compile(r"\S(?:.*?\S)??(?=\n\s*\n|\s*\Z)", re.S)
+
+
+def _units(text: str, max_len: int) -> list[tuple[int, int]]:
+    """Paragraph spans; paragraphs longer than max_len are cut at whitespace."""
+    spans = []
+    for m in _PARAGRAPH.finditer(text):
+        start, end = m.start(), m.end()
+        while end - start > max_len:
+            cut = text.rfind(" ", start + max_len // 2, start + max_len)
+            cut = cut if cut > start else start + max_len
+            spans.append((start, cut))
+            start = cut
+            while start < end and text[start].isspace():
+                start += 1
+        if end > start:
+            spans.append((start, end))
+    return spans
+
+
+def chunk_text(text: str, size: int = CHUNK_CHARS, overlap: int = CHUNK_OVERLAP) -> list[Chunk]:
+    """Pack whole paragraphs into windows of at most about ``size`` characters.
+
+    Consecutive windows share trailing paragraphs worth up to ``overlap`` characters.
+    Window ends are content-defined: once a window holds a quarter of ``size`` in new
+    text it closes after any paragraph whose checksum hits an anchor value, so boundaries depend on the local text
+    rather than on everything before it. An edit therefore only changes the chunks near
+    it, which keeps re-indexing a modified document incremental.
+    """
+    overlap = max(0, min(overlap, size // 2))
+    units = _units(text, overlap or size)
+    chunks: list[Chunk] = []
+    cur: list[tuple[int, int]] = []
+    cur_len = 0
+
+    def flush() -> None:
+        nonlocal cur, cur_len
+        start, end = cur[0][0], cur[-1][1]
+        chunks.append(Chunk(len(chunks), text[start:end], start, end))
+        keep: list[tuple[int, int]] = []
+        kept = 0
+        for prev in reversed(cur):
+            if kept + (prev[1] - prev[0]) > overlap:
+                break
+            keep.insert(0, prev)
+            kept += prev[1] - prev[0]
+        cur, cur_len = keep, kept
+
+    fresh = 0  # characters added since the last boundary (excluding the carried overlap)
+    for unit in units:
+        unit_len = unit[1] - unit[0]
+        if fresh and cur_len + unit_len > size:
+            flush()
+            fresh = 0
+        cur.append(unit)
+        cur_len += unit_len
+        fresh += unit_len
+        if fresh >= size // 4 and zlib.crc32(text[unit[0]:unit[1]].encode("utf-8")) % ANCHOR_EVERY == 0:
+            flush()
+            fresh = 0
+    if cur and (not chunks or cur[-1][1] > chunks[-1].end):
+        start, end = cur[0][0], cur[-1][1]
+        chunks.append(Chunk(len(chunks), text[start:end], start, end))
+    return chunks
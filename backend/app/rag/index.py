@@ -0,0 +1,334 @@
+"""Memory-mapped vector index with exact and IVF (inverted file) top-k search.
+
+An index version is a directory holding one contiguous float32 matrix of L2-normalized
+embeddings (``vectors.f32``, opened with ``np.memmap`` so startup does not read it),
+plus each row's chunk key: a source code and the chunk's index within that source, which
+stay stable when a source is re-indexed. Cosine similarity is then a single matrix-vector
+product.
+
+Large corpora (``RAG_ANN_MIN_ROWS`` rows or more, unless ``RAG_ANN=off``) also get an IVF
+layout: rows are clustered with k-means and stored sorted by cluster, so a query only
+scores the ``nprobe`` contiguous row ranges whose centroids are closest to it.
+
+Builds write a new version directory and then atomically repoint ``CURRENT``; readers in
+any worker process notice the change on their next search. Re-indexing one source only
+swaps that source's rows: the rest are copied from the previous version, and IVF
+centroids are reused until the row count has changed by ``RAG_ANN_RETRAIN_RATIO``.
+
+NumPy is an optional dependency; ``available()`` reports whether vector search can run.
+"""
+from __future__ import annotations
+
+import json
+import math
+import os
+import shutil
+import threading
+import time
+from typing import Iterable, Iterator
+
+try:
+    import numpy as np
+except ImportError:  # pragma: no cover - exercised only without numpy
+    np = None
+
+
+RAG_ANN = os.getenv("RAG_ANN", "auto").strip().lower()  # auto | ivf | off
+RAG_ANN_MIN_ROWS = int(os.getenv("RAG_ANN_MIN_ROWS", "50000"))
+RAG_ANN_NPROBE = int(os.getenv("RAG_ANN_NPROBE", "16"))
+RAG_ANN_RETRAIN_RATIO = max(1.0, float(os.getenv("RAG_ANN_RETRAIN_RATIO", "2")))
+KMEANS_ITERS = 8
+BLOCK_ROWS = 65536
+
+
+def available() -> bool:
+    return np is not None
+
+
+def _normalize(mat):
+    norms = np.linalg.norm(mat, axis=1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return mat / norms
+
+
+def _top_k(scores, k: int):
+    if scores.shape[0] <= k:
+        order = np.argsort(-scores)
+    else:
+        part = np.argpartition(-scores, k - 1)[:k]
+        order = part[np.argsort(-scores[part])]
+    return order
+
+
+def _kmeans(sample, nlist: int, iters: int = KMEANS_ITERS, seed: int = 0):
+    """Spherical k-means on normalized rows; returns normalized centroids."""
+    rng = np.random.default_rng(seed)
+    centroids = sample[rng.choice(sample.shape[0], size=nlist, replace=False)].copy()
+    for _ in range(iters):
+        assign = np.argmax(sample @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assign, sample)
+        counts = np.bincount(assign, minlength=nlist)
+        empty = counts == 0
+        if empty.any():
+            sums[empty] = sample[rng.choice(sample.shape[0], size=int(empty.sum()), replace=False)]
+        centroids = _normalize(sums)
+    return centroids.astype(np.float32)
+
+
+class IndexVersion:
+    """A loaded, read-only index version."""
+
+    def __init__(self, path: str):
+        with open(os.path.join(path, "meta.json"), "r", encoding="utf-8") as f:
+            self.meta = json.load(f)
+        self.path = path
+        self.n = int(self.meta["n"])
+        self.dim = int(self.meta["dim"])
+        self.sources: list[str] = self.meta["sources"]
+        self.source_codes = {s: i for i, s in enumerate(self.sources)}
+        self.source_counts: list[int] = self.meta.get("source_counts") or [0] * len(self.sources)
+        shape = (self.n, self.dim)
+        self.vectors = np.memmap(os.path.join(path, "vectors.f32"), dtype=np.float32, mode="r", shape=shape) if self.n else np.zeros(shape, np.float32)
+        self.chunks = np.load(os.path.join(path, "chunks.npy"), mmap_mode="r")
+        self.codes = np.load(os.path.join(path, "sources.npy"), mmap_mode="r")
+        self.centroids = None
+        self.offsets = None
+        if self.meta.get("ivf"):
+            self.centroids = np.load(os.path.join(path, "centroids.npy"))
+            self.offsets = np.load(os.path.join(path, "offsets.npy"))
+
+    def search(self, query: list[float], k: int, source_ids: list[str] | None = None,
+               nprobe: int = RAG_ANN_NPROBE) -> list[tuple[tuple[str, int], float]]:
+        """Top-k as ((source_id, chunk index), cosine score)."""
+        if self.n == 0 or k <= 0:
+            return []
+        q = np.asarray(query, dtype=np.float32)
+        if q.shape[0] != self.dim:
+            raise ValueError(f"Query has {q.shape[0]} dims, index has {self.dim}")
+        q = q / (np.linalg.norm(q) or 1.0)
+
+        allowed = None
+        if source_ids:
+            codes = [self.source_codes[s] for s in source_ids if s in self.source_codes]
+            if not codes:
+                return []
+            allowed = np.asarray(codes, dtype=np.int32)
+
+        ivf = self.centroids is not None
+        if ivf and allowed is not None:
+            # Selective filters scan their own rows exactly: cheaper than probing, and
+            # probing could leave fewer than k matches
+            filtered = sum(self.source_counts[c] for c in allowed)
+            ivf = filtered > self.n * nprobe / self.centroids.shape[0]
+
+        if ivf:
+            probe = _top_k(self.centroids @ q, min(nprobe, self.centroids.shape[0]))
+            ranges = [(int(self.offsets[c]), int(self.offsets[c + 1])) for c in probe]
+            rows = np.concatenate([np.arange(a, b) for a, b in ranges if b > a]) if ranges else np.empty(0, np.int64)
+            if allowed is not None and rows.size:
+                rows = rows[np.isin(self.codes[rows], allowed)]
+            if rows.size == 0:
+                return []
+            if allowed is None:
+                scores = np.concatenate([self.vectors[a:b] @ q for a, b in ranges if b > a])
+            else:
+                scores = self.vectors[rows] @ q
+        elif allowed is not None:
+            rows = np.flatnonzero(np.isin(self.codes, allowed))
+            if rows.size == 0:
+                return []
+            scores = self.vectors[rows] @ q
+        else:
+            rows = None
+            scores = self.vectors @ q
+
+        order = _top_k(scores, k)
+        picked = order if rows is None else rows[order]
+        return [((self.sources[self.codes[i]], int(self.chunks[i])), float(scores[j])) for i, j in zip(picked, order)]
+
+
+class VectorIndex:
+    def __init__(self, root: str):
+        self.root = root
+        self._current: IndexVersion | None = None
+        self._current_name = ""
+        self._lock = threading.Lock()
+
+    def _pointer(self) -> str:
+        return os.path.join(self.root, "CURRENT")
+
+    def current(self) -> IndexVersion | None:
+        """The latest built version, reloaded when another process has rebuilt it."""
+        try:
+            with open(self._pointer(), "r", encoding="utf-8") as f:
+                name = f.read().strip()
+        except FileNotFoundError:
+            return None
+        if name != self._current_name:
+            with self._lock:
+                if name != self._current_name:
+                    try:
+                        self._current = IndexVersion(os.path.join(self.root, name))
+                    except FileNotFoundError:
+                        return None  # an older layout: the next build replaces it
+                    self._current_name = name
+        return self._current
+
+    def build(self, blocks: Iterable[tuple], n: int, dim: int, sources: dict[str, int],
+              ann: str = RAG_ANN, min_rows: int = RAG_ANN_MIN_ROWS) -> str:
+        """Write a new version from (chunk indexes, source_codes, vectors) blocks and publish it.
+
+        ``sources`` maps source ids to the codes used in the blocks; it may be filled in
+        while the blocks are consumed (see ``iter_blocks``).
+        """
+        name, path = self._new_version()
+        mat, chunks, codes = self._allocate(path, n, dim)
+        self._fill(mat, chunks, codes, 0, blocks)
+        return self._publish(name, path, mat, chunks, codes, dim, sources, ann, min_rows)
+
+    def update(self, base: IndexVersion, replaced: list[str], blocks: Iterable[tuple], n_new: int,
+               sources: dict[str, int], ann: str = RAG_ANN, min_rows: int = RAG_ANN_MIN_ROWS,
+               retrain_ratio: float = RAG_ANN_RETRAIN_RATIO) -> str:
+        """Publish ``base`` with the rows of the ``replaced`` sources swapped for ``blocks``.
+
+        Other sources' rows are copied from ``base`` instead of being re-read from SQLite.
+        ``sources`` must start as a copy of ``base.source_codes``. An IVF layout keeps its
+        centroids, with new rows assigned to the nearest one, until the row count has
+        grown or shrunk by ``retrain_ratio`` since they were trained.
+        """
+        drop = [base.source_codes[s] for s in replaced if s in base.source_codes]
+        keep = np.flatnonzero(~np.isin(base.codes, drop)) if drop else np.arange(base.n)
+        n = keep.size + n_new
+        name, path = self._new_version()
+        mat, chunks, codes = self._allocate(path, n, base.dim)
+        for a in range(0, keep.size, BLOCK_ROWS):
+            rows = keep[a:a + BLOCK_ROWS]
+            mat[a:a + rows.size] = base.vectors[rows]
+            chunks[a:a + rows.size] = base.chunks[rows]
+            codes[a:a + rows.size] = base.codes[rows]
+        self._fill(mat, chunks, codes, keep.size, blocks)
+
+        trained_n = int(base.meta.get("trained_n") or 0)
+        ivf = None
+        if base.centroids is not None and n and trained_n and trained_n / retrain_ratio <= n <= trained_n * retrain_ratio:
+            # Kept rows stay in their cluster; find it from the sorted layout's offsets
+            assign = np.empty(n, dtype=np.int32)
+            assign[:keep.size] = np.searchsorted(base.offsets, keep, side="right") - 1
+            for a in range(keep.size, n, BLOCK_ROWS):
+                assign[a:a + BLOCK_ROWS] = np.argmax(np.asarray(mat[a:a + BLOCK_ROWS]) @ base.centroids.T, axis=1)
+            ivf = (base.centroids, assign, trained_n)
+        return self._publish(name, path, mat, chunks, codes, base.dim, sources, ann, min_rows, ivf)
+
+    def _new_version(self) -> tuple[str, str]:
+        name = f"v{time.time_ns()}"
+        path = os.path.join(self.root, name)
+        os.makedirs(path, exist_ok=True)
+        return name, path
+
+    @staticmethod
+    def _allocate(path: str, n: int, dim: int):
+        vec_path = os.path.join(path, "vectors.f32")
+        if n == 0:
+            open(vec_path, "wb").close()
+        mat = np.memmap(vec_path, dtype=np.float32, mode="w+", shape=(n, dim)) if n else None
+        return mat, np.empty(n, dtype=np.int32), np.empty(n, dtype=np.int32)
+
+    @staticmethod
+    def _fill(mat, chunks, codes, pos: int, blocks: Iterable[tuple]) -> None:
+        for block_chunks, block_codes, block_vecs in blocks:
+            m = len(block_chunks)
+            if pos + m > len(chunks):
+                raise ValueError(f"Expected {len(chunks)} rows, got more")
+            mat[pos:pos + m] = _normalize(np.asarray(block_vecs, dtype=np.float32))
+            chunks[pos:pos + m] = block_chunks
+            codes[pos:pos + m] = block_codes
+            pos += m
+        if pos != len(chunks):
+            raise ValueError(f"Expected {len(chunks)} rows, got {pos}")
+
+    def _publish(self, name: str, path: str, mat, chunks, codes, dim: int, sources: dict[str, int],
+                 ann: str, min_rows: int, ivf: tuple | None = None) -> str:
+        n = len(chunks)
+        names = sorted(sources, key=sources.get)
+        counts = np.bincount(codes, minlength=len(names)).tolist() if n else [0] * len(names)
+        meta = {"n": n, "dim": dim, "sources": names, "source_counts": counts, "ivf": False, "built": time.time()}
+        if n and (ann == "ivf" or (ann == "auto" and n >= min_rows)):
+            if ivf is None:
+                ivf = (*self._train(mat), n)
+            centroids, assign, trained_n = ivf
+            self._write_ivf(path, mat, chunks, codes, centroids, assign, meta)
+            meta["trained_n"] = trained_n
+        else:
+            if mat is not None:
+                mat.flush()
+            np.save(os.path.join(path, "chunks.npy"), chunks)
+            np.save(os.path.join(path, "sources.npy"), codes)
+        del mat
+        with open(os.path.join(path, "meta.json"), "w", encoding="utf-8") as f:
+            json.dump(meta, f)
+        tmp = self._pointer() + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            f.write(name)
+        os.replace(tmp, self._pointer())
+        self._cleanup(keep=name)
+        return name
+
+    @staticmethod
+    def _train(mat):
+        """k-means centroids for ``mat`` and every row's nearest centroid."""
+        n = mat.shape[0]
+        nlist = max(1, min(int(math.sqrt(n)), n // 39 or 1))
+        rng = np.random.default_rng(0)
+        sample_size = min(n, max(nlist * 64, 10000))
+        sample = np.asarray(mat[np.sort(rng.choice(n, size=sample_size, replace=False))])
+        centroids = _kmeans(sample, nlist)
+        assign = np.empty(n, dtype=np.int32)
+        for a in range(0, n, BLOCK_ROWS):
+            assign[a:a + BLOCK_ROWS] = np.argmax(np.asarray(mat[a:a + BLOCK_ROWS]) @ centroids.T, axis=1)
+        return centroids, assign
+
+    @staticmethod
+    def _write_ivf(path: str, mat, chunks, codes, centroids, assign, meta: dict) -> None:
+        n = mat.shape[0]
+        nlist = centroids.shape[0]
+        order = np.argsort(assign, kind="stable")
+        offsets = np.zeros(nlist + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assign, minlength=nlist), out=offsets[1:])
+
+        sorted_path = os.path.join(path, "vectors.sorted.f32")
+        out = np.memmap(sorted_path, dtype=np.float32, mode="w+", shape=mat.shape)
+        for a in range(0, n, BLOCK_ROWS):
+            idx = order[a:a + BLOCK_ROWS]
+            out[a:a + len(idx)] = mat[idx]
+        out.flush()
+        del out
+        os.replace(sorted_path, os.path.join(path, "vectors.f32"))
+        np.save(os.path.join(path, "chunks.npy"), chunks[order])
+        np.save(os.path.join(path, "sources.npy"), codes[order])
+        np.save(os.path.join(path, "centroids.npy"), centroids)
+        np.save(os.path.join(path, "offsets.npy"), offsets)
+        meta.update({"ivf": True, "nlist": nlist})
+
+    def _cleanup(self, keep: str) -> None:
+        # Keep the previous version too: other workers may still have it mapped
+        versions = sorted(d for d in os.listdir(self.root) if d.startswith("v") and d != keep)
+        for old in versions[:-1]:
+            shutil.rmtree(os.path.join(self.root, old), ignore_errors=True)
+
+
+def iter_blocks(rows: Iterator[tuple[str, int, bytes]], dim: int, sources: dict[str, int],
+                block_rows: int = BLOCK_ROWS) -> Iterator[tuple]:
+    """Group (source_id, chunk index, float32 blob) rows from SQLite into NumPy blocks."""
+    chunks: list[int] = []
+    codes: list[int] = []
+    blobs: list[bytes] = []
+    for source_id, idx, blob in rows:
+        chunks.append(idx)
+        codes.append(sources.setdefault(source_id, len(sources)))
+        blobs.append(blob)
+        if len(chunks) >= block_rows:
+            yield chunks, codes, np.frombuffer(b"".join(blobs), dtype=np.float32).reshape(-1, dim)
+            chunks, codes, blobs = [], [], []
+    if chunks:
+        yield chunks, codes, np.frombuffer(b"".join(blobs), dtype=np.float32).reshape(-1, dim)
@@ -0,0 +1,381 @@
+"""Source uploads, chunk metadata and the background indexing pipeline.
+
+Uploaded files are streamed to ``<data>/rag/sources/<source_id>/``. Indexing runs as a
+background task: extract text, chunk it, embed only the chunks whose content hash has no
+vector yet (for the current embedding model), then swap the source's chunk rows in one
+transaction. Vectors are keyed by chunk hash, so unchanged chunks of a re-uploaded file
+reuse their existing embeddings.
+
+State lives in ``<data>/rag/rag.sqlite3`` so every worker process sees job status. Chunk
+text is mirrored into an FTS5 table (kept in sync by triggers) for BM25 keyword search.
+"""
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import importlib
+import os
+import re
+import tempfile
+import threading
+import time
+from array import array
+from typing import AsyncIterator
+
+from .. import storage
+from ..embeddings import Embedder, OllamaEmbedder, EMBED_MODEL
+from ..uploads import UploadTooLarge
+from .chunking import chunk_text, extract_text
+
+
+RAG_EMBED_MODEL = os.getenv("RAG_EMBED_MODEL", EMBED_MODEL)
+RAG_EMBEDDER = os.getenv("RAG_EMBEDDER", "").strip()  # optional "module:attr" embedder
+RAG_EMBED_BATCH = int(os.getenv("RAG_EMBED_BATCH", "32"))
+RAG_INDEX_CONCURRENCY = int(os.getenv("RAG_INDEX_CONCURRENCY", "1"))
+RAG_MAX_UPLOAD_MB = float(os.getenv("RAG_MAX_UPLOAD_MB", "100"))
+
+
+def load_embedder() -> Embedder:
+    if RAG_EMBEDDER:
+        module_name, _, attr = RAG_EMBEDDER.partition(":")
+        obj = getattr(importlib.import_module(module_name), attr)
+        return obj() if isinstance(obj, type) else obj
+    return OllamaEmbedder(model=RAG_EMBED_MODEL)
+
+
+def safe_filename(name: str) -> str:
+    name = os.path.basename((name or "").replace("\\", "/")).strip()
+    name = re.sub(r"[^A-Za-z0-9._ -]+", "_", name).strip(" .")
+    return name or "upload.txt"
+
+
+def source_id_for(filename: str) -> str:
+    """Stable id per filename, so re-uploading a file updates the same source."""
+    return "src_" + hashlib.sha1(filename.lower().encode("utf-8")).hexdigest()[:12]
+
+
+def pack_vector(vec: list[float]) -> bytes:
+    return array("f", vec).tobytes()
+
+
+def unpack_vector(blob: bytes) -> array:
+    out = array("f")
+    out.frombytes(blob)
+    return out
+
+
+class RagStore:
+    def __init__(self, path: str | None = None):
+        self._path = path
+        self._conn = None
+        self._lock = threading.Lock()
+        self.fts = False
+
+    @property
+    def conn(self):
+        if self._conn is None:
+            self._conn = storage.connect_sqlite(self._path or storage.data_path("rag", "rag.sqlite3"))
+            self._conn.executescript(
+                """
+                CREATE TABLE IF NOT EXISTS sources (
+                    source_id TEXT PRIMARY KEY, filename TEXT NOT NULL, path TEXT NOT NULL,
+                    sha256 TEXT NOT NULL, size INTEGER NOT NULL, status TEXT NOT NULL,
+                    indexed_sha256 TEXT, error TEXT, chunks INTEGER DEFAULT 0,
+                    embedded INTEGER DEFAULT 0, reused INTEGER DEFAULT 0,
+                    created REAL NOT NULL, updated REAL NOT NULL);
+                CREATE TABLE IF NOT EXISTS chunks (
+                    source_id TEXT NOT NULL, idx INTEGER NOT NULL, hash TEXT NOT NULL,
+                    start INTEGER NOT NULL, end INTEGER NOT NULL, text TEXT NOT NULL,
+                    PRIMARY KEY (source_id, idx));
+                CREATE INDEX IF NOT EXISTS chunks_hash ON chunks(hash);
+                CREATE TABLE IF NOT EXISTS vectors (
+                    hash TEXT NOT NULL, model TEXT NOT NULL, dim INTEGER NOT NULL, vector BLOB NOT NULL,
+                    PRIMARY KEY (hash, model));
+                """
+            )
+            self._init_fts()
+        return self._conn
+
+    def _init_fts(self) -> None:
+        conn = self._conn
+        existed = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'chunks_fts'").fetchone() is not None
+        try:
+            conn.executescript(
+                """
+                CREATE VIRTUAL TABLE IF NOT EXISTS chunks_fts USING fts5(text, content='chunks', content_rowid='rowid');
+                CREATE TRIGGER IF NOT EXISTS chunks_fts_ai AFTER INSERT ON chunks BEGIN
+                    INSERT INTO chunks_fts(rowid, text) VALUES (new.rowid, new.text);
+                END;
+                CREATE TRIGGER IF NOT EXISTS chunks_fts_ad AFTER DELETE ON chunks BEGIN
+                    INSERT INTO chunks_fts(chunks_fts, rowid, text) VALUES ('delete', old.rowid, old.text);
+                END;
+                CREATE TRIGGER IF NOT EXISTS chunks_fts_au AFTER UPDATE ON chunks BEGIN
+                    INSERT INTO chunks_fts(chunks_fts, rowid, text) VALUES ('delete', old.rowid, old.text);
+                    INSERT INTO chunks_fts(rowid, text) VALUES (new.rowid, new.text);
+                END;
+                """
+            )
+        except Exception:
+            return  # SQLite built without FTS5: keyword search is unavailable
+        if not existed:
+            conn.execute("INSERT INTO chunks_fts(chunks_fts) VALUES ('rebuild')")
+        self.fts = True
+
+    def _run(self, sql: str, params: tuple = ()):
+        with self._lock:
+            return self.conn.execute(sql, params).fetchall()
+
+    def source_dir(self, source_id: str) -> str:
+        return os.path.dirname(storage.data_path("rag", "sources", source_id, "_"))
+
+    def get_source(self, source_id: str) -> dict | None:
+        with self._lock:
+            cur = self.conn.execute("SELECT * FROM sources WHERE source_id = ?", (source_id,))
+            row = cur.fetchone()
+            return dict(zip([c[0] for c in cur.description], row)) if row else None
+
+    def list_sources(self) -> list[dict]:
+        with self._lock:
+            cur = self.conn.execute("SELECT * FROM sources ORDER BY updated DESC")
+            cols = [c[0] for c in cur.description]
+            return [dict(zip(cols, row)) for row in cur.fetchall()]
+
+    def upsert_source(self, source_id: str, filename: str, path: str, sha256: str, size: int) -> bool:
+        """Record an upload; returns True when the content differs from what was indexed."""
+        now = time.time()
+        existing = self.get_source(source_id)
+        changed = existing is None or existing.get("indexed_sha256") != sha256
+        status = "UPLOADED" if changed else existing["status"]
+        self._run(
+            "INSERT INTO sources (source_id, filename, path, sha256, size, status, created, updated)"
+            " VALUES (?, ?, ?, ?, ?, ?, ?, ?)"
+            " ON CONFLICT(source_id) DO UPDATE SET filename=excluded.filename, path=excluded.path,"
+            " sha256=excluded.sha256, size=excluded.size, status=excluded.status, error=NULL, updated=excluded.updated",
+            (source_id, filename, path, sha256, size, status, now, now),
+        )
+        return changed
+
+    def set_status(self, source_id: str, status: str, **fields) -> None:
+        cols = ", ".join(f"{k} = ?" for k in fields)
+        sql = f"UPDATE sources SET status = ?, updated = ?{', ' + cols if cols else ''} WHERE source_id = ?"
+        self._run(sql, (status, time.time(), *fields.values(), source_id))
+
+    def missing_hashes(self, hashes: list[str], model: str) -> set[str]:
+        have: set[str] = set()
+        unique = list(dict.fromkeys(hashes))
+        for i in range(0, len(unique), 500):
+            batch = unique[i:i + 500]
+            marks = ",".join("?" * len(batch))
+            rows = self._run(f"SELECT hash FROM vectors WHERE model = ? AND hash IN ({marks})", (model, *batch))
+            have.update(r[0] for r in rows)
+        return set(unique) - have
+
+    def put_vectors(self, model: str, items: list[tuple[str, list[float]]]) -> None:
+        with self._lock:
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO vectors (hash, model, dim, vector) VALUES (?, ?, ?, ?)",
+                [(h, model, len(v), pack_vector(v)) for h, v in items],
+            )
+
+    def replace_chunks(self, source_id: str, chunks: list) -> None:
+        with self._lock:
+            conn = self.conn
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                old = {r[0] for r in conn.execute("SELECT hash FROM chunks WHERE source_id = ?", (source_id,))}
+                conn.execute("DELETE FROM chunks WHERE source_id = ?", (source_id,))
+                conn.executemany(
+                    "INSERT INTO chunks (source_id, idx, hash, start, end, text) VALUES (?, ?, ?, ?, ?, ?)",
+                    [(source_id, c.idx, c.hash, c.start, c.end, c.text) for c in chunks],
+                )
+                # Drop this source's old vectors that no chunk refers to anymore
+                stale = old - {c.hash for c in chunks}
+                conn.executemany(
+                    "DELETE FROM vectors WHERE hash = ? AND NOT EXISTS (SELECT 1 FROM chunks WHERE hash = ?)",
+                    [(h, h) for h in stale],
+                )
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+
+    def keyword_search(self, query: str, k: int,
+                       source_ids: list[str] | None = None) -> list[tuple[tuple[str, int], float]]:
+        """BM25 top-k as ((source_id, chunk index), score), higher is better."""
+        terms = re.findall(r"\w+", query.lower())
+        self.conn  # opens the database and detects FTS5 support
+        if not terms or not self.fts:
+            return []
+        match = " OR ".join(f'"{t}"' for t in dict.fromkeys(terms))
+        sql = ("SELECT c.source_id, c.idx, -bm25(chunks_fts) FROM chunks_fts f"
+               " JOIN chunks c ON c.rowid = f.rowid WHERE chunks_fts MATCH ?")
+        params: tuple = (match,)
+        if source_ids:
+            sql += f" AND c.source_id IN ({','.join('?' * len(source_ids))})"
+            params += tuple(source_ids)
+        rows = self._run(sql + " ORDER BY bm25(chunks_fts) LIMIT ?", (*params, k))
+        return [((r[0], int(r[1])), float(r[2])) for r in rows]
+
+    def chunk_rows(self, keys: list[tuple[str, int]]) -> dict[tuple[str, int], dict]:
+        """Chunks by (source_id, chunk index)."""
+        if not keys:
+            return {}
+        marks = ",".join("(?, ?)" for _ in keys)
+        rows = self._run(
+            "SELECT c.source_id, c.idx, c.text, s.filename FROM chunks c"
+            f" JOIN sources s ON s.source_id = c.source_id WHERE (c.source_id, c.idx) IN (VALUES {marks})",
+            tuple(v for key in keys for v in key),
+        )
+        return {(r[0], r[1]): {"source_id": r[0], "chunk": r[1], "text": r[2], "filename": r[3]} for r in rows}
+
+    @staticmethod
+    def _source_filter(source_ids: list[str] | None) -> tuple[str, tuple]:
+        if source_ids is None:
+            return "", ()
+        return f" AND c.source_id IN ({','.join('?' * len(source_ids))})", tuple(source_ids)
+
+    def vector_stats(self, model: str, source_ids: list[str] | None = None) -> tuple[int, int]:
+        """(number of chunks with a vector for ``model``, vector dimension), optionally for some sources."""
+        where, params = self._source_filter(source_ids)
+        row = self._run(
+            "SELECT COUNT(*), MAX(v.dim) FROM chunks c JOIN vectors v ON v.hash = c.hash AND v.model = ?"
+            f" WHERE 1{where}",
+            (model, *params),
+        )[0]
+        return int(row[0]), int(row[1] or 0)
+
+    def iter_vectors(self, model: str, dim: int, source_ids: list[str] | None = None):
+        """Yield (source_id, chunk index, vector blob) for every embedded chunk, optionally of some sources."""
+        where, params = self._source_filter(source_ids)
+        # A dedicated connection, so a long index build does not hold the shared lock
+        conn = storage.connect_sqlite(self._path or storage.data_path("rag", "rag.sqlite3"))
+        try:
+            yield from conn.execute(
+                "SELECT c.source_id, c.idx, v.vector FROM chunks c"
+                f" JOIN vectors v ON v.hash = c.hash AND v.model = ? WHERE v.dim = ?{where}"
+                " ORDER BY c.source_id, c.idx",
+                (model, dim, *params),
+            )
+        finally:
+            conn.close()
+
+
+def public_status(row: dict | None) -> dict | None:
+    if row is None:
+        return None
+    keys = ("source_id", "filename", "size", "sha256", "status", "error", "chunks", "embedded", "reused", "updated")
+    return {k: row.get(k) for k in keys}
+
+
+async def save_upload(store: RagStore, filename: str, chunks: AsyncIterator[bytes]) -> dict:
+    """Stream an upload to disk while hashing it; never holds the whole file in memory.
+
+    Each upload writes its own temporary file, so concurrent uploads of one name do not
+    collide; the last one to finish replaces the source.
+    """
+    filename = safe_filename(filename)
+    source_id = source_id_for(filename)
+    folder = store.source_dir(source_id)
+    final_path = os.path.join(folder, filename)
+    digest = hashlib.sha256()
+    size = 0
+    limit = int(RAG_MAX_UPLOAD_MB * 1024 * 1024)
+    f = await asyncio.to_thread(tempfile.NamedTemporaryFile, dir=folder, prefix=f".{filename}.", suffix=".part", delete=False)
+    try:
+        try:
+            async for chunk in chunks:
+                if not chunk:
+                    continue
+                size += len(chunk)
+                if size > limit:
+                    raise UploadTooLarge(f"Upload exceeds {RAG_MAX_UPLOAD_MB:g} MB")
+                digest.update(chunk)
+                await asyncio.to_thread(f.write, chunk)
+        finally:
+            await asyncio.to_thread(f.close)
+        await asyncio.to_thread(os.replace, f.name, final_path)
+    except BaseException:
+        await asyncio.to_thread(_remove_quietly, f.name)
+        raise
+    sha = digest.hexdigest()
+    changed = await asyncio.to_thread(store.upsert_source, source_id, filename, final_path, sha, size)
+    return {**public_status(await asyncio.to_thread(store.get_source, source_id)), "changed": changed}
+
+
+def _remove_quietly(path: str) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class Indexer:
+    """Runs indexing jobs as background tasks with bounded concurrency."""
+
+    def __init__(self, store: RagStore, embedder: Embedder | None = None):
+        self.store = store
+        self._embedder = embedder
+        self._sem: asyncio.Semaphore | None = None
+        self._tasks: dict[str, asyncio.Task] = {}
+        # Called after a source's chunks change (the vector index hooks in here)
+        self.on_indexed: list = []
+
+    @property
+    def embedder(self) -> Embedder:
+        if self._embedder is None:
+            self._embedder = load_embedder()
+        return self._embedder
+
+    def start(self, source_id: str, force: bool = False) -> dict | None:
+        row = self.store.get_source(source_id)
+        if row is None:
+            return None
+        running = self._tasks.get(source_id)
+        if running is not None and not running.done():
+            return public_status(row)
+        if not force and row["status"] == "INDEXED" and row.get("indexed_sha256") == row["sha256"]:
+            return public_status(row)
+        self.store.set_status(source_id, "QUEUED", error=None)
+        task = asyncio.create_task(self._run(source_id))
+        self._tasks[source_id] = task
+        task.add_done_callback(lambda _t, sid=source_id: self._tasks.pop(sid, None))
+        return public_status(self.store.get_source(source_id))
+
+    async def _run(self, source_id: str) -> None:
+        if self._sem is None:
+            self._sem = asyncio.Semaphore(max(1, RAG_INDEX_CONCURRENCY))
+        async with self._sem:
+            try:
+                await self._index(source_id)
+            except Exception as e:
+                await asyncio.to_thread(self.store.set_status, source_id, "FAILED", error=str(e) or type(e).__name__)
+
+    async def _index(self, source_id: str) -> None:
+        store = self.store
+        row = await asyncio.to_thread(store.get_source, source_id)
+        await asyncio.to_thread(store.set_status, source_id, "INDEXING", embedded=0, reused=0)
+        text = await asyncio.to_thread(extract_text, row["path"])
+        chunks = await asyncio.to_thread(chunk_text, text)
+        embedder = self.embedder
+        model = getattr(embedder, "model", RAG_EMBED_MODEL)
+        missing = await asyncio.to_thread(store.missing_hashes, [c.hash for c in chunks], model)
+        todo = [c for c in {c.hash: c for c in chunks}.values() if c.hash in missing]
+        embedded = 0
+        for i in range(0, len(todo), RAG_EMBED_BATCH):
+            batch = todo[i:i + RAG_EMBED_BATCH]
+            vectors = await embedder.embed([c.text for c in batch])
+            await asyncio.to_thread(store.put_vectors, model, [(c.hash, v) for c, v in zip(batch, vectors)])
+            embedded += len(batch)
+            await asyncio.to_thread(store.set_status, source_id, "INDEXING", embedded=embedded)
+        await asyncio.to_thread(store.replace_chunks, source_id, chunks)
+        await asyncio.to_thread(
+            store.set_status, source_id, "INDEXED",
+            indexed_sha256=row["sha256"], chunks=len(chunks), embedded=embedded,
+            reused=len({c.hash for c in chunks}) - embedded, error=None,
+        )
+        for hook in self.on_indexed:
+            await hook(source_id)
+
+
+rag_store = RagStore()
+indexer = Indexer(rag_store)
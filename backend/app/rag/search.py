@@ -0,0 +1,218 @@
+"""Hybrid retrieval over indexed sources.
+
+Vector top-k (cosine over the memory-mapped index) and BM25 keyword top-k (SQLite FTS5)
+are merged with Reciprocal Rank Fusion. When NumPy, the vector index or the embedder is
+unavailable, search degrades to keyword-only instead of failing.
+
+The vector index is updated in a background thread after each indexing job: only the
+re-indexed sources' rows are re-read from SQLite. Sources indexed while an update is
+running are coalesced into a single follow-up update.
+"""
+from __future__ import annotations
+
+import asyncio
+import os
+import re
+import time
+
+from .. import storage
+from ..cache import LRUCache
+from . import index as vector_index
+from .ingest import RAG_EMBED_MODEL, Indexer, RagStore, indexer, rag_store
+
+
+RAG_SEARCH_K = int(os.getenv("RAG_SEARCH_K", "8"))
+RAG_SEARCH_MAX_K = 100
+RAG_SNIPPET_CHARS = int(os.getenv("RAG_SNIPPET_CHARS", "320"))
+RRF_K = 60
+MODES = ("hybrid", "vector", "keyword")
+
+
+def rrf(rankings: list[list[tuple[str, int]]], k: int = RRF_K) -> dict[tuple[str, int], float]:
+    """Reciprocal Rank Fusion: sum of 1 / (k + rank) over every ranking an item appears in."""
+    fused: dict[tuple[str, int], float] = {}
+    for ranking in rankings:
+        for rank, item in enumerate(ranking, start=1):
+            fused[item] = fused.get(item, 0.0) + 1.0 / (k + rank)
+    return fused
+
+
+def snippet(text: str, limit: int = RAG_SNIPPET_CHARS) -> str:
+    text = re.sub(r"\s+", " ", text).strip()
+    return text if len(text) <= limit else text[:limit].rsplit(" ", 1)[0] + "…"
+
+
+class Searcher:
+    def __init__(self, store: RagStore, indexer: Indexer):
+        self.store = store
+        self.indexer = indexer
+        self._indexes: dict[str, vector_index.VectorIndex] = {}
+        self._query_vectors = LRUCache(256, 3600)
+        self._rebuilding = False
+        self._pending: set[str] = set()  # sources re-indexed since the last update
+        self._full = False
+        self._task: asyncio.Task | None = None
+        self.last_build: dict = {}
+        indexer.on_indexed.append(self._on_indexed)
+
+    @property
+    def model(self) -> str:
+        return getattr(self.indexer.embedder, "model", RAG_EMBED_MODEL)
+
+    def index_for(self, model: str) -> vector_index.VectorIndex:
+        idx = self._indexes.get(model)
+        if idx is None:
+            slug = re.sub(r"[^A-Za-z0-9._-]+", "_", model)
+            root = os.path.dirname(storage.data_path("rag", "index", slug, "_"))
+            idx = self._indexes[model] = vector_index.VectorIndex(root)
+        return idx
+
+    def build(self, changed: set[str] | None = None) -> dict:
+        """Bring the vector index for the current embedding model up to date (blocking).
+
+        With ``changed``, only those sources' rows are re-read and merged into the current
+        version; without it, or when there is no compatible version, every row is.
+        """
+        model = self.model
+        started = time.perf_counter()
+        idx = self.index_for(model)
+        current = idx.current()
+        incremental = current is not None and changed is not None
+        if incremental:
+            if not changed:
+                return self.last_build
+            ids = sorted(changed)
+            n, dim = self.store.vector_stats(model, ids)
+            incremental = n == 0 or dim == current.dim
+        if incremental:
+            sources = dict(current.source_codes)
+            blocks = vector_index.iter_blocks(self.store.iter_vectors(model, current.dim, ids), current.dim, sources)
+            version = idx.update(current, ids, blocks, n, sources)
+        else:
+            n, dim = self.store.vector_stats(model)
+            sources = {}
+            blocks = vector_index.iter_blocks(self.store.iter_vectors(model, dim), dim, sources)
+            version = idx.build(blocks, n, dim, sources)
+        built = idx.current()
+        self.last_build = {"model": model, "version": version, "rows": built.n, "dim": built.dim,
+                           "incremental": incremental, "seconds": round(time.perf_counter() - started, 3),
+                           "error": None}
+        return self.last_build
+
+    async def refresh(self) -> None:
+        if not vector_index.available() or self._rebuilding:
+            return
+        self._rebuilding = True
+        try:
+            while True:
+                changed, self._pending = self._pending, set()
+                full, self._full = self._full, False
+                try:
+                    await asyncio.to_thread(self.build, None if full else changed)
+                except Exception as e:
+                    self.last_build = {"model": self.model, "error": str(e) or type(e).__name__}
+                    self._full = True  # these changes never reached the index
+                if not self._pending:
+                    break
+        finally:
+            self._rebuilding = False
+
+    def _schedule_refresh(self) -> None:
+        # A running refresh picks up sources added to ``_pending`` before it finishes
+        if self._task is None or self._task.done():
+            self._task = asyncio.create_task(self.refresh())
+
+    async def _on_indexed(self, source_id: str) -> None:
+        self._pending.add(source_id)
+        self._schedule_refresh()
+
+    async def _embed_query(self, q: str) -> list[float] | None:
+        key = f"{self.model}\x00{q}"
+        vec = self._query_vectors.get(key)
+        if vec is None:
+            try:
+                vec = (await self.indexer.embedder.embed([q]))[0]
+            except Exception:
+                return None
+            self._query_vectors.set(key, vec)
+        return vec
+
+    async def _vector_hits(self, q: str, k: int,
+                           source_ids: list[str] | None) -> list[tuple[tuple[str, int], float]] | None:
+        if not vector_index.available():
+            return None
+        current = self.index_for(self.model).current()
+        if current is None:
+            # Vectors from before the index existed: build it in the background
+            if await asyncio.to_thread(self.store.vector_stats, self.model) != (0, 0):
+                self._schedule_refresh()
+            return None
+        if current.n == 0:
+            return []
+        vec = await self._embed_query(q)
+        if vec is None or len(vec) != current.dim:
+            return None
+        return await asyncio.to_thread(current.search, vec, k, source_ids)
+
+    async def search(self, q: str, k: int = RAG_SEARCH_K, source_ids: list[str] | None = None,
+                     mode: str = "hybrid") -> dict:
+        q = (q or "").strip()
+        k = max(1, min(int(k), RAG_SEARCH_MAX_K))
+        mode = mode if mode in MODES else "hybrid"
+        if not q:
+            return {"query": q, "mode": mode, "results": []}
+        started = time.perf_counter()
+        # Over-fetch each ranking so fusion has overlap to work with
+        depth = k * 4 if mode == "hybrid" else k
+
+        vector_hits: list[tuple[tuple[str, int], float]] | None = None
+        keyword_hits: list[tuple[tuple[str, int], float]] = []
+        if mode in ("hybrid", "vector"):
+            vector_hits = await self._vector_hits(q, depth, source_ids)
+        used = mode
+        if vector_hits is None:
+            used = "keyword"
+        if used != "vector":
+            keyword_hits = await asyncio.to_thread(self.store.keyword_search, q, depth, source_ids)
+
+        if used == "hybrid":
+            fused = rrf([[r for r, _ in vector_hits], [r for r, _ in keyword_hits]])
+            ranked = sorted(fused.items(), key=lambda item: -item[1])[:k]
+        else:
+            ranked = (vector_hits if used == "vector" else keyword_hits)[:k]
+
+        rows = await asyncio.to_thread(self.store.chunk_rows, [r for r, _ in ranked])
+        results = []
+        for key, score in ranked:
+            row = rows.get(key)
+            if row is None:  # chunk removed since the index was built
+                continue
+            results.append({
+                "source_id": row["source_id"],
+                "title": row["filename"],
+                "chunk": row["chunk"],
+                "snippet": snippet(row["text"]),
+                "score": round(score, 6),
+            })
+        return {
+            "query": q,
+            "mode": used,
+            "results": results,
+            "took_ms": round((time.perf_counter() - started) * 1000, 2),
+        }
+
+    def stats(self) -> dict:
+        current = self.index_for(self.model).current() if vector_index.available() else None
+        return {
+            "numpy": vector_index.available(),
+            "keyword": self.store.fts if self.store._conn is not None else None,
+            "index": None if current is None else {
+                "rows": current.n, "dim": current.dim, "ivf": bool(current.meta.get("ivf")),
+                "nlist": current.meta.get("nlist"), "built": current.meta.get("built"),
+            },
+            "rebuilding": self._rebuilding,
+            "last_build": self.last_build,
+        }
+
+
+searcher = Searcher(rag_store, indexer)
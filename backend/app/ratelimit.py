@@ -0,0 +1,197 @@
+"""Token-bucket rate limiting for the API routes.
+
+Each (route group, client) pair gets one bucket of two floats, refilled continuously,
+so a check is O(1) time and memory regardless of the limit. The client is the remote IP.
+Bearer tokens are not used: the only token is the shared ``LOCAL_API_TOKEN``, which every
+client sends, and arbitrary tokens would let one client mint fresh buckets at will.
+
+Buckets that have been idle long enough to refill completely are indistinguishable from
+new ones, so they are evicted; the number of tracked keys is also hard-capped.
+
+``RATE_LIMIT_BACKEND=sqlite`` keeps buckets in a SQLite file under the data directory so
+limits hold across multiple worker processes.
+"""
+from __future__ import annotations
+
+import math
+import os
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from fastapi import HTTPException, Request
+
+from . import metrics, storage
+
+
+WINDOW_SEC = 60
+RATE_LIMIT = int(os.getenv("RATE_LIMIT", "300"))  # requests per WINDOW_SEC, per client, per route group
+RATE_LIMIT_MAX_KEYS = int(os.getenv("RATE_LIMIT_MAX_KEYS", "10000"))
+# Shared SQLite buckets by default when several worker processes serve the API
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "sqlite" if storage.MULTI_PROCESS else "memory").strip().lower()
+
+
+@dataclass(frozen=True)
+class Limit:
+    capacity: float  # burst size
+    per_sec: float   # refill rate
+
+    @classmethod
+    def per_window(cls, requests: int, window: float = WINDOW_SEC) -> "Limit":
+        return cls(capacity=float(requests), per_sec=requests / window)
+
+    @property
+    def idle_horizon(self) -> float:
+        """Seconds after which an untouched bucket is full again."""
+        return self.capacity / self.per_sec if self.per_sec > 0 else math.inf
+
+
+# Route groups, matched by path prefix (first match wins).
+ROUTE_GROUPS: tuple[tuple[str, str], ...] = (
+    ("/health", "health"),
+    ("/api/health", "health"),
+    ("/api/status", "health"),
+    ("/api/chat", "chat"),
+    ("/api/mini/", "chat"),
+    ("/api/googleai/generate", "chat"),
+    ("/api/openrouter/generate", "chat"),
+    ("/api/ollama/generate", "chat"),
+    ("/api/tools/", "tools"),
+)
+
+LIMITS: dict[str, Limit] = {
+    "default": Limit.per_window(RATE_LIMIT),
+    "chat": Limit.per_window(int(os.getenv("RATE_LIMIT_CHAT", str(RATE_LIMIT)))),
+    "tools": Limit.per_window(int(os.getenv("RATE_LIMIT_TOOLS", str(RATE_LIMIT)))),
+    "health": Limit.per_window(int(os.getenv("RATE_LIMIT_HEALTH", str(RATE_LIMIT * 2)))),
+}
+
+
+def route_group(path: str) -> str:
+    for prefix, group in ROUTE_GROUPS:
+        if path.startswith(prefix):
+            return group
+    return "default"
+
+
+def client_key(request: Request) -> str:
+    return "ip:" + (request.client.host if request.client else "anonymous")
+
+
+def _refill(tokens: float, updated: float, now: float, limit: Limit) -> float:
+    return min(limit.capacity, tokens + (now - updated) * limit.per_sec)
+
+
+class MemoryBackend:
+    def __init__(self, max_keys: int = RATE_LIMIT_MAX_KEYS):
+        self.max_keys = max_keys
+        # key -> [tokens, updated, idle_horizon]; ordered by last use
+        self._buckets: OrderedDict[str, list[float]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def take(self, key: str, limit: Limit, now: float) -> float:
+        """Consume one token. Returns 0 when allowed, else seconds until a token is available."""
+        with self._lock:
+            bucket = self._buckets.get(key)
+            if bucket is None:
+                bucket = [limit.capacity, now, limit.idle_horizon]
+                self._buckets[key] = bucket
+            else:
+                bucket[0] = _refill(bucket[0], bucket[1], now, limit)
+                bucket[1] = now
+                self._buckets.move_to_end(key)
+            wait = 0.0
+            if bucket[0] >= 1.0:
+                bucket[0] -= 1.0
+            else:
+                wait = (1.0 - bucket[0]) / limit.per_sec if limit.per_sec > 0 else math.inf
+            self._evict(now)
+            return wait
+
+    def _evict(self, now: float) -> None:
+        # Oldest-first: stop at the first bucket that is still refilling (amortized O(1)).
+        while self._buckets:
+            key, (_, updated, horizon) = next(iter(self._buckets.items()))
+            if len(self._buckets) <= self.max_keys and now - updated < horizon:
+                break
+            del self._buckets[key]
+
+    def __len__(self) -> int:
+        return len(self._buckets)
+
+
+class SqliteBackend:
+    """Buckets in a shared SQLite table; each check is one short IMMEDIATE transaction."""
+
+    SWEEP_EVERY = 1000
+
+    def __init__(self, path: str):
+        self._conn = storage.connect_sqlite(path)
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS buckets (key TEXT PRIMARY KEY, tokens REAL NOT NULL,"
+            " updated REAL NOT NULL, horizon REAL NOT NULL)"
+        )
+        self._lock = threading.Lock()
+        self._calls = 0
+
+    def take(self, key: str, limit: Limit, now: float) -> float:
+        with self._lock:
+            conn = self._conn
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute("SELECT tokens, updated FROM buckets WHERE key = ?", (key,)).fetchone()
+                tokens = limit.capacity if row is None else _refill(row[0], row[1], now, limit)
+                wait = 0.0
+                if tokens >= 1.0:
+                    tokens -= 1.0
+                else:
+                    wait = (1.0 - tokens) / limit.per_sec if limit.per_sec > 0 else math.inf
+                conn.execute(
+                    "INSERT OR REPLACE INTO buckets (key, tokens, updated, horizon) VALUES (?, ?, ?, ?)",
+                    (key, tokens, now, min(limit.idle_horizon, 1e12)),
+                )
+                self._calls += 1
+                if self._calls % self.SWEEP_EVERY == 0:
+                    conn.execute("DELETE FROM buckets WHERE updated + horizon < ?", (now,))
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+            return wait
+
+
+class RateLimiter:
+    def __init__(self, backend_name: str = RATE_LIMIT_BACKEND):
+        self.backend_name = backend_name
+        self._backend: MemoryBackend | SqliteBackend | None = None
+        self.rejected = 0
+
+    @property
+    def backend(self) -> MemoryBackend | SqliteBackend:
+        if self._backend is None:
+            if self.backend_name == "sqlite":
+                self._backend = SqliteBackend(storage.data_path("state", "ratelimit.sqlite3"))
+            else:
+                self._backend = MemoryBackend()
+        return self._backend
+
+    def check(self, group: str, client: str) -> float:
+        limit = LIMITS.get(group) or LIMITS["default"]
+        return self.backend.take(f"{group}:{client}", limit, time.time())
+
+
+limiter = RateLimiter()
+
+
+def rate_limit(request: Request):
+    group = route_group(request.url.path)
+    wait = limiter.check(group, client_key(request))
+    if wait > 0:
+        limiter.rejected += 1
+        metrics.ratelimit_rejected.inc(group)
+        raise HTTPException(
+            status_code=429,
+            detail={"error": {"message": "Rate limit exceeded", "code": "rate_limited"}},
+            headers={"Retry-After": str(max(1, math.ceil(wait)))},
+        )
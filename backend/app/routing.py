@@ -0,0 +1,433 @@
+"""Latency-aware routing of /api/chat requests across a model group.
+
+A request may name a model group (``"group": "fast-small"``) instead of a single
+provider. The group lists interchangeable (provider, model) members; the router ranks
+them by what it has observed from real traffic (EWMA latency, error rate, cooldowns after
+429/5xx) and by the background health probes, then:
+
+- sends the request to the best member and fails over to the next on network errors,
+  timeouts, a busy local scheduler, 429/5xx or an empty completion. Any other 4xx is the request's own fault (bad
+  parameters, a rejected key): it goes back to the caller as-is, without cooling the
+  member down;
+- optionally hedges: if the current member has not answered within the group's (or the
+  request's) ``hedge_ms`` budget, the next member is started too and the first good
+  answer wins. Streaming requests fail over before the first byte but are not hedged.
+
+Credentials are per provider: ``"credentials": {"groq": "<key>", "ollama": {"base": ...}}``.
+Members without usable credentials, or whose context window the prompt does not fit, are
+skipped; Ollama defaults to ``OLLAMA_BASE``.
+
+Groups come from ``MODEL_GROUPS_CONFIG`` (a JSON file) on top of the built-in defaults:
+
+    {"fast-small": {"members": [{"provider": "groq", "model": "llama-3.1-8b-instant"},
+                                {"provider": "ollama", "model": "phi3:mini"}],
+                    "hedge_ms": 1500}}
+
+A request may also pass the member list inline: ``"group": [{"provider": ..., "model": ...}]``.
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import time
+from collections import OrderedDict
+from dataclasses import dataclass, field
+from typing import Any, Callable
+from urllib.parse import urlsplit
+
+import httpx
+from fastapi import HTTPException
+
+from . import providers, streaming
+from .cache import cacheable
+from .health import OLLAMA_BASE, health_monitor
+from .scheduler import INTERACTIVE, SchedulerBusy
+
+
+MODEL_GROUPS_CONFIG = os.getenv("MODEL_GROUPS_CONFIG", "").strip()
+ROUTE_HEDGE_MS = float(os.getenv("ROUTE_HEDGE_MS", "0"))  # 0 disables hedging unless a group sets it
+ROUTE_ATTEMPT_TIMEOUT = float(os.getenv("ROUTE_ATTEMPT_TIMEOUT", "30"))
+ROUTE_COOLDOWN = float(os.getenv("ROUTE_COOLDOWN", "30"))
+ROUTE_MAX_FAILURES = 3          # consecutive failures before a member cools down
+ROUTE_MAX_COOLDOWN = 300.0
+ROUTE_PRIOR_MS = 2000.0         # assumed latency for members without samples
+# Stats kept for members outside the configured groups (inline groups), least recently used dropped first
+ROUTE_MAX_STATS = max(1, int(os.getenv("ROUTE_MAX_STATS", "512")))
+EWMA_ALPHA = 0.3
+
+DEFAULT_GROUPS = {
+    "fast-small": {"members": [
+        {"provider": "groq", "model": "llama-3.1-8b-instant"},
+        {"provider": "ollama", "model": "phi3:mini"},
+        {"provider": "mistral", "model": "mistral-small-latest"},
+    ]},
+    "local": {"members": [
+        {"provider": "ollama", "model": "phi3:mini"},
+    ]},
+}
+
+
+class RouteError(Exception):
+    def __init__(self, message: str, attempts: list | None = None):
+        super().__init__(message)
+        self.attempts = attempts or []
+
+
+@dataclass(frozen=True)
+class Member:
+    provider: str
+    model: str
+
+    @property
+    def key(self) -> str:
+        return f"{self.provider}/{self.model}"
+
+
+@dataclass
+class Group:
+    name: str
+    members: list[Member]
+    hedge_ms: float = ROUTE_HEDGE_MS
+
+    def describe(self) -> dict:
+        return {"members": [{"provider": m.provider, "model": m.model} for m in self.members], "hedge_ms": self.hedge_ms}
+
+
+def parse_group(name: str, spec: Any) -> Group:
+    if isinstance(spec, list):
+        spec = {"members": spec}
+    if not isinstance(spec, dict):
+        raise ValueError(f"Model group {name!r} must be an object or a list of members")
+    members = []
+    for m in spec.get("members") or []:
+        provider = str((m or {}).get("provider") or "").strip().lower()
+        model = str((m or {}).get("model") or "").strip()
+        if not provider or not model:
+            raise ValueError(f"Model group {name!r} has a member without provider/model")
+        members.append(Member(provider, model))
+    if not members:
+        raise ValueError(f"Model group {name!r} has no members")
+    return Group(name, members, float(spec.get("hedge_ms", ROUTE_HEDGE_MS) or 0))
+
+
+@dataclass
+class MemberStats:
+    latency_ms: float | None = None    # full non-streaming completion
+    ttfb_ms: float | None = None       # streaming: until upstream headers
+    error_rate: float = 0.0            # EWMA of failures (0..1)
+    successes: int = 0
+    failures: int = 0
+    consecutive_failures: int = 0
+    cooldown_until: float = 0.0
+    last_error: str | None = None
+
+    def expected_ms(self, stream: bool) -> float:
+        first, second = (self.ttfb_ms, self.latency_ms) if stream else (self.latency_ms, self.ttfb_ms)
+        ms = first if first is not None else second if second is not None else ROUTE_PRIOR_MS
+        return ms * (1 + 3 * self.error_rate)
+
+    @property
+    def cooling(self) -> bool:
+        return self.cooldown_until > time.monotonic()
+
+    def observe(self, ms: float, stream: bool) -> None:
+        attr = "ttfb_ms" if stream else "latency_ms"
+        prev = getattr(self, attr)
+        setattr(self, attr, ms if prev is None else (1 - EWMA_ALPHA) * prev + EWMA_ALPHA * ms)
+
+    def success(self, ms: float, stream: bool) -> None:
+        self.observe(ms, stream)
+        self.successes += 1
+        self.consecutive_failures = 0
+        self.error_rate *= 1 - EWMA_ALPHA
+        self.cooldown_until = 0.0
+
+    def failure(self, error: str, retry_after: float | None = None) -> None:
+        self.failures += 1
+        self.consecutive_failures += 1
+        self.error_rate = (1 - EWMA_ALPHA) * self.error_rate + EWMA_ALPHA
+        self.last_error = error
+        if retry_after is not None or self.consecutive_failures >= ROUTE_MAX_FAILURES:
+            wait = min(ROUTE_MAX_COOLDOWN, max(ROUTE_COOLDOWN, retry_after or 0))
+            self.cooldown_until = time.monotonic() + wait
+
+    def snapshot(self) -> dict:
+        return {
+            "latency_ms": round(self.latency_ms, 1) if self.latency_ms is not None else None,
+            "ttfb_ms": round(self.ttfb_ms, 1) if self.ttfb_ms is not None else None,
+            "error_rate": round(self.error_rate, 4),
+            "successes": self.successes,
+            "failures": self.failures,
+            "cooling": self.cooling,
+            "last_error": self.last_error,
+        }
+
+
+@dataclass
+class Candidate:
+    member: Member
+    adapter: providers.ProviderAdapter
+    req: providers.ChatRequest
+    health: str  # health target name
+
+
+@dataclass
+class Attempt:
+    member: Member
+    outcome: str = "pending"   # ok | error | rejected | cancelled
+    status: int | None = None
+    ms: float | None = None
+    error: str | None = None
+
+    def describe(self) -> dict:
+        return {"provider": self.member.provider, "model": self.member.model, "outcome": self.outcome,
+                "status": self.status, "ms": round(self.ms, 1) if self.ms is not None else None, "error": self.error}
+
+
+@dataclass
+class Routed:
+    candidate: Candidate | None
+    response: Any = None            # (httpx.Response, data) for completions, a Response for streams
+    attempts: list[Attempt] = field(default_factory=list)
+    ok: bool = False
+
+
+def _retry_after(r: httpx.Response) -> float | None:
+    if r.status_code != 429:
+        return None
+    try:
+        return float(r.headers.get("retry-after", ""))
+    except ValueError:
+        return ROUTE_COOLDOWN
+
+
+def _retryable(status: int) -> bool:
+    """Whether another member may do better: rate limits and server errors."""
+    return status == 429 or status >= 500
+
+
+def _error_text(status: int, data: Any) -> str:
+    err = data.get("error") if isinstance(data, dict) else None
+    if isinstance(err, dict) and err.get("message"):
+        return f"HTTP {status}: {err['message']}"
+    return f"HTTP {status}"
+
+
+class ModelRouter:
+    def __init__(self, groups: dict | None = None):
+        self.groups: dict[str, Group] = {}
+        self.stats: OrderedDict[str, MemberStats] = OrderedDict()
+        self._configured: set[str] = set()     # member keys of named groups; their stats are never dropped
+        self.counters = {"requests": 0, "failovers": 0, "hedges": 0, "hedge_wins": 0, "exhausted": 0}
+        for name, spec in (groups if groups is not None else DEFAULT_GROUPS).items():
+            self.add_group(parse_group(name, spec))
+
+    def add_group(self, group: Group) -> None:
+        self.groups[group.name] = group
+        self._configured.update(m.key for m in group.members)
+
+    def load(self, path: str) -> None:
+        with open(path, "r", encoding="utf-8") as f:
+            for name, spec in json.load(f).items():
+                self.add_group(parse_group(name, spec))
+
+    def resolve(self, spec: Any) -> Group:
+        if isinstance(spec, (list, dict)):
+            return parse_group("inline", spec)
+        name = str(spec or "").strip()
+        group = self.groups.get(name)
+        if group is None:
+            raise KeyError(name)
+        return group
+
+    def member_stats(self, member: Member) -> MemberStats:
+        stats = self.stats.get(member.key)
+        if stats is not None:
+            self.stats.move_to_end(member.key)
+            return stats
+        stats = self.stats[member.key] = MemberStats()
+        inline = [key for key in self.stats if key not in self._configured]
+        for key in inline[:max(0, len(inline) - ROUTE_MAX_STATS)]:
+            del self.stats[key]
+        return stats
+
+    @staticmethod
+    def credentials(body: dict, member: Member, adapter: providers.ProviderAdapter) -> dict:
+        """The request's credentials for ``member`` as /api/chat body fields; Ollama defaults to OLLAMA_BASE."""
+        creds = body.get("credentials") if isinstance(body.get("credentials"), dict) else {}
+        cred = creds.get(member.provider) or creds.get(adapter.id) or {}
+        if isinstance(cred, str):
+            cred = {"apiKey": cred}
+        if adapter.id == "ollama" and not cred.get("base"):
+            cred = {**cred, "base": OLLAMA_BASE}
+        return cred
+
+    def candidates(self, group: Group, body: dict, stream: bool = False, history: list[dict] | None = None) -> list[Candidate]:
+        """Members with usable credentials and room for the prompt, best first. ``history`` holds earlier conversation turns."""
+        shared = {k: body[k] for k in ("prompt", "system", "messages", "max_tokens", "temperature") if k in body}
+        found = []
+        for member in group.members:
+            adapter = providers.registry.resolve(member.provider)
+            if adapter is None:
+                continue
+            cred = self.credentials(body, member, adapter)
+            req = providers.ChatRequest.from_body({**cred, **shared, "model": member.model})
+            req.history = [*(history or []), *req.history]
+            try:
+                adapter.validate(req)
+                providers.fit(adapter, req)
+            except HTTPException:
+                continue
+            health = adapter.id
+            if adapter.id == "ollama":
+                health = "ollama" if req.base == OLLAMA_BASE else f"ollama@{urlsplit(req.base).netloc}"
+            found.append(Candidate(member, adapter, req, health))
+            health_monitor.use(health)
+
+        def rank(c: Candidate):
+            stats = self.member_stats(c.member)
+            # Members that are cooling down or failing probes go last but stay eligible
+            demoted = stats.cooling or health_monitor.state(c.health) == "err"
+            return (demoted, stats.expected_ms(stream))
+        return sorted(found, key=rank)  # stable: config order breaks ties
+
+    async def _attempt(self, c: Candidate, attempt: Attempt, timeout: httpx.Timeout, priority: str, cache_mode: str):
+        stats = self.member_stats(c.member)
+        started = time.perf_counter()
+        try:
+            call = providers.complete(c.adapter, c.req, timeout, priority, coalesce=cacheable(c.req, cache_mode))
+            r, data = await asyncio.wait_for(call, ROUTE_ATTEMPT_TIMEOUT)
+        except asyncio.CancelledError:
+            attempt.outcome, attempt.ms = "cancelled", (time.perf_counter() - started) * 1000
+            # A hedge loser was at least this slow; only let that raise the estimate
+            if stats.latency_ms is None or attempt.ms > stats.latency_ms:
+                stats.observe(attempt.ms, stream=False)
+            raise
+        except (httpx.RequestError, asyncio.TimeoutError, SchedulerBusy) as e:
+            attempt.ms = (time.perf_counter() - started) * 1000
+            attempt.outcome, attempt.error = "error", str(e) or type(e).__name__
+            stats.failure(attempt.error)
+            return None
+        attempt.ms = (time.perf_counter() - started) * 1000
+        attempt.status = r.status_code
+        text = c.adapter.extract_text(data) if r.is_success else None
+        if r.is_success and isinstance(text, str) and text:
+            attempt.outcome = "ok"
+            stats.success(attempt.ms, stream=False)
+        elif r.is_success or _retryable(r.status_code):
+            attempt.outcome = "error"
+            attempt.error = _error_text(r.status_code, data) if not r.is_success else "empty completion"
+            stats.failure(attempt.error, _retry_after(r))
+        else:
+            attempt.outcome, attempt.error = "rejected", _error_text(r.status_code, data)
+        return r, data
+
+    async def complete(self, group: Group, body: dict, timeout: httpx.Timeout, hedge_ms: float | None = None,
+                       priority: str = INTERACTIVE, history: list[dict] | None = None) -> Routed:
+        queue = self.candidates(group, body, history=history)
+        if not queue:
+            raise RouteError(f"No member of model group {group.name!r} has usable credentials and room for the prompt")
+        self.counters["requests"] += 1
+        hedge = group.hedge_ms if hedge_ms is None else hedge_ms
+        cache_mode = (body.get('cache') if isinstance(body.get('cache'), str) else '').strip().lower()
+        routed = Routed(None)
+        pending: dict[asyncio.Task, tuple[Candidate, Attempt]] = {}
+
+        def launch() -> None:
+            c = queue.pop(0)
+            attempt = Attempt(c.member)
+            routed.attempts.append(attempt)
+            pending[asyncio.create_task(self._attempt(c, attempt, timeout, priority, cache_mode))] = (c, attempt)
+
+        launch()
+        try:
+            while pending:
+                wait = hedge / 1000 if hedge > 0 and queue else None
+                done, _ = await asyncio.wait(pending, timeout=wait, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    self.counters["hedges"] += 1
+                    launch()
+                    continue
+                for task in done:
+                    c, attempt = pending.pop(task)
+                    result = task.result()
+                    if attempt.outcome == "ok":
+                        if attempt is not routed.attempts[0] and routed.attempts[0].outcome == "pending":
+                            self.counters["hedge_wins"] += 1
+                        routed.candidate, routed.response, routed.ok = c, result, True
+                        return routed
+                    if attempt.outcome == "rejected":
+                        routed.candidate, routed.response = c, result
+                        return routed
+                    if result is not None:
+                        routed.candidate, routed.response = c, result
+                    if queue:
+                        self.counters["failovers"] += 1
+                        launch()
+        finally:
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+        self.counters["exhausted"] += 1
+        if routed.response is None:
+            raise RouteError(f"All members of model group {group.name!r} failed", routed.attempts)
+        return routed
+
+    async def stream(self, group: Group, body: dict, timeout: httpx.Timeout,
+                     on_complete: Callable[[Candidate], streaming.OnComplete | None],
+                     response_headers: Callable[[Candidate], dict], priority: str = INTERACTIVE,
+                     history: list[dict] | None = None) -> Routed:
+        """Open a stream on the best member, failing over until one returns a 2xx stream."""
+        queue = self.candidates(group, body, stream=True, history=history)
+        if not queue:
+            raise RouteError(f"No member of model group {group.name!r} has usable credentials and room for the prompt")
+        self.counters["requests"] += 1
+        routed = Routed(None)
+        for i, c in enumerate(queue):
+            if i:
+                self.counters["failovers"] += 1
+            stats = self.member_stats(c.member)
+            attempt = Attempt(c.member)
+            routed.attempts.append(attempt)
+            started = time.perf_counter()
+            try:
+                resp = await asyncio.wait_for(
+                    providers.stream(c.adapter, c.req, c.member.provider, timeout,
+                                     on_complete=on_complete(c), response_headers=response_headers(c), priority=priority),
+                    ROUTE_ATTEMPT_TIMEOUT)
+            except (httpx.RequestError, asyncio.TimeoutError, SchedulerBusy) as e:
+                attempt.ms = (time.perf_counter() - started) * 1000
+                attempt.outcome, attempt.error = "error", str(e) or type(e).__name__
+                stats.failure(attempt.error)
+                continue
+            attempt.ms = (time.perf_counter() - started) * 1000
+            attempt.status = resp.status_code
+            routed.candidate, routed.response = c, resp
+            if resp.status_code < 400:
+                attempt.outcome = "ok"
+                stats.success(attempt.ms, stream=True)
+                routed.ok = True
+                return routed
+            if not _retryable(resp.status_code):
+                attempt.outcome, attempt.error = "rejected", f"HTTP {resp.status_code}"
+                return routed
+            attempt.outcome, attempt.error = "error", f"HTTP {resp.status_code}"
+            retry_after = ROUTE_COOLDOWN if resp.status_code == 429 else None
+            stats.failure(attempt.error, retry_after)
+        self.counters["exhausted"] += 1
+        if routed.response is None:
+            raise RouteError(f"All members of model group {group.name!r} failed", routed.attempts)
+        return routed
+
+    def describe(self) -> dict:
+        return {
+            "groups": {name: g.describe() for name, g in self.groups.items()},
+            "members": {key: s.snapshot() for key, s in self.stats.items()},
+            **self.counters,
+        }
+
+
+model_router = ModelRouter()
+if MODEL_GROUPS_CONFIG:
+    model_router.load(MODEL_GROUPS_CONFIG)
@@ -0,0 +1,241 @@
+"""Local inference scheduler in front of Ollama.
+
+Every Ollama generation (``/api/mini/generate``, ``/api/ollama/generate`` and Ollama
+requests on ``/api/chat``) takes a slot here first:
+
+- requests queue by priority: ``interactive`` before ``background`` (batches), FIFO within
+  a class. The queue is bounded (``OLLAMA_QUEUE_MAX``) and a request that waited longer
+  than ``OLLAMA_QUEUE_TIMEOUT`` fails with ``SchedulerBusy`` (a 503 with ``Retry-After``,
+  not an upstream error);
+- each model runs at most ``OLLAMA_MODEL_CONCURRENCY`` generations at once, and
+  background work may only use all but one of those slots, so an interactive request
+  never waits behind a full set of background requests;
+- at most ``OLLAMA_MAX_MODELS`` models per server are in use at once. A request for
+  another model waits for one to drain instead of forcing Ollama to swap models back and
+  forth, and later requests do not overtake it.
+
+``MINI_MODEL`` is loaded at startup and pinned with ``keep_alive`` (``MINI_KEEP_ALIVE``,
+default ``-1`` = never unload). It is re-warmed every ``OLLAMA_WARMUP_INTERVAL`` seconds
+in case Ollama restarted.
+"""
+from __future__ import annotations
+
+import asyncio
+import itertools
+import os
+import time
+from collections import deque
+from contextlib import asynccontextmanager
+
+import httpx
+
+from . import metrics
+from .upstream import upstreams
+
+
+OLLAMA_BASE = os.getenv("OLLAMA_BASE", "http://127.0.0.1:11434").rstrip("/")
+MINI_MODEL = os.getenv("MINI_MODEL", "phi3:mini")
+MINI_KEEP_ALIVE = os.getenv("MINI_KEEP_ALIVE", "-1").strip()
+OLLAMA_MODEL_CONCURRENCY = max(1, int(os.getenv("OLLAMA_MODEL_CONCURRENCY", "2")))
+OLLAMA_MAX_MODELS = max(1, int(os.getenv("OLLAMA_MAX_MODELS", "2")))
+OLLAMA_QUEUE_MAX = int(os.getenv("OLLAMA_QUEUE_MAX", "256"))
+OLLAMA_QUEUE_TIMEOUT = float(os.getenv("OLLAMA_QUEUE_TIMEOUT", "60"))
+OLLAMA_WARMUP = os.getenv("OLLAMA_WARMUP", "1").strip().lower() not in ("0", "false", "no", "off")
+OLLAMA_WARMUP_INTERVAL = float(os.getenv("OLLAMA_WARMUP_INTERVAL", "300"))
+WAIT_SAMPLES = 1024
+
+INTERACTIVE = "interactive"
+BACKGROUND = "background"
+PRIORITIES = {INTERACTIVE: 0, BACKGROUND: 1}
+
+
+class SchedulerBusy(Exception):
+    """No Ollama slot became free in time (or the queue is full)."""
+
+    retry_after = 5  # seconds, for the Retry-After header
+
+
+def parse_priority(value) -> str:
+    value = str(value or "").strip().lower()
+    return value if value in PRIORITIES else INTERACTIVE
+
+
+def keep_alive_value(value: str):
+    """Ollama accepts durations ("30m") or a number of seconds (-1 = forever)."""
+    try:
+        return int(value)
+    except ValueError:
+        return value
+
+
+class Ticket:
+    __slots__ = ("rank", "seq", "base", "model", "priority", "future", "enqueued")
+
+    def __init__(self, seq: int, base: str, model: str, priority: str):
+        self.rank = PRIORITIES[priority]
+        self.seq = seq
+        self.base = base
+        self.model = model
+        self.priority = priority
+        self.future: asyncio.Future = asyncio.get_running_loop().create_future()
+        self.enqueued = time.monotonic()
+
+
+class OllamaScheduler:
+    def __init__(self, model_concurrency: int = OLLAMA_MODEL_CONCURRENCY, max_models: int = OLLAMA_MAX_MODELS):
+        self.model_concurrency = model_concurrency
+        self.max_models = max_models
+        self.queue: list[Ticket] = []
+        self.running: dict[tuple[str, str], dict[str, int]] = {}  # (base, model) -> {priority: n}
+        self._seq = itertools.count()
+        self.waits = {p: deque(maxlen=WAIT_SAMPLES) for p in PRIORITIES}
+        self.counters = {"admitted": 0, "rejected": 0, "timeouts": 0, "warmups": 0, "warmup_errors": 0}
+        self._warmer: asyncio.Task | None = None
+        self.warm: dict[str, float] = {}
+
+    # --- admission ---
+
+    def _running(self, key: tuple[str, str]) -> int:
+        return sum(self.running.get(key, {}).values())
+
+    def _can_run(self, t: Ticket) -> tuple[bool, bool]:
+        """(runnable, blocked by the model cap)."""
+        key = (t.base, t.model)
+        busy = self._running(key)
+        limit = self.model_concurrency
+        if t.priority == BACKGROUND and limit > 1:
+            limit -= 1  # keep one slot free for interactive requests
+        if busy >= limit:
+            return False, False
+        if busy == 0:
+            active = sum(1 for (base, _), counts in self.running.items() if base == t.base and sum(counts.values()))
+            if active >= self.max_models:
+                return False, True
+        return True, False
+
+    def _dispatch(self) -> None:
+        for t in sorted(self.queue, key=lambda t: (t.rank, t.seq)):
+            if t.future.done():
+                continue
+            ok, needs_switch = self._can_run(t)
+            if needs_switch:
+                # Let the active models drain so this one gets its turn
+                break
+            if ok:
+                self.queue.remove(t)
+                self._start(t)
+        self.queue = [t for t in self.queue if not t.future.done()]
+
+    def _start(self, t: Ticket) -> None:
+        counts = self.running.setdefault((t.base, t.model), {})
+        counts[t.priority] = counts.get(t.priority, 0) + 1
+        waited = time.monotonic() - t.enqueued
+        self.waits[t.priority].append(waited * 1000)
+        metrics.ollama_queue_wait.observe(waited, t.priority)
+        self.counters["admitted"] += 1
+        t.future.set_result(None)
+
+    def _finish(self, t: Ticket) -> None:
+        key = (t.base, t.model)
+        counts = self.running.get(key, {})
+        counts[t.priority] = counts.get(t.priority, 1) - 1
+        if not sum(counts.values()):
+            self.running.pop(key, None)
+        self._dispatch()
+
+    async def acquire(self, base: str, model: str, priority: str = INTERACTIVE, timeout: float = OLLAMA_QUEUE_TIMEOUT) -> Ticket:
+        t = Ticket(next(self._seq), base.rstrip("/"), model, parse_priority(priority))
+        if len(self.queue) >= OLLAMA_QUEUE_MAX:
+            self.counters["rejected"] += 1
+            raise SchedulerBusy("Ollama queue is full")
+        self.queue.append(t)
+        self._dispatch()
+        try:
+            await asyncio.wait_for(asyncio.shield(t.future), timeout)
+        except asyncio.TimeoutError:
+            self.counters["timeouts"] += 1
+            if not t.future.done():
+                t.future.cancel()
+                self.queue = [q for q in self.queue if q is not t]
+                self._dispatch()
+                raise SchedulerBusy(f"Waited {timeout:.0f}s for an Ollama slot for {model}")
+        except asyncio.CancelledError:
+            if t.future.done() and not t.future.cancelled():
+                self._finish(t)  # admitted just as the caller went away
+            else:
+                t.future.cancel()
+                self.queue = [q for q in self.queue if q is not t]
+                self._dispatch()
+            raise
+        return t
+
+    def release(self, t: Ticket) -> None:
+        self._finish(t)
+
+    @asynccontextmanager
+    async def slot(self, base: str, model: str, priority: str = INTERACTIVE):
+        t = await self.acquire(base, model, priority)
+        try:
+            yield t
+        finally:
+            self.release(t)
+
+    # --- warm-up ---
+
+    async def warmup(self, base: str = OLLAMA_BASE, model: str = MINI_MODEL, keep_alive: str = MINI_KEEP_ALIVE) -> bool:
+        """Load a model without generating anything and pin it with keep_alive."""
+        try:
+            async with self.slot(base, model, BACKGROUND):
+                r = await upstreams.post(f"{base}/api/generate", json={"model": model, "keep_alive": keep_alive_value(keep_alive)},
+                                         timeout=httpx.Timeout(120.0))
+        except Exception:
+            # Ollama down (httpx.RequestError), a full queue (SchedulerBusy) or anything else:
+            # count it and let _warm_loop try again rather than end it
+            self.counters["warmup_errors"] += 1
+            return False
+        if r.is_success:
+            self.counters["warmups"] += 1
+            self.warm[model] = time.time()
+            return True
+        self.counters["warmup_errors"] += 1
+        return False
+
+    async def _warm_loop(self) -> None:
+        while True:
+            ok = await self.warmup()
+            # Retry sooner while Ollama is not up yet
+            await asyncio.sleep(OLLAMA_WARMUP_INTERVAL if ok else min(30.0, OLLAMA_WARMUP_INTERVAL))
+
+    async def start(self) -> None:
+        if OLLAMA_WARMUP and MINI_MODEL and self._warmer is None:
+            self._warmer = asyncio.create_task(self._warm_loop())
+
+    async def stop(self) -> None:
+        task, self._warmer = self._warmer, None
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+    # --- metrics ---
+
+    def stats(self) -> dict:
+        def pct(samples, p):
+            ordered = sorted(samples)
+            return round(ordered[min(len(ordered) - 1, int(p * len(ordered)))], 1) if ordered else None
+
+        depth: dict[str, int] = {}
+        for t in self.queue:
+            depth[t.priority] = depth.get(t.priority, 0) + 1
+        return {
+            **self.counters,
+            "queue_depth": {p: depth.get(p, 0) for p in PRIORITIES},
+            "queued_models": sorted({t.model for t in self.queue}),
+            "running": {f"{model}@{base}": counts for (base, model), counts in self.running.items()},
+            "wait_ms": {p: {"p50": pct(w, 0.5), "p95": pct(w, 0.95), "samples": len(w)} for p, w in self.waits.items()},
+            "limits": {"model_concurrency": self.model_concurrency, "max_models": self.max_models,
+                       "queue_max": OLLAMA_QUEUE_MAX, "queue_timeout": OLLAMA_QUEUE_TIMEOUT},
+            "pinned": {"model": MINI_MODEL, "keep_alive": MINI_KEEP_ALIVE, "warmed": self.warm.get(MINI_MODEL)},
+        }
+
+
+ollama_scheduler = OllamaScheduler()
@@ -0,0 +1,62 @@
+"""Command-line entry point for serving the backend with one or more worker processes.
+
+    python backend/app/main.py [--workers N] [--server uvicorn|gunicorn] [--host H] [--port P]
+
+Every option can also come from the environment (``HOST``, ``PORT``, ``WORKERS``,
+``SERVER``). With more than one worker, process-shared state (rate-limit buckets, the
+response cache) defaults to the SQLite store under the data directory so all workers
+see the same limits and cached responses; each worker runs the app lifespan itself and
+owns its own upstream connection pool.
+"""
+from __future__ import annotations
+
+import argparse
+import os
+
+import uvicorn
+
+
+def _app_path() -> str:
+    # "app.main:app" when launched by Electron, "backend.app.main:app" from the repo root
+    return f"{__package__}.main:app"
+
+
+def _run_gunicorn(host: str, port: int, workers: int) -> None:
+    try:
+        from gunicorn.app.base import BaseApplication
+    except ImportError:
+        raise SystemExit("SERVER=gunicorn requires `pip install gunicorn` (POSIX only); use SERVER=uvicorn instead")
+
+    class _Application(BaseApplication):
+        def load_config(self):
+            self.cfg.set("bind", f"{host}:{port}")
+            self.cfg.set("workers", workers)
+            self.cfg.set("worker_class", "uvicorn.workers.UvicornWorker")
+            # Workers import the app themselves so nothing (sockets, SQLite handles) is shared across fork
+            self.cfg.set("preload_app", False)
+
+        def load(self):
+            module_name, _, attr = _app_path().partition(":")
+            module = __import__(module_name, fromlist=[attr])
+            return getattr(module, attr)
+
+    _Application().run()
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(description="Run the Zeek AI backend")
+    # Bind to loopback by default for desktop security
+    parser.add_argument("--host", default=os.getenv("HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("PORT", "8000")))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("WORKERS", "1") or 1))
+    parser.add_argument("--server", choices=("uvicorn", "gunicorn"), default=os.getenv("SERVER", "uvicorn").strip().lower())
+    args = parser.parse_args(argv)
+    workers = max(1, args.workers)
+
+    # Worker processes read this at import time to pick shared-state backends
+    os.environ["WORKERS"] = str(workers)
+
+    if args.server == "gunicorn":
+        _run_gunicorn(args.host, args.port, workers)
+    else:
+        uvicorn.run(_app_path(), host=args.host, port=args.port, reload=False, workers=workers)
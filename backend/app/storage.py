@@ -0,0 +1,29 @@
+"""Local on-disk state shared by the backend subsystems (caches, indexes, queues)."""
+from __future__ import annotations
+
+import os
+import sqlite3
+
+
+# Set by serve.py for every worker process; >1 means in-process state is not shared.
+WORKERS = max(1, int(os.getenv("WORKERS", "1") or 1))
+MULTI_PROCESS = WORKERS > 1
+
+DATA_DIR = os.path.abspath(os.getenv("ZEEK_DATA_DIR", "").strip()
+                           or os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "data"))
+
+
+def data_path(*parts: str) -> str:
+    """Absolute path under DATA_DIR; parent directories are created on demand."""
+    path = os.path.join(DATA_DIR, *parts)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    return path
+
+
+def connect_sqlite(path: str) -> sqlite3.Connection:
+    """Open a SQLite connection tuned for concurrent local readers/writers (WAL)."""
+    conn = sqlite3.connect(path, timeout=10.0, isolation_level=None, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.execute("PRAGMA busy_timeout=10000")
+    return conn
@@ -0,0 +1,229 @@
+"""Token streaming for /api/chat.
+
+Every provider streams in its own wire format (OpenAI-style SSE, Anthropic typed SSE
+events, Gemini SSE, Cohere v2 SSE, Ollama NDJSON). The parsers here turn each of them
+into one normalized event schema which is relayed to the renderer as Server-Sent Events:
+
+    data: {"type": "start", "provider": "...", "model": "..."}
+    data: {"type": "delta", "text": "..."}                        (repeated)
+    data: {"type": "done", "finish_reason": "...", "usage": {...}}
+    data: {"type": "error", "error": {"message": "...", "code": "..."}}
+
+The stream always ends with exactly one ``done`` or ``error`` event. On /api/chat the
+``done`` usage is normalized to ``input_tokens``, ``output_tokens``, ``cached_tokens`` and
+``cache_write_tokens``.
+"""
+from __future__ import annotations
+
+from typing import AsyncIterator, Awaitable, Callable
+
+import httpx
+from fastapi.responses import StreamingResponse
+
+from . import fastjson
+from .fastjson import JSONResponse
+from .upstream import upstreams
+
+
+SSE_HEADERS = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+
+def sse_event(event: dict) -> bytes:
+    return b"data: " + fastjson.dumps(event) + b"\n\n"
+
+
+async def iter_sse_data(resp: httpx.Response) -> AsyncIterator[str]:
+    """Yield the ``data`` payload of each SSE event (multi-line data joined with newlines)."""
+    buf: list[str] = []
+    async for line in resp.aiter_lines():
+        if not line:
+            if buf:
+                yield "\n".join(buf)
+                buf = []
+            continue
+        if line.startswith(":"):
+            # comment / keep-alive (e.g. OpenRouter's ": OPENROUTER PROCESSING")
+            continue
+        if line.startswith("data:"):
+            buf.append(line[5:].lstrip(" "))
+    if buf:
+        yield "\n".join(buf)
+
+
+async def iter_json_events(resp: httpx.Response) -> AsyncIterator[dict]:
+    async for data in iter_sse_data(resp):
+        if data == "[DONE]":
+            return
+        try:
+            obj = fastjson.loads(data)
+        except ValueError:
+            continue
+        if isinstance(obj, dict):
+            yield obj
+
+
+# --- Per-format parsers: upstream response -> normalized events ---
+
+async def parse_openai(resp: httpx.Response) -> AsyncIterator[dict]:
+    """OpenAI chat.completions SSE (also OpenRouter, Mistral, Groq, Azure OpenAI)."""
+    finish_reason = None
+    usage = None
+    async for obj in iter_json_events(resp):
+        if obj.get("error"):
+            yield {"type": "error", "error": {"message": str(obj["error"]), "code": "chat_upstream"}}
+            return
+        if obj.get("usage"):
+            usage = obj["usage"]
+        for choice in obj.get("choices") or []:
+            delta = choice.get("delta") or {}
+            text = delta.get("content")
+            if text:
+                yield {"type": "delta", "text": text}
+            if choice.get("finish_reason"):
+                finish_reason = choice["finish_reason"]
+    yield {"type": "done", "finish_reason": finish_reason, "usage": usage}
+
+
+async def parse_anthropic(resp: httpx.Response) -> AsyncIterator[dict]:
+    finish_reason = None
+    usage: dict = {}
+    async for obj in iter_json_events(resp):
+        kind = obj.get("type")
+        if kind == "content_block_delta":
+            text = (obj.get("delta") or {}).get("text")
+            if text:
+                yield {"type": "delta", "text": text}
+        elif kind == "message_start":
+            usage.update(((obj.get("message") or {}).get("usage")) or {})
+        elif kind == "message_delta":
+            finish_reason = (obj.get("delta") or {}).get("stop_reason") or finish_reason
+            usage.update(obj.get("usage") or {})
+        elif kind == "error":
+            err = obj.get("error") or {}
+            yield {"type": "error", "error": {"message": err.get("message") or "Upstream error", "code": "chat_upstream"}}
+            return
+        elif kind == "message_stop":
+            break
+    yield {"type": "done", "finish_reason": finish_reason, "usage": usage or None}
+
+
+async def parse_gemini(resp: httpx.Response) -> AsyncIterator[dict]:
+    finish_reason = None
+    usage = None
+    async for obj in iter_json_events(resp):
+        if obj.get("usageMetadata"):
+            usage = obj["usageMetadata"]
+        for cand in obj.get("candidates") or []:
+            for part in ((cand.get("content") or {}).get("parts")) or []:
+                text = part.get("text") if isinstance(part, dict) else None
+                if text:
+                    yield {"type": "delta", "text": text}
+            if cand.get("finishReason"):
+                finish_reason = cand["finishReason"]
+    yield {"type": "done", "finish_reason": finish_reason, "usage": usage}
+
+
+async def parse_cohere(resp: httpx.Response) -> AsyncIterator[dict]:
+    finish_reason = None
+    usage = None
+    async for obj in iter_json_events(resp):
+        kind = obj.get("type")
+        if kind == "content-delta":
+            try:
+                text = obj["delta"]["message"]["content"]["text"]
+            except (KeyError, TypeError):
+                text = None
+            if text:
+                yield {"type": "delta", "text": text}
+        elif kind == "message-end":
+            delta = obj.get("delta") or {}
+            finish_reason = delta.get("finish_reason")
+            usage = delta.get("usage")
+            break
+    yield {"type": "done", "finish_reason": finish_reason, "usage": usage}
+
+
+async def parse_ollama(resp: httpx.Response) -> AsyncIterator[dict]:
+    """Ollama /api/generate streams newline-delimited JSON objects."""
+    async for line in resp.aiter_lines():
+        if not line.strip():
+            continue
+        try:
+            obj = fastjson.loads(line)
+        except ValueError:
+            continue
+        if obj.get("error"):
+            yield {"type": "error", "error": {"message": str(obj["error"]), "code": "ollama_upstream"}}
+            return
+        if obj.get("response"):
+            yield {"type": "delta", "text": obj["response"]}
+        if obj.get("done"):
+            usage = {k: obj[k] for k in ("prompt_eval_count", "eval_count", "total_duration") if k in obj}
+            yield {"type": "done", "finish_reason": obj.get("done_reason") or "stop", "usage": usage or None}
+            return
+    yield {"type": "done", "finish_reason": None, "usage": None}
+
+
+Parser = Callable[[httpx.Response], AsyncIterator[dict]]
+# Called with (full text, done event) after a stream completes successfully.
+OnComplete = Callable[[str, dict], Awaitable[None]]
+
+
+async def relay(resp: httpx.Response, parser: Parser, provider: str, model: str,
+                on_complete: OnComplete | None = None) -> AsyncIterator[bytes]:
+    """Relay an open upstream stream as normalized SSE bytes and always close it."""
+    parts: list[str] = []
+    try:
+        yield sse_event({"type": "start", "provider": provider, "model": model})
+        done = {"type": "done", "finish_reason": None, "usage": None}
+        async for event in parser(resp):
+            yield sse_event(event)
+            if event["type"] == "delta":
+                parts.append(event["text"])
+            elif event["type"] == "error":
+                return
+            elif event["type"] == "done":
+                done = event
+                break
+        else:
+            yield sse_event(done)
+        if on_complete is not None and parts:
+            await on_complete("".join(parts), done)
+    except httpx.HTTPError as e:
+        yield sse_event({"type": "error", "error": {"message": f"Upstream error: {str(e)}", "code": "chat_upstream"}})
+    finally:
+        await resp.aclose()
+
+
+async def replay(text: str, provider: str, model: str) -> AsyncIterator[bytes]:
+    """Serve an already complete response (e.g. a cache hit) in the streaming schema."""
+    yield sse_event({"type": "start", "provider": provider, "model": model})
+    yield sse_event({"type": "delta", "text": text})
+    yield sse_event({"type": "done", "finish_reason": "cached", "usage": None})
+
+
+def replay_response(text: str, provider: str, model: str, headers: dict | None = None) -> StreamingResponse:
+    return StreamingResponse(replay(text, provider, model), media_type="text/event-stream", headers={**SSE_HEADERS, **(headers or {})})
+
+
+async def open_chat_stream(url: str, payload: dict, headers: dict | None, parser: Parser,
+                           provider: str, model: str, timeout: httpx.Timeout,
+                           on_complete: OnComplete | None = None, response_headers: dict | None = None):
+    """POST a streaming request upstream and relay it as SSE.
+
+    Upstream HTTP errors are detected before the first byte is sent to the client and
+    returned as a regular JSON error response with the upstream status code.
+    """
+    resp = await upstreams.open_stream("POST", url, json=payload, headers=headers, timeout=timeout)
+    if resp.status_code >= 400:
+        try:
+            raw = await resp.aread()
+        finally:
+            await resp.aclose()
+        try:
+            data = fastjson.loads(raw)
+        except ValueError:
+            data = {"raw": raw.decode("utf-8", "replace")}
+        return JSONResponse(status_code=resp.status_code, content={"output": None, "raw": data})
+    return StreamingResponse(relay(resp, parser, provider, model, on_complete), media_type="text/event-stream",
+                             headers={**SSE_HEADERS, **(response_headers or {})})
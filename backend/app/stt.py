@@ -0,0 +1,251 @@
+"""Local speech-to-text for /api/stt/transcribe and the /api/stt/stream WebSocket.
+
+Transcription uses faster-whisper (`pip install faster-whisper`) on the CPU. The model is
+loaded on first use and shared. Jobs run in a dedicated thread pool of ``STT_WORKERS``
+threads: CTranslate2 releases the GIL while decoding, so the threads run in parallel on
+one copy of the weights and the event loop serving chat is never blocked.
+
+Streaming sessions receive 16-bit little-endian mono PCM and gate it with an energy
+voice-activity detector in 30 ms frames. Silence is dropped before it reaches the model.
+While someone speaks, the utterance so far is re-decoded about every ``STT_PARTIAL_SEC``
+and sent as a ``partial``. At most one partial per session is in flight; late ones are
+skipped rather than queued. After ``STT_SILENCE_MS`` of silence the utterance is decoded
+once more and sent as ``final``.
+"""
+from __future__ import annotations
+
+import asyncio
+import importlib.util
+import io
+import os
+import threading
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Awaitable, Callable
+
+
+STT_MODEL = os.getenv("STT_MODEL", "base").strip()
+STT_DEVICE = os.getenv("STT_DEVICE", "cpu").strip()
+STT_COMPUTE_TYPE = os.getenv("STT_COMPUTE_TYPE", "int8").strip()
+STT_WORKERS = max(1, int(os.getenv("STT_WORKERS", "2")))
+STT_CPU_THREADS = int(os.getenv("STT_CPU_THREADS", "0"))  # per worker; 0 lets CTranslate2 decide
+STT_LANGUAGE = os.getenv("STT_LANGUAGE", "").strip() or None  # None: detect
+STT_BEAM_SIZE = int(os.getenv("STT_BEAM_SIZE", "1"))
+STT_PARTIAL_SEC = float(os.getenv("STT_PARTIAL_SEC", "1.0"))
+STT_SILENCE_MS = int(os.getenv("STT_SILENCE_MS", "600"))
+STT_VAD_THRESHOLD = float(os.getenv("STT_VAD_THRESHOLD", "0.01"))  # frame RMS, full scale = 1.0
+STT_MAX_UPLOAD_MB = float(os.getenv("STT_MAX_UPLOAD_MB", "50"))
+SAMPLE_RATE = 16000            # what Whisper expects; other rates are resampled
+FRAME_MS = 30
+PREROLL_MS = 300               # audio kept from before speech starts, so onsets are not clipped
+MAX_UTTERANCE_SEC = 30.0       # Whisper's window; longer speech is finalized in pieces
+NOISE_FACTOR = 3.0             # speech must be this much louder than the running noise floor
+
+FASTER_WHISPER = importlib.util.find_spec("faster_whisper") is not None
+if FASTER_WHISPER:
+    import numpy as np
+
+
+class SttUnavailable(RuntimeError):
+    pass
+
+
+Send = Callable[[dict], Awaitable[None]]
+
+
+class SttEngine:
+    def __init__(self):
+        self._models: dict[str, object] = {}
+        self._lock = threading.Lock()
+        self._pool: ThreadPoolExecutor | None = None
+        self.sessions = 0
+        self.counters = {"jobs": 0, "partials": 0, "partials_skipped": 0, "finals": 0, "silent_frames": 0,
+                         "speech_frames": 0, "audio_sec": 0.0, "busy_sec": 0.0}
+
+    @property
+    def pool(self) -> ThreadPoolExecutor:
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=STT_WORKERS, thread_name_prefix="stt")
+        return self._pool
+
+    def model(self, name: str = STT_MODEL):
+        """The loaded WhisperModel; the first call downloads/loads it (blocking)."""
+        with self._lock:
+            model = self._models.get(name)
+            if model is None:
+                from faster_whisper import WhisperModel
+                model = WhisperModel(name, device=STT_DEVICE, compute_type=STT_COMPUTE_TYPE,
+                                     cpu_threads=STT_CPU_THREADS, num_workers=STT_WORKERS)
+                self._models[name] = model
+            return model
+
+    def _transcribe(self, audio, language: str | None, vad_filter: bool, timestamps: bool) -> dict:
+        started = time.perf_counter()
+        if isinstance(audio, (bytes, bytearray)):
+            from faster_whisper import decode_audio
+            audio = decode_audio(io.BytesIO(audio), sampling_rate=SAMPLE_RATE)
+        segments, info = self.model().transcribe(
+            audio, language=language, beam_size=STT_BEAM_SIZE, vad_filter=vad_filter,
+            condition_on_previous_text=False, without_timestamps=not timestamps)
+        # Segments are produced lazily; decode them here, on the worker
+        segments = [{"start": round(s.start, 2), "end": round(s.end, 2), "text": s.text.strip()} for s in segments]
+        self.counters["jobs"] += 1
+        self.counters["audio_sec"] += info.duration
+        self.counters["busy_sec"] += time.perf_counter() - started
+        return {"transcript": " ".join(s["text"] for s in segments if s["text"]), "language": info.language,
+                "duration": round(info.duration, 2), "segments": segments}
+
+    async def transcribe(self, audio, language: str | None = STT_LANGUAGE, vad_filter: bool = True,
+                         timestamps: bool = True) -> dict:
+        """Transcribe float32 16 kHz samples, or encoded audio bytes (wav, mp3, ogg, webm, ...)."""
+        if not FASTER_WHISPER:
+            raise SttUnavailable("Speech-to-text needs faster-whisper (pip install faster-whisper)")
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.pool, self._transcribe, audio, language, vad_filter, timestamps)
+
+    async def transcribe_pcm(self, data: bytes, sample_rate: int = SAMPLE_RATE, language: str | None = STT_LANGUAGE) -> dict:
+        if not FASTER_WHISPER:
+            raise SttUnavailable("Speech-to-text needs faster-whisper (pip install faster-whisper)")
+        return await self.transcribe(pcm16_to_float(data, sample_rate), language)
+
+    def session(self, send: Send, sample_rate: int = SAMPLE_RATE, language: str | None = STT_LANGUAGE) -> "StreamSession":
+        if not FASTER_WHISPER:
+            raise SttUnavailable("Speech-to-text needs faster-whisper (pip install faster-whisper)")
+        return StreamSession(self, send, sample_rate, language)
+
+    async def stop(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def stats(self) -> dict:
+        return {**self.counters, "audio_sec": round(self.counters["audio_sec"], 1), "busy_sec": round(self.counters["busy_sec"], 1),
+                "available": FASTER_WHISPER, "model": STT_MODEL, "loaded": list(self._models), "workers": STT_WORKERS,
+                "sessions": self.sessions}
+
+
+def pcm16_to_float(data: bytes, sample_rate: int = SAMPLE_RATE):
+    """16-bit little-endian mono PCM -> float32 samples at 16 kHz."""
+    samples = np.frombuffer(data[:len(data) - len(data) % 2], dtype="<i2").astype(np.float32) / 32768.0
+    if sample_rate != SAMPLE_RATE and len(samples):
+        n = int(round(len(samples) * SAMPLE_RATE / sample_rate))
+        samples = np.interp(np.linspace(0, len(samples) - 1, n), np.arange(len(samples)), samples).astype(np.float32)
+    return samples
+
+
+class StreamSession:
+    """One WebSocket's audio: VAD, partial re-decodes and a final per utterance."""
+
+    FRAME = SAMPLE_RATE * FRAME_MS // 1000
+
+    def __init__(self, engine: SttEngine, send: Send, sample_rate: int, language: str | None):
+        self.engine = engine
+        self.sample_rate = sample_rate
+        self.language = language
+        self._send = send
+        self._send_lock = asyncio.Lock()
+        self._pending = np.zeros(0, dtype=np.float32)     # samples not yet framed
+        self._preroll: deque = deque(maxlen=PREROLL_MS // FRAME_MS)
+        self._speech: list = []                           # frames of the current utterance
+        self._silent = 0                                  # trailing silent frames in the utterance
+        self._noise: float | None = None
+        self._position = 0                                # frames seen since the stream started
+        self._start = 0                                   # first frame of the current utterance
+        self._partial_at = 0                              # utterance length at the last partial
+        self._partial: asyncio.Task | None = None
+        self.segment = 0
+        engine.sessions += 1
+
+    async def send(self, event: dict) -> None:
+        async with self._send_lock:
+            await self._send(event)
+
+    def _is_speech(self, frame) -> bool:
+        rms = float(np.sqrt(np.mean(frame * frame)))
+        if rms > max(STT_VAD_THRESHOLD, (self._noise or 0.0) * NOISE_FACTOR):
+            return True
+        # Track the background level between utterances only
+        if not self._speech:
+            self._noise = rms if self._noise is None else 0.95 * self._noise + 0.05 * rms
+        return False
+
+    async def feed(self, data: bytes) -> None:
+        samples = np.concatenate((self._pending, pcm16_to_float(data, self.sample_rate)))
+        usable = len(samples) - len(samples) % self.FRAME
+        self._pending = samples[usable:]
+        for i in range(0, usable, self.FRAME):
+            frame = samples[i:i + self.FRAME]
+            self._position += 1
+            if self._is_speech(frame):
+                self.engine.counters["speech_frames"] += 1
+                if not self._speech:
+                    self._start = self._position - len(self._preroll) - 1
+                    self._speech.extend(self._preroll)
+                    self._preroll.clear()
+                self._speech.append(frame)
+                self._silent = 0
+            elif self._speech:
+                self._speech.append(frame)
+                self._silent += 1
+                if self._silent * FRAME_MS >= STT_SILENCE_MS:
+                    await self.finish_utterance()
+                    continue
+            else:
+                self.engine.counters["silent_frames"] += 1
+                self._preroll.append(frame)
+                continue
+            if len(self._speech) * FRAME_MS >= MAX_UTTERANCE_SEC * 1000:
+                await self.finish_utterance()
+            elif (len(self._speech) - self._partial_at) * FRAME_MS >= STT_PARTIAL_SEC * 1000:
+                self._start_partial()
+
+    def _start_partial(self) -> None:
+        self._partial_at = len(self._speech)
+        if self._partial is not None and not self._partial.done():
+            self.engine.counters["partials_skipped"] += 1
+            return
+        self._partial = asyncio.create_task(self._emit_partial(np.concatenate(self._speech), self.segment))
+
+    async def _emit_partial(self, audio, segment: int) -> None:
+        try:
+            result = await self.engine.transcribe(audio, self.language, vad_filter=False, timestamps=False)
+        except Exception:
+            return  # the final decode reports errors
+        # Drop partials that arrive after their utterance was finalized
+        if segment == self.segment and result["transcript"]:
+            self.engine.counters["partials"] += 1
+            await self.send({"type": "partial", "segment": segment, "text": result["transcript"]})
+
+    async def finish_utterance(self) -> None:
+        speech, self._speech = self._speech, []
+        start, self._silent, self._partial_at = self._start, 0, 0
+        segment, self.segment = self.segment, self.segment + 1
+        if not speech:
+            return
+        try:
+            result = await self.engine.transcribe(np.concatenate(speech), self.language, vad_filter=False, timestamps=False)
+        except Exception as e:
+            await self.send({"type": "error", "segment": segment, "error": {"message": str(e) or type(e).__name__, "code": "stt_failed"}})
+            return
+        if self.language is None and result["language"]:
+            self.language = result["language"]  # detect once, then reuse for speed and consistency
+        if result["transcript"]:
+            self.engine.counters["finals"] += 1
+            await self.send({"type": "final", "segment": segment, "text": result["transcript"], "language": result["language"],
+                             "start": round(start * FRAME_MS / 1000, 2), "end": round((start + len(speech)) * FRAME_MS / 1000, 2)})
+
+    async def finish(self) -> None:
+        """Flush buffered speech (client sent ``end``)."""
+        if len(self._pending) and self._speech:
+            self._speech.append(self._pending)
+        self._pending = np.zeros(0, dtype=np.float32)
+        await self.finish_utterance()
+
+    def close(self) -> None:
+        if self._partial is not None:
+            self._partial.cancel()
+        self.engine.sessions -= 1
+
+
+stt_engine = SttEngine()
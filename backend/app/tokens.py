@@ -0,0 +1,231 @@
+"""Local token counting and context budgets for /api/chat.
+
+Each model gets the most accurate local tokenizer that is available:
+
+- OpenAI models use tiktoken (`pip install tiktoken`) with the model's encoding;
+- other models use a Hugging Face ``tokenizer.json`` found under ``TOKENIZER_DIR``
+  (`pip install tokenizers`), looked up by model family. ``llama-3.1-8b-instant`` tries
+  ``llama-3.1-8b-instant``, ``llama-3.1-8b``, ``llama-3.1`` and ``llama``; ``phi3:mini``
+  tries ``phi3``;
+- everything else falls back to a characters-per-token estimate.
+
+Tokenizers are loaded once, in a worker thread; until one is ready, counts use the
+estimate. Counts of long texts (system prompts, pasted documents) are cached by content
+hash.
+
+``fit`` runs before a request leaves the machine. It drops the oldest history turns
+until the prompt fits the model's context window with room for a reply, rejects requests
+that can never fit, and lowers ``max_tokens`` to the room that is left.
+"""
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import importlib.util
+import math
+import os
+from dataclasses import dataclass
+from typing import Callable
+
+from .cache import LRUCache
+
+
+TOKENIZER_DIR = os.getenv("TOKENIZER_DIR", "").strip()
+CHAT_DEFAULT_MAX_TOKENS = int(os.getenv("CHAT_DEFAULT_MAX_TOKENS", "1024"))
+CHAT_MIN_OUTPUT_TOKENS = int(os.getenv("CHAT_MIN_OUTPUT_TOKENS", "256"))
+MESSAGE_OVERHEAD_TOKENS = 4    # role and separators per message
+REPLY_OVERHEAD_TOKENS = 3      # assistant turn priming
+CACHE_MIN_CHARS = 1024         # shorter texts are cheaper to count than to hash
+CHARS_PER_TOKEN = {"anthropic": 3.5}
+DEFAULT_CHARS_PER_TOKEN = 4.0
+
+_TIKTOKEN = importlib.util.find_spec("tiktoken") is not None
+_TOKENIZERS = importlib.util.find_spec("tokenizers") is not None
+OPENAI_PROVIDERS = ("openai", "azure")
+O200K_PREFIXES = ("gpt-4o", "gpt-4.1", "gpt-4.5", "gpt-5", "chatgpt-4o", "o1", "o3", "o4")
+
+
+class TokenBudgetError(ValueError):
+    def __init__(self, input_tokens: int, window: int):
+        super().__init__(f"Prompt is about {input_tokens} tokens but the context window is {window}")
+        self.input_tokens = input_tokens
+        self.window = window
+
+
+def approx_tokens(text: str, chars_per_token: float = DEFAULT_CHARS_PER_TOKEN) -> int:
+    """Characters per token, with non-ASCII text (CJK, emoji) counted closer to one token per character."""
+    if not text:
+        return 0
+    chars = len(text)
+    wide = (len(text.encode("utf-8", "ignore")) - chars) / 2  # roughly the non-ASCII characters
+    return math.ceil((chars - wide) / chars_per_token + wide)
+
+
+@dataclass
+class Tokenizer:
+    name: str
+    count: Callable[[str], int]
+
+
+@dataclass
+class Fit:
+    input_tokens: int
+    max_tokens: int | None
+    trimmed: int            # history messages dropped to fit
+    window: int | None
+    method: str
+
+    def headers(self) -> dict:
+        headers = {"X-Input-Tokens": str(self.input_tokens)}
+        if self.trimmed:
+            headers["X-Context-Trimmed"] = str(self.trimmed)
+        return headers
+
+
+def _family_names(model: str) -> list[str]:
+    name = model.lower().strip()
+    name = name.removeprefix("models/").rsplit("/", 1)[-1].split(":", 1)[0]
+    parts = name.split("-")
+    return ["-".join(parts[:i]) for i in range(len(parts), 0, -1)]
+
+
+def _openai_encoding(model: str) -> str:
+    import tiktoken
+    try:
+        return tiktoken.encoding_name_for_model(model)
+    except KeyError:
+        return "o200k_base" if model.startswith(O200K_PREFIXES) else "cl100k_base"
+
+
+class TokenCounter:
+    def __init__(self):
+        self._loaded: dict[str, Tokenizer | None] = {}
+        self._loading: dict[str, asyncio.Future] = {}
+        self.cache = LRUCache(1024, 3600.0)
+        self.counters = {"requests": 0, "estimated": 0, "cache_hits": 0, "trimmed": 0, "rejected": 0,
+                         "loaded": 0, "load_errors": 0}
+
+    # --- tokenizer selection ---
+
+    @staticmethod
+    def spec(provider: str, model: str) -> str | None:
+        """The tokenizer to load: ``tiktoken:<encoding>`` or ``hf:<path>``, never a raw model name,
+        so any number of model strings share the few tokenizers that exist."""
+        model = (model or "").lower().removeprefix("models/")
+        bare = model.rsplit("/", 1)[-1]
+        if _TIKTOKEN and (provider in OPENAI_PROVIDERS or model.startswith("openai/") or bare.startswith(("gpt-", *O200K_PREFIXES))):
+            return f"tiktoken:{_openai_encoding(bare)}"
+        if _TOKENIZERS and TOKENIZER_DIR:
+            for name in _family_names(model):
+                for path in (os.path.join(TOKENIZER_DIR, name, "tokenizer.json"), os.path.join(TOKENIZER_DIR, f"{name}.json")):
+                    if os.path.isfile(path):
+                        return f"hf:{path}"
+        return None
+
+    def _load(self, spec: str) -> Tokenizer | None:
+        kind, _, arg = spec.partition(":")
+        try:
+            if kind == "tiktoken":
+                import tiktoken
+                encoding = tiktoken.get_encoding(arg)
+                tok = Tokenizer(f"tiktoken:{encoding.name}", lambda text: len(encoding.encode(text, disallowed_special=())))
+            else:
+                from tokenizers import Tokenizer as HFTokenizer
+                hf = HFTokenizer.from_file(arg)
+                tok = Tokenizer(f"hf:{os.path.basename(os.path.dirname(arg)) or arg}",
+                                lambda text: len(hf.encode(text, add_special_tokens=False).ids))
+            self.counters["loaded"] += 1
+        except Exception:
+            # Offline without a cached BPE file, unreadable tokenizer.json, ...: keep estimating
+            tok = None
+            self.counters["load_errors"] += 1
+        self._loaded[spec] = tok
+        return tok
+
+    def tokenizer(self, provider: str, model: str) -> Tokenizer | None:
+        """The loaded tokenizer, or None (estimate) while it loads in the background."""
+        spec = self.spec(provider, model)
+        if spec is None:
+            return None
+        if spec in self._loaded:
+            return self._loaded[spec]
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            return self._load(spec)
+        if spec not in self._loading:
+            self._loading[spec] = loop.run_in_executor(None, self._load, spec)
+        return None
+
+    async def prepare(self, provider: str, model: str) -> Tokenizer | None:
+        """Like ``tokenizer`` but waits for the load."""
+        self.tokenizer(provider, model)
+        spec = self.spec(provider, model)
+        if spec is not None and spec not in self._loaded:
+            await self._loading[spec]
+        return self._loaded.get(spec) if spec else None
+
+    # --- counting ---
+
+    def count(self, text: str, provider: str, tok: Tokenizer | None) -> int:
+        if not text:
+            return 0
+        if tok is None:
+            return approx_tokens(text, CHARS_PER_TOKEN.get(provider, DEFAULT_CHARS_PER_TOKEN))
+        if len(text) < CACHE_MIN_CHARS:
+            return tok.count(text)
+        key = f"{tok.name}:{hashlib.blake2b(text.encode('utf-8', 'surrogatepass'), digest_size=16).hexdigest()}"
+        n = self.cache.get(key)
+        if n is None:
+            n = tok.count(text)
+            self.cache.set(key, n)
+        else:
+            self.counters["cache_hits"] += 1
+        return n
+
+    def count_request(self, provider: str, req, tok: Tokenizer | None = None) -> tuple[int, list[int]]:
+        """(total input tokens, per-history-message tokens) for a ChatRequest."""
+        per_message = [self.count(m["content"], provider, tok) + MESSAGE_OVERHEAD_TOKENS for m in req.history]
+        total = sum(per_message) + self.count(req.prompt, provider, tok) + MESSAGE_OVERHEAD_TOKENS + REPLY_OVERHEAD_TOKENS
+        if req.system:
+            total += self.count(req.system, provider, tok) + MESSAGE_OVERHEAD_TOKENS
+        return total, per_message
+
+    def fit(self, provider: str, window: int | None, req) -> Fit:
+        """Trim ``req.history`` and clamp ``req.max_tokens`` so the request fits ``window``."""
+        self.counters["requests"] += 1
+        tok = self.tokenizer(provider, req.model)
+        if tok is None:
+            self.counters["estimated"] += 1
+        total, per_message = self.count_request(provider, req, tok)
+        trimmed = 0
+        if window:
+            need = min(req.max_tokens or CHAT_DEFAULT_MAX_TOKENS, CHAT_MIN_OUTPUT_TOKENS)
+            history = list(req.history)
+            while history and total + need > window:
+                total -= per_message[trimmed]
+                trimmed += 1
+                history.pop(0)
+                # Keep the history opening with a user turn
+                while history and history[0]["role"] != "user":
+                    total -= per_message[trimmed]
+                    trimmed += 1
+                    history.pop(0)
+            if trimmed:
+                req.history = history
+                self.counters["trimmed"] += 1
+            if total + need > window:
+                self.counters["rejected"] += 1
+                raise TokenBudgetError(total, window)
+            room = window - total
+            if (req.max_tokens and req.max_tokens > room) or (not req.max_tokens and room < CHAT_DEFAULT_MAX_TOKENS):
+                req.max_tokens = room
+        return Fit(total, req.max_tokens, trimmed, window, tok.name if tok else "estimate")
+
+    def stats(self) -> dict:
+        return {**self.counters, "tokenizers": {spec: (tok.name if tok else None) for spec, tok in self._loaded.items()},
+                "backends": {"tiktoken": _TIKTOKEN, "tokenizers": _TOKENIZERS and bool(TOKENIZER_DIR)},
+                "cached_counts": len(self.cache)}
+
+
+token_counter = TokenCounter()
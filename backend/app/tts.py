@@ -0,0 +1,296 @@
+"""Local text-to-speech for /api/tts/synthesize.
+
+Speech is synthesized on the CPU with Piper (`pip install piper-tts`) from ``.onnx``
+voices in ``TTS_VOICE_DIR``. Text is split into sentences, and the sentences are
+synthesized in parallel in a pool of ``TTS_WORKERS`` processes, each of which loads a
+voice once and keeps it. Audio streams out in order as soon as the next sentence is
+ready, so playback starts after the first sentence, not the whole text.
+
+Each sentence's audio is cached by content: the key is a hash of (voice, speed, text).
+Repeated phrases cost nothing, across requests and worker processes. The cache lives in
+SQLite at ``<data>/tts/audio.sqlite3``, capped at ``TTS_CACHE_MB`` with
+least-recently-used eviction.
+"""
+from __future__ import annotations
+
+import asyncio
+import glob
+import hashlib
+import importlib.util
+import json
+import multiprocessing
+import os
+import re
+import struct
+import threading
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from typing import AsyncIterator
+
+from . import storage
+from .singleflight import SingleFlight
+
+
+TTS_VOICE_DIR = os.getenv("TTS_VOICE_DIR", "").strip() or os.path.join(storage.DATA_DIR, "tts", "voices")
+TTS_VOICE = os.getenv("TTS_VOICE", "en_US-lessac-medium").strip()
+TTS_WORKERS = max(1, int(os.getenv("TTS_WORKERS", "2")))
+TTS_CACHE_MB = float(os.getenv("TTS_CACHE_MB", "256"))
+TTS_MAX_CHARS = int(os.getenv("TTS_MAX_CHARS", "20000"))
+TTS_SENTENCE_PAUSE_MS = int(os.getenv("TTS_SENTENCE_PAUSE_MS", "200"))
+MAX_SENTENCE_CHARS = 400       # longer sentences are split at commas, then at spaces
+MIN_SENTENCE_CHARS = 24        # shorter ones are merged into the next
+LOOKAHEAD = 2                  # sentences queued per worker ahead of playback
+
+PIPER = importlib.util.find_spec("piper") is not None
+
+_SENTENCE_END = re.compile(r"([.!?…。！？][\"')\]”’]*)\s+|\n\s*\n")
+_CLAUSE_END = re.compile(r"(?<=[,;:—])\s+")
+
+
+class TtsUnavailable(RuntimeError):
+    pass
+
+
+class UnknownVoice(ValueError):
+    pass
+
+
+def _split_long(sentence: str) -> list[str]:
+    if len(sentence) <= MAX_SENTENCE_CHARS:
+        return [sentence]
+    parts, current = [], ""
+    for piece in _CLAUSE_END.split(sentence):
+        while len(piece) > MAX_SENTENCE_CHARS:
+            cut = piece.rfind(" ", 0, MAX_SENTENCE_CHARS)
+            cut = cut if cut > 0 else MAX_SENTENCE_CHARS
+            parts.append(piece[:cut].strip())
+            piece = piece[cut:].strip()
+        if current and len(current) + 1 + len(piece) > MAX_SENTENCE_CHARS:
+            parts.append(current)
+            current = piece
+        else:
+            current = f"{current} {piece}".strip()
+    if current:
+        parts.append(current)
+    return parts
+
+
+def split_sentences(text: str) -> list[str]:
+    """Sentences for synthesis: whitespace collapsed, very short ones merged, long ones split."""
+    out: list[str] = []
+    carry = ""
+    for raw in _SENTENCE_END.sub(lambda m: (m.group(1) or "") + "\0", text or "").split("\0"):
+        sentence = " ".join(raw.split())
+        if not sentence:
+            continue
+        sentence = f"{carry} {sentence}".strip()
+        if len(sentence) < MIN_SENTENCE_CHARS:
+            carry = sentence
+            continue
+        carry = ""
+        out.extend(_split_long(sentence))
+    if carry:
+        out.append(carry)
+    return out
+
+
+def wav_header(sample_rate: int, data_bytes: int = 0xFFFFFFFF - 36) -> bytes:
+    """16-bit mono WAV header. The default (maximal) length lets players stream it."""
+    return (b"RIFF" + struct.pack("<I", min(0xFFFFFFFF, 36 + data_bytes)) + b"WAVEfmt "
+            + struct.pack("<IHHIIHH", 16, 1, 1, sample_rate, sample_rate * 2, 2, 16)
+            + b"data" + struct.pack("<I", data_bytes))
+
+
+# --- worker processes ---
+
+_voices: dict[str, object] = {}
+
+
+def _synthesize(voice_path: str, text: str, length_scale: float) -> bytes:
+    """Runs in a pool process: 16-bit mono PCM for one sentence."""
+    voice = _voices.get(voice_path)
+    if voice is None:
+        from piper import PiperVoice
+        voice = _voices[voice_path] = PiperVoice.load(voice_path)
+    if hasattr(voice, "synthesize_stream_raw"):  # piper-tts < 1.3
+        return b"".join(voice.synthesize_stream_raw(text, length_scale=length_scale))
+    from piper import SynthesisConfig
+    return b"".join(chunk.audio_int16_bytes for chunk in voice.synthesize(text, syn_config=SynthesisConfig(length_scale=length_scale)))
+
+
+# --- cache ---
+
+class AudioCache:
+    """Content-addressed sentence audio in SQLite, size-capped with LRU eviction."""
+
+    EVICT_EVERY = 16  # writes between eviction passes
+
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._writes = 0
+        self._conn = None
+
+    @property
+    def conn(self):
+        if self._conn is None:
+            conn = storage.connect_sqlite(storage.data_path("tts", "audio.sqlite3"))
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS audio ("
+                " key TEXT PRIMARY KEY, voice TEXT NOT NULL, pcm BLOB NOT NULL, size INTEGER NOT NULL,"
+                " accessed REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS audio_accessed ON audio(accessed)")
+            self._conn = conn
+        return self._conn
+
+    def get(self, key: str) -> bytes | None:
+        with self._lock:
+            row = self.conn.execute("SELECT pcm FROM audio WHERE key = ?", (key,)).fetchone()
+            if row is not None:
+                self.conn.execute("UPDATE audio SET accessed = ? WHERE key = ?", (time.time(), key))
+        return row[0] if row is not None else None
+
+    def set(self, key: str, voice: str, pcm: bytes) -> None:
+        with self._lock:
+            self.conn.execute("INSERT OR REPLACE INTO audio (key, voice, pcm, size, accessed) VALUES (?, ?, ?, ?, ?)",
+                              (key, voice, pcm, len(pcm), time.time()))
+            self._writes += 1
+            if self._writes % self.EVICT_EVERY == 0:
+                self._evict()
+
+    def _evict(self) -> None:
+        total = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM audio").fetchone()[0]
+        if total <= self.max_bytes:
+            return
+        excess, freed, doomed = total - self.max_bytes, 0, []
+        for key, size in self.conn.execute("SELECT key, size FROM audio ORDER BY accessed ASC"):
+            doomed.append((key,))
+            freed += size
+            if freed >= excess:
+                break
+        self.conn.executemany("DELETE FROM audio WHERE key = ?", doomed)
+
+    def clear(self) -> None:
+        with self._lock:
+            self.conn.execute("DELETE FROM audio")
+
+    def stats(self) -> dict:
+        with self._lock:
+            count, size = self.conn.execute("SELECT COUNT(*), COALESCE(SUM(size), 0) FROM audio").fetchone()
+        return {"entries": count, "bytes": size, "max_bytes": self.max_bytes}
+
+
+# --- engine ---
+
+class TtsEngine:
+    def __init__(self):
+        self.cache = AudioCache(int(TTS_CACHE_MB * 1024 * 1024))
+        self.flights = SingleFlight()
+        self._pool: ProcessPoolExecutor | None = None
+        self.counters = {"requests": 0, "sentences": 0, "cache_hits": 0, "synthesized": 0, "audio_bytes": 0, "busy_sec": 0.0}
+
+    @property
+    def pool(self) -> ProcessPoolExecutor:
+        if self._pool is None:
+            # spawn: forking a process that runs threads (the event loop's executors) is unsafe
+            self._pool = ProcessPoolExecutor(max_workers=TTS_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return self._pool
+
+    @staticmethod
+    def voices() -> list[dict]:
+        found = []
+        for path in sorted(glob.glob(os.path.join(TTS_VOICE_DIR, "*.onnx"))):
+            name = os.path.basename(path)[:-len(".onnx")]
+            found.append({"id": name, "sample_rate": TtsEngine._sample_rate(path), "default": name == TTS_VOICE})
+        return found
+
+    @staticmethod
+    def _sample_rate(path: str) -> int | None:
+        try:
+            with open(f"{path}.json", "r", encoding="utf-8") as f:
+                return int(json.load(f)["audio"]["sample_rate"])
+        except (OSError, ValueError, KeyError, TypeError):
+            return None
+
+    def voice(self, name: str = "") -> tuple[str, str, int]:
+        """(voice id, model path, sample rate) for a voice name; raises when it cannot be used."""
+        if not PIPER:
+            raise TtsUnavailable("Text-to-speech needs Piper (pip install piper-tts) and a voice in TTS_VOICE_DIR")
+        name = name or TTS_VOICE
+        path = os.path.join(TTS_VOICE_DIR, f"{name}.onnx")
+        if os.path.basename(name) != name or not os.path.isfile(path):
+            raise UnknownVoice(f"Unknown voice: {name}")
+        rate = self._sample_rate(path)
+        if rate is None:
+            raise UnknownVoice(f"Voice {name} has no readable {name}.onnx.json")
+        return name, path, rate
+
+    @staticmethod
+    def key(voice: str, speed: float, sentence: str) -> str:
+        return hashlib.sha256(f"{voice}\0{speed:g}\0{sentence}".encode("utf-8")).hexdigest()
+
+    async def _sentence(self, voice: str, path: str, sentence: str, speed: float) -> bytes:
+        key = self.key(voice, speed, sentence)
+        pcm = await asyncio.to_thread(self.cache.get, key)
+        if pcm is not None:
+            self.counters["cache_hits"] += 1
+            return pcm
+        # Identical sentences requested concurrently are synthesized once
+        return await self.flights.do(key, lambda: self._synthesize(key, voice, path, sentence, speed))
+
+    async def _synthesize(self, key: str, voice: str, path: str, sentence: str, speed: float) -> bytes:
+        started = time.perf_counter()
+        loop = asyncio.get_running_loop()
+        try:
+            pcm = await loop.run_in_executor(self.pool, _synthesize, path, sentence, 1.0 / speed)
+        except BrokenProcessPool:
+            self._pool = None  # a worker died; start a fresh pool next time
+            raise
+        self.counters["synthesized"] += 1
+        self.counters["busy_sec"] += time.perf_counter() - started
+        await asyncio.to_thread(self.cache.set, key, voice, pcm)
+        return pcm
+
+    async def stream(self, sentences: list[str], voice: str, path: str, sample_rate: int, speed: float = 1.0) -> AsyncIterator[bytes]:
+        """PCM per sentence, in order, with a short pause between sentences."""
+        self.counters["requests"] += 1
+        self.counters["sentences"] += len(sentences)
+        pause = bytes(2 * (sample_rate * TTS_SENTENCE_PAUSE_MS // 1000))
+        queued = iter(sentences)
+        tasks: deque[asyncio.Task] = deque()
+
+        def schedule():
+            sentence = next(queued, None)
+            if sentence is not None:
+                tasks.append(asyncio.ensure_future(self._sentence(voice, path, sentence, speed)))
+
+        for _ in range(TTS_WORKERS * LOOKAHEAD):
+            schedule()
+        try:
+            first = True
+            while tasks:
+                pcm = await tasks.popleft()
+                schedule()
+                if not first:
+                    yield pause
+                first = False
+                self.counters["audio_bytes"] += len(pcm)
+                yield pcm
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    async def stop(self) -> None:
+        if self._pool is not None:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+            self._pool = None
+
+    def stats(self) -> dict:
+        return {**self.counters, "busy_sec": round(self.counters["busy_sec"], 1), "available": PIPER,
+                "voice": TTS_VOICE, "workers": TTS_WORKERS, "cache": self.cache.stats(), "flights": self.flights.stats()}
+
+
+tts_engine = TtsEngine()
@@ -0,0 +1,124 @@
+"""Size-capped streaming reads of upload request bodies.
+
+Starlette's ``request.form()`` reads and spools the whole multipart body before a route
+can look at its size, so an upload limit checked afterwards bounds neither memory nor
+disk. These helpers read ``request.stream()`` incrementally instead, parse multipart
+with python-multipart's push parser, and stop as soon as the body passes the cap.
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass
+from typing import AsyncIterator
+
+from fastapi import Request
+
+try:
+    from python_multipart.exceptions import MultipartParseError
+    from python_multipart.multipart import MultipartParser, parse_options_header
+except ImportError:  # python-multipart < 0.0.13
+    from multipart.exceptions import MultipartParseError
+    from multipart.multipart import MultipartParser, parse_options_header
+
+
+MULTIPART_OVERHEAD = 64 * 1024   # boundaries, part headers and small fields around the file
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+class BadUpload(ValueError):
+    pass
+
+
+@dataclass
+class FilePart:
+    filename: str
+    content_type: str
+    chunks: AsyncIterator[bytes]
+
+
+async def capped(chunks: AsyncIterator[bytes], limit: int, message: str) -> AsyncIterator[bytes]:
+    """Pass chunks through; raise UploadTooLarge once more than ``limit`` bytes went by."""
+    size = 0
+    async for chunk in chunks:
+        size += len(chunk)
+        if size > limit:
+            raise UploadTooLarge(message)
+        yield chunk
+
+
+async def _events(request: Request, limit: int, message: str) -> AsyncIterator[tuple[str, object]]:
+    """("part", headers), ("data", bytes) and ("end", None) events of a multipart body."""
+    _, params = parse_options_header(request.headers.get("content-type", ""))
+    boundary = params.get(b"boundary")
+    if not boundary:
+        raise BadUpload("multipart boundary is missing")
+    events: list[tuple[str, object]] = []
+    headers: dict[str, str] = {}
+    field, value = bytearray(), bytearray()
+
+    def on_part_begin():
+        headers.clear()
+
+    def on_header_field(data, start, end):
+        field.extend(data[start:end])
+
+    def on_header_value(data, start, end):
+        value.extend(data[start:end])
+
+    def on_header_end():
+        headers[field.decode("latin-1").lower()] = value.decode("utf-8", "replace")
+        field.clear()
+        value.clear()
+
+    def on_headers_finished():
+        events.append(("part", dict(headers)))
+
+    def on_part_data(data, start, end):
+        events.append(("data", bytes(data[start:end])))
+
+    def on_part_end():
+        events.append(("end", None))
+
+    parser = MultipartParser(boundary, {
+        "on_part_begin": on_part_begin, "on_header_field": on_header_field, "on_header_value": on_header_value,
+        "on_header_end": on_header_end, "on_headers_finished": on_headers_finished, "on_part_data": on_part_data,
+        "on_part_end": on_part_end,
+    })
+    try:
+        async for chunk in capped(request.stream(), limit, message):
+            parser.write(chunk)
+            for event in events:
+                yield event
+            events.clear()
+        parser.finalize()
+    except MultipartParseError as e:
+        raise BadUpload(f"Malformed multipart body: {e}")
+    for event in events:
+        yield event
+
+
+async def file_part(request: Request, limit: int, message: str, name: str = "file") -> FilePart | None:
+    """The multipart file field ``name``, streamed; None when the body has no such field.
+
+    ``limit`` caps the file; the whole body may exceed it by ``MULTIPART_OVERHEAD``.
+    """
+    events = _events(request, limit + MULTIPART_OVERHEAD, message)
+    async for kind, headers in events:
+        if kind != "part":
+            continue
+        _, params = parse_options_header(headers.get("content-disposition", ""))
+        if params.get(b"name", b"").decode("utf-8", "replace") != name:
+            continue
+
+        async def chunks():
+            async for kind, data in events:
+                if kind == "end":
+                    return
+                if kind == "data":
+                    yield data
+
+        return FilePart(params.get(b"filename", b"").decode("utf-8", "replace"), headers.get("content-type", ""),
+                        capped(chunks(), limit, message))
+    return None
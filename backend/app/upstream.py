@@ -0,0 +1,177 @@
+"""Shared, pooled HTTP clients for upstream providers and tool backends.
+
+One ``httpx.AsyncClient`` is kept per upstream origin (scheme://host:port) so
+repeated calls reuse DNS results, TCP connections and TLS sessions instead of
+paying for a fresh handshake on every request. Clients are created lazily and
+closed together from the app lifespan. At most ``UPSTREAM_MAX_ORIGINS`` clients are kept
+(user-supplied base URLs can name any number of origins); the least recently used one
+is closed to make room.
+
+Identical concurrent requests are coalesced (single-flight): while one is in flight,
+others with the same method, URL, body hash and credential hash await its response
+instead of going upstream again. GET/HEAD requests coalesce by default. POSTs only
+coalesce when the caller marks them idempotent with ``coalesce=True``: embeddings, and
+chat or generate calls that are cacheable (deterministic or opted in). Streaming
+requests are never coalesced.
+"""
+from __future__ import annotations
+
+import asyncio
+import hashlib
+import importlib.util
+import os
+import time
+from collections import OrderedDict
+from urllib.parse import urlsplit
+
+import httpx
+
+from . import metrics
+from .singleflight import SingleFlight
+
+
+UPSTREAM_MAX_CONNECTIONS = int(os.getenv("UPSTREAM_MAX_CONNECTIONS", "100"))
+UPSTREAM_MAX_KEEPALIVE = int(os.getenv("UPSTREAM_MAX_KEEPALIVE", "20"))
+UPSTREAM_KEEPALIVE_EXPIRY = float(os.getenv("UPSTREAM_KEEPALIVE_EXPIRY", "60"))
+UPSTREAM_MAX_ORIGINS = max(1, int(os.getenv("UPSTREAM_MAX_ORIGINS", "64")))
+# HTTP/2 is negotiated via ALPN, so servers without it transparently fall back to HTTP/1.1.
+# It needs the optional `h2` package (`pip install httpx[http2]`).
+UPSTREAM_HTTP2 = os.getenv("UPSTREAM_HTTP2", "1").strip().lower() not in ("0", "false", "no", "off")
+UPSTREAM_COALESCE = os.getenv("UPSTREAM_COALESCE", "1").strip().lower() not in ("0", "false", "no", "off")
+_H2_AVAILABLE = importlib.util.find_spec("h2") is not None
+
+DEFAULT_TIMEOUT = httpx.Timeout(60.0)
+EVICT_GRACE_SEC = 120.0   # evicted clients stay open this long for calls already using them
+COALESCE_METHODS = ("GET", "HEAD")
+CREDENTIAL_HEADERS = ("authorization", "x-api-key", "api-key", "x-goog-api-key", "x-subscription-token", "cookie")
+
+
+def _origin(url: str) -> str:
+    parts = urlsplit(url)
+    if not parts.scheme or not parts.netloc:
+        raise httpx.UnsupportedProtocol(f"Invalid upstream URL: {url!r}")
+    return f"{parts.scheme.lower()}://{parts.netloc.lower()}"
+
+
+def flight_key(request: httpx.Request) -> tuple[str, str, str, str]:
+    """(method, URL, body hash, credential hash) identifying an upstream request."""
+    body = hashlib.sha256(request.content).hexdigest()
+    creds = hashlib.sha256(
+        "\n".join(f"{h}:{request.headers.get(h, '')}" for h in CREDENTIAL_HEADERS).encode("utf-8")
+    ).hexdigest()[:16]
+    return request.method, str(request.url), body, creds
+
+
+class UpstreamPool:
+    """Per-origin keep-alive client pool.
+
+    Handlers call ``upstreams.get(url, ...)`` / ``upstreams.post(url, ...)`` exactly like
+    an ``httpx.AsyncClient`` and the pool routes the call to the client for that origin.
+    """
+
+    def __init__(self) -> None:
+        self._clients: OrderedDict[str, httpx.AsyncClient] = OrderedDict()
+        self._evicted: set[asyncio.Task] = set()
+        self.evictions = 0
+        self.flights = SingleFlight()
+
+    def _limits(self) -> httpx.Limits:
+        return httpx.Limits(
+            max_connections=UPSTREAM_MAX_CONNECTIONS,
+            max_keepalive_connections=UPSTREAM_MAX_KEEPALIVE,
+            keepalive_expiry=UPSTREAM_KEEPALIVE_EXPIRY,
+        )
+
+    @staticmethod
+    def _event_hooks(origin: str) -> dict:
+        async def on_request(request: httpx.Request) -> None:
+            request.extensions["sent_at"] = time.perf_counter()
+
+        async def on_response(response: httpx.Response) -> None:
+            # Runs as soon as headers arrive, before the body is read
+            sent = response.request.extensions.get("sent_at")
+            if sent is not None:
+                metrics.upstream_ttfb.observe(time.perf_counter() - sent, origin)
+            metrics.upstream_requests.inc(origin, response.status_code)
+        return {"request": [on_request], "response": [on_response]}
+
+    def client(self, url: str) -> httpx.AsyncClient:
+        origin = _origin(url)
+        client = self._clients.get(origin)
+        if client is None or client.is_closed:
+            client = httpx.AsyncClient(
+                timeout=DEFAULT_TIMEOUT,
+                limits=self._limits(),
+                http2=UPSTREAM_HTTP2 and _H2_AVAILABLE and origin.startswith("https://"),
+                event_hooks=self._event_hooks(origin) if metrics.METRICS else None,
+            )
+            self._clients[origin] = client
+            while len(self._clients) > UPSTREAM_MAX_ORIGINS:
+                self._evict(self._clients.popitem(last=False)[1])
+        self._clients.move_to_end(origin)
+        return client
+
+    def _evict(self, client: httpx.AsyncClient) -> None:
+        self.evictions += 1
+
+        async def close_later():
+            try:
+                await asyncio.sleep(EVICT_GRACE_SEC)
+            finally:
+                await client.aclose()
+
+        task = asyncio.get_running_loop().create_task(close_later())
+        self._evicted.add(task)
+        task.add_done_callback(self._evicted.discard)
+
+    async def _timed(self, origin: str, call):
+        started = time.perf_counter()
+        try:
+            return await call
+        except httpx.RequestError as e:
+            metrics.upstream_errors.inc(origin, type(e).__name__)
+            raise
+        finally:
+            metrics.add_upstream_time(time.perf_counter() - started)
+
+    async def request(self, method: str, url: str, coalesce: bool | None = None, **kwargs) -> httpx.Response:
+        client = self.client(url)
+        send_kwargs = {k: kwargs.pop(k) for k in ("auth", "follow_redirects") if k in kwargs}
+        request = client.build_request(method, url, **kwargs)
+        if coalesce is None:
+            coalesce = request.method in COALESCE_METHODS
+        if not (coalesce and UPSTREAM_COALESCE):
+            return await self._timed(_origin(url), client.send(request, **send_kwargs))
+        # Everyone waiting on the key gets the same (fully read) response object
+        return await self._timed(_origin(url), self.flights.do(flight_key(request), lambda: client.send(request, **send_kwargs)))
+
+    async def get(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("GET", url, **kwargs)
+
+    async def post(self, url: str, **kwargs) -> httpx.Response:
+        return await self.request("POST", url, **kwargs)
+
+    async def open_stream(self, method: str, url: str, **kwargs) -> httpx.Response:
+        """Send a request and return as soon as headers arrive; the body is left unread.
+
+        The caller owns the response and must ``await response.aclose()`` when done.
+        """
+        client = self.client(url)
+        request = client.build_request(method, url, **kwargs)
+        return await self._timed(_origin(url), client.send(request, stream=True))
+
+    def stats(self) -> dict:
+        return {"origins": sorted(self._clients), "max_origins": UPSTREAM_MAX_ORIGINS, "evictions": self.evictions, "http2": UPSTREAM_HTTP2 and _H2_AVAILABLE,
+                "coalesce": {"enabled": UPSTREAM_COALESCE, **self.flights.stats()}}
+
+    async def aclose(self) -> None:
+        clients, self._clients = list(self._clients.values()), OrderedDict()
+        for client in clients:
+            await client.aclose()
+        # Close evicted clients now instead of after their grace period
+        for task in list(self._evicted):
+            task.cancel()
+        await asyncio.gather(*self._evicted, return_exceptions=True)
+
+
+upstreams = UpstreamPool()
@@ -0,0 +1,184 @@
+"""Geocoding and current-weather lookups for /api/tools/weather, with caching.
+
+- Geocodes (place string -> lat/lon/display name) are cached in memory and in SQLite
+  for ``GEOCODE_TTL`` (default 30 days). Places that could not be found are cached for a
+  day, so typos do not keep hitting Nominatim.
+- Current weather is cached in memory for ``WEATHER_TTL`` seconds, keyed on coordinates
+  rounded to ~1 km.
+- Concurrent identical lookups share one upstream call, and Nominatim calls are spaced
+  at least one second apart (its usage policy).
+"""
+from __future__ import annotations
+
+import asyncio
+import os
+import threading
+import time
+
+import httpx
+
+from . import storage
+from .cache import LRUCache
+from .singleflight import SingleFlight
+from .upstream import upstreams
+
+
+GEOCODE_TTL = float(os.getenv("GEOCODE_TTL", str(30 * 24 * 3600)))
+GEOCODE_NEGATIVE_TTL = 24 * 3600
+WEATHER_TTL = float(os.getenv("WEATHER_TTL", "600"))
+WEATHER_COORD_DECIMALS = 2
+NOMINATIM_MIN_INTERVAL = 1.0
+
+GEO_URL = "https://geocoding-api.open-meteo.com/v1/search"
+NOMINATIM_URL = "https://nominatim.openstreetmap.org/search"
+FORECAST_URL = "https://api.open-meteo.com/v1/forecast"
+
+
+class WeatherError(Exception):
+    def __init__(self, status_code: int):
+        super().__init__(f"Weather fetch failed ({status_code})")
+        self.status_code = status_code
+
+
+def normalize_place(place: str) -> str:
+    return " ".join(place.lower().split())
+
+
+def _is_json(r: httpx.Response) -> bool:
+    return r.status_code == 200 and r.headers.get("content-type", "").startswith("application/json")
+
+
+class GeocodeStore:
+    """Persistent place -> (lat, lon, display name) table; lat/lon NULL means not found."""
+
+    def __init__(self, path: str | None = None):
+        self._path = path
+        self._conn = None
+        self._lock = threading.Lock()
+
+    @property
+    def conn(self):
+        if self._conn is None:
+            self._conn = storage.connect_sqlite(self._path or storage.data_path("cache", "geocode.sqlite3"))
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS geocode (key TEXT PRIMARY KEY, lat REAL, lon REAL,"
+                " place TEXT NOT NULL, created REAL NOT NULL)"
+            )
+        return self._conn
+
+    def get(self, key: str) -> tuple | None:
+        with self._lock:
+            row = self.conn.execute("SELECT lat, lon, place, created FROM geocode WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        lat, lon, place, created = row
+        ttl = GEOCODE_TTL if lat is not None else GEOCODE_NEGATIVE_TTL
+        return (lat, lon, place) if created + ttl > time.time() else None
+
+    def set(self, key: str, value: tuple) -> None:
+        with self._lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO geocode (key, lat, lon, place, created) VALUES (?, ?, ?, ?, ?)",
+                (key, value[0], value[1], value[2], time.time()),
+            )
+
+
+class WeatherService:
+    def __init__(self, store: GeocodeStore | None = None):
+        self.store = store or GeocodeStore()
+        self.geocodes = LRUCache(2048, GEOCODE_TTL)
+        self.current_weather = LRUCache(1024, WEATHER_TTL)
+        self.flights = SingleFlight()
+        self._nominatim_lock: asyncio.Lock | None = None
+        self._nominatim_last = 0.0
+        self.counters = {"geocode_hits": 0, "geocode_misses": 0, "weather_hits": 0, "weather_misses": 0}
+
+    async def geocode(self, place: str, timeout: httpx.Timeout) -> tuple[float | None, float | None, str]:
+        """Returns (lat, lon, display name); lat/lon are None when the place is unknown."""
+        key = normalize_place(place)
+        hit = self.geocodes.get(key)
+        if hit is None:
+            hit = await asyncio.to_thread(self.store.get, key)
+            if hit is not None:
+                self.geocodes.set(key, hit, ttl=GEOCODE_TTL if hit[0] is not None else GEOCODE_NEGATIVE_TTL)
+        if hit is not None:
+            self.counters["geocode_hits"] += 1
+            return hit
+        self.counters["geocode_misses"] += 1
+        return await self.flights.do(("geo", key), lambda: self._geocode_upstream(key, place, timeout))
+
+    async def _geocode_upstream(self, key: str, place: str, timeout: httpx.Timeout) -> tuple:
+        lat = lon = None
+        # Open-Meteo first, then Nominatim (OpenStreetMap)
+        gr = await upstreams.get(GEO_URL, params={"name": place, "count": 1}, timeout=timeout)
+        if _is_json(gr):
+            g = gr.json()
+            if g and g.get("results"):
+                r0 = g["results"][0]
+                lat = r0.get("latitude")
+                lon = r0.get("longitude")
+                if r0.get("name") and r0.get("country"):
+                    place = f"{r0['name']}, {r0['country']}"
+        if lat is None or lon is None:
+            try:
+                lat, lon, place = await self._nominatim(place, timeout)
+            except Exception:
+                # Not a definitive "not found": don't cache it
+                return None, None, place
+        value = (lat, lon, place)
+        ttl = GEOCODE_TTL if lat is not None and lon is not None else GEOCODE_NEGATIVE_TTL
+        self.geocodes.set(key, value, ttl=ttl)
+        await asyncio.to_thread(self.store.set, key, value)
+        return value
+
+    async def _nominatim(self, place: str, timeout: httpx.Timeout) -> tuple:
+        if self._nominatim_lock is None:
+            self._nominatim_lock = asyncio.Lock()
+        async with self._nominatim_lock:
+            wait = self._nominatim_last + NOMINATIM_MIN_INTERVAL - time.monotonic()
+            if wait > 0:
+                await asyncio.sleep(wait)
+            try:
+                # Public service: be kind and include a UA
+                nr = await upstreams.get(NOMINATIM_URL, params={"q": place, "format": "json", "limit": 1},
+                                         headers={"User-Agent": "zeek-ai/0.1 (desktop)"}, timeout=timeout)
+            finally:
+                self._nominatim_last = time.monotonic()
+        if not _is_json(nr):
+            raise WeatherError(nr.status_code)
+        nj = nr.json() or []
+        lat = lon = None
+        if isinstance(nj, list) and nj:
+            lat = float(nj[0].get("lat")) if nj[0].get("lat") else None
+            lon = float(nj[0].get("lon")) if nj[0].get("lon") else None
+            place = nj[0].get("display_name") or place
+        return lat, lon, place
+
+    async def current(self, lat: float, lon: float, timeout: httpx.Timeout) -> dict:
+        key = (round(float(lat), WEATHER_COORD_DECIMALS), round(float(lon), WEATHER_COORD_DECIMALS))
+        hit = self.current_weather.get(key)
+        if hit is not None:
+            self.counters["weather_hits"] += 1
+            return hit
+        self.counters["weather_misses"] += 1
+        return await self.flights.do(("wx", key), lambda: self._current_upstream(key, timeout))
+
+    async def _current_upstream(self, key: tuple, timeout: httpx.Timeout) -> dict:
+        wr = await upstreams.get(FORECAST_URL, params={
+            "latitude": key[0],
+            "longitude": key[1],
+            "current_weather": True,
+            "temperature_unit": "fahrenheit"
+        }, timeout=timeout)
+        if wr.status_code != 200:
+            raise WeatherError(wr.status_code)
+        cw = (wr.json() or {}).get("current_weather") or {}
+        self.current_weather.set(key, cw)
+        return cw
+
+    def stats(self) -> dict:
+        return {**self.counters, "memory_geocodes": len(self.geocodes),
+                "memory_weather": len(self.current_weather), **self.flights.stats()}
+
+
+weather_service = WeatherService()
@@ -0,0 +1,294 @@
+"""Web search backends for /api/tools/search, queried with hedging or fan-out.
+
+Backends (SearXNG primary/fallback, Brave, DuckDuckGo) are tried in priority order,
+but not strictly one after another:
+
+- ``hedge`` (default): start the best backend; if it has not answered within
+  ``SEARCH_HEDGE_MS`` (or fails), also start the next one, and so on. First non-empty
+  result set wins and the rest are cancelled.
+- ``race``: start every backend at once; first non-empty result set wins.
+- ``merge``: start every backend at once, wait for all (up to the deadline) and return
+  the deduplicated union, interleaved by rank.
+- ``sequential``: the original one-after-another behavior.
+
+Each backend keeps an EWMA of its latency and a consecutive-failure count. Backends that
+keep failing, or whose typical latency exceeds ``SEARCH_SLOW_MS``, are moved to the back
+of the order until they recover; failing ones are retried after a cooldown.
+"""
+from __future__ import annotations
+
+import asyncio
+import os
+import time
+from dataclasses import dataclass, field
+from typing import Awaitable, Callable
+from urllib.parse import urlsplit
+
+import httpx
+
+from .upstream import upstreams
+
+
+BRAVE_API_KEY = os.getenv("BRAVE_API_KEY", "").strip()
+SEARXNG_URL = os.getenv("SEARXNG_URL", "").strip().rstrip('/')
+SEARXNG_FALLBACK_URL = os.getenv("SEARXNG_FALLBACK_URL", "").strip().rstrip('/') or "https://searx.party"
+
+SEARCH_MODE = os.getenv("SEARCH_MODE", "hedge").strip().lower()
+SEARCH_HEDGE_MS = float(os.getenv("SEARCH_HEDGE_MS", "800"))
+SEARCH_DEADLINE = float(os.getenv("SEARCH_DEADLINE", "10"))
+SEARCH_BACKEND_TIMEOUT = float(os.getenv("SEARCH_BACKEND_TIMEOUT", "10"))
+SEARCH_SLOW_MS = float(os.getenv("SEARCH_SLOW_MS", "3000"))
+SEARCH_FAILURES_TO_DEMOTE = 3
+SEARCH_COOLDOWN = 60.0
+EWMA_ALPHA = 0.3
+MODES = ("hedge", "race", "merge", "sequential")
+
+
+class BackendError(Exception):
+    pass
+
+
+@dataclass
+class BackendHealth:
+    ewma_ms: float | None = None
+    successes: int = 0
+    failures: int = 0
+    consecutive_failures: int = 0
+    last_failure: float = 0.0
+    last_error: str = ""
+
+    def observe(self, ms: float) -> None:
+        self.ewma_ms = ms if self.ewma_ms is None else EWMA_ALPHA * ms + (1 - EWMA_ALPHA) * self.ewma_ms
+
+    def success(self, ms: float) -> None:
+        self.observe(ms)
+        self.successes += 1
+        self.consecutive_failures = 0
+
+    def failure(self, ms: float, error: str) -> None:
+        self.observe(ms)
+        self.failures += 1
+        self.consecutive_failures += 1
+        self.last_failure = time.monotonic()
+        self.last_error = error
+
+    @property
+    def demoted(self) -> bool:
+        if self.consecutive_failures >= SEARCH_FAILURES_TO_DEMOTE:
+            return time.monotonic() - self.last_failure < SEARCH_COOLDOWN
+        return self.ewma_ms is not None and self.ewma_ms > SEARCH_SLOW_MS
+
+    def snapshot(self) -> dict:
+        return {
+            "ewma_ms": round(self.ewma_ms, 1) if self.ewma_ms is not None else None,
+            "successes": self.successes,
+            "failures": self.failures,
+            "consecutive_failures": self.consecutive_failures,
+            "demoted": self.demoted,
+            "last_error": self.last_error or None,
+        }
+
+
+Fetch = Callable[[str, int, httpx.Timeout], Awaitable[list[dict]]]
+
+
+@dataclass
+class Backend:
+    name: str
+    fetch: Fetch
+    health: BackendHealth = field(default_factory=BackendHealth)
+
+
+def _json(r: httpx.Response) -> dict:
+    if r.status_code != 200:
+        raise BackendError(f"HTTP {r.status_code}")
+    if not r.headers.get("content-type", "").startswith("application/json"):
+        raise BackendError("non-JSON response")
+    return r.json() or {}
+
+
+def searxng(base: str) -> Fetch:
+    async def fetch(q: str, max: int, timeout: httpx.Timeout) -> list[dict]:
+        r = await upstreams.get(
+            f"{base}/search",
+            params={"q": q, "format": "json", "language": "en", "safesearch": 1, "categories": "general"},
+            headers={"Accept": "application/json"},
+            timeout=timeout,
+        )
+        return [
+            {"title": d.get("title") or d.get("url"), "url": d.get("url"), "snippet": d.get("content") or d.get("pretty_url") or ""}
+            for d in (_json(r).get("results") or [])[:max]
+        ]
+    return fetch
+
+
+async def brave(q: str, max: int, timeout: httpx.Timeout) -> list[dict]:
+    r = await upstreams.get(
+        "https://api.search.brave.com/res/v1/web/search",
+        params={"q": q, "count": max},
+        headers={"Accept": "application/json", "X-Subscription-Token": BRAVE_API_KEY},
+        timeout=timeout,
+    )
+    return [
+        {"title": d.get("title") or d.get("url"), "url": d.get("url"), "snippet": d.get("description") or ""}
+        for d in (_json(r).get("web", {}).get("results", []) or [])[:max]
+    ]
+
+
+async def duckduckgo(q: str, max: int, timeout: httpx.Timeout) -> list[dict]:
+    """DuckDuckGo Instant Answer API (limited but keyless)."""
+    r = await upstreams.get("https://api.duckduckgo.com/", params={"q": q, "format": "json", "no_redirect": 1, "no_html": 1}, timeout=timeout)
+    if r.status_code != 200:
+        raise BackendError(f"HTTP {r.status_code}")
+    j = r.json() or {}
+    items = []
+    if j.get("AbstractText") and j.get("AbstractURL"):
+        items.append({"title": j.get("Heading") or j.get("AbstractURL"), "url": j.get("AbstractURL"), "snippet": j.get("AbstractText")})
+    for rt in (j.get("RelatedTopics") or []):
+        if isinstance(rt, dict) and rt.get("Text") and rt.get("FirstURL"):
+            items.append({"title": rt.get("Text")[:80], "url": rt.get("FirstURL"), "snippet": rt.get("Text")})
+        if len(items) >= max:
+            break
+    return items[:max]
+
+
+def _url_key(url: str | None) -> str:
+    parts = urlsplit((url or "").strip())
+    host = parts.netloc.lower().removeprefix("www.")
+    return f"{host}{parts.path.rstrip('/')}?{parts.query}" if host else (url or "")
+
+
+def merge_results(result_sets: list[list[dict]], limit: int) -> list[dict]:
+    """Round-robin by rank across backends, dropping duplicate URLs."""
+    seen: set[str] = set()
+    merged: list[dict] = []
+    for rank in range(max(map(len, result_sets), default=0)):
+        for items in result_sets:
+            if rank < len(items):
+                key = _url_key(items[rank].get("url"))
+                if key not in seen:
+                    seen.add(key)
+                    merged.append(items[rank])
+    return merged[:limit]
+
+
+@dataclass
+class Outcome:
+    items: list[dict]
+    backends: list[str]
+    errors: dict[str, str]
+
+
+class SearchRouter:
+    def __init__(self, backends: list[Backend]):
+        self.backends = backends
+
+    def ordered(self) -> list[Backend]:
+        """Configured priority, with demoted backends moved to the end."""
+        return sorted(self.backends, key=lambda b: b.health.demoted)
+
+    async def _call(self, backend: Backend, q: str, max: int) -> list[dict]:
+        started = time.perf_counter()
+        try:
+            items = await backend.fetch(q, max, httpx.Timeout(SEARCH_BACKEND_TIMEOUT))
+        except asyncio.CancelledError:
+            # Lost a race: all we know is that it would have taken at least this long
+            ms = (time.perf_counter() - started) * 1000
+            if backend.health.ewma_ms is None or ms > backend.health.ewma_ms:
+                backend.health.observe(ms)
+            raise
+        except (httpx.RequestError, BackendError, ValueError) as e:
+            backend.health.failure((time.perf_counter() - started) * 1000, str(e) or type(e).__name__)
+            raise
+        backend.health.success((time.perf_counter() - started) * 1000)
+        return items
+
+    async def search(self, q: str, max: int = 5, mode: str = SEARCH_MODE) -> Outcome:
+        mode = mode if mode in MODES else "hedge"
+        order = self.ordered()
+        if mode == "sequential":
+            return await self._sequential(order, q, max)
+        hedge = SEARCH_HEDGE_MS / 1000 if mode == "hedge" else 0.0
+        return await self._fan_out(order, q, max, hedge=hedge, merge=mode == "merge")
+
+    async def _sequential(self, order: list[Backend], q: str, max: int) -> Outcome:
+        errors: dict[str, str] = {}
+        for backend in order:
+            try:
+                items = await self._call(backend, q, max)
+            except (httpx.RequestError, BackendError, ValueError) as e:
+                errors[backend.name] = str(e) or type(e).__name__
+                continue
+            if items:
+                return Outcome(items, [backend.name], errors)
+        return Outcome([], [], errors)
+
+    async def _fan_out(self, order: list[Backend], q: str, max: int, hedge: float, merge: bool) -> Outcome:
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + SEARCH_DEADLINE
+        pending: dict[asyncio.Task, Backend] = {}
+        results: dict[str, list[dict]] = {}
+        errors: dict[str, str] = {}
+        queue = list(order)
+
+        def launch() -> None:
+            backend = queue.pop(0)
+            pending[asyncio.create_task(self._call(backend, q, max))] = backend
+
+        launch()
+        if not hedge:
+            while queue:
+                launch()
+        try:
+            while pending:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                wait = min(remaining, hedge) if hedge and queue else remaining
+                done, _ = await asyncio.wait(pending, timeout=wait, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    if queue:  # hedge: the running backends are slow, bring in the next one
+                        launch()
+                    continue
+                missed = False
+                for task in done:
+                    backend = pending.pop(task)
+                    try:
+                        items = task.result()
+                    except (httpx.RequestError, BackendError, ValueError) as e:
+                        errors[backend.name] = str(e) or type(e).__name__
+                        items = []
+                    if items:
+                        results[backend.name] = items
+                    else:
+                        missed = True
+                if results and not merge:
+                    break
+                if hedge and queue and missed:
+                    launch()  # a backend failed or came back empty: don't wait out the hedge delay
+        finally:
+            for task in pending:
+                task.cancel()
+        names = [b.name for b in order if b.name in results]
+        if merge:
+            return Outcome(merge_results([results[n] for n in names], max), names, errors)
+        return Outcome(results[names[0]] if names else [], names[:1], errors)
+
+    def stats(self) -> dict:
+        return {b.name: b.health.snapshot() for b in self.ordered()}
+
+
+def default_backends() -> list[Backend]:
+    # SearXNG first (open-source, keyless), then Brave if a key is set, then DuckDuckGo
+    backends = []
+    if SEARXNG_URL:
+        backends.append(Backend("searxng", searxng(SEARXNG_URL)))
+    if SEARXNG_FALLBACK_URL:
+        backends.append(Backend("searxng_fallback", searxng(SEARXNG_FALLBACK_URL)))
+    if BRAVE_API_KEY:
+        backends.append(Backend("brave", brave))
+    backends.append(Backend("duckduckgo", duckduckgo))
+    return backends
+
+
+search_router = SearchRouter(default_backends())
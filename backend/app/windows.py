@@ -0,0 +1,128 @@
+"""Context windows per model, for the local fit in ``tokens.TokenCounter.fit``.
+
+A provider serves models with very different windows (Groq runs 8k and 128k models,
+Ollama runs whatever ``num_ctx`` a model was created or configured with), so the window
+is looked up per model:
+
+1. ``MODEL_CONTEXT_WINDOWS``: a JSON object of model name prefixes to windows, e.g.
+   ``{"llama3.1:8b": 32768, "my-azure-deployment": 128000}``;
+2. Ollama models: ``num_ctx`` from ``/api/show``, else ``OLLAMA_CONTEXT_LENGTH`` (the
+   server's own default, when this process is told about it);
+3. cloud models: the longest matching prefix in ``KNOWN_WINDOWS``;
+4. the adapter's ``Capabilities.max_context``, for providers whose models share a window.
+
+An unknown window is None and the local check is skipped; the provider still rejects
+prompts that do not fit. ``/api/show`` answers are cached; ``lookup`` never waits for one
+(it starts the request and answers None until it lands), ``get`` does.
+"""
+from __future__ import annotations
+
+import asyncio
+import json
+import os
+import re
+
+import httpx
+
+from .cache import LRUCache
+from .upstream import upstreams
+
+
+OLLAMA_WINDOW_TTL = float(os.getenv("OLLAMA_WINDOW_TTL", "600"))
+OLLAMA_CONTEXT_LENGTH = int(os.getenv("OLLAMA_CONTEXT_LENGTH", "0") or 0) or None
+# Prefixes of bare model names (no "provider/" or "models/" prefix), longest match wins
+KNOWN_WINDOWS = {
+    "gpt-3.5-turbo": 16385, "gpt-4": 8192, "gpt-4-turbo": 128000, "gpt-4o": 128000, "chatgpt-4o": 128000,
+    "gpt-4.1": 1047576, "gpt-5": 400000, "o1": 200000, "o3": 200000, "o4": 200000,
+    "claude-": 200000,
+    "gemini-1.5-flash": 1048576, "gemini-1.5-pro": 2097152, "gemini-2": 1048576,
+    "llama-3.1": 131072, "llama-3.2": 131072, "llama-3.3": 131072, "llama3-8b-8192": 8192, "llama3-70b-8192": 8192,
+    "meta-llama-3.1": 131072, "gemma2-9b": 8192,
+    "mistral-large": 131072, "mistral-medium": 131072, "mistral-small": 32768, "open-mistral-nemo": 131072,
+    "ministral": 131072, "codestral": 256000, "mixtral-8x7b": 32768, "mixtral-8x22b": 65536,
+    "command-r": 128000, "command-a": 256000,
+}
+NUM_CTX = re.compile(r"^\s*num_ctx\s+(\d+)", re.MULTILINE)
+
+
+def _overrides() -> dict[str, int]:
+    raw = os.getenv("MODEL_CONTEXT_WINDOWS", "").strip()
+    if not raw:
+        return {}
+    try:
+        data = json.loads(raw)
+    except ValueError:
+        return {}
+    return {str(k).lower(): int(v) for k, v in data.items() if isinstance(v, int) and v > 0} if isinstance(data, dict) else {}
+
+
+def _prefix_match(table: dict[str, int], model: str) -> int | None:
+    name = model.lower().strip().removeprefix("models/")
+    for candidate in (name, name.rsplit("/", 1)[-1]):
+        matches = [k for k in table if candidate.startswith(k)]
+        if matches:
+            return table[max(matches, key=len)]
+    return None
+
+
+class ContextWindows:
+    def __init__(self):
+        self.overrides = _overrides()
+        self.ollama = LRUCache(256, OLLAMA_WINDOW_TTL)
+        self._fetching: dict[str, asyncio.Task] = {}
+        self.counters = {"ollama_lookups": 0, "ollama_errors": 0, "unknown": 0}
+
+    def lookup(self, adapter, model: str, base: str = "") -> int | None:
+        """The window for ``model`` on ``adapter``, or None when unknown (or still being looked up)."""
+        window = _prefix_match(self.overrides, model or "")
+        if window is None and adapter.id == "ollama":
+            key = f"{base}|{model}"
+            cached = self.ollama.get(key)
+            if cached is None:
+                self._fetch(key, base, model)
+            window = cached or OLLAMA_CONTEXT_LENGTH
+        elif window is None:
+            window = _prefix_match(KNOWN_WINDOWS, model or "") or adapter.capabilities.max_context
+        if window is None:
+            self.counters["unknown"] += 1
+        return window
+
+    async def get(self, adapter, model: str, base: str = "") -> int | None:
+        """Like ``lookup`` but waits for Ollama's ``/api/show``."""
+        if adapter.id == "ollama" and _prefix_match(self.overrides, model or "") is None:
+            task = self._fetch(f"{base}|{model}", base, model)
+            if task is not None:
+                await asyncio.shield(task)
+        return self.lookup(adapter, model, base)
+
+    def _fetch(self, key: str, base: str, model: str) -> asyncio.Task | None:
+        if not base or not model or self.ollama.get(key) is not None:
+            return None
+        task = self._fetching.get(key)
+        if task is None:
+            try:
+                task = asyncio.get_running_loop().create_task(self._show(key, base, model))
+            except RuntimeError:
+                return None
+            self._fetching[key] = task
+            task.add_done_callback(lambda t, k=key: self._fetching.pop(k, None))
+        return task
+
+    async def _show(self, key: str, base: str, model: str) -> None:
+        self.counters["ollama_lookups"] += 1
+        window = 0   # cached as "asked, no num_ctx"
+        try:
+            r = await upstreams.post(f"{base.rstrip('/')}/api/show", json={"model": model}, timeout=httpx.Timeout(5.0))
+            data = r.json() if r.is_success else {}
+            match = NUM_CTX.search(data.get("parameters") or "") if isinstance(data, dict) else None
+            if match:
+                window = int(match.group(1))
+        except (httpx.HTTPError, httpx.InvalidURL, ValueError):
+            self.counters["ollama_errors"] += 1
+        self.ollama.set(key, window)
+
+    def stats(self) -> dict:
+        return {**self.counters, "overrides": len(self.overrides), "ollama_cached": len(self.ollama)}
+
+
+context_windows = ContextWindows()
@@ -0,0 +1,276 @@
+"""Offline load test for the backend against mock upstreams.
+
+    python backend/bench/load.py --concurrency 16 --requests 400
+    python backend/bench/load.py --scenarios chat_openai,chat_openai_stream --json out.json
+    python backend/bench/load.py --baseline out.json --tolerance 0.2   # exit 1 on regression
+
+Starts ``mock_upstreams.py`` and the backend as child processes. The backend runs
+through ``serve.py``, which sends every upstream call to the mock, with a throwaway data
+dir and no background probing, so nothing leaves the machine. Then each scenario is
+driven at a fixed concurrency. Per scenario it reports throughput, p50/p95/p99 latency
+(and time to first chunk for streams), errors and the backend's peak RSS.
+
+With ``--baseline`` the run is compared to an earlier ``--json`` report and fails when
+p95 latency grows or throughput drops by more than ``--tolerance``.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import itertools
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import asdict, dataclass, field
+from typing import Callable
+
+import httpx
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+
+@dataclass
+class Scenario:
+    name: str
+    method: str
+    path: str
+    body: Callable[[int], dict] | None = None
+    stream: bool = False
+
+
+def scenarios(mock: str) -> list[Scenario]:
+    def chat(provider: str, model: str, unique: bool = True):
+        return lambda i: {"provider": provider, "model": model, "apiKey": "mock", "base": mock,
+                          "prompt": f"benchmark prompt {i if unique else 0}", "cache": "bypass" if unique else "on"}
+    return [
+        Scenario("health", "GET", "/api/health"),
+        Scenario("chat_openai", "POST", "/api/chat", chat("openai", "gpt-mock")),
+        Scenario("chat_openai_stream", "POST", "/api/chat/stream", chat("openai", "gpt-mock"), stream=True),
+        Scenario("chat_anthropic", "POST", "/api/chat", chat("anthropic", "claude-mock")),
+        Scenario("chat_anthropic_stream", "POST", "/api/chat/stream", chat("anthropic", "claude-mock"), stream=True),
+        Scenario("chat_gemini", "POST", "/api/chat", chat("google", "gemini-mock")),
+        Scenario("chat_ollama", "POST", "/api/chat", chat("ollama", "phi3:mini")),
+        Scenario("chat_ollama_stream", "POST", "/api/chat/stream", chat("ollama", "phi3:mini"), stream=True),
+        Scenario("chat_cached", "POST", "/api/chat", chat("openai", "gpt-mock", unique=False)),
+        Scenario("mini_generate", "POST", "/api/mini/generate", lambda i: {"prompt": f"mini prompt {i}"}),
+        Scenario("tools_search", "GET", "/api/tools/search?q=bench{i}&max=5"),
+        Scenario("tools_weather", "GET", "/api/tools/weather?location=City{i}"),
+        Scenario("ollama_tags", "GET", f"/api/ollama/tags?base={mock}"),
+    ]
+
+
+@dataclass
+class Result:
+    name: str
+    requests: int = 0
+    errors: int = 0
+    seconds: float = 0.0
+    rps: float = 0.0
+    p50_ms: float | None = None
+    p95_ms: float | None = None
+    p99_ms: float | None = None
+    ttfb_p50_ms: float | None = None
+    ttfb_p95_ms: float | None = None
+    peak_rss_mb: float | None = None
+    latencies: list = field(default_factory=list, repr=False)
+    ttfbs: list = field(default_factory=list, repr=False)
+
+
+def pct(samples: list[float], p: float) -> float | None:
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return round(ordered[min(len(ordered) - 1, int(p * len(ordered)))], 2)
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def rss_mb(pid: int) -> float | None:
+    try:
+        with open(f"/proc/{pid}/status", encoding="ascii") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def wait_ready(url: str, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(url, timeout=1.0).status_code < 500:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.1)
+    raise RuntimeError(f"{url} did not come up within {timeout:.0f}s")
+
+
+async def one(client: httpx.AsyncClient, sc: Scenario, i: int, result: Result) -> None:
+    path = sc.path.replace("{i}", str(i))
+    started = time.perf_counter()
+    try:
+        if sc.stream:
+            async with client.stream(sc.method, path, json=sc.body(i)) as r:
+                first = None
+                async for _ in r.aiter_bytes():
+                    if first is None:
+                        first = time.perf_counter()
+                ok = r.status_code < 400
+            if first is not None:
+                result.ttfbs.append((first - started) * 1000)
+        else:
+            r = await client.request(sc.method, path, json=sc.body(i) if sc.body else None)
+            ok = r.status_code < 400
+    except httpx.HTTPError:
+        ok = False
+    result.latencies.append((time.perf_counter() - started) * 1000)
+    result.requests += 1
+    if not ok:
+        result.errors += 1
+
+
+async def drive(base: str, sc: Scenario, concurrency: int, total: int, warmup: int, backend_pid: int) -> Result:
+    result = Result(sc.name)
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    async with httpx.AsyncClient(base_url=base, timeout=httpx.Timeout(60.0), limits=limits) as client:
+        warm = Result(sc.name)
+        await asyncio.gather(*(one(client, sc, 10_000_000 + i, warm) for i in range(warmup)))
+        counter = itertools.count()
+        peak = [rss_mb(backend_pid)]
+
+        async def worker():
+            while (i := next(counter)) < total:
+                await one(client, sc, i, result)
+
+        async def sample_rss():
+            while True:
+                value = rss_mb(backend_pid)
+                if value is not None:
+                    peak[0] = max(peak[0] or 0.0, value)
+                await asyncio.sleep(0.1)
+
+        sampler = asyncio.create_task(sample_rss())
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        result.seconds = round(time.perf_counter() - started, 3)
+        sampler.cancel()
+    result.rps = round(result.requests / result.seconds, 1) if result.seconds else 0.0
+    result.p50_ms, result.p95_ms, result.p99_ms = (pct(result.latencies, p) for p in (0.5, 0.95, 0.99))
+    result.ttfb_p50_ms, result.ttfb_p95_ms = pct(result.ttfbs, 0.5), pct(result.ttfbs, 0.95)
+    result.peak_rss_mb = round(peak[0], 1) if peak[0] is not None else None
+    return result
+
+
+def start_processes(args, data_dir: str) -> tuple[subprocess.Popen, subprocess.Popen, str, str]:
+    mock_port, backend_port = free_port(), free_port()
+    mock = f"http://127.0.0.1:{mock_port}"
+    mock_proc = subprocess.Popen(
+        [sys.executable, os.path.join(BACKEND_DIR, "bench", "mock_upstreams.py"), "--port", str(mock_port),
+         "--latency-ms", str(args.latency_ms), "--jitter-ms", str(args.jitter_ms),
+         "--tokens", str(args.tokens), "--token-ms", str(args.token_ms), "--error-rate", str(args.error_rate)])
+    env = {
+        **os.environ,
+        "OLLAMA_BASE": mock,
+        "SEARXNG_URL": mock,
+        "SEARXNG_FALLBACK_URL": mock,
+        "ZEEK_DATA_DIR": data_dir,
+        "HEALTH_PROBES": "off",
+        "OLLAMA_WARMUP": "0",
+        "RATE_LIMIT": "100000000",
+        "LOCAL_API_TOKEN": "",
+        "WORKERS": "1",
+    }
+    backend_proc = subprocess.Popen(
+        [sys.executable, os.path.join(BACKEND_DIR, "bench", "serve.py"), "--upstream", mock,
+         "--host", "127.0.0.1", "--port", str(backend_port)],
+        cwd=BACKEND_DIR, env=env)
+    backend = f"http://127.0.0.1:{backend_port}"
+    wait_ready(f"{mock}/api/version")
+    wait_ready(f"{backend}/health")
+    return mock_proc, backend_proc, mock, backend
+
+
+def compare(results: list[dict], baseline: dict, tolerance: float) -> list[str]:
+    failures = []
+    for r in results:
+        base = baseline.get(r["name"])
+        if not base:
+            continue
+        if base.get("p95_ms") and r["p95_ms"] and r["p95_ms"] > base["p95_ms"] * (1 + tolerance):
+            failures.append(f"{r['name']}: p95 {r['p95_ms']} ms vs baseline {base['p95_ms']} ms")
+        if base.get("rps") and r["rps"] < base["rps"] * (1 - tolerance):
+            failures.append(f"{r['name']}: {r['rps']} req/s vs baseline {base['rps']} req/s")
+    return failures
+
+
+def print_table(results: list[dict]) -> None:
+    cols = ("name", "requests", "errors", "rps", "p50_ms", "p95_ms", "p99_ms", "ttfb_p50_ms", "ttfb_p95_ms", "peak_rss_mb")
+    widths = [max(len(c), *(len(str(r.get(c) if r.get(c) is not None else "-")) for r in results)) for c in cols]
+    print("  ".join(c.ljust(w) for c, w in zip(cols, widths)))
+    for r in results:
+        print("  ".join(str(r.get(c) if r.get(c) is not None else "-").ljust(w) for c, w in zip(cols, widths)))
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description="Offline backend load test against mock upstreams.")
+    parser.add_argument("--scenarios", default="", help="comma-separated scenario names (default: all)")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=400, help="requests per scenario")
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--latency-ms", type=float, default=50.0, help="mock upstream latency")
+    parser.add_argument("--jitter-ms", type=float, default=10.0)
+    parser.add_argument("--tokens", type=int, default=16, help="chunks per streamed mock completion")
+    parser.add_argument("--token-ms", type=float, default=5.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--json", help="write the report to this file")
+    parser.add_argument("--baseline", help="earlier --json report to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="zeek-bench-") as data_dir:
+        mock_proc, backend_proc, mock, backend = start_processes(args, data_dir)
+        try:
+            selected = {s.strip() for s in args.scenarios.split(",") if s.strip()}
+            results = []
+            for sc in scenarios(mock):
+                if selected and sc.name not in selected:
+                    continue
+                r = asyncio.run(drive(backend, sc, args.concurrency, args.requests, args.warmup, backend_proc.pid))
+                results.append({k: v for k, v in asdict(r).items() if k not in ("latencies", "ttfbs")})
+                print(f"{sc.name}: {r.rps} req/s, p95 {r.p95_ms} ms, errors {r.errors}", file=sys.stderr)
+        finally:
+            for proc in (backend_proc, mock_proc):
+                proc.terminate()
+                try:
+                    proc.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    proc.kill()
+
+    print_table(results)
+    report = {"config": {k: v for k, v in vars(args).items() if k not in ("json", "baseline")}, "results": results}
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    if args.baseline:
+        with open(args.baseline, "r", encoding="utf-8") as f:
+            baseline = {r["name"]: r for r in json.load(f).get("results", [])}
+        failures = compare(results, baseline, args.tolerance)
+        for line in failures:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        return 1 if failures else 0
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
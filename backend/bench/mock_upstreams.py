@@ -0,0 +1,221 @@
+"""Offline stand-ins for the upstream services the backend talks to.
+
+    python backend/bench/mock_upstreams.py --port 9100 --latency-ms 80 --jitter-ms 20 --tokens 32 --token-ms 5
+
+One server answers in the wire formats of OpenAI-compatible chat APIs (OpenAI, Groq,
+Mistral, OpenRouter), Anthropic, Gemini, Cohere, Ollama, SearXNG, DuckDuckGo and
+Open-Meteo, selected by path. Point the backend at it with
+``python backend/bench/serve.py --upstream http://127.0.0.1:9100`` (and
+``OLLAMA_BASE``/``SEARXNG_URL``).
+
+Every response waits ``latency`` +/- ``jitter`` ms before the headers; streams then send
+``tokens`` chunks ``token_ms`` apart. ``error_rate`` answers that share of chat calls
+with a 500. Output is deterministic apart from the timing.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import random
+from dataclasses import dataclass
+
+from starlette.applications import Starlette
+from starlette.requests import Request
+from starlette.responses import JSONResponse, Response, StreamingResponse
+from starlette.routing import Route
+
+
+@dataclass
+class MockConfig:
+    latency_ms: float = 50.0
+    jitter_ms: float = 10.0
+    tokens: int = 16
+    token_ms: float = 5.0
+    error_rate: float = 0.0
+    seed: int = 0
+
+
+def create_app(config: MockConfig | None = None) -> Starlette:
+    config = config or MockConfig()
+    rng = random.Random(config.seed)
+
+    async def delay() -> None:
+        ms = config.latency_ms + rng.uniform(-config.jitter_ms, config.jitter_ms)
+        if ms > 0:
+            await asyncio.sleep(ms / 1000)
+
+    def tokens(prompt: str) -> list[str]:
+        return [f"tok{i} " for i in range(config.tokens - 1)] + [f"[{len(prompt)}]"]
+
+    def failed() -> bool:
+        return config.error_rate > 0 and rng.random() < config.error_rate
+
+    def sse(events) -> StreamingResponse:
+        async def body():
+            for i, event in enumerate(events):
+                if i and config.token_ms > 0:
+                    await asyncio.sleep(config.token_ms / 1000)
+                yield event
+        return StreamingResponse(body(), media_type="text/event-stream")
+
+    def data(obj) -> str:
+        return f"data: {json.dumps(obj)}\n\n"
+
+    async def openai_chat(request: Request):
+        body = await request.json()
+        await delay()
+        if failed():
+            return JSONResponse({"error": {"message": "mock failure"}}, status_code=500)
+        prompt = body["messages"][-1]["content"]
+        parts = tokens(prompt)
+        if body.get("stream"):
+            events = [data({"choices": [{"index": 0, "delta": {"content": t}}]}) for t in parts]
+            events.append(data({"choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}))
+            return sse(events + ["data: [DONE]\n\n"])
+        return JSONResponse({"id": "mock", "object": "chat.completion", "model": body.get("model"),
+                             "choices": [{"index": 0, "message": {"role": "assistant", "content": "".join(parts)}, "finish_reason": "stop"}],
+                             "usage": {"prompt_tokens": len(prompt.split()), "completion_tokens": len(parts)}})
+
+    async def anthropic_messages(request: Request):
+        body = await request.json()
+        await delay()
+        if failed():
+            return JSONResponse({"type": "error", "error": {"message": "mock failure"}}, status_code=500)
+        prompt = body["messages"][-1]["content"]
+        parts = tokens(prompt)
+        if body.get("stream"):
+            events = [f"event: message_start\n{data({'type': 'message_start', 'message': {'usage': {'input_tokens': 3}}})}"]
+            events += [f"event: content_block_delta\n{data({'type': 'content_block_delta', 'delta': {'type': 'text_delta', 'text': t}})}" for t in parts]
+            events.append(f"event: message_delta\n{data({'type': 'message_delta', 'delta': {'stop_reason': 'end_turn'}, 'usage': {'output_tokens': len(parts)}})}")
+            events.append(f"event: message_stop\n{data({'type': 'message_stop'})}")
+            return sse(events)
+        return JSONResponse({"id": "mock", "type": "message", "content": [{"type": "text", "text": "".join(parts)}],
+                             "stop_reason": "end_turn", "usage": {"input_tokens": 3, "output_tokens": len(parts)}})
+
+    async def gemini(request: Request):
+        body = await request.json()
+        await delay()
+        if failed():
+            return JSONResponse({"error": {"message": "mock failure"}}, status_code=500)
+        prompt = body["contents"][-1]["parts"][0]["text"]
+        parts = tokens(prompt)
+        if request.path_params["method"] == "streamGenerateContent":
+            events = [data({"candidates": [{"content": {"parts": [{"text": t}]}}]}) for t in parts[:-1]]
+            events.append(data({"candidates": [{"content": {"parts": [{"text": parts[-1]}]}, "finishReason": "STOP"}]}))
+            return sse(events)
+        return JSONResponse({"candidates": [{"content": {"parts": [{"text": "".join(parts)}]}, "finishReason": "STOP"}]})
+
+    async def gemini_models(request: Request):
+        await delay()
+        return JSONResponse({"models": [{"name": "models/gemini-mock"}]})
+
+    async def cohere_chat(request: Request):
+        body = await request.json()
+        await delay()
+        prompt = body["messages"][-1]["content"]
+        parts = tokens(prompt)
+        if body.get("stream"):
+            events = [data({"type": "content-delta", "delta": {"message": {"content": {"text": t}}}}) for t in parts]
+            events.append(data({"type": "message-end", "delta": {"finish_reason": "COMPLETE"}}))
+            return sse(events)
+        return JSONResponse({"message": {"content": [{"type": "text", "text": "".join(parts)}]}})
+
+    async def openrouter_models(request: Request):
+        await delay()
+        return JSONResponse({"data": [{"id": f"mock/model-{i}"} for i in range(50)]})
+
+    async def ollama_generate(request: Request):
+        body = await request.json()
+        await delay()
+        prompt = body.get("prompt")
+        if prompt is None:  # warm-up / keep_alive only
+            return JSONResponse({"model": body.get("model"), "response": "", "done": True})
+        parts = tokens(prompt)
+        if body.get("stream", True):
+            async def lines():
+                for i, t in enumerate(parts):
+                    if i and config.token_ms > 0:
+                        await asyncio.sleep(config.token_ms / 1000)
+                    yield json.dumps({"model": body.get("model"), "response": t, "done": False}) + "\n"
+                yield json.dumps({"model": body.get("model"), "response": "", "done": True, "eval_count": len(parts)}) + "\n"
+            return StreamingResponse(lines(), media_type="application/x-ndjson")
+        return JSONResponse({"model": body.get("model"), "response": "".join(parts), "done": True, "eval_count": len(parts)})
+
+    async def ollama_embed(request: Request):
+        body = await request.json()
+        await delay()
+        inputs = body.get("input") or []
+        inputs = [inputs] if isinstance(inputs, str) else inputs
+        return JSONResponse({"embeddings": [[float(len(t) % 7), 1.0, float(len(t.split()))] for t in inputs]})
+
+    async def ollama_tags(request: Request):
+        await delay()
+        return JSONResponse({"models": [{"name": "phi3:mini"}, {"name": "llama3:8b"}]})
+
+    async def ollama_version(request: Request):
+        return JSONResponse({"version": "0.0.0-mock"})
+
+    async def search(request: Request):
+        await delay()
+        q = request.query_params.get("q", "")
+        if "categories" not in request.query_params:  # Nominatim shares the path
+            return JSONResponse([{"lat": "52.52", "lon": "13.40", "display_name": q or "Mock City"}])
+        return JSONResponse({"results": [{"title": f"{q} result {i}", "url": f"https://example.com/{i}?q={q}", "content": "snippet"}
+                                         for i in range(10)]})
+
+    async def duckduckgo(request: Request):
+        await delay()
+        return JSONResponse({"AbstractText": "", "RelatedTopics": [{"Text": "Mock topic", "FirstURL": "https://example.com/ddg"}]})
+
+    async def geocode(request: Request):
+        await delay()
+        return JSONResponse({"results": [{"latitude": 52.52, "longitude": 13.4, "name": request.query_params.get("name", "Mock"), "country": "Mockland"}]})
+
+    async def forecast(request: Request):
+        await delay()
+        return JSONResponse({"current_weather": {"temperature": 68.0, "windspeed": 7.2, "weathercode": 1, "time": "2024-01-01T12:00"}})
+
+    async def root(request: Request):
+        if request.query_params.get("q") is not None:
+            return await duckduckgo(request)
+        return Response(status_code=204)  # health probes
+
+    routes = [
+        Route("/{prefix:path}/chat/completions", openai_chat, methods=["POST"]),
+        Route("/v1/messages", anthropic_messages, methods=["POST"]),
+        Route("/v1beta/models/{model}:{method}", gemini, methods=["POST"]),
+        Route("/v1beta/models", gemini_models),
+        Route("/v2/chat", cohere_chat, methods=["POST"]),
+        Route("/api/v1/models", openrouter_models),
+        Route("/api/generate", ollama_generate, methods=["POST"]),
+        Route("/api/embed", ollama_embed, methods=["POST"]),
+        Route("/api/tags", ollama_tags),
+        Route("/api/version", ollama_version),
+        Route("/search", search),
+        Route("/v1/search", geocode),
+        Route("/v1/forecast", forecast),
+        Route("/", root),
+    ]
+    return Starlette(routes=routes)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9100)
+    parser.add_argument("--latency-ms", type=float, default=50.0)
+    parser.add_argument("--jitter-ms", type=float, default=10.0)
+    parser.add_argument("--tokens", type=int, default=16)
+    parser.add_argument("--token-ms", type=float, default=5.0)
+    parser.add_argument("--error-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    import uvicorn
+    config = MockConfig(args.latency_ms, args.jitter_ms, args.tokens, args.token_ms, args.error_rate, args.seed)
+    uvicorn.run(create_app(config), host=args.host, port=args.port, log_level="warning", access_log=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,99 @@
+"""Latency benchmark for the RAG vector index on synthetic embeddings.
+
+    python backend/bench/rag_search.py --rows 1000000 --dim 384 --queries 200
+
+Builds a throwaway index (exact and IVF layouts) in a temp directory and reports build
+time, p50/p95 query latency, the time to re-index one source and, for IVF, recall@k
+against exact search.
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+
+from app.rag import index as vector_index  # noqa: E402
+
+
+def synthetic_blocks(rows: int, dim: int, sources: int, seed: int = 0):
+    # Clustered data, closer to real embeddings than uniform noise
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((256, dim)).astype(np.float32)
+    for start in range(0, rows, vector_index.BLOCK_ROWS):
+        m = min(vector_index.BLOCK_ROWS, rows - start)
+        vecs = centers[rng.integers(0, len(centers), m)] + 0.6 * rng.standard_normal((m, dim)).astype(np.float32)
+        yield np.arange(start, start + m), rng.integers(0, sources, m), vecs
+
+
+def timed(fn, queries):
+    times, results = [], []
+    for q in queries:
+        t = time.perf_counter()
+        results.append(fn(q))
+        times.append((time.perf_counter() - t) * 1000)
+    times.sort()
+    return times, results
+
+
+def report(label, times):
+    p = lambda f: times[min(len(times) - 1, int(f * len(times)))]
+    print(f"{label:<22} p50 {p(0.50):7.2f} ms   p95 {p(0.95):7.2f} ms   max {times[-1]:7.2f} ms")
+
+
+def main() -> None:
+    ap = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    ap.add_argument("--rows", type=int, default=1_000_000)
+    ap.add_argument("--dim", type=int, default=384)
+    ap.add_argument("--sources", type=int, default=100)
+    ap.add_argument("--queries", type=int, default=200)
+    ap.add_argument("-k", type=int, default=8)
+    ap.add_argument("--nprobe", type=int, default=vector_index.RAG_ANN_NPROBE)
+    ap.add_argument("--skip-exact", action="store_true", help="only build and time the IVF layout")
+    args = ap.parse_args()
+
+    rng = np.random.default_rng(1)
+    queries = rng.standard_normal((args.queries, args.dim)).astype(np.float32)
+    source_names = {f"src_{i}": i for i in range(args.sources)}
+    with tempfile.TemporaryDirectory() as tmp:
+        exact = None
+        if not args.skip_exact:
+            t = time.perf_counter()
+            idx = vector_index.VectorIndex(os.path.join(tmp, "exact"))
+            idx.build(synthetic_blocks(args.rows, args.dim, args.sources), args.rows, args.dim, dict(source_names), ann="off")
+            print(f"exact build            {time.perf_counter() - t:7.1f} s")
+            exact = idx.current()
+            np.asarray(exact.vectors).sum()  # warm the page cache
+            times, exact_results = timed(lambda q: exact.search(q, args.k), queries)
+            report("exact", times)
+            times, _ = timed(lambda q: exact.search(q, args.k, ["src_1", "src_2"]), queries)
+            report("exact, 2 sources", times)
+
+        t = time.perf_counter()
+        idx = vector_index.VectorIndex(os.path.join(tmp, "ivf"))
+        idx.build(synthetic_blocks(args.rows, args.dim, args.sources), args.rows, args.dim, dict(source_names), ann="ivf")
+        ivf = idx.current()
+        print(f"ivf build              {time.perf_counter() - t:7.1f} s   nlist {ivf.meta['nlist']}   nprobe {args.nprobe}")
+        np.asarray(ivf.vectors).sum()
+        times, ivf_results = timed(lambda q: ivf.search(q, args.k, nprobe=args.nprobe), queries)
+        report("ivf", times)
+        times, _ = timed(lambda q: ivf.search(q, args.k, ["src_1", "src_2"], nprobe=args.nprobe), queries)
+        report("ivf, 2 sources", times)
+        t = time.perf_counter()
+        code = ivf.source_codes["src_1"]
+        m = ivf.source_counts[code]
+        blocks = ((c, np.full(len(c), code), v) for c, _, v in synthetic_blocks(m, args.dim, 1, seed=2))
+        idx.update(ivf, ["src_1"], blocks, m, dict(ivf.source_codes))
+        print(f"update 1 source        {time.perf_counter() - t:7.1f} s   ({m} rows)")
+        if exact is not None:
+            hits = sum(len({r for r, _ in a} & {r for r, _ in b}) for a, b in zip(exact_results, ivf_results))
+            print(f"ivf recall@{args.k}            {hits / (args.k * len(queries)):.3f}")
+
+
+if __name__ == "__main__":
+    main()
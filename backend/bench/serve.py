@@ -0,0 +1,66 @@
+"""Run the backend with every upstream call sent to a mock server (benchmarks only).
+
+    python backend/bench/serve.py --upstream http://127.0.0.1:9100 --port 8001
+
+Before the app is imported, ``httpx.AsyncClient`` is replaced in this process by a
+subclass whose transport rewrites each request's origin to ``--upstream``. The pool in
+``app/upstream.py`` is otherwise untouched, so per-origin clients, coalescing keys and
+metrics still see the real provider origins. Nothing of this ships in the app itself.
+"""
+from __future__ import annotations
+
+import argparse
+import os
+import sys
+
+import httpx
+
+BACKEND_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+sys.path.insert(0, BACKEND_DIR)
+
+
+class RewriteTransport(httpx.AsyncBaseTransport):
+    """Send every request to ``target`` (scheme://host:port), keeping path and query."""
+
+    def __init__(self, target: str, **kwargs):
+        self.target = httpx.URL(target)
+        self.inner = httpx.AsyncHTTPTransport(**kwargs)
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        request.url = request.url.copy_with(scheme=self.target.scheme, host=self.target.host, port=self.target.port)
+        request.headers["host"] = self.target.netloc.decode("ascii")
+        return await self.inner.handle_async_request(request)
+
+    async def aclose(self) -> None:
+        await self.inner.aclose()
+
+
+def install(target: str) -> None:
+    """Route every ``httpx.AsyncClient`` created from now on to ``target``."""
+    base = httpx.AsyncClient
+
+    class MockedClient(base):
+        def __init__(self, *args, **kwargs):
+            if kwargs.get("transport") is None:
+                kwargs["transport"] = RewriteTransport(target, limits=kwargs.get("limits") or httpx.Limits(),
+                                                       http2=bool(kwargs.get("http2")))
+            super().__init__(*args, **kwargs)
+
+    httpx.AsyncClient = MockedClient
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--upstream", required=True, help="mock server origin, e.g. http://127.0.0.1:9100")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    args = parser.parse_args()
+
+    install(args.upstream)
+    print(f"bench: all upstream traffic goes to {args.upstream}", file=sys.stderr)
+    import uvicorn
+    uvicorn.run("app.main:app", host=args.host, port=args.port, log_level="warning", access_log=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -1780,36 +1780,76 @@ function fetchWithTimeout(resource, options = {}) {
 }
 
 async function updateStatusLights() {
-    const b = document.getElementById('light-backend');
-    const m = document.getElementById('light-modelhub');
-    const r = document.getElementById('light-rag');
-    setLight(b, 'unknown'); setLight(m, 'unknown'); setLight(r, 'unknown');
+    // One cheap snapshot: the backend probes providers in the background, so this costs no upstream calls
     try {
-        const res = await fetchWithTimeout('/api/health', { timeout: 3000 });
-        setLight(b, res.ok ? 'ok' : 'err');
-        window.__status.backend = { state: (res.ok ? 'ok' : 'err'), updatedAt: Date.now(), error: null };
-    } catch (e) {
-        setLight(b, 'err'); window.__status.backend = { state: 'err', updatedAt: Date.now(), error: e && e.message ? e.message : 'Error' };
-    }
-    try {
-        const res = await fetchWithTimeout('/api/model_hub/providers', { timeout: 4000 });
-        setLight(m, res.ok ? 'ok' : 'err');
-        window.__status.modelhub = { state: (res.ok ? 'ok' : 'err'), updatedAt: Date.now(), error: null };
-    } catch (e) {
-        setLight(m, 'err'); window.__status.modelhub = { state: 'err', updatedAt: Date.now(), error: e && e.message ? e.message : 'Error' };
-    }
-    try {
-        const res = await fetchWithTimeout('/api/rag/search?q=pulse', { timeout: 4000 });
-        setLight(r, res.ok ? 'ok' : 'err');
-        window.__status.rag = { state: (res.ok ? 'ok' : 'err'), updatedAt: Date.now(), error: null };
+        const res = await fetchWithTimeout('/api/status', { timeout: 3000 });
+        if (!res.ok) throw new Error(`HTTP ${res.status}`);
+        const json = await res.json();
+        applyStatusSnapshot(json && json.data);
+        subscribeStatusStream();
     } catch (e) {
-        setLight(r, 'err'); window.__status.rag = { state: 'err', updatedAt: Date.now(), error: e && e.message ? e.message : 'Error' };
+        const error = e && e.message ? e.message : 'Error';
+        ['backend', 'modelhub', 'rag'].forEach(key => { window.__status[key] = { state: 'err', updatedAt: Date.now(), error }; });
+        setLight(document.getElementById('light-backend'), 'err');
+        setLight(document.getElementById('light-modelhub'), 'err');
+        setLight(document.getElementById('light-rag'), 'err');
+        updateStatusChips();
+        updateStatusTitles();
+        renderStatusBanner();
     }
+}
+
+function applyStatusSnapshot(snap) {
+    const lights = (snap && snap.lights) || {};
+    const services = (snap && snap.services) || {};
+    const lightIds = { backend: 'light-backend', modelhub: 'light-modelhub', rag: 'light-rag' };
+    Object.keys(lightIds).forEach(key => {
+        const state = lights[key] || 'unknown';
+        let error = null;
+        if (key === 'modelhub' && state !== 'ok') {
+            const failing = Object.entries(services).filter(([, s]) => s.group === 'llm' && s.error);
+            error = failing.map(([name, s]) => `${name}: ${s.error}`).join('\n') || null;
+        }
+        window.__status[key] = { state, updatedAt: Date.now(), error };
+        setLight(document.getElementById(lightIds[key]), state);
+    });
     updateStatusChips();
     updateStatusTitles();
     renderStatusBanner();
 }
 
+// Push channel: the backend sends a snapshot whenever a service changes state
+async function subscribeStatusStream() {
+    if (window.__statusStream) return;
+    window.__statusStream = true;
+    try {
+        const res = await fetch('/api/status/stream');
+        if (!res.ok || !res.body) throw new Error(`HTTP ${res.status}`);
+        const reader = res.body.getReader();
+        const decoder = new TextDecoder();
+        let buf = '';
+        while (true) {
+            const { value, done } = await reader.read();
+            if (done) break;
+            buf += decoder.decode(value, { stream: true });
+            let idx;
+            while ((idx = buf.indexOf('\n\n')) >= 0) {
+                const frame = buf.slice(0, idx);
+                buf = buf.slice(idx + 2);
+                const data = frame.split('\n').filter(l => l.startsWith('data:')).map(l => l.slice(5).trim()).join('');
+                if (!data) continue;
+                try {
+                    const evt = JSON.parse(data);
+                    if (evt && evt.type === 'status') applyStatusSnapshot(evt);
+                } catch {}
+            }
+        }
+    } catch {}
+    window.__statusStream = false;
+    // Reconnect later; the periodic snapshot keeps the lights current meanwhile
+    setTimeout(subscribeStatusStream, 10000);
+}
+
 function updateStatusChips() {
     const colors = { ok: '#2e7d32', warn: '#f9a825', err: '#d32f2f', unknown: '#90a4ae' };
     document.querySelectorAll('.status-chip').forEach(chip => {
@@ -1935,8 +1975,22 @@ function toast(message, type = 'info') {
 }
 
 // --- RAG helpers ---
+function pickFile(accept) {
+    return new Promise((resolve) => {
+        const input = document.createElement('input');
+        input.type = 'file';
+        if (accept) input.accept = accept;
+        input.addEventListener('change', () => resolve(input.files && input.files[0] ? input.files[0] : null), { once: true });
+        input.click();
+    });
+}
+
 async function ragUpload() {
-    const res = await fetch('/api/rag/sources/upload', { method: 'POST' });
+    const file = await pickFile('.txt,.md,.markdown,.pdf');
+    if (!file) throw new Error('No file selected');
+    const form = new FormData();
+    form.append('file', file, file.name);
+    const res = await fetch('/api/rag/sources/upload?index=true', { method: 'POST', body: form });
     if (!res.ok) throw new Error(`Upload failed: HTTP ${res.status}`);
     return res.json();
 }